@@ -27,12 +27,15 @@ import networkx as nx
 from assemblyline.lib.transcript import Exon, NEG_STRAND
 from base import NODE_SCORE, CHAIN_NODES, \
     SMOOTH_FWD, SMOOTH_REV, SMOOTH_TMP, PathInfo
-from path_finder import find_suboptimal_paths
+from path_finder import find_suboptimal_paths, find_flow_paths
 from smooth import smooth_graph
 
 SOURCE = -1
 SINK = -2
 
+# methods for enumerating isoforms from the k-mer graph
+ISOFORM_MODES = ("greedy", "flow")
+
 def get_start_end_nodes(G):
     # get all leaf nodes
     start_nodes = set()
@@ -259,23 +262,11 @@ def expand_path_chains(G, strand, path):
     newpath.append(Exon(chain[0].start, chain[-1].end))
     return newpath
 
-def assemble_transcript_graph(G, strand, partial_paths, 
-                              user_kmax, ksensitivity,
-                              fraction_major_path, 
-                              max_paths):
+def get_kmer_range(partial_paths, user_kmax, ksensitivity):
     """
-    enumerates individual transcript isoforms from transcript graph using
-    a greedy algorithm
-    
-    strand: strand of graph G
-    fraction_major_path: only return isoforms with score greater than 
-    some fraction of the highest score path
-    max_paths: do not enumerate more than max_paths isoforms     
+    returns (kmin, kmax) tuple with the range of 'k' that will be
+    searched when building the k-mer graph
     """
-    # constrain sensitivity parameter
-    ksensitivity = min(max(0.0, ksensitivity), 1.0)
-    # constrain fraction_major_path parameter
-    fraction_major_path = min(max(0.0, fraction_major_path), 1.0)
     # determine parameter 'k' for assembly
     longest_path_length = max(len(x[0]) for x in partial_paths)
     if user_kmax > 0:
@@ -287,18 +278,48 @@ def assemble_transcript_graph(G, strand, partial_paths,
         kmin = 1
     else:
         kmin = kmax
+    return kmin, kmax
+
+def build_kmer_graph(G, partial_paths, kmin, kmax, ksensitivity):
+    """
+    creates and smooths the k-mer graph used for path finding
+
+    returns (K, k) tuple
+    """
+    # constrain sensitivity parameter
+    ksensitivity = min(max(0.0, ksensitivity), 1.0)
     logging.debug("\tConstructing k-mer graph")
     K, k = optimize_k(G, partial_paths, kmin, kmax, ksensitivity)
     # smooth kmer graph
     smooth_graph(K)
+    return K, k
+
+def find_transcript_paths(G, K, strand, fraction_major_path, max_paths,
+                          isoform_mode="greedy"):
+    """
+    finds up to 'max_paths' isoforms in k-mer graph K built from 
+    transcript graph G.  path finding does not modify the node scores 
+    of K, so K can be searched repeatedly with different parameters.
+
+    isoform_mode 'greedy' repeatedly finds and subtracts the path with
+    the highest minimum node score.  'flow' decomposes edge flows 
+    estimated from the node scores (see find_flow_paths)
+
+    returns list of PathInfo objects
+    """
+    # constrain fraction_major_path parameter
+    fraction_major_path = min(max(0.0, fraction_major_path), 1.0)
     # find up to 'max_paths' paths through graph
-    logging.debug("\tFinding suboptimal paths in k=%d graph (%d nodes)" % (k,len(K)))
+    logging.debug("\tFinding suboptimal paths in k-mer graph (%d nodes)" % 
+                  (len(K)))
     path_info_list = []
     id_kmer_map = K.graph['id_kmer_map']   
-    for kmer_path, score in find_suboptimal_paths(K, K.graph['source'], 
-                                                  K.graph['sink'],
-                                                  fraction_major_path, 
-                                                  max_paths):
+    if isoform_mode == "flow":
+        path_func = find_flow_paths
+    else:
+        path_func = find_suboptimal_paths
+    for kmer_path, score in path_func(K, K.graph['source'], K.graph['sink'],
+                                      fraction_major_path, max_paths):
         # reconstruct path from kmer ids
         path = list(id_kmer_map[kmer_path[1]])
         path.extend(id_kmer_map[n][-1] for n in kmer_path[2:-1])
@@ -308,3 +329,24 @@ def assemble_transcript_graph(G, strand, partial_paths,
         path_info_list.append(PathInfo(score, path))
         logging.debug("\t\tscore=%f length=%d" % (score, len(path)))
     return path_info_list
+
+def assemble_transcript_graph(G, strand, partial_paths, 
+                              user_kmax, ksensitivity,
+                              fraction_major_path, 
+                              max_paths,
+                              isoform_mode="greedy"):
+    """
+    enumerates individual transcript isoforms from transcript graph using
+    a greedy algorithm
+    
+    strand: strand of graph G
+    fraction_major_path: only return isoforms with score greater than 
+    some fraction of the highest score path
+    max_paths: do not enumerate more than max_paths isoforms     
+    isoform_mode: method used to enumerate isoforms (see ISOFORM_MODES)
+    """
+    kmin, kmax = get_kmer_range(partial_paths, user_kmax, ksensitivity)
+    K, k = build_kmer_graph(G, partial_paths, kmin, kmax, ksensitivity)
+    logging.debug("\tUsing k=%d" % (k))
+    return find_transcript_paths(G, K, strand, fraction_major_path, 
+                                 max_paths, isoform_mode)
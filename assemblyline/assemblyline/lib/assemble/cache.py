@@ -0,0 +1,131 @@
+'''
+Created on Oct 19, 2013
+
+@author: mkiyer
+
+AssemblyLine: transcriptome meta-assembly from RNA-Seq
+
+Copyright (C) 2012-2013 Matthew Iyer
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import os
+import logging
+import hashlib
+import tempfile
+import cPickle as pickle
+
+import assemblyline
+from assemblyline.lib.base import GTFAttr
+from assemblyline.lib.transcript import Exon
+from assemblyline.lib.assemble.base import PathInfo
+
+# increment when the format of cached results changes
+CACHE_FORMAT_VERSION = 1
+
+# assembly parameters that affect the results of a locus
+CACHE_PARAMS = ('min_transcript_length', 'min_trim_length',
+                'trim_utr_fraction', 'trim_intron_fraction', 'guided',
+                'kmax', 'ksensitivity', 'fraction_major_isoform',
+                'max_paths', 'isoform_mode', 'create_bedgraph',
+                'create_bigwig')
+
+def locus_cache_key(transcripts, config):
+    '''
+    returns a hex digest that identifies the assembly of a locus.  the
+    key depends only on the parts of each transcript that are used by
+    the assembler (chromosome, strand, exons, score, and reference flag)
+    and not on transcript ids or other attributes, so that a locus is
+    recognized when the same transcripts are given different ids in a
+    new run.  transcripts are sorted so that the key does not depend on
+    the order of lines in the input file.
+    '''
+    records = []
+    for t in transcripts:
+        is_ref = int(t.attrs.get(GTFAttr.REF, "0"))
+        exons = tuple((e.start, e.end) for e in t.exons)
+        records.append((t.chrom, t.strand, exons, repr(t.score), is_ref))
+    records.sort()
+    params = [(attr, repr(getattr(config, attr))) for attr in CACHE_PARAMS]
+    h = hashlib.sha1()
+    h.update('%s\t%d\n' % (assemblyline.__version__, CACHE_FORMAT_VERSION))
+    h.update(repr(params))
+    for r in records:
+        h.update(repr(r))
+        h.update('\n')
+    return h.hexdigest()
+
+def pack_path_info_list(path_info_list):
+    '''
+    converts PathInfo objects to tuples for storage in the cache
+    '''
+    return [(p.score, tuple((e.start, e.end) for e in p.path))
+            for p in path_info_list]
+
+def unpack_path_info_list(packed):
+    return [PathInfo(score, [Exon(start, end) for start,end in path])
+            for score,path in packed]
+
+class LocusCache(object):
+    '''
+    on-disk store of locus assembly results addressed by the key from
+    locus_cache_key().  each result is a pickled file stored in a
+    subdirectory named by the first two characters of its key.  results
+    are written to a temporary file and renamed into place so that
+    concurrent workers (or runs) never read a partially written file.
+    '''
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def get(self, key):
+        '''
+        returns the cached value or None if the key is not in the cache
+        '''
+        filename = self._path(key)
+        if not os.path.exists(filename):
+            self.misses += 1
+            return None
+        try:
+            fileh = open(filename, 'rb')
+            value = pickle.load(fileh)
+            fileh.close()
+        except Exception:
+            # unreadable cache entries are recomputed and replaced
+            logging.warning("Ignoring unreadable cache file %s" %
+                            (filename))
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        filename = self._path(key)
+        subdir = os.path.dirname(filename)
+        if not os.path.exists(subdir):
+            try:
+                os.makedirs(subdir)
+            except OSError:
+                # created by another process
+                if not os.path.isdir(subdir):
+                    raise
+        fd, tmp_file = tempfile.mkstemp(prefix='.tmp', dir=subdir)
+        fileh = os.fdopen(fd, 'wb')
+        pickle.dump(value, fileh, pickle.HIGHEST_PROTOCOL)
+        fileh.close()
+        os.rename(tmp_file, filename)
@@ -168,3 +168,93 @@ def find_suboptimal_paths(G, source, sink, fraction_major_path=1e-3,
     clear_tmp_attributes(G) 
     # return (path,score) tuples sorted from high -> low score
     return path_results.items()
+
+def estimate_edge_flows(G):
+    """
+    converts node scores to edge flows.  the score of each node is split
+    among its outgoing edges in proportion to the scores of the
+    successor nodes, and among its incoming edges in proportion to the
+    scores of the predecessor nodes.  the flow of an edge is the smaller
+    of the two estimates so that no node carries more flow than its 
+    score.
+
+    returns dictionary mapping (u,v) edges to flows
+    """
+    node_score = lambda n: imax2(MIN_SCORE, G.node[n][NODE_SCORE])
+    out_totals = {}
+    in_totals = {}
+    for n in G.nodes_iter():
+        out_totals[n] = sum(node_score(v) for v in G.successors_iter(n))
+        in_totals[n] = sum(node_score(u) for u in G.predecessors_iter(n))
+    flows = {}
+    for u,v in G.edges_iter():
+        u_score = node_score(u)
+        v_score = node_score(v)
+        out_flow = u_score * (v_score / out_totals[u])
+        in_flow = v_score * (u_score / in_totals[v])
+        flows[(u,v)] = imin2(out_flow, in_flow)
+    return flows
+
+def find_flow_paths(G, source, sink, fraction_major_path=1e-3, 
+                    max_paths=1000):
+    """
+    finds paths through graph G by greedy-width decomposition of the
+    edge flows estimated from the node scores.  each iteration finds 
+    the path with the largest minimum edge flow and subtracts that flow
+    from the edges along the path.  at least one edge is exhausted in
+    every iteration so the same path is never found twice and at most
+    min(max_paths, number of edges) iterations are needed.
+
+    paths with score lower than 'fraction_major_path' of the highest
+    scoring path are not returned.  when no edge carries flow above 
+    MIN_SCORE the highest scoring greedy path is returned so that, like
+    find_suboptimal_paths, at least one path is always found.
+    """
+    flows = estimate_edge_flows(G)
+    # the topological order remains valid as edges are exhausted
+    order = nx.topological_sort(G)
+    max_iterations = imin2(max_paths, len(flows))
+    path_results = []
+    lowest_score = None
+    iterations = 0
+    while iterations < max_iterations:
+        # dynamic programming search for the widest path
+        width = {source: float('inf')}
+        prev = {source: None}
+        for u in order:
+            if u not in width:
+                continue
+            u_width = width[u]
+            for v in G.successors_iter(u):
+                f = flows[(u,v)]
+                if f <= MIN_SCORE:
+                    continue
+                w = imin2(u_width, f)
+                if (v not in width) or (w > width[v]):
+                    width[v] = w
+                    prev[v] = u
+        if sink not in width:
+            break
+        score = width[sink]
+        if lowest_score is None:
+            lowest_score = imax2(MIN_SCORE, score * fraction_major_path)
+        elif score <= lowest_score:
+            break
+        # traceback
+        path = [sink]
+        while prev[path[-1]] is not None:
+            path.append(prev[path[-1]])
+        path.reverse()
+        path_results.append((tuple(path), score))
+        # subtract path flow
+        for i in xrange(len(path) - 1):
+            e = (path[i], path[i+1])
+            flows[e] = flows[e] - score
+        iterations += 1
+    logging.debug("\t\tflow decomposition iterations=%d" % iterations)
+    if len(path_results) == 0:
+        # fall back to the best greedy path
+        init_tmp_attributes(G)
+        path_results.append(find_path(G, source, sink))
+        clear_tmp_attributes(G)
+    return path_results
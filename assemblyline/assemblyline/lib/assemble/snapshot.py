@@ -0,0 +1,164 @@
+'''
+Created on Oct 20, 2013
+
+@author: mkiyer
+
+AssemblyLine: transcriptome meta-assembly from RNA-Seq
+
+Copyright (C) 2012-2013 Matthew Iyer
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import os
+import zlib
+import collections
+import cPickle as pickle
+import networkx as nx
+
+from assemblyline.lib.transcript import Exon
+from assemblyline.lib.assemble.base import CHAIN_NODES
+from assemblyline.lib.assemble.transcript_graph import TranscriptGraph
+
+SNAPSHOT_FILE = "graphs.snapshot"
+INDEX_SUFFIX = ".idx"
+
+SnapshotEntry = collections.namedtuple('SnapshotEntry',
+                                       ['locus_num', 'chrom', 'start',
+                                        'end', 'num_graphs', 'offset',
+                                        'size'])
+
+def pack_transcript_graph(tg):
+    '''
+    converts a collapsed transcript graph to tuples of integers.  only
+    the graph structure, the chain of original nodes within each
+    collapsed node, and the partial paths are kept because these are
+    all that k-mer graph construction and path finding use
+    '''
+    nodes = tg.Gsub.nodes()
+    node_index = dict((n,i) for i,n in enumerate(nodes))
+    node_coords = tuple((n.start, n.end) for n in nodes)
+    chains = tuple(tuple((c.start, c.end) for c in tg.Gsub.node[n][CHAIN_NODES])
+                   for n in nodes)
+    edges = tuple((node_index[u], node_index[v])
+                  for u,v in tg.Gsub.edges_iter())
+    # partial paths order is preserved because it determines the
+    # order in which k-mers are created
+    partial_paths = tuple((tuple(node_index[n] for n in path), score)
+                          for path,score in tg.partial_paths)
+    return (tg.strand, node_coords, chains, edges, partial_paths)
+
+def unpack_transcript_graph(chrom, packed):
+    strand, node_coords, chains, edges, packed_paths = packed
+    nodes = [Exon(start, end) for start,end in node_coords]
+    G = nx.DiGraph()
+    for n,chain in zip(nodes, chains):
+        G.add_node(n, attr_dict={CHAIN_NODES: [Exon(s,e) for s,e in chain]})
+    G.add_edges_from((nodes[u], nodes[v]) for u,v in edges)
+    tg = TranscriptGraph(chrom, strand, G)
+    tg.partial_paths = [(tuple(nodes[i] for i in path), score)
+                        for path,score in packed_paths]
+    return tg
+
+def format_entry(entry):
+    return '\t'.join(map(str, entry))
+
+def parse_entry(line):
+    fields = line.rstrip('\n').split('\t')
+    return SnapshotEntry(int(fields[0]), fields[1], int(fields[2]),
+                         int(fields[3]), int(fields[4]), int(fields[5]),
+                         int(fields[6]))
+
+def read_snapshot_index(filename):
+    '''
+    returns (params, entries) tuple where params is a list of (key,value)
+    tuples from the header of the index and entries is a list of
+    SnapshotEntry tuples
+    '''
+    params = []
+    entries = []
+    for line in open(filename):
+        if line.startswith('#'):
+            k,v = line[1:].rstrip('\n').split('\t', 1)
+            params.append((k,v))
+            continue
+        entries.append(parse_entry(line))
+    return params, entries
+
+def read_snapshot_entry(fileh, entry):
+    '''
+    returns list of TranscriptGraph objects stored at 'entry'
+    '''
+    fileh.seek(entry.offset)
+    data = fileh.read(entry.size)
+    return [unpack_transcript_graph(entry.chrom, packed)
+            for packed in pickle.loads(zlib.decompress(data))]
+
+class SnapshotWriter(object):
+    '''
+    appends the transcript graphs of each locus to a snapshot file as a
+    compressed record and writes the location of the record to an index
+    file
+    '''
+    def __init__(self, filename, mode='w'):
+        self.fileh = open(filename, mode + 'b')
+        self.index_fileh = open(filename + INDEX_SUFFIX, mode)
+
+    def filehs(self):
+        return [self.fileh, self.index_fileh]
+
+    def write(self, locus_num, chrom, transcript_graphs):
+        if len(transcript_graphs) == 0:
+            return
+        packed = [pack_transcript_graph(tg) for tg in transcript_graphs]
+        data = zlib.compress(pickle.dumps(packed, pickle.HIGHEST_PROTOCOL))
+        start = min(n.start for tg in transcript_graphs for n in tg.Gsub)
+        end = max(n.end for tg in transcript_graphs for n in tg.Gsub)
+        offset = self.fileh.tell()
+        self.fileh.write(data)
+        entry = SnapshotEntry(locus_num, chrom, start, end,
+                              len(transcript_graphs), offset, len(data))
+        print >>self.index_fileh, format_entry(entry)
+
+    def close(self):
+        self.fileh.close()
+        self.index_fileh.close()
+
+def merge_snapshots(filenames, output_file, params=()):
+    '''
+    merges snapshot files written by separate processes into a single
+    file with records ordered by locus number.  'params' is a list of
+    (key,value) tuples written to the header of the index
+    '''
+    entries = []
+    for i,filename in enumerate(filenames):
+        if not os.path.exists(filename + INDEX_SUFFIX):
+            continue
+        for line in open(filename + INDEX_SUFFIX):
+            entries.append((parse_entry(line), i))
+    entries.sort()
+    filehs = [open(f, 'rb') for f in filenames]
+    outfh = open(output_file, 'wb')
+    index_fh = open(output_file + INDEX_SUFFIX, 'w')
+    for k,v in params:
+        print >>index_fh, '#%s\t%s' % (k,v)
+    for entry,i in entries:
+        filehs[i].seek(entry.offset)
+        data = filehs[i].read(entry.size)
+        entry = entry._replace(offset=outfh.tell())
+        outfh.write(data)
+        print >>index_fh, format_entry(entry)
+    index_fh.close()
+    outfh.close()
+    for fileh in filehs:
+        fileh.close()
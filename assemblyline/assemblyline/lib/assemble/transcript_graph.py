@@ -29,6 +29,7 @@ import bisect
 from assemblyline.lib.bx.cluster import ClusterTree
 from assemblyline.lib.transcript import Exon, POS_STRAND, NEG_STRAND, NO_STRAND
 from assemblyline.lib.base import GTFAttr, FLOAT_PRECISION
+from assemblyline.lib import bedgraph
 from base import NODE_SCORE, NODE_LENGTH
 from trim import trim_graph
 from collapse import collapse_strand_specific_graph
@@ -255,11 +256,11 @@ def create_transcript_graphs(chrom, transcripts,
     graphs
     '''
     def get_bedgraph_lines(chrom, G):
-        for n in sorted(G.nodes()):
-            if n.start < 0:
-                continue
-            fields = (chrom, n.start, n.end, G.node[n][NODE_SCORE]) 
-            yield fields
+        nodes = [n for n in G.nodes_iter() if n.start >= 0]
+        return bedgraph.get_bedgraph_lines(chrom,
+                                           [n.start for n in nodes],
+                                           [n.end for n in nodes],
+                                           [G.node[n][NODE_SCORE] for n in nodes])
     # partition transcripts by strand and resolve unstranded transcripts
     logging.debug("\tResolving unstranded transcripts")
     strand_transcript_lists, strand_ref_transcripts = \
@@ -272,8 +273,8 @@ def create_transcript_graphs(chrom, transcripts,
         G = create_directed_graph(strand, transcript_list)
         # output bedgraph
         if create_bedgraph:
-            for fields in get_bedgraph_lines(chrom, G):
-                print >>bedgraph_filehs[strand], '\t'.join(map(str,fields))
+            for line in get_bedgraph_lines(chrom, G):
+                print >>bedgraph_filehs[strand], line
         # trim utrs and intron retentions
         trim_nodes = trim_graph(G, strand, 
                                 min_trim_length, 
@@ -25,6 +25,8 @@ import subprocess
 import math
 import logging
 import collections
+import threading
+import Queue
 
 # float precision threshold
 FLOAT_PRECISION = 1e-10
@@ -105,6 +107,17 @@ class CategoryStats(object):
         self.counts = [0] * Category.NUM_CATEGORIES
         self.signal = [0.0] * Category.NUM_CATEGORIES
 
+    def add_transcript(self, attrs):
+        '''
+        count an annotated transcript using its GTF attributes
+        '''
+        if bool(int(attrs[GTFAttr.TEST])):
+            category = Category.SAME_STRAND
+        else:
+            category = int(attrs[GTFAttr.CATEGORY])
+        self.counts[category] += 1
+        self.signal[category] += float(attrs[GTFAttr.SCORE])
+
     def to_fields(self):
         return [self.library_id] + self.counts + self.signal
     @property
@@ -135,6 +148,13 @@ class CategoryStats(object):
         for line in f:
             yield CategoryStats.from_line(line)
         f.close()
+    @staticmethod
+    def to_file(filename, stats_iter):
+        fh = open(filename, "w")
+        print >>fh, '\t'.join(CategoryStats.header_fields())
+        for statsobj in stats_iter:
+            print >>fh, '\t'.join(map(str, statsobj.to_fields()))
+        fh.close()
 
 class Library(object):
     fields = ('sample_id', 'library_id', 'gtf_file', 'bam_file')
@@ -180,13 +200,22 @@ class Library(object):
         return True
 
 class FileHandleCache(object):
-    def __init__(self, keyfunc, maxsize=MAX_OPEN_FILE_DESCRIPTORS):
+    '''
+    keeps file handles for keys with at most 'maxsize' files open 
+    (least recently used files are closed first).  a file is truncated
+    the first time it is opened unless its key is in 'append_keys' and
+    is reopened for appending after it is closed
+    '''
+    def __init__(self, keyfunc, maxsize=MAX_OPEN_FILE_DESCRIPTORS,
+                 append_keys=None):
         self.fileh_dict = collections.OrderedDict()
         self.file_dict = {}
         self.keyfunc = keyfunc
-        self.maxsize = maxsize
+        self.maxsize = max(1, maxsize)
+        self.append_keys = set() if append_keys is None else set(append_keys)
         self.hits = 0
         self.misses = 0
+        self.opens = 0
 
     def get_file_handle(self, k):
         if k in self.fileh_dict:
@@ -196,71 +225,137 @@ class FileHandleCache(object):
             if k not in self.file_dict:
                 filename = self.keyfunc(k)
                 self.file_dict[k] = filename 
-                mode = 'w'
+                mode = 'a' if k in self.append_keys else 'w'
             else:
                 # not opening for the first time so append
                 filename = self.file_dict[k]
                 mode = 'a'
                 self.misses += 1
             # control number of open files
-            if len(self.fileh_dict) > self.maxsize:
+            if len(self.fileh_dict) >= self.maxsize:
                 # close least recently accessed file
-                lrufileh = self.fileh_dict.popitem(0)[1]
+                lrufileh = self.fileh_dict.popitem(last=False)[1]
                 lrufileh.close()        
             # open file                
             fileh = open(filename, mode)
+            self.opens += 1
         # update
         self.fileh_dict[k] = fileh
         return fileh
+
+    def get_open_file_handle(self, k):
+        '''
+        returns the file handle of a key if its file is open (without
+        changing the order in which files are closed) or None
+        '''
+        return self.fileh_dict.get(k)
     
     def close(self):
         for fileh in self.fileh_dict.itervalues():
             fileh.close()
+        self.fileh_dict = collections.OrderedDict()
 
-class BufferedFileSplitter(object):
-    def __init__(self, keyfunc, maxsize=1000000):
-        self.keyfunc = keyfunc
-        self.maxsize = maxsize
+class FileSplitter(object):
+    '''
+    writes lines to files chosen by key.  lines are buffered per key 
+    and when more than 'bufsize' bytes are buffered each buffer is 
+    written with a single call to a file handle kept in a 
+    FileHandleCache of at most 'maxfiles' open files.  when 'threaded'
+    is True buffers are written by a separate thread while the caller
+    continues to produce lines.  the buffer being filled and the one
+    being written then hold at most 'bufsize' / 2 bytes each so that
+    no more than 'bufsize' bytes are buffered in total
+
+    'sizes' records the number of bytes written for each key and 
+    'file_dict' the file of each key
+    '''
+    def __init__(self, keyfunc, bufsize=(1 << 26), 
+                 maxfiles=MAX_OPEN_FILE_DESCRIPTORS, threaded=False):
+        self.bufsize = bufsize
+        self.maxbuf = (bufsize // 2) if threaded else bufsize
         self.cursize = 0
-        self.flushes = 0
-        self.file_dict = {}
         self.buf_dict = {}
+        self.sizes = {}
+        self.cache = FileHandleCache(keyfunc, maxfiles)
+        self.file_dict = self.cache.file_dict
+        self.flushes = 0
+        self.error = None
+        self.queue = None
+        self.thread = None
+        if threaded:
+            self.queue = Queue.Queue(maxsize=1)
+            self.thread = threading.Thread(target=self._writer)
+            self.thread.daemon = True
+            self.thread.start()
 
-    def _flush(self):
-        for k in self.buf_dict:
-            # get file
-            if k not in self.file_dict:
-                # seeing for first time so create
-                filename = self.keyfunc(k)
-                self.file_dict[k] = filename
-                fileh = open(filename, 'w')
-            else:
-                # already opened so append
-                filename = self.file_dict[k]
-                fileh = open(filename, 'a')
-            for line in self.buf_dict[k]:
-                fileh.write(line)
-            fileh.close()
-            del self.buf_dict[k]
-            self.buf_dict[k] = []
-        self.flushes += 1
+    @property
+    def opens(self):
+        return self.cache.opens
+
+    def _write_chunk(self, k, data):
+        self.cache.get_file_handle(k).write(data)
+
+    def _writer(self):
+        while True:
+            chunks = self.queue.get()
+            try:
+                if chunks is None:
+                    break
+                if self.error is not None:
+                    continue
+                for k, data in chunks:
+                    self._write_chunk(k, data)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def _write_chunks(self, chunks):
+        if self.thread is None:
+            for k, data in chunks:
+                self._write_chunk(k, data)
+            return
+        if self.error is not None:
+            raise self.error
+        self.queue.put(chunks)
+
+    def flush(self):
+        if self.thread is not None:
+            # wait for the previous buffer to be written so that only 
+            # one buffer is written while the next is filled
+            self.queue.join()
+        # files that are already open are written first so that they
+        # are not closed to make room for other files
+        fileh_dict = self.cache.fileh_dict
+        keys = sorted(self.buf_dict, key=lambda k: k in fileh_dict,
+                      reverse=True)
+        chunks = []
+        for k in keys:
+            data = ''.join(self.buf_dict.pop(k))
+            self.sizes[k] = self.sizes.get(k, 0) + len(data)
+            chunks.append((k, data))
         self.cursize = 0
+        self._write_chunks(chunks)
+        self.flushes += 1
 
     def write(self, k, line):
-        # check size of buffer
-        if (self.cursize + len(line)) > self.maxsize:
-            # flush all buffers
-            self._flush()
-        # get buffer
-        if k not in self.buf_dict:
-            self.buf_dict[k] = [line] 
-        else:
-            self.buf_dict[k].append(line)
+        buf = self.buf_dict.get(k)
+        if buf is None:
+            buf = self.buf_dict[k] = []
+        buf.append(line)
         self.cursize += len(line)
+        if self.cursize > self.maxbuf:
+            self.flush()
 
     def close(self):
-        if self.cursize > 0:
-            self._flush()
+        self.flush()
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        self.cache.close()
+        if self.error is not None:
+            raise self.error
 
 def float_check_nan(x):
     x = float(x)
@@ -0,0 +1,630 @@
+'''
+Created on Oct 22, 2013
+
+@author: mkiyer
+
+AssemblyLine: transcriptome meta-assembly from RNA-Seq
+
+Copyright (C) 2012-2013 Matthew Iyer
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Writes the UCSC bigWig and bigBed (BBI) indexed binary formats described
+in Kent et al. 2010 Bioinformatics 26(17):2204-2207.  Data is written in
+zlib compressed blocks indexed by an R-tree, chromosome names are stored
+in a B+ tree, and zoom levels of summary records are computed for fast
+display of large regions.
+'''
+import zlib
+import struct
+import itertools
+import operator
+import numpy as np
+
+from assemblyline.lib.bedgraph import coverage_runs
+
+BIGWIG_MAGIC = 0x888FFC26
+BIGBED_MAGIC = 0x8789F2EB
+BPT_MAGIC = 0x78CA8C91
+CIRTREE_MAGIC = 0x2468ACE0
+BBI_VERSION = 4
+MAX_ZOOM_LEVELS = 10
+ZOOM_INCREMENT = 4
+ITEMS_PER_SLOT = 1024
+BLOCK_SIZE = 256
+BEDGRAPH_SECTION_TYPE = 1
+
+HEADER_FMT = '<IHHQQQHHQQIQ'
+ZOOM_HEADER_FMT = '<IIQQ'
+SUMMARY_FMT = '<Qdddd'
+BPT_HEADER_FMT = '<IIIIQQ'
+CIRTREE_HEADER_FMT = '<IIQIIIIQII'
+NODE_HEADER_FMT = '<BBH'
+CIRTREE_LEAF_FMT = '<IIIIQQ'
+CIRTREE_NODE_FMT = '<IIIIQ'
+BIGWIG_SECTION_FMT = '<IIIIIBBH'
+BIGBED_ITEM_FMT = '<III'
+
+BEDGRAPH_ITEM_DTYPE = np.dtype([('start', '<u4'), ('end', '<u4'),
+                                ('value', '<f4')])
+ZOOM_RECORD_DTYPE = np.dtype([('chrom_id', '<u4'), ('start', '<u4'),
+                              ('end', '<u4'), ('valid_count', '<u4'),
+                              ('min_val', '<f4'), ('max_val', '<f4'),
+                              ('sum_data', '<f4'), ('sum_squares', '<f4')])
+
+BED_AUTOSQL_FIELDS = [
+    'string chrom;       "Reference sequence chromosome or scaffold"',
+    'uint   chromStart;  "Start position in chromosome"',
+    'uint   chromEnd;    "End position in chromosome"',
+    'string name;        "Name of item"',
+    'uint   score;       "Score from 0-1000"',
+    'char[1] strand;     "+ or - or . for unknown"',
+    'uint   thickStart;  "Start of where display should be thick"',
+    'uint   thickEnd;    "End of where display should be thick"',
+    'uint   reserved;    "Used as itemRgb"',
+    'int    blockCount;  "Number of blocks"',
+    'int[blockCount] blockSizes; "Comma separated list of block sizes"',
+    'int[blockCount] chromStarts; "Start positions relative to chromStart"']
+
+def read_chrom_sizes(filename):
+    '''
+    returns dictionary of chromosome name -> size from a two column file
+    '''
+    chrom_sizes = {}
+    for line in open(filename):
+        fields = line.split()
+        if len(fields) < 2 or fields[0].startswith('#'):
+            continue
+        chrom_sizes[fields[0]] = int(fields[1])
+    return chrom_sizes
+
+def get_bed_autosql(field_count):
+    lines = ['table bed', '"Browser Extensible Data"', '    (']
+    lines.extend('    %s' % x for x in BED_AUTOSQL_FIELDS[:field_count])
+    lines.append('    )')
+    return '\n'.join(lines) + '\n'
+
+def scan_records(records, chrom_sizes, allow_overlap):
+    '''
+    checks that records are sorted and within chromosome bounds
+
+    returns (chroms, item_count, total_span) where chroms is the list of
+    chromosomes in the order they appear
+    '''
+    chroms = []
+    item_count = 0
+    total_span = 0
+    prev_chrom = None
+    prev_start = 0
+    prev_end = 0
+    for chrom, start, end, data in records:
+        if chrom != prev_chrom:
+            if chrom not in chrom_sizes:
+                raise ValueError("chromosome '%s' not found in chrom "
+                                 "sizes" % (chrom))
+            if prev_chrom is not None and chrom < prev_chrom:
+                raise ValueError("records not sorted by chromosome "
+                                 "('%s' after '%s')" % (chrom, prev_chrom))
+            chroms.append(chrom)
+            prev_chrom = chrom
+            prev_start = 0
+            prev_end = 0
+        if start < prev_start:
+            raise ValueError("records not sorted by position at %s:%d" %
+                             (chrom, start))
+        if (not allow_overlap) and (start < prev_end):
+            raise ValueError("overlapping records at %s:%d" % (chrom, start))
+        if (start >= end) or (end > chrom_sizes[chrom]):
+            raise ValueError("invalid interval %s:%d-%d" %
+                             (chrom, start, end))
+        prev_start = start
+        prev_end = end
+        item_count += 1
+        total_span += end - start
+    return chroms, item_count, total_span
+
+def write_chrom_tree(fileh, chroms, chrom_sizes, block_size=BLOCK_SIZE):
+    '''
+    writes B+ tree mapping chromosome names to (id, size) where the
+    chromosome id is the index of the chromosome in 'chroms'
+    '''
+    items = sorted((chrom, i) for i,chrom in enumerate(chroms))
+    key_size = max([len(chrom) for chrom in chroms] + [1])
+    block_size = max(1, min(block_size, len(items)))
+    fileh.write(struct.pack(BPT_HEADER_FMT, BPT_MAGIC, block_size, key_size,
+                            8, len(items), 0))
+    # leaf nodes hold the items
+    levels = [[items[i:i+block_size]
+               for i in xrange(0, max(1, len(items)), block_size)]]
+    # each higher level holds the first key of its child nodes
+    while len(levels[-1]) > 1:
+        children = levels[-1]
+        levels.append([children[i:i+block_size]
+                       for i in xrange(0, len(children), block_size)])
+    # write levels from the root down so that the root node immediately
+    # follows the header.  leaf items (key, id, size) and internal items
+    # (key, child offset) have the same size
+    item_size = key_size + 8
+    header_size = struct.calcsize(NODE_HEADER_FMT)
+    offset = fileh.tell()
+    level_offsets = []
+    for level in reversed(levels):
+        level_offsets.append(offset)
+        offset += sum(header_size + len(node) * item_size for node in level)
+    level_offsets.reverse()
+    def first_key(node, depth):
+        while depth > 0:
+            node = node[0]
+            depth -= 1
+        return node[0][0]
+    for depth in xrange(len(levels) - 1, -1, -1):
+        level = levels[depth]
+        if depth == 0:
+            for node in level:
+                fileh.write(struct.pack(NODE_HEADER_FMT, 1, 0, len(node)))
+                for chrom, chrom_id in node:
+                    fileh.write(chrom.ljust(key_size, '\0'))
+                    fileh.write(struct.pack('<II', chrom_id,
+                                            chrom_sizes[chrom]))
+        else:
+            child_offset = level_offsets[depth-1]
+            for node in level:
+                fileh.write(struct.pack(NODE_HEADER_FMT, 0, 0, len(node)))
+                for child in node:
+                    fileh.write(first_key(child, depth-1).ljust(key_size, '\0'))
+                    fileh.write(struct.pack('<Q', child_offset))
+                    child_offset += header_size + len(child) * item_size
+
+def write_rtree(fileh, items, end_file_offset, items_per_slot=ITEMS_PER_SLOT,
+                block_size=BLOCK_SIZE):
+    '''
+    writes R-tree index of data blocks.  'items' is a list of
+    (start_chrom_id, start, end_chrom_id, end, offset, size) tuples sorted
+    by position
+    '''
+    def bounds(nodes):
+        if len(nodes) == 0:
+            return (0, 0, 0, 0)
+        return (min((x[0], x[1]) for x in nodes) +
+                max((x[2], x[3]) for x in nodes))
+    start_bounds = bounds(items)
+    fileh.write(struct.pack(CIRTREE_HEADER_FMT, CIRTREE_MAGIC, block_size,
+                            len(items), start_bounds[0], start_bounds[1],
+                            start_bounds[2], start_bounds[3],
+                            end_file_offset, items_per_slot, 0))
+    levels = [[items[i:i+block_size]
+               for i in xrange(0, max(1, len(items)), block_size)]]
+    while len(levels[-1]) > 1:
+        children = levels[-1]
+        levels.append([children[i:i+block_size]
+                       for i in xrange(0, len(children), block_size)])
+    header_size = struct.calcsize(NODE_HEADER_FMT)
+    leaf_item_size = struct.calcsize(CIRTREE_LEAF_FMT)
+    node_item_size = struct.calcsize(CIRTREE_NODE_FMT)
+    # compute offset of the first node of each level with the root first
+    offset = fileh.tell()
+    level_offsets = [0] * len(levels)
+    for depth in xrange(len(levels) - 1, -1, -1):
+        level_offsets[depth] = offset
+        item_size = leaf_item_size if depth == 0 else node_item_size
+        offset += sum(header_size + len(node) * item_size
+                      for node in levels[depth])
+    # bounds of every node at each level
+    level_bounds = [[bounds(node) for node in levels[0]]]
+    for depth in xrange(1, len(levels)):
+        level_bounds.append([bounds(level_bounds[depth-1][i:i+block_size])
+                             for i in xrange(0, len(level_bounds[depth-1]),
+                                             block_size)])
+    for depth in xrange(len(levels) - 1, -1, -1):
+        if depth == 0:
+            for node in levels[0]:
+                fileh.write(struct.pack(NODE_HEADER_FMT, 1, 0, len(node)))
+                for item in node:
+                    fileh.write(struct.pack(CIRTREE_LEAF_FMT, *item))
+        else:
+            child_offset = level_offsets[depth-1]
+            child_item_size = leaf_item_size if depth == 1 else node_item_size
+            child_index = 0
+            for node in levels[depth]:
+                fileh.write(struct.pack(NODE_HEADER_FMT, 0, 0, len(node)))
+                for child in node:
+                    b = level_bounds[depth-1][child_index]
+                    fileh.write(struct.pack(CIRTREE_NODE_FMT, b[0], b[1],
+                                            b[2], b[3], child_offset))
+                    child_offset += header_size + len(child) * child_item_size
+                    child_index += 1
+
+def get_zoom_records(chrom_id, starts, ends, values, reduction):
+    '''
+    summarizes non-overlapping sorted intervals in bins of size
+    'reduction'.  returns array of ZOOM_RECORD_DTYPE
+    '''
+    if len(starts) == 0:
+        return np.zeros(0, dtype=ZOOM_RECORD_DTYPE)
+    first_bin = starts // reduction
+    last_bin = (ends - 1) // reduction
+    # split intervals at bin boundaries
+    npieces = last_bin - first_bin + 1
+    inds = np.repeat(np.arange(len(starts)), npieces)
+    piece_offsets = (np.arange(len(inds)) -
+                     np.repeat(np.cumsum(npieces) - npieces, npieces))
+    bins = first_bin[inds] + piece_offsets
+    piece_starts = np.maximum(starts[inds], bins * reduction)
+    piece_ends = np.minimum(ends[inds], (bins + 1) * reduction)
+    piece_lengths = piece_ends - piece_starts
+    piece_values = values[inds]
+    # summarize pieces in each bin
+    bin_first = np.flatnonzero(np.concatenate(([True], bins[1:] != bins[:-1])))
+    bin_last = np.append(bin_first[1:], len(bins)) - 1
+    records = np.zeros(len(bin_first), dtype=ZOOM_RECORD_DTYPE)
+    records['chrom_id'] = chrom_id
+    records['start'] = piece_starts[bin_first]
+    records['end'] = piece_ends[bin_last]
+    records['valid_count'] = np.add.reduceat(piece_lengths, bin_first)
+    records['min_val'] = np.minimum.reduceat(piece_values, bin_first)
+    records['max_val'] = np.maximum.reduceat(piece_values, bin_first)
+    records['sum_data'] = np.add.reduceat(piece_values * piece_lengths,
+                                          bin_first)
+    records['sum_squares'] = np.add.reduceat(piece_values * piece_values *
+                                             piece_lengths, bin_first)
+    return records
+
+def get_summary(starts, ends, values):
+    '''
+    returns (valid_count, min_val, max_val, sum_data, sum_squares)
+    '''
+    if len(starts) == 0:
+        return (0, np.inf, -np.inf, 0.0, 0.0)
+    lengths = (ends - starts).astype(np.float64)
+    return (int((ends - starts).sum()), float(values.min()),
+            float(values.max()), float((values * lengths).sum()),
+            float((values * values * lengths).sum()))
+
+def merge_summary(a, b):
+    return (a[0] + b[0], min(a[1], b[1]), max(a[2], b[2]), a[3] + b[3],
+            a[4] + b[4])
+
+def write_blocks(fileh, blocks):
+    '''
+    compresses and writes (data, start_chrom_id, start, end_chrom_id, end)
+    blocks.  returns (index_items, max_uncompressed_size)
+    '''
+    index_items = []
+    max_size = 0
+    for data, start_chrom_id, start, end_chrom_id, end in blocks:
+        compressed = zlib.compress(data)
+        index_items.append((start_chrom_id, start, end_chrom_id, end,
+                            fileh.tell(), len(compressed)))
+        fileh.write(compressed)
+        max_size = max(max_size, len(data))
+    return index_items, max_size
+
+def get_zoom_blocks(records, items_per_slot=ITEMS_PER_SLOT):
+    for i in xrange(0, len(records), items_per_slot):
+        chunk = records[i:i+items_per_slot]
+        yield (chunk.tobytes(), int(chunk['chrom_id'][0]),
+               int(chunk['start'][0]), int(chunk['chrom_id'][-1]),
+               int(chunk['end'].max()))
+
+def choose_zoom_levels(reductions, zoom_records, item_count):
+    '''
+    keeps zoom levels that at least halve the number of records of the
+    data, and afterwards, each level that reduces the size of the
+    previous level
+    '''
+    levels = []
+    prev_count = item_count
+    for reduction, records in zip(reductions, zoom_records):
+        count = sum(len(x) for x in records)
+        if count == 0:
+            break
+        if len(levels) == 0:
+            if count * 2 > item_count:
+                continue
+        elif count >= prev_count:
+            break
+        levels.append((reduction, records))
+        prev_count = count
+    return levels
+
+def write_bbi(output_file, magic, records_func, chrom_sizes, block_func,
+              coverage_func, field_count=0, defined_field_count=0,
+              autosql=None, allow_overlap=False,
+              items_per_slot=ITEMS_PER_SLOT, block_size=BLOCK_SIZE):
+    '''
+    writes BBI file from records.  'records_func' returns an iterator
+    over sorted (chrom, start, end, data) records and is called twice:
+    once to check the records and choose zoom levels, and once to write
+    the data.  'block_func' returns the uncompressed data blocks of the
+    records of one chromosome and 'coverage_func' returns the
+    (starts, ends, values) arrays of non-overlapping intervals that are
+    summarized in zoom levels.
+    '''
+    chroms, item_count, total_span = scan_records(records_func(),
+                                                  chrom_sizes,
+                                                  allow_overlap)
+    chrom_ids = dict((chrom,i) for i,chrom in enumerate(chroms))
+    # zoom levels begin at ten times the average item size
+    initial_reduction = max(1, 10 * total_span // max(1, item_count))
+    reductions = [initial_reduction * (ZOOM_INCREMENT ** i)
+                  for i in xrange(MAX_ZOOM_LEVELS)]
+    max_chrom_size = max([chrom_sizes[c] for c in chroms] + [1])
+    reductions = [r for r in reductions if r < max_chrom_size] or reductions[:1]
+    zoom_records = [[] for r in reductions]
+    fileh = open(output_file, 'wb')
+    # reserve space for header and zoom headers
+    fileh.write('\0' * (struct.calcsize(HEADER_FMT) +
+                        MAX_ZOOM_LEVELS * struct.calcsize(ZOOM_HEADER_FMT)))
+    autosql_offset = 0
+    if autosql is not None:
+        autosql_offset = fileh.tell()
+        fileh.write(autosql + '\0')
+    summary_offset = fileh.tell()
+    fileh.write('\0' * struct.calcsize(SUMMARY_FMT))
+    chrom_tree_offset = fileh.tell()
+    write_chrom_tree(fileh, chroms, chrom_sizes, block_size)
+    # write data blocks one chromosome at a time
+    data_offset = fileh.tell()
+    fileh.write(struct.pack('<Q', 0))
+    index_items = []
+    max_block_size = 0
+    summary = get_summary([], [], [])
+    for chrom, chrom_records in itertools.groupby(records_func(),
+                                                  operator.itemgetter(0)):
+        chrom_id = chrom_ids[chrom]
+        chrom_records = list(chrom_records)
+        items, max_size = write_blocks(fileh, block_func(chrom_id,
+                                                         chrom_records,
+                                                         items_per_slot))
+        index_items.extend(items)
+        max_block_size = max(max_block_size, max_size)
+        starts, ends, values = coverage_func(chrom_records)
+        summary = merge_summary(summary, get_summary(starts, ends, values))
+        for i,reduction in enumerate(reductions):
+            zoom_records[i].append(get_zoom_records(chrom_id, starts, ends,
+                                                    values, reduction))
+    index_offset = fileh.tell()
+    write_rtree(fileh, index_items, index_offset, items_per_slot, block_size)
+    # write zoom levels
+    zoom_headers = []
+    for reduction, records in choose_zoom_levels(reductions, zoom_records,
+                                                 item_count):
+        zoom_data_offset = fileh.tell()
+        fileh.write(struct.pack('<I', sum(len(x) for x in records)))
+        zoom_items = []
+        for chrom_zoom_records in records:
+            items, max_size = write_blocks(fileh,
+                                           get_zoom_blocks(chrom_zoom_records,
+                                                           items_per_slot))
+            zoom_items.extend(items)
+            max_block_size = max(max_block_size, max_size)
+        zoom_index_offset = fileh.tell()
+        write_rtree(fileh, zoom_items, zoom_index_offset, items_per_slot,
+                    block_size)
+        zoom_headers.append((reduction, 0, zoom_data_offset,
+                             zoom_index_offset))
+    # fill in header, zoom headers, summary, and data count
+    fileh.seek(0)
+    fileh.write(struct.pack(HEADER_FMT, magic, BBI_VERSION,
+                            len(zoom_headers), chrom_tree_offset,
+                            data_offset, index_offset, field_count,
+                            defined_field_count, autosql_offset,
+                            summary_offset, max_block_size, 0))
+    for zoom_header in zoom_headers:
+        fileh.write(struct.pack(ZOOM_HEADER_FMT, *zoom_header))
+    fileh.seek(summary_offset)
+    if summary[0] == 0:
+        summary = (0, 0.0, 0.0, 0.0, 0.0)
+    fileh.write(struct.pack(SUMMARY_FMT, *summary))
+    fileh.seek(data_offset)
+    if magic == BIGWIG_MAGIC:
+        data_count = len(index_items)
+    else:
+        data_count = item_count
+    fileh.write(struct.pack('<Q', data_count))
+    fileh.close()
+
+def get_bigwig_blocks(chrom_id, records, items_per_slot):
+    items = np.zeros(len(records), dtype=BEDGRAPH_ITEM_DTYPE)
+    items['start'] = [r[1] for r in records]
+    items['end'] = [r[2] for r in records]
+    items['value'] = [r[3] for r in records]
+    for i in xrange(0, len(items), items_per_slot):
+        chunk = items[i:i+items_per_slot]
+        start = int(chunk['start'][0])
+        end = int(chunk['end'][-1])
+        header = struct.pack(BIGWIG_SECTION_FMT, chrom_id, start, end,
+                             0, 0, BEDGRAPH_SECTION_TYPE, 0, len(chunk))
+        yield header + chunk.tobytes(), chrom_id, start, chrom_id, end
+
+def get_bigwig_coverage(records):
+    return (np.array([r[1] for r in records], dtype=np.int64),
+            np.array([r[2] for r in records], dtype=np.int64),
+            np.array([r[3] for r in records], dtype=np.float32).astype(np.float64))
+
+def write_bigwig(records_func, chrom_sizes, output_file,
+                 items_per_slot=ITEMS_PER_SLOT, block_size=BLOCK_SIZE):
+    '''
+    writes bigWig file from (chrom, start, end, value) records sorted
+    by chromosome and position.  'records_func' returns a new iterator
+    over the records each time it is called
+    '''
+    write_bbi(output_file, BIGWIG_MAGIC, records_func, chrom_sizes,
+              get_bigwig_blocks, get_bigwig_coverage,
+              items_per_slot=items_per_slot, block_size=block_size)
+
+def get_bigbed_blocks(chrom_id, records, items_per_slot):
+    for i in xrange(0, len(records), items_per_slot):
+        chunk = records[i:i+items_per_slot]
+        data = ''.join(struct.pack(BIGBED_ITEM_FMT, chrom_id, r[1], r[2]) +
+                       r[3] + '\0' for r in chunk)
+        yield (data, chrom_id, chunk[0][1], chrom_id,
+               max(r[2] for r in chunk))
+
+def get_bigbed_coverage(records):
+    # zoom levels of bigBed files summarize the depth of items
+    return coverage_runs([r[1] for r in records],
+                         [r[2] for r in records],
+                         np.ones(len(records)))
+
+def parse_bed_records(filename):
+    for line in open(filename):
+        if line.startswith('track') or line.startswith('#'):
+            continue
+        fields = line.rstrip('\n').split('\t', 3)
+        if len(fields) < 3:
+            continue
+        rest = fields[3] if len(fields) > 3 else ''
+        yield fields[0], int(fields[1]), int(fields[2]), rest
+
+def write_bigbed(bed_file, chrom_sizes, output_file,
+                 items_per_slot=ITEMS_PER_SLOT, block_size=BLOCK_SIZE):
+    '''
+    writes bigBed file from a BED file sorted by chromosome and start
+    '''
+    field_count = 0
+    for record in parse_bed_records(bed_file):
+        field_count = 3 + (len(record[3].split('\t')) if record[3] else 0)
+        break
+    defined_field_count = min(field_count, len(BED_AUTOSQL_FIELDS))
+    write_bbi(output_file, BIGBED_MAGIC,
+              lambda: parse_bed_records(bed_file), chrom_sizes,
+              get_bigbed_blocks, get_bigbed_coverage,
+              field_count=field_count,
+              defined_field_count=defined_field_count,
+              autosql=get_bed_autosql(defined_field_count),
+              allow_overlap=True, items_per_slot=items_per_slot,
+              block_size=block_size)
+
+class BBIFile(object):
+    '''
+    reads records from bigWig and bigBed files using the R-tree index
+    '''
+    def __init__(self, filename):
+        self.fileh = open(filename, 'rb')
+        header = self._unpack(HEADER_FMT)
+        (self.magic, self.version, zoom_count, chrom_tree_offset,
+         self.data_offset, self.index_offset, self.field_count,
+         self.defined_field_count, self.autosql_offset,
+         summary_offset, self.uncompress_buf_size, ext_offset) = header
+        if self.magic not in (BIGWIG_MAGIC, BIGBED_MAGIC):
+            raise ValueError("%s is not a bigWig or bigBed file" %
+                             (filename))
+        self.zoom_levels = [self._unpack(ZOOM_HEADER_FMT)
+                            for i in xrange(zoom_count)]
+        self.fileh.seek(summary_offset)
+        self.summary = self._unpack(SUMMARY_FMT)
+        self.chrom_sizes = {}
+        self.chrom_ids = {}
+        self.fileh.seek(chrom_tree_offset)
+        magic, block_size, key_size, val_size, item_count, reserved = \
+            self._unpack(BPT_HEADER_FMT)
+        self._read_chrom_node(self.fileh.tell(), key_size)
+
+    def _unpack(self, fmt):
+        return struct.unpack(fmt, self.fileh.read(struct.calcsize(fmt)))
+
+    def _read_chrom_node(self, offset, key_size):
+        self.fileh.seek(offset)
+        is_leaf, reserved, count = self._unpack(NODE_HEADER_FMT)
+        children = []
+        for i in xrange(count):
+            key = self.fileh.read(key_size).rstrip('\0')
+            if is_leaf:
+                chrom_id, chrom_size = self._unpack('<II')
+                self.chrom_ids[key] = chrom_id
+                self.chrom_sizes[key] = chrom_size
+            else:
+                children.append(self._unpack('<Q')[0])
+        for child_offset in children:
+            self._read_chrom_node(child_offset, key_size)
+
+    def _find_blocks(self, offset, chrom_id, start, end):
+        self.fileh.seek(offset)
+        is_leaf, reserved, count = self._unpack(NODE_HEADER_FMT)
+        fmt = CIRTREE_LEAF_FMT if is_leaf else CIRTREE_NODE_FMT
+        items = [self._unpack(fmt) for i in xrange(count)]
+        blocks = []
+        for item in items:
+            if ((item[0], item[1]) >= (chrom_id, end) or
+                (item[2], item[3]) <= (chrom_id, start)):
+                continue
+            if is_leaf:
+                blocks.append((item[4], item[5]))
+            else:
+                blocks.extend(self._find_blocks(item[4], chrom_id, start, end))
+        return blocks
+
+    def _read_blocks(self, index_offset, chrom, start, end):
+        if chrom not in self.chrom_ids:
+            return
+        chrom_id = self.chrom_ids[chrom]
+        root_offset = index_offset + struct.calcsize(CIRTREE_HEADER_FMT)
+        for offset, size in self._find_blocks(root_offset, chrom_id,
+                                              start, end):
+            self.fileh.seek(offset)
+            data = self.fileh.read(size)
+            if self.uncompress_buf_size > 0:
+                data = zlib.decompress(data)
+            yield chrom_id, data
+
+    def fetch(self, chrom, start, end):
+        '''
+        returns list of (start, end, value) records for bigWig files or
+        (start, end, rest) records for bigBed files overlapping the
+        interval
+        '''
+        results = []
+        for chrom_id, data in self._read_blocks(self.index_offset, chrom,
+                                                start, end):
+            if self.magic == BIGWIG_MAGIC:
+                header_size = struct.calcsize(BIGWIG_SECTION_FMT)
+                section = struct.unpack(BIGWIG_SECTION_FMT,
+                                        data[:header_size])
+                items = np.frombuffer(data[header_size:],
+                                      dtype=BEDGRAPH_ITEM_DTYPE,
+                                      count=section[-1])
+                records = [(int(x['start']), int(x['end']),
+                            float(x['value'])) for x in items]
+            else:
+                records = []
+                pos = 0
+                item_size = struct.calcsize(BIGBED_ITEM_FMT)
+                while pos < len(data):
+                    item_chrom_id, s, e = struct.unpack(BIGBED_ITEM_FMT,
+                                                        data[pos:pos+item_size])
+                    rest_end = data.index('\0', pos + item_size)
+                    records.append((s, e, data[pos+item_size:rest_end]))
+                    pos = rest_end + 1
+            results.extend(r for r in records if r[0] < end and r[1] > start)
+        return results
+
+    def fetch_zoom(self, level, chrom, start, end):
+        '''
+        returns array of zoom records of ZOOM_RECORD_DTYPE at zoom level
+        'level' overlapping the interval
+        '''
+        index_offset = self.zoom_levels[level][3]
+        chunks = [np.frombuffer(data, dtype=ZOOM_RECORD_DTYPE)
+                  for chrom_id, data in self._read_blocks(index_offset, chrom,
+                                                          start, end)]
+        if len(chunks) == 0:
+            return np.zeros(0, dtype=ZOOM_RECORD_DTYPE)
+        records = np.concatenate(chunks)
+        mask = ((records['chrom_id'] == self.chrom_ids[chrom]) &
+                (records['start'] < end) & (records['end'] > start))
+        return records[mask]
+
+    def close(self):
+        self.fileh.close()
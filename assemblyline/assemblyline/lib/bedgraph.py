@@ -0,0 +1,112 @@
+'''
+Created on Oct 22, 2013
+
+@author: mkiyer
+
+AssemblyLine: transcriptome meta-assembly from RNA-Seq
+
+Copyright (C) 2012-2013 Matthew Iyer
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import heapq
+import numpy as np
+
+def coverage_runs(starts, ends, values):
+    '''
+    computes coverage of a set of weighted intervals using a difference
+    array over the interval boundaries.  adjacent runs with the same
+    value are merged and uncovered runs are dropped.
+
+    returns (run_starts, run_ends, run_values) arrays
+    '''
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = np.asarray(ends, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    if len(starts) == 0:
+        return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64),
+                np.zeros(0, dtype=np.float64))
+    # compress coordinates to the set of interval boundaries
+    boundaries = np.unique(np.concatenate((starts, ends)))
+    start_inds = np.searchsorted(boundaries, starts)
+    end_inds = np.searchsorted(boundaries, ends)
+    # difference arrays of value and of interval depth
+    nruns = len(boundaries) - 1
+    diff = np.zeros(len(boundaries), dtype=np.float64)
+    depth = np.zeros(len(boundaries), dtype=np.int64)
+    np.add.at(diff, start_inds, values)
+    np.add.at(diff, end_inds, -values)
+    np.add.at(depth, start_inds, 1)
+    np.add.at(depth, end_inds, -1)
+    run_values = np.cumsum(diff)[:nruns]
+    covered = np.cumsum(depth)[:nruns] > 0
+    run_starts = boundaries[:-1][covered]
+    run_ends = boundaries[1:][covered]
+    run_values = run_values[covered]
+    if len(run_starts) == 0:
+        return run_starts, run_ends, run_values
+    # merge adjacent runs with equal values.  a run begins a new block
+    # unless it continues the previous run with the same value
+    new_block = np.ones(len(run_starts), dtype=bool)
+    new_block[1:] = ((run_starts[1:] != run_ends[:-1]) |
+                     (run_values[1:] != run_values[:-1]))
+    block_inds = np.flatnonzero(new_block)
+    block_last = np.append(block_inds[1:], len(run_starts)) - 1
+    return (run_starts[block_inds], run_ends[block_last],
+            run_values[block_inds])
+
+def get_bedgraph_lines(chrom, starts, ends, values):
+    '''
+    generates bedgraph lines from the coverage of weighted intervals
+    '''
+    run_starts, run_ends, run_values = coverage_runs(starts, ends, values)
+    for i in xrange(len(run_starts)):
+        yield '%s\t%d\t%d\t%s' % (chrom, run_starts[i], run_ends[i],
+                                  str(float(run_values[i])))
+
+def parse_bedgraph_key(line):
+    fields = line.split('\t', 2)
+    return fields[0], int(fields[1])
+
+def merge_bedgraph_lines(filenames):
+    '''
+    generates the lines of bedgraph files that are each sorted by
+    (chrom, start) in sorted order without re-sorting the combined
+    lines
+    '''
+    filehs = [open(f) for f in filenames]
+    iters = [((parse_bedgraph_key(line), i, line) for line in fileh)
+             for i,fileh in enumerate(filehs)]
+    for key, i, line in heapq.merge(*iters):
+        yield line
+    for fileh in filehs:
+        fileh.close()
+
+def merge_bedgraph_records(filenames):
+    '''
+    generates sorted (chrom, start, end, value) tuples from bedgraph
+    files that are each sorted by (chrom, start)
+    '''
+    for line in merge_bedgraph_lines(filenames):
+        fields = line.rstrip('\n').split('\t')
+        yield fields[0], int(fields[1]), int(fields[2]), float(fields[3])
+
+def merge_bedgraph_files(filenames, output_file):
+    '''
+    merges bedgraph files that are each sorted by (chrom, start) into a
+    single sorted file
+    '''
+    outfh = open(output_file, 'w')
+    outfh.writelines(merge_bedgraph_lines(filenames))
+    outfh.close()
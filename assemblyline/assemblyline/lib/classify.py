@@ -0,0 +1,553 @@
+'''
+Created on Nov 4, 2013
+
+@author: mkiyer
+
+AssemblyLine: transcriptome meta-assembly from RNA-Seq
+
+Copyright (C) 2012,2013 Matthew Iyer
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Classification of the transcripts of a library as expressed or
+background using the likelihood ratio of two-dimensional kernel
+density estimates of (mean_recurrence, pctrank).  Known transcripts
+(and test transcripts) form the expressed class and intronic-like or
+intergenic-like transcripts form the background class.
+
+This reimplements the classify_transcripts.R script that was formerly
+run for each library and writes the same statistics and performance
+files (except for the plots).  Classes with fewer than 
+BINNED_KDE_MIN_OBS observations use the same formulas as R, so log10
+likelihood ratios differ from R only by floating point rounding 
+(around 1e-12) and decisions only differ for transcripts that close to
+the cutoff.  test_classify checks this against a direct transcription
+of the R formulas.  Larger classes use the binned density estimate 
+(kde2d_binned), which differs from the exact estimate by less than 
+1e-3 of the maximum density (it is computed exactly when the bandwidth
+is too small for its grid, as with heavy-tailed recurrence).  The
+relative error is larger where the density is small, so log10 
+likelihood ratios differ by less than about 5e-2 in sparse regions of
+the data and much less near typical cutoffs.  Decisions then differ
+for transcripts within that tolerance of the cutoff (a few in 10^4 in
+synthetic libraries).
+
+Alternatively the densities are estimated once (PooledModel) from a
+stratified sample of transcripts of all libraries and each library is
+scored by interpolating them.  Libraries keep their own prior weights
+and choose their own cutoff when they have enough training transcripts
+(otherwise the pooled cutoff is offset by the prior weight).
+'''
+import array
+import zipfile
+import StringIO
+import numpy as np
+
+from assemblyline.lib.base import Category, GTFAttr
+from assemblyline.lib.gtf import TRANSCRIPT_ID_RE
+from assemblyline.lib.locus_codec import get_attr_values
+from assemblyline.lib.stats import kde2d, kde2d_binned, interp_surface, \
+    bandwidth_nrd
+
+# added to densities to avoid division by zero
+SATURATION = 1e-10
+# minimum number of transcripts in each class
+MIN_OBS = 50
+# number of kernel density grid points in each direction
+KDE2D_N = 50
+# number of observations above which densities are estimated by binning
+BINNED_KDE_MIN_OBS = 10000
+# prior fractions of signal from each type of transcript
+PRIOR_MRNA = 0.95
+PRIOR_INTERGENIC = 0.02
+PRIOR_INTRONIC = 1 - (PRIOR_MRNA + PRIOR_INTERGENIC)
+# classification variables
+CLASSIFY_VARIABLES = ('mean_recurrence', 'pctrank')
+
+# classes of observations
+TEST_CLASS = 0
+BACKGROUND_CLASS = 1
+EXPRESSED_CLASS = 2
+
+# timestamp of the members of pooled model files
+NPZ_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+PERF_HEADER_FIELDS = ["train.auc", "test.auc", "train.cutoff",
+                      "train.tp", "train.fp", "train.fn", "train.tn",
+                      "train.sens", "train.spec", "train.balacc",
+                      "test.tp", "test.fp", "test.fn", "test.tn",
+                      "test.sens", "test.spec", "test.balacc"]
+
+def r_str(x, digits=7):
+    '''
+    formats values the way R prints them (None is a missing value)
+    '''
+    if x is None:
+        return "NA"
+    if isinstance(x, basestring):
+        return x
+    if isinstance(x, (bool, np.bool_)):
+        return "TRUE" if x else "FALSE"
+    if np.isnan(x):
+        return "NaN"
+    if np.isinf(x):
+        return "Inf" if x > 0 else "-Inf"
+    return '%.*g' % (digits, x)
+
+def write_r_line(fileh, values):
+    # cat(..., "\n", sep="\t") ends lines with a tab
+    print >>fileh, '\t'.join(map(r_str, values)) + '\t'
+
+def weighted_log10lr(z_bkgd, z_expr, clweights):
+    '''
+    returns weighted log10 likelihood ratio of expressed versus 
+    background class densities
+    '''
+    zw1 = z_bkgd * clweights[0] + SATURATION
+    zw2 = z_expr * clweights[1] + SATURATION
+    return np.log10(zw2 / zw1)
+
+def classify_kde2d(x, y, cl, clweights, n=KDE2D_N):
+    '''
+    returns weighted log10 likelihood ratio of the expressed versus
+    background class densities at each observation
+    '''
+    lims = (x.min(), x.max(), y.min(), y.max())
+    z = []
+    for c in (BACKGROUND_CLASS, EXPRESSED_CLASS):
+        gx, gy, d = estimate_density(x[cl == c], y[cl == c], n, lims)
+        z.append(interp_surface(gx, gy, d, x, y))
+    return weighted_log10lr(z[0], z[1], clweights)
+
+def estimate_density(x, y, n, lims):
+    if len(x) >= BINNED_KDE_MIN_OBS:
+        return kde2d_binned(x, y, n=n, lims=lims)
+    return kde2d(x, y, n=n, lims=lims)
+
+def performance_table(pred, labels):
+    '''
+    sensitivity, specificity, and balanced accuracy when predictions
+    greater than or equal to each cutoff are positive, along with the
+    area under the ROC curve.  cutoffs are the distinct predictions in
+    decreasing order preceded by infinity (as in the R package ROCR)
+
+    returns (cutoffs, sens, spec, balacc, auc)
+    '''
+    labels = np.asarray(labels, dtype=np.bool)
+    npos = labels.sum()
+    nneg = len(labels) - npos
+    if (npos == 0) or (nneg == 0):
+        raise ValueError("Number of classes is not equal to 2")
+    order = np.argsort(-pred, kind='mergesort')
+    pred = pred[order]
+    labels = labels[order]
+    tp = np.cumsum(labels)
+    fp = np.cumsum(~labels)
+    # keep the last of each run of tied predictions
+    last = np.ones(len(pred), dtype=np.bool)
+    last[:-1] = pred[1:] != pred[:-1]
+    cutoffs = np.concatenate(([np.inf], pred[last]))
+    tp = np.concatenate(([0], tp[last]))
+    fp = np.concatenate(([0], fp[last]))
+    sens = tp / float(npos)
+    spec = (nneg - fp) / float(nneg)
+    balacc = (sens + spec) / 2.0
+    fpr = fp / float(nneg)
+    auc = np.sum(0.5 * np.diff(fpr) * (sens[1:] + sens[:-1]))
+    return cutoffs, sens, spec, balacc, auc
+
+def performance_at_cutoff(cutoff, pred, labels):
+    labels = np.asarray(labels, dtype=np.bool)
+    positive = (pred >= cutoff)
+    tp = int((positive & labels).sum())
+    fn = int(((~positive) & labels).sum())
+    fp = int((positive & (~labels)).sum())
+    tn = int(((~positive) & (~labels)).sum())
+    sens = 0.0
+    spec = 0.0
+    if (tp + fn) > 0:
+        sens = tp / float(tp + fn)
+    if (tn + fp) > 0:
+        spec = tn / float(tn + fp)
+    balacc = (sens + spec) / 2.0
+    return [tp, fp, fn, tn, sens, spec, balacc]
+
+def best_cutoff(log10lr, cl):
+    '''
+    returns (cutoff, auc) where cutoff gives the best balanced accuracy
+    on the training data
+    '''
+    train = (cl == BACKGROUND_CLASS) | (cl == EXPRESSED_CLASS)
+    train_lr = log10lr[train]
+    train_labels = (cl[train] == EXPRESSED_CLASS)
+    cutoffs, sens, spec, balacc, auc_train = \
+        performance_table(train_lr, train_labels)
+    return cutoffs[np.argmax(balacc)], auc_train
+
+def write_performance(prefix, log10lr, cl, cutoff, auc_train):
+    '''
+    writes performance at cutoff on the training and test data to
+    <prefix>.perf.txt.  the areas under the ROC curve are missing (None)
+    when the data lack one of the classes
+    '''
+    train = (cl == BACKGROUND_CLASS) | (cl == EXPRESSED_CLASS)
+    train_perf = performance_at_cutoff(cutoff, log10lr[train], 
+                                       cl[train] == EXPRESSED_CLASS)
+    # test data
+    if np.any(cl == TEST_CLASS):
+        test = (cl == TEST_CLASS) | (cl == BACKGROUND_CLASS)
+        test_lr = log10lr[test]
+        test_labels = (cl[test] == TEST_CLASS)
+        if np.all(test_labels):
+            auc_test = None
+        else:
+            auc_test = performance_table(test_lr, test_labels)[-1]
+        test_perf = performance_at_cutoff(cutoff, test_lr, test_labels)
+    else:
+        auc_test = None
+        test_perf = [None] * 7
+    fileh = open(prefix + ".perf.txt", "w")
+    print >>fileh, '\t'.join(PERF_HEADER_FIELDS) + '\t'
+    write_r_line(fileh, [auc_train, auc_test, cutoff] + train_perf +
+                 test_perf)
+    fileh.close()
+
+def classify_and_write_results(x, y, cl, clweights, prefix, n=KDE2D_N):
+    '''
+    classifies observations, chooses the cutoff with the best balanced
+    accuracy on the training data and writes performance to
+    <prefix>.perf.txt
+
+    returns (log10lr, pred_train) arrays
+    '''
+    log10lr = classify_kde2d(x, y, cl, clweights, n)
+    cutoff, auc_train = best_cutoff(log10lr, cl)
+    write_performance(prefix, log10lr, cl, cutoff, auc_train)
+    return log10lr, (log10lr > cutoff)
+
+def score_and_write_results(model, name, x, y, cl, clweights, prefix,
+                            min_obs=MIN_OBS):
+    '''
+    scores observations with the densities of a pooled model.  the 
+    cutoff is chosen on the training data of the library when it has at
+    least 'min_obs' observations in both classes.  otherwise it is the
+    cutoff of the pooled model shifted by the log10 prior weight of the
+    library (the offset of its log10 likelihood ratios relative to the
+    pooled ones).  writes performance to <prefix>.perf.txt
+
+    returns (log10lr, pred_train) arrays
+    '''
+    log10lr = model.log10lr(name, x, y, clweights)
+    num_bkgd = (cl == BACKGROUND_CLASS).sum()
+    num_expr = (cl == EXPRESSED_CLASS).sum()
+    if (num_bkgd >= min_obs) and (num_expr >= min_obs):
+        cutoff, auc_train = best_cutoff(log10lr, cl)
+    else:
+        cutoff = (model.cutoffs[name] + 
+                  np.log10(float(clweights[1]) / clweights[0]))
+        auc_train = None
+        if (num_bkgd > 0) and (num_expr > 0):
+            auc_train = best_cutoff(log10lr, cl)[1]
+    write_performance(prefix, log10lr, cl, cutoff, auc_train)
+    return log10lr, (log10lr > cutoff)
+
+class LibraryFeatures(object):
+    '''
+    classification features of the transcripts of a library stored as
+    arrays with one element per transcript.  'line_rows' holds the
+    transcript (array index) of each line of the library GTF file
+    '''
+    def __init__(self):
+        self.t_ids = []
+        self.category = None
+        self.is_test = None
+        self.score = None
+        self.mean_recurrence = None
+        self.pctrank = None
+        self.num_exons = None
+        self.line_rows = None
+
+    def __len__(self):
+        return len(self.t_ids)
+
+    @staticmethod
+    def from_gtf(gtf_file):
+        '''
+        reads features in a single pass over a library GTF file.  only
+        the attributes of 'transcript' lines are parsed
+        '''
+        attr_names = set([GTFAttr.CATEGORY, GTFAttr.TEST, GTFAttr.SCORE,
+                          GTFAttr.MEAN_RECURRENCE, GTFAttr.PCTRANK])
+        t_index = {}
+        t_attrs = []
+        num_exons = []
+        line_rows = array.array('l')
+        for line in open(gtf_file):
+            fields = line.split('\t', 8)
+            t_id = TRANSCRIPT_ID_RE.search(fields[8]).group(1)
+            row = t_index.get(t_id)
+            if row is None:
+                row = t_index[t_id] = len(t_attrs)
+                t_attrs.append(None)
+                num_exons.append(0)
+            if fields[2] == 'transcript':
+                t_attrs[row] = get_attr_values(fields[8], attr_names)
+            elif fields[2] == 'exon':
+                num_exons[row] += 1
+            line_rows.append(row)
+        f = LibraryFeatures()
+        f.t_ids = [None] * len(t_index)
+        for t_id, row in t_index.iteritems():
+            f.t_ids[row] = t_id
+        def column(name, dtype):
+            return np.array([a[name] for a in t_attrs], 
+                            dtype=np.float).astype(dtype)
+        f.category = column(GTFAttr.CATEGORY, np.int)
+        f.is_test = column(GTFAttr.TEST, np.int) == 1
+        f.score = column(GTFAttr.SCORE, np.float)
+        f.mean_recurrence = column(GTFAttr.MEAN_RECURRENCE, np.float)
+        f.pctrank = column(GTFAttr.PCTRANK, np.float)
+        f.num_exons = np.array(num_exons, dtype=np.int)
+        f.line_rows = np.frombuffer(line_rows, dtype=np.int)
+        return f
+
+def classify_features(features, prefix, min_obs=MIN_OBS, 
+                      kde2d_n=KDE2D_N, model=None):
+    '''
+    classifies the transcripts of a library, writes library statistics
+    to <prefix>.info.txt and the performance of intronic and intergenic
+    classification to <prefix>.intronic.perf.txt and 
+    <prefix>.intergenic.perf.txt
+
+    when 'model' is a PooledModel the library is scored with its 
+    densities instead of estimating densities from the library
+
+    returns list of (log10lr, pred_train) arrays for intronic and 
+    intergenic classification.  log10lr is NaN and pred_train is False
+    for transcripts that were not classified
+    '''
+    category = features.category
+    is_test = features.is_test
+    score = features.score
+    x = features.mean_recurrence
+    y = features.pctrank
+    intronic_like = np.in1d(category, list(Category.INTRONIC_LIKE))
+    intergenic_like = np.in1d(category, list(Category.INTERGENIC_LIKE))
+    # divide known transcripts into training/test sets
+    mrna = (category == Category.SAME_STRAND) | is_test
+    train = (category == Category.SAME_STRAND) & (~is_test)
+    num_mrna = int(mrna.sum())
+    num_tests = int(is_test.sum())
+    # divide unknown and test transcripts into classes
+    intronic = (~is_test) & intronic_like
+    intergenic = (~is_test) & intergenic_like
+    # compute ratio of each type of transcript
+    with np.errstate(divide='ignore', invalid='ignore'):
+        total_score = score.sum()
+        frac_mrna = score[mrna].sum() / total_score
+        frac_intronic = score[intronic].sum() / total_score
+        frac_intergenic = score[intergenic].sum() / total_score
+        # compute weights based on priors
+        known_vs_intronic_ratio = ((frac_mrna / PRIOR_MRNA) /
+                                   (frac_intronic / PRIOR_INTRONIC))
+        known_vs_intergenic_ratio = ((frac_mrna / PRIOR_MRNA) /
+                                     (frac_intergenic / PRIOR_INTERGENIC))
+    # determine whether there are enough samples to perform
+    # classification
+    do_intronic = (num_mrna >= min_obs) and (intronic.sum() >= min_obs)
+    do_intergenic = (num_mrna >= min_obs) and (intergenic.sum() >= min_obs)
+    if model is not None:
+        do_intronic = model.has_class("intronic") and intronic.any()
+        do_intergenic = model.has_class("intergenic") and intergenic.any()
+    # write stats information
+    fileh = open(prefix + ".info.txt", "w")
+    write_r_line(fileh, ["mrna", num_mrna, frac_mrna])
+    write_r_line(fileh, ["tests", num_tests])
+    write_r_line(fileh, ["intronic", intronic.sum(), frac_intronic])
+    write_r_line(fileh, ["intergenic", intergenic.sum(), frac_intergenic])
+    write_r_line(fileh, ["prior_mrna_vs_intronic", known_vs_intronic_ratio])
+    write_r_line(fileh, ["prior_mrna_vs_intergenic",
+                         known_vs_intergenic_ratio])
+    write_r_line(fileh, ["do_intronic", do_intronic])
+    write_r_line(fileh, ["do_intergenic", do_intergenic])
+    fileh.close()
+    # classify intronic-like and intergenic-like transcripts
+    results = []
+    for name, background, ratio, do_classify in \
+        (("intronic", intronic_like, known_vs_intronic_ratio, do_intronic),
+         ("intergenic", intergenic_like, known_vs_intergenic_ratio,
+          do_intergenic)):
+        log10lr = np.empty(len(category), dtype=np.float)
+        log10lr.fill(np.nan)
+        pred_train = np.zeros(len(category), dtype=np.bool)
+        if do_classify:
+            testrows = is_test & background
+            bkgdrows = (~is_test) & background
+            inds = np.flatnonzero(train | testrows | bkgdrows)
+            cl = np.where(testrows, TEST_CLASS,
+                          np.where(bkgdrows, BACKGROUND_CLASS,
+                                   EXPRESSED_CLASS))[inds]
+            if model is None:
+                lr, pred = classify_and_write_results(x[inds], y[inds], cl,
+                                                      (1, ratio),
+                                                      "%s.%s" % (prefix, name),
+                                                      kde2d_n)
+            else:
+                lr, pred = score_and_write_results(model, name, 
+                                                   x[inds], y[inds], cl,
+                                                   (1, ratio),
+                                                   "%s.%s" % (prefix, name),
+                                                   min_obs)
+            log10lr[inds] = lr
+            pred_train[inds] = pred
+        results.append((log10lr, pred_train))
+    return results
+
+def decide(features, results):
+    '''
+    decides which transcripts are expressed.  known and test transcripts
+    are always expressed and receive the larger of their log10 
+    likelihood ratios.  intronic-like transcripts are expressed when 
+    they have multiple exons and intergenic-like transcripts when they
+    have multiple exons or were predicted to be expressed
+
+    returns (pred, log10lr) arrays
+    '''
+    (intronic_lr, intronic_pred), (intergenic_lr, intergenic_pred) = results
+    category = features.category
+    multi_exon = features.num_exons > 1
+    known = features.is_test | (category == Category.SAME_STRAND)
+    intronic_like = (~known) & np.in1d(category, list(Category.INTRONIC_LIKE))
+    intergenic_like = ((~known) & 
+                       np.in1d(category, list(Category.INTERGENIC_LIKE)))
+    with np.errstate(invalid='ignore'):
+        known_lr = np.fmax(intronic_lr, intergenic_lr)
+    log10lr = np.where(known, known_lr, 
+                       np.where(intronic_like, intronic_lr, intergenic_lr))
+    pred = (known | (intronic_like & multi_exon) | 
+            (intergenic_like & (multi_exon | intergenic_pred)))
+    return pred, log10lr
+
+def sample_features(features, max_samples, random_state):
+    '''
+    stratified sample of at most 'max_samples' transcripts of each 
+    class of a library.  test transcripts are not sampled
+
+    returns dictionary with (x, y) arrays of 'expressed', 'intronic'
+    and 'intergenic' classes
+    '''
+    category = features.category
+    is_test = features.is_test
+    strata = (("expressed", category == Category.SAME_STRAND),
+              ("intronic", np.in1d(category, list(Category.INTRONIC_LIKE))),
+              ("intergenic", 
+               np.in1d(category, list(Category.INTERGENIC_LIKE))))
+    samples = {}
+    for name, mask in strata:
+        inds = np.flatnonzero(mask & (~is_test))
+        if len(inds) > max_samples:
+            inds = np.sort(random_state.choice(inds, max_samples, 
+                                               replace=False))
+        samples[name] = (features.mean_recurrence[inds], 
+                         features.pctrank[inds])
+    return samples
+
+class PooledModel(object):
+    '''
+    expressed and background densities estimated once from transcripts
+    pooled across libraries.  'cutoffs' holds the cutoff of the log10
+    likelihood ratio with the best balanced accuracy on the pooled
+    transcripts and is used for libraries too small to choose their own
+    '''
+    CLASSES = ("expressed", "intronic", "intergenic")
+
+    def __init__(self):
+        self.gx = None
+        self.gy = None
+        self.densities = {}
+        self.cutoffs = {}
+
+    def has_class(self, name):
+        return (name in self.densities) and ("expressed" in self.densities)
+
+    def log10lr(self, name, x, y, clweights):
+        z_bkgd = interp_surface(self.gx, self.gy, self.densities[name], x, y)
+        z_expr = interp_surface(self.gx, self.gy, 
+                                self.densities["expressed"], x, y)
+        return weighted_log10lr(z_bkgd, z_expr, clweights)
+
+    def to_file(self, filename):
+        arrays = {"gx": self.gx, "gy": self.gy}
+        for name, z in self.densities.iteritems():
+            arrays[name] = z
+        for name, cutoff in self.cutoffs.iteritems():
+            arrays[name + "_cutoff"] = np.array(cutoff)
+        # written like numpy.savez but with fixed member order and 
+        # timestamps so that the same model gives the same file
+        zipf = zipfile.ZipFile(filename, "w", zipfile.ZIP_STORED)
+        for name in sorted(arrays):
+            buf = StringIO.StringIO()
+            np.save(buf, arrays[name])
+            info = zipfile.ZipInfo(name + ".npy", NPZ_DATE_TIME)
+            info.external_attr = 0644 << 16
+            zipf.writestr(info, buf.getvalue())
+        zipf.close()
+
+    @staticmethod
+    def from_file(filename):
+        npzfile = np.load(filename)
+        m = PooledModel()
+        m.gx = npzfile["gx"]
+        m.gy = npzfile["gy"]
+        for name in PooledModel.CLASSES:
+            if name in npzfile.files:
+                m.densities[name] = npzfile[name]
+            if (name + "_cutoff") in npzfile.files:
+                m.cutoffs[name] = float(npzfile[name + "_cutoff"])
+        npzfile.close()
+        return m
+
+def train_pooled_model(samples_list, lims, min_obs=MIN_OBS, 
+                       kde2d_n=KDE2D_N):
+    '''
+    estimates class densities on a common grid spanning 'lims' (xmin,
+    xmax, ymin, ymax) from the samples of all libraries (see 
+    sample_features).  classes with fewer than 'min_obs' pooled samples
+    or without spread in either feature (no bandwidth for the density
+    estimate) are left out of the model
+    '''
+    m = PooledModel()
+    pooled = {}
+    for name in PooledModel.CLASSES:
+        xs = [samples[name][0] for samples in samples_list]
+        ys = [samples[name][1] for samples in samples_list]
+        x = np.concatenate(xs) if xs else np.zeros(0)
+        y = np.concatenate(ys) if ys else np.zeros(0)
+        if len(x) < min_obs:
+            continue
+        if (bandwidth_nrd(x) <= 0) or (bandwidth_nrd(y) <= 0):
+            continue
+        m.gx, m.gy, m.densities[name] = estimate_density(x, y, kde2d_n, 
+                                                         lims)
+        pooled[name] = (x, y)
+    for name in ("intronic", "intergenic"):
+        if not m.has_class(name):
+            continue
+        x = np.concatenate((pooled[name][0], pooled["expressed"][0]))
+        y = np.concatenate((pooled[name][1], pooled["expressed"][1]))
+        cl = np.repeat([BACKGROUND_CLASS, EXPRESSED_CLASS], 
+                       [len(pooled[name][0]), len(pooled["expressed"][0])])
+        log10lr = m.log10lr(name, x, y, (1, 1))
+        m.cutoffs[name] = best_cutoff(log10lr, cl)[0]
+    return m
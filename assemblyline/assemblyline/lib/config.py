@@ -46,7 +46,11 @@ SAMPLE_ID_MAP = 'sample_id.map'
 TRANSCRIPTS_DROPPED_GTF_FILE = "transcripts.dropped.gtf"
 TRANSCRIPTS_GTF_FILE = "transcripts.gtf"
 TRANSCRIPT_STATS_FILE = "aggregate_library_stats.txt"
+AGGREGATE_DIR = 'aggregate'
+AGGREGATE_MANIFEST_FILE = 'aggregate_manifest.txt'
 ANNOTATED_TRANSCRIPTS_GTF_FILE = 'transcripts.annotated.gtf'
+ANNOTATE_QUARANTINE_GTF_FILE = 'transcripts.annotate_quarantine.gtf'
+ANNOTATE_QUARANTINE_INDEX_FILE = 'transcripts.annotate_quarantine.txt'
 CATEGORY_STATS_FILE = "category_stats.txt"
 CLASSIFY_DIR = 'classify'
 REF_GTF_FILE = 'ref.gtf'
@@ -63,7 +67,11 @@ class AssemblylineResults(object):
         self.transcripts_dropped_gtf_file = os.path.join(output_dir, TRANSCRIPTS_DROPPED_GTF_FILE)
         self.transcripts_gtf_file = os.path.join(output_dir, TRANSCRIPTS_GTF_FILE)
         self.transcript_stats_file = os.path.join(output_dir, TRANSCRIPT_STATS_FILE)
+        self.aggregate_dir = os.path.join(output_dir, AGGREGATE_DIR)
+        self.aggregate_manifest_file = os.path.join(output_dir, AGGREGATE_MANIFEST_FILE)
         self.annotated_transcripts_gtf_file = os.path.join(output_dir, ANNOTATED_TRANSCRIPTS_GTF_FILE)
+        self.annotate_quarantine_gtf_file = os.path.join(output_dir, ANNOTATE_QUARANTINE_GTF_FILE)
+        self.annotate_quarantine_index_file = os.path.join(output_dir, ANNOTATE_QUARANTINE_INDEX_FILE)
         self.classify_dir = os.path.join(output_dir, CLASSIFY_DIR)
         self.category_stats_file = os.path.join(output_dir, CATEGORY_STATS_FILE)
         self.ref_gtf_file = os.path.join(output_dir, REF_GTF_FILE)
@@ -21,12 +21,16 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
 import os
+import re
 import subprocess
 import shutil
+import heapq
+
 
 GTF_EMPTY_FIELD = '.'
 GTF_ATTR_SEP = ';'
 GTF_ATTR_TAGVALUE_SEP = ' '
+TRANSCRIPT_ID_RE = re.compile(r'transcript_id "([^"]*)"')
 
 class GTFError(Exception):
     pass
@@ -40,6 +44,63 @@ def sort_gtf(filename, output_file, tmp_dir=None):
     myenv["LC_ALL"] = "C"
     return subprocess.call(args, stdout=open(output_file, "w"), env=myenv)
 
+_reverse_str_keys = {}
+def _reverse_str_key(s):
+    '''
+    key that orders strings in reverse byte order
+    '''
+    key = _reverse_str_keys.get(s)
+    if key is None:
+        key = ''.join(chr(255 - ord(c)) for c in s) + '\xff'
+        _reverse_str_keys[s] = key
+    return key
+
+def gtf_sort_key(line):
+    '''
+    key that orders GTF lines the same way as sort_gtf: by chromosome,
+    start position, feature type in reverse order, and then by the 
+    entire line.  strings are compared by bytes, which matches 'sort' 
+    only in the C locale (sort_gtf sets LC_ALL=C)
+    '''
+    line = line.rstrip('\n')
+    fields = line.split('\t', 4)
+    return (fields[0], int(fields[3]), _reverse_str_key(fields[2]), line)
+
+def _iter_sorted_gtf_keys(fileh, filename):
+    '''
+    generator of (gtf_sort_key, line) tuples of a sorted GTF file.  
+    raises GTFError when a line sorts before the previous line
+    '''
+    prev_key = None
+    for line in fileh:
+        key = gtf_sort_key(line)
+        if (prev_key is not None) and (key < prev_key):
+            raise GTFError("GTF file %s is not sorted in sort_gtf (C "
+                           "locale) order at line: %s" % 
+                           (filename, line.rstrip('\n')))
+        prev_key = key
+        yield key, line
+
+def merge_sorted_gtf_files(gtf_files, output_file):
+    '''
+    merges GTF files that are each sorted in sort_gtf order into a 
+    single sorted file without sorting the combined lines.  files must
+    be sorted with chromosome names in byte order as by 'sort' in the C
+    locale (sort_gtf or sorting with gtf_sort_key).  a file sorted in
+    another locale raises GTFError when its order is found to differ
+    '''
+    filehs = [open(f) for f in gtf_files]
+    outfh = open(output_file, "w")
+    try:
+        for key, line in heapq.merge(*[_iter_sorted_gtf_keys(fileh, f) 
+                                       for fileh, f in zip(filehs, 
+                                                           gtf_files)]):
+            outfh.write(line)
+    finally:
+        outfh.close()
+        for fileh in filehs:
+            fileh.close()
+
 def merge_sort_gtf_files(gtf_files, output_file, tmp_dir=None):
     tmp_file = os.path.splitext(output_file)[0] + ".unsorted.gtf"
     outfh = open(tmp_file, "w")
@@ -102,6 +163,122 @@ def parse_loci(line_iter):
     if len(window) > 0:
         yield window
 
+def get_exonic_overlap(a, b):
+    '''
+    returns number of bases shared by two sorted lists of non-overlapping
+    (start, end) intervals
+    '''
+    overlap = 0
+    i = 0
+    j = 0
+    while i < len(a) and j < len(b):
+        start = max(a[i][0], b[j][0])
+        end = min(a[i][1], b[j][1])
+        if start < end:
+            overlap += end - start
+        if a[i][1] < b[j][1]:
+            i += 1
+        else:
+            j += 1
+    return overlap
+
+def merge_intervals(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+def split_stranded_loci(lines):
+    '''
+    divides the lines of a locus into loci of overlapping transcripts on
+    the same strand.  clusters of overlapping unstranded transcripts are
+    added to the stranded locus with the greatest exonic overlap.  when
+    loci on both strands share the greatest overlap they are merged into
+    a single ambiguous locus.  unstranded clusters without exonic overlap
+    form loci of their own.
+
+    returns a list of loci ordered by start position where each locus 
+    is a list of lines in their original order
+    '''
+    # group lines by transcript
+    transcripts = {}
+    for i,line in enumerate(lines):
+        fields = line.split('\t')
+        m = TRANSCRIPT_ID_RE.search(fields[8]) if len(fields) > 8 else None
+        t_id = m.group(1) if m is not None else i
+        start = int(fields[3]) - 1
+        end = int(fields[4])
+        t = transcripts.get(t_id)
+        if t is None:
+            strand = fields[6] if fields[6] in ('+', '-') else '.'
+            t = transcripts[t_id] = [start, end, strand, [], []]
+        t[0] = min(t[0], start)
+        t[1] = max(t[1], end)
+        if fields[2] == 'exon':
+            t[3].append((start, end))
+        t[4].append(i)
+    # cluster overlapping transcripts on each strand
+    clusters = []
+    for strand in ('+', '-', '.'):
+        window = None
+        for t in sorted((t for t in transcripts.itervalues() 
+                         if t[2] == strand), key=lambda t: t[0]):
+            if (window is None) or (t[0] > window[1]):
+                window = [t[0], t[1], strand, []]
+                clusters.append(window)
+            window[1] = max(window[1], t[1])
+            window[3].append(t)
+    if len(clusters) == 1:
+        return [lines]
+    exons = [merge_intervals(e for t in c[3] for e in t[3]) 
+             for c in clusters]
+    stranded = [i for i,c in enumerate(clusters) if c[2] != '.']
+    # groups of clusters that form each locus
+    group_map = dict((i,i) for i in xrange(len(clusters)))
+    def find(i):
+        while group_map[i] != i:
+            i = group_map[i]
+        return i
+    for i,c in enumerate(clusters):
+        if c[2] != '.':
+            continue
+        overlaps = []
+        for j in stranded:
+            if (clusters[j][0] < c[1]) and (c[0] < clusters[j][1]):
+                overlap = get_exonic_overlap(exons[i], exons[j])
+                if overlap > 0:
+                    overlaps.append((overlap, j))
+        if len(overlaps) == 0:
+            continue
+        best_overlap = max(overlaps)[0]
+        best = [j for x,j in overlaps if x == best_overlap]
+        if len(set(clusters[j][2] for j in best)) > 1:
+            # ambiguous strand
+            for j in best[1:]:
+                group_map[find(j)] = find(best[0])
+        group_map[find(i)] = find(best[0])
+    # collect lines of each locus
+    groups = {}
+    for i,c in enumerate(clusters):
+        inds = groups.setdefault(find(i), [])
+        for t in c[3]:
+            inds.extend(t[4])
+    loci = sorted(sorted(x) for x in groups.itervalues())
+    return [[lines[i] for i in x] for x in loci]
+
+def parse_stranded_loci(line_iter):
+    '''
+    same as parse_loci but overlapping transcripts on opposite strands
+    are separated into different loci (see split_stranded_loci)
+    '''
+    for lines in parse_loci(line_iter):
+        for locus_lines in split_stranded_loci(lines):
+            yield locus_lines
+
 class GTFFeature(object):
     '''
     1. seqname - The name of the sequence. Must be a chromosome or scaffold.
@@ -0,0 +1,132 @@
+'''
+Created on Oct 23, 2013
+
+@author: mkiyer
+
+AssemblyLine: transcriptome meta-assembly from RNA-Seq
+
+Copyright (C) 2012-2013 Matthew Iyer
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Interval index stored in flat NumPy arrays.  Unlike dictionaries of
+IntervalTree objects, the arrays contain no Python objects, so reading
+them from forked worker processes does not update reference counts and
+the pages remain shared with the parent.  An index saved to a directory
+is loaded with memory mapping so that all processes share a single
+copy through the page cache.
+'''
+import os
+import numpy as np
+
+CHROMS_FILE = "chroms.txt"
+ARRAY_NAMES = ('chrom_offsets', 'starts', 'ends', 'max_ends', 'values')
+
+def save_arrays(dirname, arrays):
+    '''
+    saves dictionary of name -> array to directory as .npy files
+    '''
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+    for name, a in arrays.iteritems():
+        np.save(os.path.join(dirname, name + ".npy"), a)
+
+def load_arrays(dirname, names, mmap=True):
+    '''
+    loads arrays saved by save_arrays.  when 'mmap' is true the arrays
+    are read-only memory maps of the files
+    '''
+    mmap_mode = 'r' if mmap else None
+    return dict((name, np.load(os.path.join(dirname, name + ".npy"),
+                               mmap_mode=mmap_mode))
+                for name in names)
+
+class IntervalIndex(object):
+    '''
+    intervals are sorted by chromosome and start.  'max_ends' holds the
+    running maximum of interval ends within each chromosome so that the
+    intervals overlapping a query are found with two binary searches
+    '''
+    def __init__(self, chroms, chrom_offsets, starts, ends, max_ends,
+                 values):
+        self.chroms = list(chroms)
+        self.chrom_ids = dict((c,i) for i,c in enumerate(self.chroms))
+        self.chrom_offsets = chrom_offsets
+        self.starts = starts
+        self.ends = ends
+        self.max_ends = max_ends
+        self.values = values
+
+    def __len__(self):
+        return len(self.starts)
+
+    @staticmethod
+    def from_intervals(intervals):
+        '''
+        builds index from (chrom, start, end, value) tuples where value
+        is an integer, such as the index of a feature in a list
+        '''
+        intervals = sorted(intervals)
+        chroms = sorted(set(x[0] for x in intervals))
+        chrom_ids = dict((c,i) for i,c in enumerate(chroms))
+        n = len(intervals)
+        starts = np.array([x[1] for x in intervals], dtype=np.int64)
+        ends = np.array([x[2] for x in intervals], dtype=np.int64)
+        values = np.array([x[3] for x in intervals], dtype=np.int64)
+        chrom_inds = np.array([chrom_ids[x[0]] for x in intervals],
+                              dtype=np.int64)
+        chrom_offsets = np.searchsorted(chrom_inds, np.arange(len(chroms) + 1))
+        max_ends = np.zeros(n, dtype=np.int64)
+        for i in xrange(len(chroms)):
+            lo, hi = chrom_offsets[i], chrom_offsets[i+1]
+            max_ends[lo:hi] = np.maximum.accumulate(ends[lo:hi])
+        return IntervalIndex(chroms, chrom_offsets, starts, ends, max_ends,
+                             values)
+
+    def find(self, chrom, start, end):
+        '''
+        returns array of positions in the index of the intervals that
+        overlap [start, end)
+        '''
+        i = self.chrom_ids.get(chrom)
+        if i is None:
+            return np.zeros(0, dtype=np.int64)
+        lo, hi = int(self.chrom_offsets[i]), int(self.chrom_offsets[i+1])
+        # intervals at or after 'first' may end after the query start
+        first = lo + np.searchsorted(self.max_ends[lo:hi], start,
+                                     side='right')
+        # intervals before 'last' start before the query end
+        last = lo + np.searchsorted(self.starts[lo:hi], end, side='left')
+        if first >= last:
+            return np.zeros(0, dtype=np.int64)
+        inds = np.arange(first, last)
+        return inds[self.ends[first:last] > start]
+
+    def find_values(self, chrom, start, end):
+        return self.values[self.find(chrom, start, end)]
+
+    def save(self, dirname):
+        save_arrays(dirname, dict((name, getattr(self, name))
+                                  for name in ARRAY_NAMES))
+        fileh = open(os.path.join(dirname, CHROMS_FILE), 'w')
+        for chrom in self.chroms:
+            print >>fileh, chrom
+        fileh.close()
+
+    @staticmethod
+    def load(dirname, mmap=True):
+        chroms = [line.rstrip('\n') for line in
+                  open(os.path.join(dirname, CHROMS_FILE))]
+        arrays = load_arrays(dirname, ARRAY_NAMES, mmap)
+        return IntervalIndex(chroms, **arrays)
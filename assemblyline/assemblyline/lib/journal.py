@@ -0,0 +1,246 @@
+'''
+Created on Oct 18, 2013
+
+@author: mkiyer
+
+AssemblyLine: transcriptome meta-assembly from RNA-Seq
+
+Copyright (C) 2012-2013 Matthew Iyer
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import os
+import collections
+
+from assemblyline.lib.base import MAX_OPEN_FILE_DESCRIPTORS, FileHandleCache
+
+JOURNAL_SUFFIX = ".journal"
+
+JournalEntry = collections.namedtuple('JournalEntry',
+                                      ['locus_num', 'ids', 'offsets'])
+
+def _parse_entry(line):
+    fields = line.rstrip('\n').split('\t')
+    if len(fields) != 3:
+        return None
+    try:
+        locus_num = int(fields[0])
+        ids = tuple(int(x) for x in fields[1].split(',') if x)
+        offsets = tuple(int(x) for x in fields[2].split(',') if x)
+    except ValueError:
+        return None
+    return JournalEntry(locus_num, ids, offsets)
+
+def read_journal(filename):
+    '''
+    returns list of JournalEntry tuples from a journal file.  an
+    incomplete trailing line (written when a process was killed) is
+    ignored
+    '''
+    entries = []
+    if not os.path.exists(filename):
+        return entries
+    for line in open(filename):
+        if not line.endswith('\n'):
+            break
+        entry = _parse_entry(line)
+        if entry is None:
+            break
+        entries.append(entry)
+    return entries
+
+def recover_journal(journal_file, filenames):
+    '''
+    restores a set of output files to the state recorded by the last
+    usable entry in the journal.  an entry is usable when every output
+    file is at least as large as the offset recorded for it (output that
+    was lost before reaching disk invalidates all later entries).  files
+    are truncated to the offsets of that entry and the journal is
+    rewritten to end with it.
+
+    returns list of JournalEntry tuples that remain committed
+    '''
+    entries = read_journal(journal_file)
+    sizes = [os.path.getsize(f) if os.path.exists(f) else 0
+             for f in filenames]
+    while len(entries) > 0:
+        offsets = entries[-1].offsets
+        if ((len(offsets) == len(filenames)) and
+            all(off <= size for off, size in zip(offsets, sizes))):
+            break
+        entries.pop()
+    if len(entries) > 0:
+        offsets = entries[-1].offsets
+    else:
+        offsets = [0] * len(filenames)
+    for filename, offset in zip(filenames, offsets):
+        fileh = open(filename, 'a')
+        fileh.truncate(offset)
+        fileh.close()
+    fileh = open(journal_file, 'w')
+    for entry in entries:
+        print >>fileh, format_entry(entry)
+    fileh.close()
+    return entries
+
+def format_entry(entry):
+    return '\t'.join([str(entry.locus_num),
+                      ','.join(map(str, entry.ids)),
+                      ','.join(map(str, entry.offsets))])
+
+class LocusJournal(object):
+    '''
+    append-only record of the loci completed by a single worker process.
+
+    after all output for a locus has been written the worker calls
+    commit(), which flushes the output files and records the locus
+    number, a snapshot of the id counters, and the byte offset of the
+    end of each output file.  rollback() discards any output written
+    since the last commit.
+    '''
+    def __init__(self, filename, filehs, mode='w'):
+        self.filename = filename
+        self.filehs = filehs
+        self.fileh = open(filename, mode)
+        self.offsets = [fh.tell() for fh in filehs]
+
+    def commit(self, locus_num, ids=()):
+        for fh in self.filehs:
+            fh.flush()
+        self.offsets = [fh.tell() for fh in self.filehs]
+        entry = JournalEntry(locus_num, tuple(ids), tuple(self.offsets))
+        print >>self.fileh, format_entry(entry)
+        self.fileh.flush()
+
+    def rollback(self):
+        for fh, offset in zip(self.filehs, self.offsets):
+            fh.flush()
+            fh.truncate(offset)
+            fh.seek(offset)
+
+    def close(self):
+        self.fileh.close()
+
+def _parse_split_entry(line):
+    fields = line.rstrip('\n').split('\t')
+    try:
+        locus_num = int(fields[0])
+        sizes = []
+        for field in fields[1:]:
+            k, size = field.rsplit(':', 1)
+            sizes.append((k, int(size)))
+    except ValueError:
+        return None
+    return locus_num, sizes
+
+def recover_split_journal(journal_file, keyfunc):
+    '''
+    restores the files of a JournaledFileSplitter to the state recorded
+    by its journal.  entries are replayed until one refers to output
+    that never reached disk.  each file that was committed is truncated
+    to its last committed size and the journal is rewritten to end with
+    the last usable entry.
+
+    returns dictionary mapping keys to committed file sizes
+    '''
+    lines = []
+    committed = {}
+    if os.path.exists(journal_file):
+        for line in open(journal_file):
+            if not line.endswith('\n'):
+                break
+            entry = _parse_split_entry(line)
+            if entry is None:
+                break
+            locus_num, sizes = entry
+            if not all(os.path.exists(keyfunc(k)) and
+                       (size <= os.path.getsize(keyfunc(k)))
+                       for k, size in sizes):
+                break
+            committed.update(sizes)
+            lines.append(line)
+    for k, size in committed.iteritems():
+        fileh = open(keyfunc(k), 'a')
+        fileh.truncate(size)
+        fileh.close()
+    fileh = open(journal_file, 'w')
+    fileh.writelines(lines)
+    fileh.close()
+    return committed
+
+class JournaledFileSplitter(object):
+    '''
+    writes lines to a set of files chosen by key (for example one file
+    per library) and journals each completed locus like LocusJournal.
+    keys must not contain tabs.
+
+    at most 'maxsize' files are kept open at once.  commit() flushes
+    the files written since the previous commit and records their
+    sizes.  'committed' is the dictionary returned by
+    recover_split_journal when a worker is restarted
+    '''
+    def __init__(self, filename, keyfunc, committed=None,
+                 maxsize=MAX_OPEN_FILE_DESCRIPTORS):
+        self.keyfunc = keyfunc
+        if committed is None:
+            committed = {}
+        self.sizes = dict(committed)
+        # files of keys that are not committed are truncated when first
+        # opened to discard output of an earlier process
+        self.cache = FileHandleCache(keyfunc, maxsize, 
+                                     append_keys=committed)
+        self.dirty = set()
+        mode = 'a' if len(committed) > 0 else 'w'
+        self.fileh = open(filename, mode)
+
+    def write(self, k, line):
+        self.cache.get_file_handle(k).write(line)
+        self.dirty.add(k)
+
+    def writelines(self, k, lines):
+        self.cache.get_file_handle(k).writelines(lines)
+        self.dirty.add(k)
+
+    def commit(self, locus_num):
+        fields = [str(locus_num)]
+        for k in self.dirty:
+            fileh = self.cache.get_open_file_handle(k)
+            if fileh is not None:
+                fileh.flush()
+                size = fileh.tell()
+            else:
+                size = os.path.getsize(self.keyfunc(k))
+            self.sizes[k] = size
+            fields.append('%s:%d' % (k, size))
+        self.dirty = set()
+        print >>self.fileh, '\t'.join(fields)
+        self.fileh.flush()
+
+    def rollback(self):
+        for k in self.dirty:
+            size = self.sizes.get(k, 0)
+            fileh = self.cache.get_open_file_handle(k)
+            if fileh is not None:
+                fileh.flush()
+                fileh.truncate(size)
+                fileh.seek(size)
+            else:
+                fileh = open(self.keyfunc(k), 'a')
+                fileh.truncate(size)
+                fileh.close()
+        self.dirty = set()
+
+    def close(self):
+        self.cache.close()
+        self.fileh.close()
@@ -0,0 +1,232 @@
+'''
+Created on Oct 24, 2013
+
+@author: mkiyer
+
+AssemblyLine: transcriptome meta-assembly from RNA-Seq
+
+Copyright (C) 2012-2013 Matthew Iyer
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Compact binary encoding of the transcripts of a GTF locus that is sent
+from the process reading the GTF file to worker processes.  A record
+holds the chromosome, transcript coordinates, strand codes, exon
+coordinates grouped by transcript, and only the attribute columns
+needed by the workers, so workers rebuild Transcript objects without
+parsing GTF text.
+'''
+import struct
+import numpy as np
+
+from assemblyline.lib.gtf import GTFError, GTF_EMPTY_FIELD, GTF_ATTR_SEP, \
+    GTF_ATTR_TAGVALUE_SEP
+from assemblyline.lib.base import GTFAttr
+from assemblyline.lib.transcript import Transcript, Exon, \
+    strand_str_to_int, transcripts_from_gtf_lines
+
+# num transcripts, num exons, num attribute columns, chrom length
+HEADER_FMT = '<IIIH'
+HEADER_SIZE = struct.calcsize(HEADER_FMT)
+# attribute name length, length of joined values
+ATTR_HEADER_FMT = '<HI'
+ATTR_HEADER_SIZE = struct.calcsize(ATTR_HEADER_FMT)
+ATTR_VALUE_SEP = '\0'
+COORD_DTYPE = np.dtype('<i8')
+STRAND_DTYPE = np.dtype('<i1')
+COUNT_DTYPE = np.dtype('<i4')
+PRESENT_DTYPE = np.dtype('<u1')
+
+def get_attr_values(attr_string, names):
+    '''
+    returns dictionary with the values of the attributes in 'names'
+    parsed the same way as GTFFeature.from_string
+    '''
+    attrs = {}
+    if attr_string == GTF_EMPTY_FIELD:
+        return attrs
+    for a in attr_string.split(GTF_ATTR_SEP):
+        a = a.strip()
+        if len(a) == 0:
+            continue
+        tag, value = a.split(GTF_ATTR_TAGVALUE_SEP, 1)
+        if tag in names:
+            attrs[tag] = value.strip('"')
+            if len(attrs) == len(names):
+                break
+    return attrs
+
+def encode_locus(lines, attr_names):
+    '''
+    encodes the GTF lines of a locus as a binary string.  'attr_names'
+    are the attributes kept for each transcript (the transcript id is
+    always kept).  raises GTFError under the same conditions as
+    transcripts_from_gtf_lines
+    '''
+    attr_names = [GTFAttr.TRANSCRIPT_ID] + [x for x in attr_names
+                                            if x != GTFAttr.TRANSCRIPT_ID]
+    attr_name_set = frozenset(attr_names)
+    t_id_set = frozenset([GTFAttr.TRANSCRIPT_ID])
+    t_indexes = {}
+    t_starts = []
+    t_ends = []
+    t_strands = []
+    t_attrs = []
+    exon_t_indexes = []
+    exon_starts = []
+    exon_ends = []
+    chrom = None
+    for line in lines:
+        fields = line.strip().split('\t')
+        if chrom is None:
+            chrom = fields[0]
+        feature_type = fields[2]
+        start = int(fields[3]) - 1
+        end = int(fields[4])
+        if feature_type == 'transcript':
+            attrs = get_attr_values(fields[8], attr_name_set)
+        else:
+            attrs = get_attr_values(fields[8], t_id_set)
+        t_id = attrs[GTFAttr.TRANSCRIPT_ID]
+        i = t_indexes.get(t_id)
+        if i is None:
+            if feature_type != 'transcript':
+                raise GTFError("Feature type '%s' found before "
+                               "'transcript' record: %s" %
+                               (feature_type, line))
+            i = len(t_starts)
+            t_indexes[t_id] = i
+            t_starts.append(start)
+            t_ends.append(end)
+            t_strands.append(strand_str_to_int(fields[6] if fields[6] in
+                                               ('+', '-') else
+                                               GTF_EMPTY_FIELD))
+            t_attrs.append(attrs)
+        if feature_type == 'exon':
+            exon_t_indexes.append(i)
+            exon_starts.append(start)
+            exon_ends.append(end)
+    # group exons by transcript in genomic order
+    exon_t_indexes = np.array(exon_t_indexes, dtype=np.int64)
+    exon_starts = np.array(exon_starts, dtype=COORD_DTYPE)
+    exon_ends = np.array(exon_ends, dtype=COORD_DTYPE)
+    order = np.lexsort((exon_ends, exon_starts, exon_t_indexes))
+    exon_counts = np.bincount(exon_t_indexes, minlength=len(t_starts))
+    if chrom is None:
+        chrom = ''
+    parts = [struct.pack(HEADER_FMT, len(t_starts), len(exon_starts),
+                         len(attr_names), len(chrom)),
+             chrom,
+             np.array(t_starts, dtype=COORD_DTYPE).tostring(),
+             np.array(t_ends, dtype=COORD_DTYPE).tostring(),
+             np.array(t_strands, dtype=STRAND_DTYPE).tostring(),
+             exon_counts.astype(COUNT_DTYPE).tostring(),
+             exon_starts[order].tostring(),
+             exon_ends[order].tostring()]
+    for name in attr_names:
+        present = np.array([name in x for x in t_attrs],
+                           dtype=PRESENT_DTYPE)
+        values = ATTR_VALUE_SEP.join(x.get(name, '') for x in t_attrs)
+        parts.extend([struct.pack(ATTR_HEADER_FMT, len(name), len(values)),
+                      name, values, present.tostring()])
+    return ''.join(parts)
+
+def read_array(data, dtype, count, offset):
+    '''
+    returns list of 'count' values read from 'data' at 'offset' and the
+    offset of the end of the array
+    '''
+    a = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+    return a.tolist(), offset + count * dtype.itemsize
+
+def decode_locus(data):
+    '''
+    returns the list of Transcript objects of a locus encoded by
+    encode_locus
+    '''
+    num_transcripts, num_exons, num_attrs, chrom_len = \
+        struct.unpack_from(HEADER_FMT, data, 0)
+    offset = HEADER_SIZE
+    chrom = data[offset:offset+chrom_len]
+    offset += chrom_len
+    t_starts, offset = read_array(data, COORD_DTYPE,
+                                  num_transcripts, offset)
+    t_ends, offset = read_array(data, COORD_DTYPE,
+                                num_transcripts, offset)
+    t_strands, offset = read_array(data, STRAND_DTYPE,
+                                   num_transcripts, offset)
+    exon_counts, offset = read_array(data, COUNT_DTYPE,
+                                     num_transcripts, offset)
+    exon_starts, offset = read_array(data, COORD_DTYPE,
+                                     num_exons, offset)
+    exon_ends, offset = read_array(data, COORD_DTYPE,
+                                   num_exons, offset)
+    transcripts = []
+    j = 0
+    for i in xrange(num_transcripts):
+        t = Transcript()
+        t.chrom = chrom
+        t.start = t_starts[i]
+        t.end = t_ends[i]
+        t.strand = t_strands[i]
+        t.exons = [Exon(exon_starts[k], exon_ends[k])
+                   for k in xrange(j, j + exon_counts[i])]
+        j += exon_counts[i]
+        t.attrs = {}
+        transcripts.append(t)
+    for x in xrange(num_attrs):
+        name_len, values_len = struct.unpack_from(ATTR_HEADER_FMT, data,
+                                                  offset)
+        offset += ATTR_HEADER_SIZE
+        name = data[offset:offset+name_len]
+        offset += name_len
+        values = data[offset:offset+values_len].split(ATTR_VALUE_SEP)
+        offset += values_len
+        present, offset = read_array(data, PRESENT_DTYPE,
+                                     num_transcripts, offset)
+        for i,t in enumerate(transcripts):
+            if present[i]:
+                t.attrs[name] = values[i]
+    return transcripts
+
+def pack_locus(lines, attr_names):
+    '''
+    returns the payload sent to workers for a locus.  loci that cannot
+    be encoded are sent as GTF lines so that the error is raised (and
+    the locus quarantined) by the worker
+    '''
+    try:
+        return encode_locus(lines, attr_names)
+    except (GTFError, ValueError, IndexError, KeyError):
+        return lines
+
+def unpack_locus(payload):
+    '''
+    returns list of Transcript objects from a payload of pack_locus
+    '''
+    if isinstance(payload, list):
+        return transcripts_from_gtf_lines(payload)
+    return decode_locus(payload)
+
+def unpack_locus_lines(payload):
+    '''
+    returns GTF lines of a payload of pack_locus.  encoded loci only
+    retain the attributes chosen when the locus was encoded
+    '''
+    if isinstance(payload, list):
+        return payload
+    lines = []
+    for t in decode_locus(payload):
+        lines.extend(str(f) for f in t.to_gtf_features())
+    return lines
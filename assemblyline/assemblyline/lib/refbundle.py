@@ -0,0 +1,396 @@
+'''
+Created on Oct 28, 2013
+
+@author: mkiyer
+
+AssemblyLine: transcriptome meta-assembly from RNA-Seq
+
+Copyright (C) 2012-2013 Matthew Iyer
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Reference annotation bundle.  A reference GTF file is compiled once
+into a directory of NumPy arrays that are loaded with memory mapping:
+
+- transcripts sorted by chromosome and position with their exons,
+  gene index and splice pattern hash
+- sorted unique introns of each chromosome
+- loci (clusters of overlapping transcripts) and their extents
+- an interval index of reference exons
+
+The exon and transcript records are stored as GTF text (without the
+'ref' and 'tst' attributes that tools add) so that tools writing
+reference features copy them without parsing the reference again.
+'''
+import os
+import logging
+import collections
+import hashlib
+import struct
+import numpy as np
+
+from assemblyline.lib.base import GTFAttr
+from assemblyline.lib.gtf import GTFFeature
+from assemblyline.lib.transcript import Transcript, Exon, \
+    strand_str_to_int
+from assemblyline.lib.intervalindex import IntervalIndex, save_arrays, \
+    load_arrays
+
+BUNDLE_VERSION = 1
+SOURCE_FILE = 'source.txt'
+CHROMS_FILE = 'chroms.txt'
+GENE_IDS_FILE = 'gene_ids.txt'
+TRANSCRIPT_IDS_FILE = 'transcript_ids.txt'
+EXON_GTF_FILE = 'exons.gtf'
+TRANSCRIPT_GTF_FILE = 'transcripts.gtf'
+EXON_INDEX_DIR = 'exon_index'
+LOCUS_INDEX_DIR = 'locus_index'
+ARRAY_NAMES = ('t_chrom_offsets', 't_starts', 't_ends', 't_strands',
+               't_genes', 't_exon_offsets', 't_patterns',
+               'exon_starts', 'exon_ends',
+               'intron_chrom_offsets', 'intron_starts', 'intron_ends',
+               'intron_strands', 'locus_offsets',
+               'pattern_hashes', 'pattern_transcripts')
+# attributes added to reference features by tools
+TOOL_ATTRS = (GTFAttr.REF, GTFAttr.TEST)
+# pattern hash of transcripts without introns
+NO_PATTERN = 0
+
+def splice_pattern_hash(chrom, strand, exons):
+    '''
+    returns 64-bit hash of the intron chain of a transcript, or
+    NO_PATTERN for transcripts with a single exon
+    '''
+    if len(exons) < 2:
+        return NO_PATTERN
+    coords = []
+    for j in xrange(1, len(exons)):
+        coords.append(exons[j-1][1])
+        coords.append(exons[j][0])
+    s = '%s\t%d\t%s' % (chrom, strand,
+                        np.array(coords, dtype='<i8').tostring())
+    h = struct.unpack('<q', hashlib.md5(s).digest()[:8])[0]
+    # reserve the value used for transcripts without introns
+    return h if h != NO_PATTERN else 1
+
+def add_attrs_to_line(line, attrs):
+    '''
+    appends (key, value) attributes to the attribute field of a GTF line
+    '''
+    attr_str = ' '.join('%s "%s";' % (k, v) for (k, v) in attrs)
+    if line.endswith('\t'):
+        return line + attr_str
+    return line + ' ' + attr_str
+
+def is_reference_bundle(path):
+    return os.path.isdir(path) and \
+        os.path.exists(os.path.join(path, SOURCE_FILE))
+
+def _read_lines(filename):
+    return [line.rstrip('\n') for line in open(filename)]
+
+def _write_lines(filename, lines):
+    fileh = open(filename, 'w')
+    for line in lines:
+        print >>fileh, line
+    fileh.close()
+
+def read_reference_transcripts(gtf_file):
+    '''
+    groups the exons of a reference GTF file by chromosome and transcript
+    id.  returns list of (chrom, start, end, strand, t_id, g_id,
+    exon_features, transcript_feature) tuples in genomic order
+    '''
+    exon_dict = collections.defaultdict(lambda: [])
+    transcript_dict = {}
+    for f in GTFFeature.parse(open(gtf_file)):
+        for attr in TOOL_ATTRS:
+            if attr in f.attrs:
+                del f.attrs[attr]
+        key = (f.seqid, f.attrs[GTFAttr.TRANSCRIPT_ID])
+        if f.feature_type == "transcript":
+            transcript_dict[key] = f
+        elif f.feature_type == "exon":
+            exon_dict[key].append(f)
+    transcripts = []
+    for key, features in exon_dict.iteritems():
+        features.sort(key=lambda f: f.start)
+        if key in transcript_dict:
+            t = transcript_dict[key]
+        else:
+            t = GTFFeature()
+            t.seqid = features[0].seqid
+            t.source = features[0].source
+            t.feature_type = 'transcript'
+            t.start = features[0].start
+            t.end = features[-1].end
+            t.score = features[0].score
+            t.strand = features[0].strand
+            t.phase = '.'
+            t.attrs = features[0].attrs.copy()
+            if "exon_number" in t.attrs:
+                del t.attrs["exon_number"]
+        transcripts.append((t.seqid, t.start, t.end,
+                            strand_str_to_int(t.strand), key[1],
+                            t.attrs.get(GTFAttr.GENE_ID, key[1]),
+                            features, t))
+    transcripts.sort(key=lambda x: x[:5])
+    return transcripts
+
+def build_reference_bundle(gtf_file, dirname):
+    '''
+    compiles reference GTF file into a bundle directory
+    '''
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+    # remove marker of a complete bundle while writing
+    source_file = os.path.join(dirname, SOURCE_FILE)
+    if os.path.exists(source_file):
+        os.remove(source_file)
+    transcripts = read_reference_transcripts(gtf_file)
+    chroms = sorted(set(x[0] for x in transcripts))
+    chrom_ids = dict((c,i) for i,c in enumerate(chroms))
+    gene_ids = {}
+    t_chrom_inds = []
+    t_genes = []
+    t_patterns = []
+    t_exon_offsets = [0]
+    exon_starts = []
+    exon_ends = []
+    introns = set()
+    exon_intervals = []
+    locus_offsets = []
+    locus_intervals = []
+    locus_end = None
+    exon_fileh = open(os.path.join(dirname, EXON_GTF_FILE), 'w')
+    transcript_fileh = open(os.path.join(dirname, TRANSCRIPT_GTF_FILE), 'w')
+    for i, x in enumerate(transcripts):
+        chrom, start, end, strand, t_id, g_id, features, t_feature = x
+        t_chrom_inds.append(chrom_ids[chrom])
+        t_genes.append(gene_ids.setdefault(g_id, len(gene_ids)))
+        exons = [(f.start, f.end) for f in features]
+        t_patterns.append(splice_pattern_hash(chrom, strand, exons))
+        for j, f in enumerate(features):
+            exon_starts.append(f.start)
+            exon_ends.append(f.end)
+            exon_intervals.append((chrom, f.start, f.end, i))
+            if j > 0:
+                introns.add((chrom_ids[chrom], exons[j-1][1], f.start,
+                             strand))
+            print >>exon_fileh, str(f)
+        t_exon_offsets.append(len(exon_starts))
+        print >>transcript_fileh, str(t_feature)
+        # transcripts are sorted by position so loci are contiguous
+        if (i == 0) or (chrom != transcripts[i-1][0]) or (start > locus_end):
+            if i > 0:
+                locus_intervals[-1][2] = locus_end
+            locus_offsets.append(i)
+            locus_intervals.append([chrom, start, end,
+                                    len(locus_intervals)])
+            locus_end = end
+        else:
+            locus_end = max(locus_end, end)
+    if len(locus_intervals) > 0:
+        locus_intervals[-1][2] = locus_end
+    locus_offsets.append(len(transcripts))
+    exon_fileh.close()
+    transcript_fileh.close()
+    # splice patterns sorted by hash
+    t_patterns = np.array(t_patterns, dtype=np.int64)
+    pattern_transcripts = np.argsort(t_patterns, kind='mergesort')
+    pattern_hashes = t_patterns[pattern_transcripts]
+    # introns sorted by chromosome and position
+    introns = np.array(sorted(introns), dtype=np.int64).reshape(-1, 4)
+    intron_chrom_offsets = np.searchsorted(introns[:,0],
+                                           np.arange(len(chroms) + 1))
+    t_chrom_inds = np.array(t_chrom_inds, dtype=np.int64)
+    arrays = {'t_chrom_offsets': np.searchsorted(t_chrom_inds,
+                                                 np.arange(len(chroms) + 1)),
+              't_starts': np.array([x[1] for x in transcripts], dtype=np.int64),
+              't_ends': np.array([x[2] for x in transcripts], dtype=np.int64),
+              't_strands': np.array([x[3] for x in transcripts], dtype=np.int8),
+              't_genes': np.array(t_genes, dtype=np.int64),
+              't_exon_offsets': np.array(t_exon_offsets, dtype=np.int64),
+              't_patterns': t_patterns,
+              'exon_starts': np.array(exon_starts, dtype=np.int64),
+              'exon_ends': np.array(exon_ends, dtype=np.int64),
+              'intron_chrom_offsets': intron_chrom_offsets,
+              'intron_starts': introns[:,1].copy(),
+              'intron_ends': introns[:,2].copy(),
+              'intron_strands': introns[:,3].astype(np.int8),
+              'locus_offsets': np.array(locus_offsets, dtype=np.int64),
+              'pattern_hashes': pattern_hashes,
+              'pattern_transcripts': pattern_transcripts}
+    save_arrays(dirname, arrays)
+    IntervalIndex.from_intervals(exon_intervals).save(
+        os.path.join(dirname, EXON_INDEX_DIR))
+    IntervalIndex.from_intervals(tuple(x) for x in locus_intervals).save(
+        os.path.join(dirname, LOCUS_INDEX_DIR))
+    _write_lines(os.path.join(dirname, CHROMS_FILE), chroms)
+    _write_lines(os.path.join(dirname, GENE_IDS_FILE),
+                 sorted(gene_ids, key=gene_ids.get))
+    _write_lines(os.path.join(dirname, TRANSCRIPT_IDS_FILE),
+                 [x[4] for x in transcripts])
+    # source file is written last and marks a complete bundle
+    st = os.stat(gtf_file)
+    _write_lines(source_file, ['version\t%d' % (BUNDLE_VERSION),
+                               'gtf_file\t%s' % (os.path.abspath(gtf_file)),
+                               'size\t%d' % (st.st_size),
+                               'mtime\t%d' % (int(st.st_mtime)),
+                               'num_transcripts\t%d' % (len(transcripts))])
+    return len(transcripts)
+
+class ReferenceBundle(object):
+    def __init__(self, dirname, mmap=True):
+        self.dirname = dirname
+        self.source = dict(line.split('\t', 1) for line in
+                           _read_lines(os.path.join(dirname, SOURCE_FILE)))
+        if int(self.source['version']) != BUNDLE_VERSION:
+            raise ValueError("Reference bundle %s has version %s "
+                             "(expected %d)" % (dirname,
+                                                self.source['version'],
+                                                BUNDLE_VERSION))
+        for msg in self.check_source():
+            logging.warning("Reference bundle %s may be stale: %s" %
+                            (dirname, msg))
+        self.chroms = _read_lines(os.path.join(dirname, CHROMS_FILE))
+        self.chrom_ids = dict((c,i) for i,c in enumerate(self.chroms))
+        self.gene_ids = _read_lines(os.path.join(dirname, GENE_IDS_FILE))
+        self.transcript_ids = _read_lines(os.path.join(dirname,
+                                                       TRANSCRIPT_IDS_FILE))
+        for name, a in load_arrays(dirname, ARRAY_NAMES, mmap).iteritems():
+            setattr(self, name, a)
+        self.exon_index = IntervalIndex.load(
+            os.path.join(dirname, EXON_INDEX_DIR), mmap)
+        self.locus_index = IntervalIndex.load(
+            os.path.join(dirname, LOCUS_INDEX_DIR), mmap)
+
+    def __len__(self):
+        return len(self.transcript_ids)
+
+    def check_source(self):
+        '''
+        compares the size and modification time of the reference GTF
+        file with those recorded when the bundle was built and returns a
+        list of messages describing the differences
+        '''
+        gtf_file = self.source['gtf_file']
+        if not os.path.exists(gtf_file):
+            return ['source GTF file %s not found' % (gtf_file)]
+        st = os.stat(gtf_file)
+        msgs = []
+        if st.st_size != int(self.source['size']):
+            msgs.append('source GTF file %s size %d differs from %s' %
+                        (gtf_file, st.st_size, self.source['size']))
+        if int(st.st_mtime) != int(self.source['mtime']):
+            msgs.append('source GTF file %s modified after the bundle '
+                        'was built' % (gtf_file))
+        return msgs
+
+    def get_exons(self, i):
+        lo, hi = self.t_exon_offsets[i], self.t_exon_offsets[i+1]
+        return zip(self.exon_starts[lo:hi].tolist(),
+                   self.exon_ends[lo:hi].tolist())
+
+    def get_chrom(self, i):
+        return self.chroms[np.searchsorted(self.t_chrom_offsets, i,
+                                           side='right') - 1]
+
+    def iter_gtf_lines(self):
+        '''
+        generator of (transcript index, exon lines, transcript line)
+        tuples in the order of the transcripts of the bundle
+        '''
+        exon_fileh = open(os.path.join(self.dirname, EXON_GTF_FILE))
+        transcript_fileh = open(os.path.join(self.dirname,
+                                             TRANSCRIPT_GTF_FILE))
+        exon_counts = np.diff(self.t_exon_offsets).tolist()
+        for i, line in enumerate(transcript_fileh):
+            exon_lines = [exon_fileh.next().rstrip('\n')
+                          for j in xrange(exon_counts[i])]
+            yield i, exon_lines, line.rstrip('\n')
+        exon_fileh.close()
+        transcript_fileh.close()
+
+    def iter_transcripts(self):
+        '''
+        generator of Transcript objects with the attributes of the
+        transcript records
+        '''
+        t_starts = self.t_starts.tolist()
+        t_ends = self.t_ends.tolist()
+        t_strands = self.t_strands.tolist()
+        t_chrom_offsets = self.t_chrom_offsets.tolist()
+        transcript_fileh = open(os.path.join(self.dirname,
+                                             TRANSCRIPT_GTF_FILE))
+        c = 0
+        for i, line in enumerate(transcript_fileh):
+            while i >= t_chrom_offsets[c+1]:
+                c += 1
+            t = Transcript()
+            t.chrom = self.chroms[c]
+            t.start = t_starts[i]
+            t.end = t_ends[i]
+            t.strand = t_strands[i]
+            t.exons = [Exon(start, end) for start, end in self.get_exons(i)]
+            t.attrs = GTFFeature.from_string(line).attrs
+            yield t
+        transcript_fileh.close()
+
+    def iter_loci(self):
+        '''
+        generator of (chrom, start, end, first transcript index, last
+        transcript index + 1) tuples of each locus
+        '''
+        index = self.locus_index
+        locus_offsets = self.locus_offsets.tolist()
+        for c, chrom in enumerate(index.chroms):
+            for j in xrange(index.chrom_offsets[c], index.chrom_offsets[c+1]):
+                k = int(index.values[j])
+                yield (chrom, int(index.starts[j]), int(index.ends[j]),
+                       locus_offsets[k], locus_offsets[k+1])
+
+    def find_exon_transcripts(self, chrom, start, end, strand=None):
+        '''
+        returns array of indexes of transcripts with exons overlapping
+        [start, end) on 'strand' (any strand when None)
+        '''
+        t_inds = self.exon_index.find_values(chrom, start, end)
+        if strand is not None:
+            t_inds = t_inds[self.t_strands[t_inds] == strand]
+        return t_inds
+
+    def has_intron(self, chrom, start, end, strand):
+        c = self.chrom_ids.get(chrom)
+        if c is None:
+            return False
+        lo = int(self.intron_chrom_offsets[c])
+        hi = int(self.intron_chrom_offsets[c+1])
+        starts = self.intron_starts[lo:hi]
+        i = lo + np.searchsorted(starts, start, side='left')
+        j = lo + np.searchsorted(starts, start, side='right')
+        return bool(np.any((self.intron_ends[i:j] == end) &
+                           (self.intron_strands[i:j] == strand)))
+
+    def find_splice_pattern(self, chrom, strand, exons):
+        '''
+        returns array of indexes of the multi-exon transcripts with the
+        same intron chain as 'exons'
+        '''
+        h = splice_pattern_hash(chrom, strand, exons)
+        if h == NO_PATTERN:
+            return np.zeros(0, dtype=np.int64)
+        i = np.searchsorted(self.pattern_hashes, h, side='left')
+        j = np.searchsorted(self.pattern_hashes, h, side='right')
+        return np.sort(self.pattern_transcripts[i:j])
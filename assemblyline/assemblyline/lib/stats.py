@@ -59,6 +59,11 @@ DAMAGE.
 """
 import numpy as np
 
+# 1/sqrt(2*pi)
+M_1_SQRT_2PI = 0.398942280401432677939946059934
+# number of observations for which kde2d evaluates kernels at once
+KDE2D_BLOCK_SIZE = 1 << 16
+
 def _interpolate(a, b, fraction):
     """Returns the point at the given fraction between a and b, where
     'fraction' must be between 0 and 1.
@@ -123,15 +128,15 @@ def scoreatpercentile(a, per, limit=(), interpolation_method='fraction'):
         values = values[(limit[0] <= values) & (values <= limit[1])]
     idx = per /100. * (values.shape[0] - 1)
     if (idx % 1 == 0):
-        score = values[idx]
+        score = values[int(idx)]
     else:
         if interpolation_method == 'fraction':
             score = _interpolate(values[int(idx)], values[int(idx) + 1],
                                  idx % 1)
         elif interpolation_method == 'lower':
-            score = values[np.floor(idx)]
+            score = values[int(np.floor(idx))]
         elif interpolation_method == 'higher':
-            score = values[np.ceil(idx)]
+            score = values[int(np.ceil(idx))]
         else:
             raise ValueError("interpolation_method can only be 'fraction', " \
                              "'lower' or 'higher'")
@@ -269,3 +274,221 @@ class ECDF(StepFunction):
         nobs = len(x)
         y = np.linspace(1./nobs,1,nobs)
         super(ECDF, self).__init__(x, y, side=side, sorted=True)
+
+def bandwidth_nrd(x):
+    """
+    Normal reference bandwidth of a kernel density estimate (as in the 
+    bandwidth.nrd function of the R package MASS)
+    """
+    x = np.asarray(x, dtype=np.float)
+    q25, q75 = np.percentile(x, [25, 75])
+    h = (q75 - q25) / 1.34
+    return 4 * 1.06 * min(np.sqrt(np.var(x, ddof=1)), h) * len(x)**(-1/5.0)
+
+def dnorm(x):
+    """
+    Density of the standard normal distribution
+    """
+    return M_1_SQRT_2PI * np.exp(-0.5 * x * x)
+
+def kde2d(x, y, h=None, n=25, lims=None):
+    """
+    Two-dimensional kernel density estimation with an axis-aligned 
+    bivariate normal kernel evaluated on a square grid (as in the kde2d
+    function of the R package MASS)
+
+    Parameters
+    ----------
+    x, y : array-like
+    Coordinates of the observations
+    h : tuple, optional
+    Bandwidths in the x and y directions. Default is bandwidth_nrd of
+    each coordinate.
+    n : int
+    Number of grid points in each direction
+    lims : tuple, optional
+    Limits of the grid (xmin, xmax, ymin, ymax). Default is the range of
+    the data.
+
+    Returns
+    -------
+    gx, gy, z : grid coordinates in each direction and the density at
+    each grid point in an array of shape (len(gx), len(gy))
+    """
+    x = np.asarray(x, dtype=np.float)
+    y = np.asarray(y, dtype=np.float)
+    nx = len(x)
+    if len(y) != nx:
+        raise ValueError("data vectors must be the same length")
+    if not (np.all(np.isfinite(x)) and np.all(np.isfinite(y))):
+        raise ValueError("missing or infinite values in the data are not "
+                         "allowed")
+    if lims is None:
+        lims = (x.min(), x.max(), y.min(), y.max())
+    if not np.all(np.isfinite(lims)):
+        raise ValueError("only finite values are allowed in 'lims'")
+    gx = np.linspace(lims[0], lims[1], n)
+    gy = np.linspace(lims[2], lims[3], n)
+    if h is None:
+        h = (bandwidth_nrd(x), bandwidth_nrd(y))
+    hx, hy = h
+    if (hx <= 0) or (hy <= 0):
+        raise ValueError("bandwidths must be strictly positive")
+    hx, hy = hx / 4.0, hy / 4.0
+    # kernels are evaluated for blocks of observations to bound memory
+    z = np.zeros((n, n), dtype=np.float)
+    for i in xrange(0, max(nx, 1), KDE2D_BLOCK_SIZE):
+        ax = dnorm(np.subtract.outer(gx, x[i:i + KDE2D_BLOCK_SIZE]) / hx)
+        ay = dnorm(np.subtract.outer(gy, y[i:i + KDE2D_BLOCK_SIZE]) / hy)
+        z += np.dot(ax, ay.T)
+    z /= (nx * hx * hy)
+    return gx, gy, z
+
+def interp_surface(gx, gy, z, locx, locy):
+    """
+    Bilinear interpolation of a surface defined on a grid (such as a 
+    kde2d density) at locations within the grid (as in the 
+    interp.surface function of the R package fields)
+    """
+    nx = len(gx)
+    ny = len(gy)
+    lx = np.interp(locx, gx, np.arange(nx, dtype=np.float))
+    ly = np.interp(locy, gy, np.arange(ny, dtype=np.float))
+    lx1 = np.floor(lx).astype(np.int)
+    ly1 = np.floor(ly).astype(np.int)
+    ex = lx - lx1
+    ey = ly - ly1
+    # points on the last grid line use the last cell
+    ex[lx1 == nx - 1] = 1
+    ey[ly1 == ny - 1] = 1
+    lx1[lx1 == nx - 1] = nx - 2
+    ly1[ly1 == ny - 1] = ny - 2
+    return (z[lx1, ly1] * (1 - ex) * (1 - ey) + 
+            z[lx1 + 1, ly1] * ex * (1 - ey) +
+            z[lx1, ly1 + 1] * (1 - ex) * ey + 
+            z[lx1 + 1, ly1 + 1] * ex * ey)
+
+def _linear_bin(x, start, step, num):
+    '''
+    returns bin of each value on a grid of 'num' points beginning at
+    'start' and the weight given to the bin (the rest of the weight goes
+    to the next grid point)
+    '''
+    pos = (x - start) / step
+    i = np.clip(np.floor(pos).astype(np.int), 0, num - 2)
+    return i, 1.0 - (pos - i)
+
+def _fft_size(n):
+    '''
+    smallest product of powers of 2, 3 and 5 that is at least n
+    '''
+    best = 1 << int(np.ceil(np.log2(n)))
+    p5 = 1
+    while p5 < best:
+        p35 = p5
+        while p35 < best:
+            size = p35 * (1 << max(0, int(np.ceil(np.log2(n / float(p35))))))
+            best = min(best, size)
+            p35 *= 3
+        p5 *= 5
+    return best
+
+def kde2d_binned(x, y, h=None, n=25, lims=None, oversample=8, 
+                 truncate=6.0, min_kernel_steps=8, max_grid=4097):
+    """
+    Two-dimensional kernel density estimation computed by linear binning
+    of the observations onto a grid followed by convolution with the 
+    kernel using the FFT.  Parameters and results are the same as for 
+    kde2d, which evaluates the kernel for every pair of grid point and
+    observation.  This takes O(n + m log m) time for n observations and
+    m grid points instead of O(n * m).
+
+    Observations are binned onto a grid that is at least \'oversample\'
+    times finer than the output grid, and fine enough that the kernel
+    bandwidth spans \'min_kernel_steps\' grid steps (the grid is extended
+    to cover observations outside the limits).  The kernel is truncated
+    at \'truncate\' bandwidths.  When the fine grid would have more than
+    \'max_grid\' points in a direction (bandwidths that are very small
+    compared to the limits, as with heavy-tailed data) the exact kde2d
+    is used instead.  The error compared to kde2d is below 1e-3 of the
+    maximum density.
+    """
+    x = np.asarray(x, dtype=np.float)
+    y = np.asarray(y, dtype=np.float)
+    nx = len(x)
+    if len(y) != nx:
+        raise ValueError("data vectors must be the same length")
+    if not (np.all(np.isfinite(x)) and np.all(np.isfinite(y))):
+        raise ValueError("missing or infinite values in the data are not "
+                         "allowed")
+    if lims is None:
+        lims = (x.min(), x.max(), y.min(), y.max())
+    lims = np.asarray(lims, dtype=np.float)
+    if not np.all(np.isfinite(lims)):
+        raise ValueError("only finite values are allowed in 'lims'")
+    if (lims[0] == lims[1]) or (lims[2] == lims[3]) or (n < 2):
+        # grid has no extent
+        return kde2d(x, y, h, n, lims)
+    if h is None:
+        h = (bandwidth_nrd(x), bandwidth_nrd(y))
+    hx, hy = h
+    if (hx <= 0) or (hy <= 0):
+        raise ValueError("bandwidths must be strictly positive")
+    hx, hy = hx / 4.0, hy / 4.0
+    gx = np.linspace(lims[0], lims[1], n)
+    gy = np.linspace(lims[2], lims[3], n)
+    # the fine grid must resolve the kernel (binning error grows 
+    # quickly when the bandwidth spans only a few fine grid steps) so
+    # it is made finer than the output grid for small bandwidths.  when
+    # the fine grid would be too large use the exact estimate instead
+    factors = []
+    for lo, hi, bw in ((lims[0], lims[1], hx), (lims[2], lims[3], hy)):
+        ostep = (hi - lo) / (n - 1)
+        factor = max(oversample, int(np.ceil(ostep * min_kernel_steps / bw)))
+        if (n - 1) * factor + 1 > max_grid:
+            return kde2d(x, y, h, n, lims)
+        factors.append(factor)
+    # fine grid aligned with the output grid and extended to cover
+    # observations within the reach of the truncated kernel.  more
+    # distant observations do not contribute to the output grid
+    # (allowing for rounding of the grid positions)
+    keep = np.ones(nx, dtype=np.bool)
+    grids = []
+    for v, lo, hi, bw, factor in ((x, lims[0], lims[1], hx, factors[0]), 
+                                  (y, lims[2], lims[3], hy, factors[1])):
+        step = (hi - lo) / ((n - 1) * factor)
+        width = int(np.ceil(truncate * bw / step))
+        before = min(width, max(0, int(np.ceil((lo - v.min()) / step))))
+        after = min(width, max(0, int(np.ceil((v.max() - hi) / step))))
+        num = (n - 1) * factor + 1 + before + after
+        start = lo - before * step
+        keep &= ((v >= start - 0.5 * step) & 
+                 (v <= start + (num - 0.5) * step))
+        # kernel weights at grid offsets
+        width = min(width, num - 1)
+        k = dnorm(np.arange(-width, width + 1) * step / bw) / bw
+        grids.append((v, step, start, before, num, width, k))
+    # linear binning of observations
+    (xv, xstep, xstart, xbefore, xnum, xwidth, kx) = grids[0]
+    (yv, ystep, ystart, ybefore, ynum, ywidth, ky) = grids[1]
+    xi, xw = _linear_bin(xv[keep], xstart, xstep, xnum)
+    yi, yw = _linear_bin(yv[keep], ystart, ystep, ynum)
+    counts = np.zeros(xnum * ynum, dtype=np.float)
+    for dx, wx in ((0, xw), (1, 1.0 - xw)):
+        for dy, wy in ((0, yw), (1, 1.0 - yw)):
+            counts += np.bincount((xi + dx) * ynum + (yi + dy), 
+                                  weights=wx * wy, minlength=xnum * ynum)
+    counts = counts.reshape((xnum, ynum))
+    # convolve with the kernel using the FFT.  the circular convolution
+    # only needs to be long enough that the grid points do not wrap
+    # around
+    fshape = (_fft_size(xnum + xwidth), _fft_size(ynum + ywidth))
+    kernel = np.outer(kx, ky)
+    conv = np.fft.irfft2(np.fft.rfft2(counts, fshape) * 
+                         np.fft.rfft2(kernel, fshape), fshape)
+    conv = conv[xwidth:xwidth + xnum, ywidth:ywidth + ynum]
+    xfactor, yfactor = factors
+    z = conv[xbefore:xbefore + (n - 1) * xfactor + 1:xfactor,
+             ybefore:ybefore + (n - 1) * yfactor + 1:yfactor]
+    z = np.maximum(z, 0.0) / nx
+    return gx, gy, z
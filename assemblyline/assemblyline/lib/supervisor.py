@@ -0,0 +1,323 @@
+'''
+Created on Oct 18, 2013
+
+@author: mkiyer
+
+AssemblyLine: transcriptome meta-assembly from RNA-Seq
+
+Copyright (C) 2012-2013 Matthew Iyer
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import os
+import logging
+import collections
+import select
+import traceback
+from multiprocessing import Process, Pipe
+
+# messages sent from workers to the supervisor
+TASK_DONE = 0
+TASK_FAILED = 1
+# task failed and the worker exits because it could not roll back
+TASK_FAILED_EXIT = 2
+
+# seconds to wait for worker messages before checking worker health
+POLL_INTERVAL = 1.0
+
+class Task(object):
+    __slots__ = ('task_id', 'payload', 'attempt')
+    def __init__(self, task_id, payload, attempt=0):
+        self.task_id = task_id
+        self.payload = payload
+        self.attempt = attempt
+
+class WorkerHandler(object):
+    '''
+    base class for the objects that do the work inside a supervised
+    worker process.  process() is called once per task.  'attempt' is
+    zero the first time a task is seen and positive when the task is
+    being retried after a failure.  if process() raises an exception
+    rollback() must discard any partial output of the task.
+    '''
+    def process(self, task_id, payload, attempt):
+        raise NotImplementedError
+    def rollback(self):
+        pass
+    def close(self):
+        pass
+
+def _worker_main(worker_id, conn, handler_factory, restarted):
+    handler = handler_factory(worker_id, restarted)
+    while True:
+        task = conn.recv()
+        if task is None:
+            break
+        task_id, payload, attempt = task
+        try:
+            handler.process(task_id, payload, attempt)
+        except Exception:
+            msg = traceback.format_exc()
+            try:
+                handler.rollback()
+            except Exception:
+                # output is in an unknown state so let the supervisor
+                # restart this worker
+                logging.error("Worker %d rollback failed:\n%s" %
+                              (worker_id, traceback.format_exc()))
+                conn.send((TASK_FAILED_EXIT, task_id, msg))
+                os._exit(1)
+            conn.send((TASK_FAILED, task_id, msg))
+        else:
+            conn.send((TASK_DONE, task_id, None))
+    handler.close()
+    conn.close()
+
+class _Worker(object):
+    def __init__(self, worker_id):
+        self.worker_id = worker_id
+        self.proc = None
+        self.conn = None
+        self.task = None
+
+class SupervisedPool(object):
+    '''
+    runs tasks in a fixed number of worker processes and keeps going when
+    a worker raises an exception or dies (for example when it is killed
+    by the out of memory killer).
+
+    each worker receives tasks one at a time over its own pipe so that a
+    dead worker cannot leave a shared queue locked, and the supervisor
+    always knows which task a dead worker was running.  dead workers are
+    replaced by new processes.  a failed task is retried until it has
+    been attempted 'max_attempts' times, after which it is passed to the
+    'quarantine_func(task_id, payload, reason)' callback and skipped.
+
+    handler_factory(worker_id, restarted) is called inside each worker
+    process and must return a WorkerHandler.  'restarted' is True when
+    the worker replaces a process that died.
+    '''
+    def __init__(self, num_processes, handler_factory,
+                 quarantine_func=None, max_attempts=2):
+        self.num_processes = max(1, num_processes)
+        self.handler_factory = handler_factory
+        self.quarantine_func = quarantine_func
+        self.max_attempts = max_attempts
+        self.workers = [_Worker(i) for i in xrange(self.num_processes)]
+        self.retries = collections.deque()
+        self.num_done = 0
+        self.num_failures = 0
+        self.num_restarts = 0
+        self.quarantined = []
+        # replaced worker processes that have not been joined yet
+        self.exited = []
+
+    def _start_worker(self, w, restarted=False):
+        parent_conn, child_conn = Pipe()
+        p = Process(target=_worker_main,
+                    args=(w.worker_id, child_conn, self.handler_factory,
+                          restarted))
+        p.daemon = True
+        p.start()
+        # close child end in parent so that worker death is seen as EOF
+        child_conn.close()
+        w.proc = p
+        w.conn = parent_conn
+        w.task = None
+
+    def _replace_worker(self, w):
+        '''
+        starts a new process for a worker whose process exited or is
+        exiting.  the old process is joined later by _reap_exited()
+        '''
+        w.conn.close()
+        self.exited.append(w.proc)
+        self.num_restarts += 1
+        self._start_worker(w, restarted=True)
+
+    def _reap_exited(self):
+        for p in self.exited:
+            p.join(0)
+        self.exited = [p for p in self.exited if p.is_alive()]
+
+    def _send_task(self, w, task):
+        '''
+        sends a task to an idle worker.  a worker that died after it was
+        last checked is replaced and the task, which it never received,
+        is put back at the front of the retries without counting an
+        attempt
+        '''
+        w.task = task
+        try:
+            w.conn.send((task.task_id, task.payload, task.attempt))
+        except (IOError, OSError, EOFError), e:
+            logging.warning("Worker %d died before receiving task %s "
+                            "(%s), restarting" % (w.worker_id, 
+                                                  str(task.task_id), 
+                                                  str(e)))
+            w.task = None
+            self.retries.appendleft(task)
+            self._replace_worker(w)
+
+    def _task_failed(self, task, reason):
+        self.num_failures += 1
+        task.attempt += 1
+        if task.attempt < self.max_attempts:
+            logging.warning("Task %s failed (attempt %d), retrying:\n%s" %
+                            (str(task.task_id), task.attempt, reason))
+            self.retries.append(task)
+        else:
+            logging.error("Task %s failed (attempt %d), quarantined:\n%s" %
+                          (str(task.task_id), task.attempt, reason))
+            self.quarantined.append(task.task_id)
+            if self.quarantine_func is not None:
+                self.quarantine_func(task.task_id, task.payload, reason)
+
+    def _worker_died(self, w):
+        w.proc.join()
+        reason = "worker %d exited with code %s" % (w.worker_id,
+                                                    str(w.proc.exitcode))
+        w.conn.close()
+        task = w.task
+        # replace worker before retrying task
+        self.num_restarts += 1
+        self._start_worker(w, restarted=True)
+        if task is not None:
+            self._task_failed(task, reason)
+
+    def _receive(self, w):
+        try:
+            msgtype, task_id, reason = w.conn.recv()
+        except (EOFError, IOError):
+            self._worker_died(w)
+            return
+        task = w.task
+        w.task = None
+        if msgtype == TASK_DONE:
+            self.num_done += 1
+        else:
+            self._task_failed(task, reason)
+            if msgtype == TASK_FAILED_EXIT:
+                # a worker that could not roll back its output exits
+                # after reporting the failure
+                self._replace_worker(w)
+
+    def run(self, task_iter):
+        '''
+        process (task_id, payload) tuples from 'task_iter' and return
+        when all tasks have completed or been quarantined
+        '''
+        for w in self.workers:
+            self._start_worker(w)
+        task_iter = iter(task_iter)
+        buf = collections.deque()
+        exhausted = False
+        while True:
+            # assign tasks to idle workers (retries first)
+            for w in self.workers:
+                if w.task is not None:
+                    continue
+                if not w.proc.is_alive():
+                    # idle worker died so replace it
+                    self._replace_worker(w)
+                if len(self.retries) > 0:
+                    task = self.retries.popleft()
+                elif len(buf) > 0:
+                    task = buf.popleft()
+                else:
+                    break
+                self._send_task(w, task)
+            self._reap_exited()
+            busy = [w for w in self.workers if w.task is not None]
+            if (exhausted and len(buf) == 0 and len(self.retries) == 0 and
+                len(busy) == 0):
+                break
+            # read ahead while workers are busy
+            timeout = POLL_INTERVAL
+            if (not exhausted) and (len(buf) < self.num_processes):
+                try:
+                    task_id, payload = task_iter.next()
+                    buf.append(Task(task_id, payload))
+                    timeout = 0
+                except StopIteration:
+                    exhausted = True
+            if len(busy) == 0:
+                continue
+            # wait for messages from workers
+            fdmap = dict((w.conn.fileno(), w) for w in busy)
+            readable, _, _ = select.select(fdmap.keys(), [], [], timeout)
+            for fd in readable:
+                self._receive(fdmap[fd])
+            # check for workers that died without closing their pipe
+            for w in busy:
+                if (w.task is not None) and (not w.proc.is_alive()):
+                    if w.conn.poll():
+                        self._receive(w)
+                    if w.task is not None:
+                        self._worker_died(w)
+        # stop workers
+        for w in self.workers:
+            try:
+                w.conn.send(None)
+            except IOError:
+                pass
+        for w in self.workers:
+            w.proc.join()
+            w.conn.close()
+        for p in self.exited:
+            p.join()
+        self.exited = []
+        if (self.num_failures > 0) or (self.num_restarts > 0):
+            logging.warning("Tasks failed=%d quarantined=%d worker "
+                            "restarts=%d" % (self.num_failures,
+                                             len(self.quarantined),
+                                             self.num_restarts))
+        return self.num_done
+
+class LocusQuarantine(object):
+    '''
+    quarantine_func for a SupervisedPool that runs GTF loci.  writes
+    the lines of loci that could not be processed to a side GTF file and
+    records the locus number and failure reason in an index file (used
+    to skip these loci when resuming a run)
+    '''
+    def __init__(self, gtf_file, index_file, resume=False):
+        self.gtf_file = gtf_file
+        self.index_file = index_file
+        self.loci = set()
+        if resume and os.path.exists(self.index_file):
+            for line in open(self.index_file):
+                self.loci.add(int(line.split('\t', 1)[0]))
+        else:
+            for filename in (self.gtf_file, self.index_file):
+                if os.path.exists(filename):
+                    os.remove(filename)
+
+    def __call__(self, locus_num, lines, reason):
+        fileh = open(self.gtf_file, "a")
+        for line in lines:
+            print >>fileh, line
+        fileh.close()
+        # first and last line of the traceback are most informative
+        reason_lines = [x.strip() for x in reason.strip().splitlines()]
+        if len(reason_lines) > 1:
+            reason = ' | '.join([reason_lines[0], reason_lines[-1]])
+        else:
+            reason = reason_lines[0]
+        fields = lines[0].split('\t', 5)
+        locus_str = '%s:%s' % (fields[0], fields[3])
+        fileh = open(self.index_file, "a")
+        print >>fileh, '\t'.join([str(locus_num), locus_str, reason])
+        fileh.close()
+        self.loci.add(locus_num)
@@ -27,14 +27,31 @@ import os
 import collections
 import operator
 import random
+import itertools
+import shutil
+import multiprocessing
+import array
+import tempfile
+import numpy as np
 
 # project imports
 import assemblyline
 import assemblyline.lib.config as config
 from assemblyline.lib.base import Library, GTFAttr
-from assemblyline.lib.gtf import GTFFeature, sort_gtf
+from assemblyline.lib.gtf import GTFFeature, GTFError, gtf_sort_key, \
+    merge_sorted_gtf_files
+from assemblyline.lib.batch_sort import batch_sort
+from assemblyline.lib.refbundle import ReferenceBundle, is_reference_bundle, \
+    add_attrs_to_line
 from assemblyline.lib.stats import ECDF, scoreatpercentile
 
+# maximum number of GTF lines sorted in memory at once
+SORT_BUFFER_LINES = 100000
+
+# columns of the manifest of incremental aggregation runs
+MANIFEST_HEADER = ('library_id', 'orig_library_id', 'gtf_file', 'size', 
+                   'mtime', 'params')
+
 def make_transcript_feature(exon_features):
     f = GTFFeature()
     f.seqid = exon_features[0].seqid
@@ -88,6 +105,39 @@ def add_reference_gtf_file(ref_gtf_file, test_gene_ids,
         del transcript_dict
     del gene_dict
 
+def add_reference_bundle(bundle_dir, test_gene_ids, random_test_frac, 
+                         outfh):
+    '''
+    writes reference transcripts of a bundle built by 
+    build_reference_bundle, which does not require parsing the 
+    reference GTF file.  exon records are copied and transcript 
+    records are rebuilt from the first and last exon like 
+    add_reference_gtf_file does
+    '''
+    bundle = ReferenceBundle(bundle_dir)
+    user_defined_tests = len(test_gene_ids) > 0
+    gene_ids = bundle.gene_ids
+    t_genes = bundle.t_genes.tolist()
+    gene_tests = {}
+    for i, exon_lines, t_line in bundle.iter_gtf_lines():
+        # label test transcripts
+        g_id = gene_ids[t_genes[i]]
+        is_test = gene_tests.get(g_id)
+        if is_test is None:
+            if user_defined_tests:
+                is_test = (g_id in test_gene_ids)
+            else:
+                is_test = (random.random() < random_test_frac)
+            gene_tests[g_id] = is_test
+        attrs = ((GTFAttr.REF, '1'), (GTFAttr.TEST, '1' if is_test else '0'))
+        for line in exon_lines:
+            print >>outfh, add_attrs_to_line(line, attrs)
+        f = make_transcript_feature([GTFFeature.from_string(exon_lines[0]),
+                                     GTFFeature.from_string(exon_lines[-1])])
+        f.attrs[GTFAttr.REF] = '1'
+        f.attrs[GTFAttr.TEST] = '1' if is_test else '0'
+        print >>outfh, str(f)
+
 def read_gtf_file(library, gtf_score_attr):
     # read all transcripts
     t_dict = collections.OrderedDict()
@@ -127,6 +177,72 @@ def read_gtf_file(library, gtf_score_attr):
             t_dict[new_t_id].append(feature)
     return t_dict
 
+def clip_transcript(features):
+    '''
+    sorts exon features in transcript order (in place) and removes very
+    short first and last exons.  returns (clipped features, number of
+    exons removed)
+    '''
+    reverse = True if features[0].strand == "-" else False
+    features.sort(key=operator.attrgetter('start'), reverse=reverse)
+    new_features = collections.deque(features)
+    num_clipped = 0
+    if len(features) > 1:
+        f = new_features[0]
+        length = f.end - f.start
+        if length < config.MIN_EXON_LENGTH:
+            num_clipped += 1
+            new_features.popleft()
+        f = new_features[-1]
+        length = f.end - f.start
+        if length < config.MIN_EXON_LENGTH:
+            num_clipped += 1
+            new_features.pop()
+    return list(new_features), num_clipped
+
+def write_dropped_transcript(features, dropfileh):
+    feature = make_transcript_feature(features)
+    print >>dropfileh, str(feature)
+    for feature in features:
+        print >>dropfileh, str(feature)
+
+def write_transcript(features, score, pctrank, outfileh):
+    # reverse features if this is negative strand
+    if features[0].strand == "-":
+        features.reverse()
+    # write transcript
+    feature = make_transcript_feature(features)
+    feature.attrs[GTFAttr.SCORE] = score
+    feature.attrs[GTFAttr.PCTRANK] = pctrank
+    print >>outfileh, str(feature)
+    # write exons
+    for i,feature in enumerate(features):
+        feature.attrs[GTFAttr.SCORE] = score
+        feature.attrs[GTFAttr.PCTRANK] = pctrank
+        feature.attrs['exon_number'] = "%d" % (i + 1)
+        print >>outfileh, str(feature)
+
+def write_library_stats(library_id, passed, failed, too_short, 
+                        too_short_exon, failed_scores, passed_scores, 
+                        statsfileh):
+    failed_quantiles = [scoreatpercentile(failed_scores, q) 
+                        for q in config.TRANSCRIPT_SCORE_QUANTILES]
+    passed_quantiles = [scoreatpercentile(passed_scores, q) 
+                        for q in config.TRANSCRIPT_SCORE_QUANTILES]
+    fields = [library_id, passed, failed, too_short, too_short_exon]
+    fields.extend(failed_quantiles)
+    fields.extend(passed_quantiles)
+    print >>statsfileh, '\t'.join(map(str, fields))
+
+def get_pctranks(scores):
+    '''
+    percentile rank of each score among all scores
+    '''
+    if len(scores) == 0:
+        return scores
+    ecdf = ECDF(scores, side="left")
+    return 100.0 * ecdf(scores)
+
 def filter_transcripts(library_id, t_dict, outfileh, dropfileh, statsfileh, 
                        min_transcript_length):
     # filter transcripts
@@ -138,71 +254,252 @@ def filter_transcripts(library_id, t_dict, outfileh, dropfileh, statsfileh,
     failed_scores = []
     filtered_t_dict = collections.OrderedDict()
     for t_id, features in t_dict.iteritems():
-        strand = features[0].strand
         score = float(features[0].attrs[GTFAttr.SCORE])            
-        reverse = True if strand == "-" else False
-        num_exons = len(features)        
         # check first/last exon lengths and clip very short exons
-        features.sort(key=operator.attrgetter('start'), reverse=reverse)
-        new_features = collections.deque(features)
-        if num_exons > 1:
-            f = new_features[0]
-            length = f.end - f.start
-            if length < config.MIN_EXON_LENGTH:
-                too_short_exon += 1
-                new_features.popleft()
-            f = new_features[-1]
-            length = f.end - f.start
-            if length < config.MIN_EXON_LENGTH:
-                too_short_exon += 1
-                new_features.pop()
-        keep = True
+        new_features, num_clipped = clip_transcript(features)
+        too_short_exon += num_clipped
         transcript_length = sum((f.end - f.start) for f in new_features)
         if transcript_length <= min_transcript_length:
             too_short += 1
-            keep = False
-        if not keep:
             failed += 1
             failed_scores.append(score)
-            feature = make_transcript_feature(features)
-            print >>dropfileh, str(feature)
-            for feature in features:
-                print >>dropfileh, str(feature)
+            write_dropped_transcript(features, dropfileh)
         else:
             passed += 1
             passed_scores.append(score)
-            filtered_t_dict[t_id] = (score, list(new_features))
-    # make empirical cdf for scores
-    ecdf = ECDF(passed_scores, side="left")
-    for t_id, vtuple in filtered_t_dict.iteritems():
+            filtered_t_dict[t_id] = (score, new_features)
+    # percentile rank of scores
+    pctranks = get_pctranks(np.array(passed_scores, dtype=np.float64))
+    for i,vtuple in enumerate(filtered_t_dict.itervalues()):
         score, features = vtuple
-        pctrank = 100.0 * ecdf(score)
-        # reverse features if this is negative strand
-        if features[0].strand == "-":
-            features.reverse()
-        # write transcript
-        feature = make_transcript_feature(features)
-        feature.attrs[GTFAttr.SCORE] = score
-        feature.attrs[GTFAttr.PCTRANK] = pctrank
-        print >>outfileh, str(feature)
-        # write exons
-        for i,feature in enumerate(features):
-            feature.attrs[GTFAttr.SCORE] = score
-            feature.attrs[GTFAttr.PCTRANK] = pctrank
-            feature.attrs['exon_number'] = "%d" % (i + 1)
-            print >>outfileh, str(feature)
-
+        write_transcript(features, score, pctranks[i], outfileh)
     # compute and write stats
-    failed_quantiles = [scoreatpercentile(failed_scores, q) 
-                        for q in config.TRANSCRIPT_SCORE_QUANTILES]
-    passed_quantiles = [scoreatpercentile(passed_scores, q) 
-                        for q in config.TRANSCRIPT_SCORE_QUANTILES]
-    fields = [library_id, passed, failed, too_short, too_short_exon]
-    fields.extend(failed_quantiles)
-    fields.extend(passed_quantiles)
-    print >>statsfileh, '\t'.join(map(str, fields))
+    write_library_stats(library_id, passed, failed, too_short, 
+                        too_short_exon, failed_scores, passed_scores,
+                        statsfileh)
+
+def parse_library_transcripts(library, gtf_score_attr):
+    '''
+    generates (transcript_id, exon features) tuples with the same
+    renamed ids and attributes as read_gtf_file, holding only one
+    transcript in memory.  the exons of each transcript must be
+    contiguous in the file, otherwise GTFError is raised
+    '''
+    cur_t_id = 0
+    cur_g_id = 1
+    g_id_map = {}
+    seen_t_ids = set()
+    t_id = None
+    new_t_id = None
+    features = []
+    for feature in GTFFeature.parse(open(library.gtf_file)):
+        if feature.feature_type != "exon":
+            continue
+        if feature.attrs[GTFAttr.TRANSCRIPT_ID] != t_id:
+            if len(features) > 0:
+                yield new_t_id, features
+            t_id = feature.attrs[GTFAttr.TRANSCRIPT_ID]
+            if t_id in seen_t_ids:
+                raise GTFError("Exons of transcript '%s' are not "
+                               "contiguous in file %s" % 
+                               (t_id, library.gtf_file))
+            seen_t_ids.add(t_id)
+            cur_t_id += 1
+            new_t_id = "%s.T%d" % (library.library_id, cur_t_id)
+            features = []
+        # rename gene id
+        g_id = feature.attrs[GTFAttr.GENE_ID]
+        if g_id not in g_id_map:
+            new_g_id = "%s.G%d" % (library.library_id, cur_g_id)
+            g_id_map[g_id] = new_g_id
+            cur_g_id += 1
+        else:
+            new_g_id = g_id_map[g_id]
+        # update transcript attributes
+        newattrs = {GTFAttr.TRANSCRIPT_ID: new_t_id,
+                    GTFAttr.GENE_ID: new_g_id,
+                    GTFAttr.SAMPLE_ID: library.sample_id,
+                    GTFAttr.LIBRARY_ID: library.library_id,
+                    GTFAttr.REF: '0',
+                    GTFAttr.SCORE: feature.attrs.get(gtf_score_attr, '0.0')}
+        feature.attrs = newattrs
+        features.append(feature)
+    if len(features) > 0:
+        yield new_t_id, features
+
+def stream_filter_library(library, gtf_score_attr, min_transcript_length,
+                          outfileh, dropfileh, statsfileh):
+    '''
+    filters the transcripts of a library in two passes over the GTF 
+    file.  the first pass stores only the transcript scores, which are
+    needed to compute percentile ranks, and the second pass filters and
+    writes each transcript.  returns the number of transcripts, or -1
+    if the exons of the transcripts in the file are not contiguous
+    '''
+    # first pass collects scores and filter results
+    passed_scores = array.array('d')
+    failed_scores = array.array('d')
+    keep_flags = array.array('b')
+    too_short = 0
+    too_short_exon = 0
+    try:
+        for t_id, features in parse_library_transcripts(library, 
+                                                        gtf_score_attr):
+            score = float(features[0].attrs[GTFAttr.SCORE])            
+            new_features, num_clipped = clip_transcript(features)
+            too_short_exon += num_clipped
+            transcript_length = sum((f.end - f.start) for f in new_features)
+            if transcript_length <= min_transcript_length:
+                too_short += 1
+                failed_scores.append(score)
+                keep_flags.append(0)
+            else:
+                passed_scores.append(score)
+                keep_flags.append(1)
+    except GTFError:
+        return -1
+    if len(keep_flags) == 0:
+        return 0
+    passed_scores = np.frombuffer(passed_scores, dtype=np.float64)
+    failed_scores = np.frombuffer(failed_scores, dtype=np.float64)
+    pctranks = get_pctranks(passed_scores)
+    # second pass filters and writes transcripts
+    i = 0
+    for t_num, tup in enumerate(parse_library_transcripts(library, 
+                                                          gtf_score_attr)):
+        t_id, features = tup
+        new_features, num_clipped = clip_transcript(features)
+        if keep_flags[t_num]:
+            write_transcript(new_features, passed_scores[i].item(), 
+                             pctranks[i], outfileh)
+            i += 1
+        else:
+            write_dropped_transcript(features, dropfileh)
+    write_library_stats(library.library_id, len(passed_scores), 
+                        len(failed_scores), too_short, too_short_exon, 
+                        failed_scores, passed_scores, statsfileh)
+    return len(keep_flags)
+
+def sort_gtf_file(input_file, output_file, tmp_dir):
+    '''
+    sorts a GTF file in the same order as sort_gtf and removes the
+    input file.  files with more than SORT_BUFFER_LINES lines are 
+    sorted in chunks that are merged
+    '''
+    chunk_dir = tempfile.mkdtemp(dir=tmp_dir)
+    try:
+        batch_sort(input_file, output_file, key=gtf_sort_key, 
+                   buffer_size=SORT_BUFFER_LINES, tempdirs=[chunk_dir])
+    finally:
+        shutil.rmtree(chunk_dir)
+    os.remove(input_file)
+
+def read_id_map(filename):
+    '''
+    returns OrderedDict of original id -> renamed id from a library or
+    sample id map file
+    '''
+    id_map = collections.OrderedDict()
+    if os.path.exists(filename):
+        for line in open(filename):
+            new_id, orig_id = line.rstrip('\n').split('\t')
+            id_map[orig_id] = new_id
+    return id_map
+
+def get_next_id_num(id_map):
+    '''
+    returns the number following the largest renamed id (such as 'L12')
+    '''
+    return 1 + max([int(x[1:]) for x in id_map.itervalues()] + [0])
+
+def read_manifest(filename):
+    '''
+    returns dictionary of renamed library id -> manifest fields.  the
+    dictionary is empty when the manifest is missing or corrupt so that
+    all libraries are processed again
+    '''
+    manifest = {}
+    if not os.path.exists(filename):
+        return manifest
+    rows = [line.rstrip('\n').split('\t') for line in open(filename)]
+    if ((len(rows) == 0) or (tuple(rows[0]) != MANIFEST_HEADER) or
+        any(len(fields) != len(MANIFEST_HEADER) for fields in rows[1:])):
+        logging.warning("Manifest file %s is corrupt, processing all "
+                        "libraries" % (filename))
+        return manifest
+    for fields in rows[1:]:
+        manifest[fields[0]] = tuple(fields[1:])
+    return manifest
+
+def write_manifest(filename, manifest):
+    tmp_file = filename + ".tmp"
+    fileh = open(tmp_file, "w")
+    print >>fileh, '\t'.join(MANIFEST_HEADER)
+    for library_id, fields in manifest.iteritems():
+        print >>fileh, '\t'.join((library_id,) + fields)
+    fileh.close()
+    os.rename(tmp_file, filename)
+
+def get_manifest_fields(library, orig_library_id, gtf_score_attr, 
+                        min_transcript_length):
+    '''
+    returns the fields recorded in the manifest for a library.  the 
+    library is processed again when any field changes
+    '''
+    gtf_file = os.path.abspath(library.gtf_file)
+    params = ';'.join('%s=%s' % x for x in 
+                      (('version', assemblyline.__version__),
+                       ('sample_id', library.sample_id),
+                       ('gtf_score_attr', gtf_score_attr),
+                       ('min_transcript_length', min_transcript_length),
+                       ('min_exon_length', config.MIN_EXON_LENGTH)))
+    return (orig_library_id, gtf_file, str(os.path.getsize(gtf_file)),
+            repr(os.path.getmtime(gtf_file)), params)
+
+def get_library_files(prefix):
+    '''
+    returns the (gtf, dropped gtf, stats) files written for a library
+    '''
+    return (prefix + ".gtf", prefix + ".dropped.gtf", prefix + ".stats.txt")
+
+def aggregate_library(args):
+    '''
+    reads and filters the transcripts of a single library and writes
+    the results to temporary files with the prefix 'prefix'
+    '''
+    library, gtf_score_attr, min_transcript_length, prefix = args
+    gtf_file, dropped_gtf_file, stats_file = get_library_files(prefix)
+    unsorted_gtf_file = prefix + ".unsorted.gtf"
+    filehs = [open(f, "w") for f in (unsorted_gtf_file, dropped_gtf_file, 
+                                     stats_file)]
+    outfileh, dropfileh, statsfileh = filehs
+    num_transcripts = stream_filter_library(library, gtf_score_attr, 
+                                            min_transcript_length,
+                                            outfileh, dropfileh, 
+                                            statsfileh)
+    if num_transcripts < 0:
+        # exons are not grouped by transcript so read entire library
+        logging.debug("Library %s transcripts are not contiguous, reading "
+                      "into memory" % (library.library_id))
+        t_dict = read_gtf_file(library, gtf_score_attr)
+        num_transcripts = len(t_dict)
+        if num_transcripts > 0:
+            filter_transcripts(library.library_id, t_dict, 
+                               outfileh, dropfileh, statsfileh, 
+                               min_transcript_length)
+    logging.debug("Read %s transcripts from file %s" % (num_transcripts,
+                                                        library.gtf_file))
+    if num_transcripts == 0:
+        logging.warning("Library %s has no transcripts" % 
+                        (library.library_id))
+    for fileh in filehs:
+        fileh.close()
+    # sort library transcripts
+    sort_gtf_file(unsorted_gtf_file, gtf_file, os.path.dirname(prefix))
+    return library.library_id
 
 def main():
+    multiprocessing.freeze_support()
     # setup logging
     logging.basicConfig(level=logging.DEBUG,
                         format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
@@ -210,6 +507,10 @@ def main():
     logging.info("----------------------------------")
     # parse command line
     parser = argparse.ArgumentParser()
+    parser.add_argument("-p", "--num-processors", type=int, 
+                        dest="num_processors", default=1,
+                        help="Number of libraries to process in parallel "
+                        "[default=%(default)s]")
     parser.add_argument('--min-transcript-length', type=int, 
                         dest="min_transcript_length",
                         metavar="N",
@@ -235,7 +536,15 @@ def main():
                         "reference 'gene_id' attributes "
                         "(one per line) that define test cases "
                         "to use for validation purposes")
-    parser.add_argument('ref_gtf_file')
+    parser.add_argument("--incremental", dest="incremental", 
+                        action="store_true", default=False,
+                        help="Keep the processed transcripts of each "
+                        "library in the output directory and only "
+                        "process libraries that are new or changed since "
+                        "the last incremental run. Library and sample ids "
+                        "of previous runs are kept")
+    parser.add_argument('ref_gtf_file', help="reference GTF file or "
+                        "bundle directory built by build_reference_bundle")
     parser.add_argument('library_table_file')
     args = parser.parse_args()
     # check command line parameters
@@ -249,14 +558,17 @@ def main():
         parser.error("test file %s not found" % (args.test_file))
     if (args.random_test_frac < 0):
         parser.error("cannot set --random-test-frac < 0")
+    num_processors = max(1, args.num_processors)
     # show parameters
     logging.info("Parameters:")
+    logging.info("num processors:        %d" % (num_processors))
     logging.info("min transcript length: %d" % (args.min_transcript_length))
     logging.info("gtf score attr:        %s" % (args.gtf_score_attr))
     logging.info("output directory:      %s" % (args.output_dir))
     logging.info("reference GTF file:    %s" % (args.ref_gtf_file))
     logging.info("test file:             %s" % (args.test_file))
     logging.info("library table file:    %s" % (args.library_table_file))
+    logging.info("incremental:           %s" % (args.incremental))
     logging.info("----------------------------------")
     # setup results
     results = config.AssemblylineResults(args.output_dir)
@@ -267,42 +579,47 @@ def main():
     if not os.path.exists(results.tmp_dir):
         logging.info("Creating tmp directory '%s'" % (results.tmp_dir))
         os.makedirs(results.tmp_dir)
+    # ids assigned by previous incremental runs are kept
+    if args.incremental:
+        if not os.path.exists(results.aggregate_dir):
+            os.makedirs(results.aggregate_dir)
+        library_id_map = read_id_map(results.library_id_map)
+        sample_id_map = read_id_map(results.sample_id_map)
+        manifest = read_manifest(results.aggregate_manifest_file)
+    else:
+        library_id_map = collections.OrderedDict()
+        sample_id_map = collections.OrderedDict()
+        manifest = {}
     # parse sample table
     logging.info("Parsing library table")
     libraries = []
-    valid = True
-    library_num = 1
-    sample_num = 1
-    sample_id_map = {}
-    library_map_fileh = open(results.library_id_map, 'w')
-    sample_map_fileh = open(results.sample_id_map, 'w')
+    orig_library_ids = []
+    library_num = get_next_id_num(library_id_map)
+    sample_num = get_next_id_num(sample_id_map)
     for library in Library.from_file(args.library_table_file):
         # exclude samples
         if not os.path.exists(library.gtf_file):
             logging.warning("Library '%s' GTF file not found" % (library.library_id)) 
             continue
         # rename library id
-        new_library_id = "L%d" % (library_num)
-        print >>library_map_fileh, '\t'.join([new_library_id, library.library_id]) 
-        library_num += 1
-        library.library_id = new_library_id
+        if library.library_id not in library_id_map:
+            library_id_map[library.library_id] = "L%d" % (library_num)
+            library_num += 1
+        orig_library_ids.append(library.library_id)
+        library.library_id = library_id_map[library.library_id]
         # rename sample id
         if library.sample_id not in sample_id_map:
-            new_sample_id = "S%d" % (sample_num)
-            print >>sample_map_fileh, '\t'.join([new_sample_id, library.sample_id]) 
-            sample_id_map[library.sample_id] = new_sample_id
+            sample_id_map[library.sample_id] = "S%d" % (sample_num)
             sample_num += 1
-        else:
-            new_sample_id = sample_id_map[library.sample_id]
-        library.sample_id = new_sample_id
+        library.sample_id = sample_id_map[library.sample_id]
         libraries.append(library)
-    if not valid:
-        logging.warning("Invalid libraries in table file")
-    library_map_fileh.close()
-    sample_map_fileh.close()
+    for filename, id_map in ((results.library_id_map, library_id_map),
+                             (results.sample_id_map, sample_id_map)):
+        fileh = open(filename, 'w')
+        for orig_id, new_id in id_map.iteritems():
+            print >>fileh, '\t'.join([new_id, orig_id])
+        fileh.close()
     # setup output files
-    tmp_file = os.path.join(results.tmp_dir, "transcripts.unsorted.gtf")
-    tmpfileh = open(tmp_file, "w")
     dropfileh = open(results.transcripts_dropped_gtf_file, "w")
     statsfileh = open(results.transcript_stats_file, 'w')
     header_fields = ['#library_id']
@@ -319,32 +636,83 @@ def main():
         logging.info("Read %d test genes" % len(test_gene_ids))
     # read reference GTF file and aggregate
     logging.info("Adding reference GTF file")
-    add_reference_gtf_file(args.ref_gtf_file, test_gene_ids, 
-                           args.random_test_frac, tmpfileh)
-    # parse sample table
+    ref_unsorted_gtf_file = os.path.join(results.tmp_dir, "ref.unsorted.gtf")
+    ref_gtf_file = os.path.join(results.tmp_dir, "ref.gtf")
+    fileh = open(ref_unsorted_gtf_file, "w")
+    if is_reference_bundle(args.ref_gtf_file):
+        add_reference_bundle(args.ref_gtf_file, test_gene_ids, 
+                             args.random_test_frac, fileh)
+    else:
+        add_reference_gtf_file(args.ref_gtf_file, test_gene_ids, 
+                               args.random_test_frac, fileh)
+    fileh.close()
+    sort_gtf_file(ref_unsorted_gtf_file, ref_gtf_file, results.tmp_dir)
+    # process libraries in parallel
     logging.info("Adding libraries")
-    for library in libraries:
-        t_dict = read_gtf_file(library, args.gtf_score_attr)
-        logging.debug("Read %s transcripts from file %s" % (len(t_dict), 
-                                                            library.gtf_file))
-        if len(t_dict) == 0:
-            logging.warning("Library %s has no transcripts" % 
-                            (library.library_id))
+    prefixes = []
+    tasks = []
+    new_manifest = collections.OrderedDict()
+    for library, orig_library_id in zip(libraries, orig_library_ids):
+        if args.incremental:
+            prefix = os.path.join(results.aggregate_dir, library.library_id)
         else:
-            filter_transcripts(library.library_id, t_dict, 
-                               tmpfileh, dropfileh, statsfileh, 
-                               args.min_transcript_length)
+            prefix = os.path.join(results.tmp_dir, library.library_id)
+        prefixes.append(prefix)
+        fields = get_manifest_fields(library, orig_library_id, 
+                                     args.gtf_score_attr, 
+                                     args.min_transcript_length)
+        new_manifest[library.library_id] = fields
+        if ((manifest.get(library.library_id) == fields) and
+            all(os.path.exists(f) for f in get_library_files(prefix))):
+            logging.debug("Library %s unchanged" % (library.library_id))
+            continue
+        tasks.append((library, args.gtf_score_attr, 
+                      args.min_transcript_length, prefix))
+    logging.info("Processing %d of %d libraries" % (len(tasks), 
+                                                    len(libraries)))
+    if num_processors > 1:
+        pool = multiprocessing.Pool(processes=num_processors)
+        result_iter = pool.imap_unordered(aggregate_library, tasks)
+    else:
+        pool = None
+        result_iter = itertools.imap(aggregate_library, tasks)
+    for library_id in result_iter:
+        logging.debug("Finished library %s" % (library_id))
+    if pool is not None:
+        pool.close()
+        pool.join()
+    if args.incremental:
+        write_manifest(results.aggregate_manifest_file, new_manifest)
+        # remove files of libraries that are no longer in the table
+        old_library_ids = set(library_id_map.itervalues())
+        for library_id in old_library_ids.difference(new_manifest):
+            prefix = os.path.join(results.aggregate_dir, library_id)
+            for filename in get_library_files(prefix):
+                if os.path.exists(filename):
+                    os.remove(filename)
+    # merge library output in library order
+    logging.info("Merging library output")
+    gtf_files = [ref_gtf_file]
+    for prefix in prefixes:
+        gtf_file, dropped_gtf_file, stats_file = get_library_files(prefix)
+        gtf_files.append(gtf_file)
+        for filename, fileh in ((dropped_gtf_file, dropfileh), 
+                                (stats_file, statsfileh)):
+            shutil.copyfileobj(open(filename), fileh)
+    dropfileh.close()
     statsfileh.close()
-    tmpfileh.close()
-    logging.info("Sorting GTF")
-    retcode = sort_gtf(tmp_file, results.transcripts_gtf_file, tmp_dir=results.tmp_dir)
-    if retcode != 0:
-        logging.error("sort GTF failed")
-        if os.path.exists(results.transcripts_gtf_file):
-            os.remove(results.transcripts_gtf_file)
-    os.remove(tmp_file)
+    # library and reference transcripts are already sorted so only 
+    # need to be merged
+    logging.info("Merging sorted GTF files")
+    merge_sorted_gtf_files(gtf_files, results.transcripts_gtf_file)
+    # library files of incremental runs are kept
+    os.remove(ref_gtf_file)
+    if not args.incremental:
+        for prefix in prefixes:
+            for filename in get_library_files(prefix):
+                os.remove(filename)
     logging.info("Done")
-    return retcode
+    return 0
 
 if __name__ == '__main__':
     sys.exit(main())
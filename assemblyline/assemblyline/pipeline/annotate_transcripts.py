@@ -24,17 +24,24 @@ import logging
 import argparse
 import os
 import collections
+import shutil
 import sys
-from multiprocessing import Process, JoinableQueue
+import numpy as np
 
 # project imports
 import assemblyline
 import assemblyline.lib.config as config
 from assemblyline.lib.bx.intersection import Interval, IntervalTree
-from assemblyline.lib.gtf import parse_loci, merge_sort_gtf_files
+from assemblyline.lib.gtf import GTFFeature, parse_loci, gtf_sort_key, \
+    merge_sort_gtf_files, merge_sorted_gtf_files
+from assemblyline.lib.journal import LocusJournal, JOURNAL_SUFFIX, \
+    recover_journal, recover_split_journal, JournaledFileSplitter
+from assemblyline.lib.supervisor import SupervisedPool, WorkerHandler, \
+    LocusQuarantine
 from assemblyline.lib.transcript import transcripts_from_gtf_lines, \
     POS_STRAND, NEG_STRAND, NO_STRAND
-from assemblyline.lib.base import Category, GTFAttr, FLOAT_PRECISION
+from assemblyline.lib.base import Category, CategoryStats, GTFAttr, \
+    FLOAT_PRECISION, MAX_OPEN_FILE_DESCRIPTORS
 from assemblyline.lib.assemble.transcript_graph import \
     find_exon_boundaries, split_exons
 
@@ -45,160 +52,376 @@ CInfo = collections.namedtuple('CategoryInfo',
                                 'ann_cov_ratio',
                                 'is_test'])
 
-def compute_coverage_overlap(nodes1, nodes2):
-    a = set(nodes1)
-    b = set(nodes2)
-    shared_nodes = a.intersection(b)
-    union_nodes = a.union(b)
-    shared_length = sum((n[1] - n[0]) for n in shared_nodes)    
-    total_length = sum((n[1] - n[0]) for n in union_nodes)
-    return shared_length, total_length
-
-def find_best_coverage_overlap(nodes, reftuples, ignore_test=False):
-    # find the reference transcript with the best overlap
-    best_ref_t = None
-    best_shared_cov_ratio = 0.0
-    for ref_t, ref_nodes in reftuples:
-        is_test = bool(int(ref_t.attrs[GTFAttr.TEST]))
-        if is_test and ignore_test:
-            continue
-        shared_cov, union_cov = compute_coverage_overlap(nodes, ref_nodes)
-        shared_ratio = float(shared_cov) / union_cov
-        if shared_ratio > best_shared_cov_ratio:
-            best_ref_t = ref_t
-            best_shared_cov_ratio = shared_ratio
-    return best_ref_t, best_shared_cov_ratio
-
-def find_best_intron_overlap(test_nodes, test_introns, reftuples, 
-                             ignore_test=False):
-    best_ref_t = None
-    best_shared_intron_ratio = 0.0
-    best_shared_cov_ratio = 0.0    
-    for ref_t, ref_nodes in reftuples:
-        is_test = bool(int(ref_t.attrs[GTFAttr.TEST]))
-        if is_test and ignore_test:
+# split output of a worker is stored at <prefix>/<library_id>.gtf with 
+# reference transcripts at <prefix>.ref.gtf
+REF_SPLIT_KEY = ''
+REF_SPLIT_SUFFIX = '.ref.gtf'
+STATS_SPLIT_SUFFIX = '.category_stats.txt'
+
+class LocusIndex(object):
+    '''
+    nodes (intervals between consecutive exon boundaries) and introns of 
+    the transcripts of a locus are numbered once.  each transcript is 
+    stored as sorted arrays of its node and intron numbers so that the 
+    overlap between a transcript and many reference transcripts is 
+    computed with array operations
+    '''
+    def __init__(self, transcripts, boundaries):
+        boundaries = np.array(boundaries, dtype=np.int64)
+        self.transcripts = transcripts
+        self.node_lengths = np.diff(boundaries)
+        self.t_ids = {}
+        intron_ids = {}
+        node_arrays = []
+        intron_arrays = []
+        test_flags = []
+        ref_nodes = []
+        ref_owners = []
+        for i,t in enumerate(transcripts):
+            self.t_ids[id(t)] = i
+            # nodes are numbered by the index of their start boundary
+            exon_starts = np.array([e.start for e in t.exons], dtype=np.int64)
+            exon_ends = np.array([e.end for e in t.exons], dtype=np.int64)
+            first = np.searchsorted(boundaries, exon_starts)
+            last = np.searchsorted(boundaries, exon_ends)
+            nodes = [np.arange(a, b) for a,b in zip(first, last)]
+            node_arrays.append(np.unique(np.concatenate(nodes)))
+            introns = [intron_ids.setdefault(x, len(intron_ids)) 
+                       for x in t.iterintrons()]
+            intron_arrays.append(np.unique(np.array(introns, dtype=np.int64)))
+            is_ref = bool(int(t.attrs[GTFAttr.REF]))
+            test_flags.append(is_ref and bool(int(t.attrs[GTFAttr.TEST])))
+            if is_ref:
+                ref_nodes.append(node_arrays[-1])
+                ref_owners.append(np.repeat(i, len(node_arrays[-1])))
+        self.num_introns = len(intron_ids)
+        self.node_arrays = node_arrays
+        self.intron_arrays = intron_arrays
+        self.lengths = np.array([self.node_lengths[a].sum() 
+                                 for a in node_arrays], dtype=np.int64)
+        self.test_flags = np.array(test_flags, dtype=bool)
+        self.transcript_ids = np.array([t.attrs[GTFAttr.TRANSCRIPT_ID] 
+                                        for t in transcripts], dtype=object)
+        # reference transcripts of each node on each strand sorted by
+        # node and position in the locus
+        if len(ref_nodes) > 0:
+            ref_nodes = np.concatenate(ref_nodes)
+            ref_owners = np.concatenate(ref_owners).astype(np.int64)
+        else:
+            ref_nodes = np.zeros(0, dtype=np.int64)
+            ref_owners = np.zeros(0, dtype=np.int64)
+        strands = np.array([t.strand for t in transcripts], dtype=np.int8)
+        ref_strands = strands[ref_owners]
+        self.node_refs = []
+        self.node_ref_offsets = []
+        for strand in (POS_STRAND, NEG_STRAND, NO_STRAND):
+            mask = (ref_strands == strand)
+            nodes = ref_nodes[mask]
+            owners = ref_owners[mask]
+            order = np.lexsort((owners, nodes))
+            self.node_refs.append(owners[order])
+            self.node_ref_offsets.append(
+                np.searchsorted(nodes[order], 
+                                np.arange(len(self.node_lengths) + 1)))
+
+    def index(self, t):
+        return self.t_ids[id(t)]
+
+    def find_overlapping_refs(self, i, strand):
+        '''
+        returns array of the indexes of the reference transcripts on 
+        'strand' that share nodes with transcript 'i', in the order they 
+        are first found when scanning the nodes of transcript 'i' from 
+        left to right
+        '''
+        nodes = self.node_arrays[i]
+        offsets = self.node_ref_offsets[strand]
+        starts = offsets[nodes]
+        counts = offsets[nodes + 1] - starts
+        # positions of the references of each node of the transcript
+        ends = np.cumsum(counts)
+        inds = np.arange(ends[-1] if len(ends) > 0 else 0)
+        inds += np.repeat(starts - (ends - counts), counts)
+        refs = self.node_refs[strand][inds]
+        refs, first = np.unique(refs, return_index=True)
+        return refs[np.argsort(first)]
+
+    def _shared(self, arrays, mask, inds):
+        '''
+        sums the values of 'mask' over the arrays of each transcript
+        in 'inds'
+        '''
+        segments = [arrays[j] for j in inds]
+        counts = np.array([len(a) for a in segments], dtype=np.int64)
+        values = mask[np.concatenate(segments)]
+        owners = np.repeat(np.arange(len(inds)), counts)
+        return np.bincount(owners, weights=values, 
+                           minlength=len(inds)).astype(np.int64)
+
+    def coverage_overlap(self, i, inds):
+        '''
+        returns arrays of the shared and total (union) lengths of 
+        transcript 'i' and each transcript in 'inds'
+        '''
+        mask = np.zeros(len(self.node_lengths), dtype=np.int64)
+        nodes = self.node_arrays[i]
+        mask[nodes] = self.node_lengths[nodes]
+        shared = self._shared(self.node_arrays, mask, inds)
+        total = self.lengths[i] + self.lengths[inds] - shared
+        return shared, total
+
+    def intron_overlap(self, i, inds):
+        '''
+        returns arrays of the number of shared and total (union) introns 
+        of transcript 'i' and each transcript in 'inds'
+        '''
+        mask = np.zeros(self.num_introns, dtype=np.int64)
+        mask[self.intron_arrays[i]] = 1
+        shared = self._shared(self.intron_arrays, mask, inds)
+        counts = np.array([len(self.intron_arrays[j]) for j in inds], 
+                          dtype=np.int64)
+        total = len(self.intron_arrays[i]) + counts - shared
+        return shared, total
+
+def order_refs_by_id(locus_index, inds):
+    '''
+    candidate references are collected in a dictionary keyed by 
+    transcript id and the first reference (in dictionary order) with the 
+    best overlap wins ties
+    '''
+    inds = np.asarray(inds, dtype=np.int64)
+    ref_dict = dict(zip(locus_index.transcript_ids[inds].tolist(), 
+                        inds.tolist()))
+    return ref_dict.values()
+
+def best_coverage_index(cov_ratios, valid):
+    '''
+    returns position of the first 'valid' reference with the largest 
+    (nonzero) coverage ratio, or None
+    '''
+    ratios = np.where(valid, cov_ratios, 0.0)
+    i = int(np.argmax(ratios))
+    if not (ratios[i] > 0.0):
+        return None
+    return i
+
+def best_intron_index(intron_ratios, cov_ratios, valid):
+    '''
+    returns position of the first 'valid' reference with the largest
+    intron ratio, breaking ties using the coverage ratio, or None
+    '''
+    ratios = np.where(valid, intron_ratios, -1.0)
+    tied_cov_ratios = np.where(ratios == ratios.max(), cov_ratios, -1.0)
+    i = int(np.argmax(tied_cov_ratios))
+    if not (valid[i] and ((intron_ratios[i] > 0.0) or 
+                          (cov_ratios[i] > 0.0))):
+        return None
+    return i
+
+def find_best_coverage_overlap(locus_index, t_index, ref_inds):
+    '''
+    returns (best reference index, coverage ratio) considering all 
+    references and considering only references that are not 'test' 
+    transcripts.  the reference index is None when there is no overlap
+    '''
+    if len(ref_inds) == 0:
+        return (None, 0.0), (None, 0.0)
+    shared_cov, union_cov = locus_index.coverage_overlap(t_index, ref_inds)
+    shared_ratios = shared_cov.astype(float) / union_cov
+    results = []
+    for valid in (np.ones(len(ref_inds), dtype=bool), 
+                  ~locus_index.test_flags[ref_inds]):
+        i = best_coverage_index(shared_ratios, valid)
+        if i is None:
+            results.append((None, 0.0))
+        else:
+            results.append((ref_inds[i], float(shared_ratios[i])))
+    return tuple(results)
+
+def find_best_intron_overlap(locus_index, t_index, ref_inds):
+    '''
+    returns (best reference index, intron ratio, coverage ratio) 
+    considering all references and considering only references that are
+    not 'test' transcripts
+    '''
+    if len(ref_inds) == 0:
+        return (None, 0.0, 0.0), (None, 0.0, 0.0)
+    shared_introns, union_introns = \
+        locus_index.intron_overlap(t_index, ref_inds)
+    shared_intron_ratios = shared_introns.astype(float) / union_introns
+    shared_cov, total_cov = locus_index.coverage_overlap(t_index, ref_inds)
+    shared_cov_ratios = shared_cov.astype(float) / total_cov
+    results = []
+    for valid in (np.ones(len(ref_inds), dtype=bool), 
+                  ~locus_index.test_flags[ref_inds]):
+        i = best_intron_index(shared_intron_ratios, shared_cov_ratios, valid)
+        if i is None:
+            results.append((None, 0.0, 0.0))
+        else:
+            results.append((ref_inds[i], float(shared_intron_ratios[i]),
+                             float(shared_cov_ratios[i])))
+    return tuple(results)
+
+def categorize_nonref_transcript(t, introns, opp_strand_refs, intron_tree):
+    if len(opp_strand_refs) > 0:
+        # transcript has coverage overlapping on the opposite strand
+        # compared to reference transcripts
+        return Category.OPP_STRAND
+    # transcript has no coverage overlapping a reference transcript
+    # so it must be either intronic, interleaving, or intergenic
+    # search for introns overlapping transcript
+    found_hit = False
+    categories = set()
+    for hit in intron_tree.find(t.start, t.end):
+        if ((t.strand == hit.strand) and 
+            ((hit.start,hit.end) in introns)):
             continue
-        ref_introns = set(ref_t.iterintrons())
-        shared_introns = test_introns.intersection(ref_introns)
-        union_introns = test_introns.union(ref_introns)
-        shared_intron_ratio = float(len(shared_introns)) / len(union_introns)
-        shared_cov, total_cov = compute_coverage_overlap(test_nodes, ref_nodes)
-        shared_cov_ratio = float(shared_cov) / total_cov
-        if ((shared_intron_ratio > best_shared_intron_ratio) or
-            ((shared_intron_ratio == best_shared_intron_ratio) and
-             (shared_cov_ratio > best_shared_cov_ratio))):
-            best_ref_t = ref_t
-            best_shared_intron_ratio = shared_intron_ratio
-            best_shared_cov_ratio = shared_cov_ratio
-    return best_ref_t, best_shared_intron_ratio, best_shared_cov_ratio
-
-def categorize_transcript(t, nodes, introns, 
+        found_hit = True
+        # check if there is an intron that encompasses the 
+        # entire transcript
+        if (hit.start < t.start) and (hit.end > t.end):
+            if t.strand == NO_STRAND:
+                categories.add(Category.INTRONIC_AMBIGUOUS)
+                # no need to check other introns for unstranded 
+                break
+            elif hit.strand == t.strand:
+                categories.add(Category.INTRONIC_SAME_STRAND)
+            else:
+                categories.add(Category.INTRONIC_OPP_STRAND)
+    if not found_hit:
+        # no overlap with introns
+        return Category.INTERGENIC
+    elif len(categories) == 1:
+        return categories.pop()
+    elif len(categories) > 1:
+        # overlaps introns on both strand
+        return Category.INTRONIC_AMBIGUOUS
+    # a single intron does not encompass the transcript
+    return Category.INTERLEAVING
+
+def categorize_transcript(t, t_index, introns, 
+                          locus_index,
                           shared_intron_refs,
                           same_strand_refs,
                           opp_strand_refs,
-                          intron_tree,
-                          ignore_test=False):
+                          intron_tree):
+    '''
+    returns CInfo of the transcript.  when the best reference is a 'test'
+    transcript the category is the one found when 'test' references are
+    ignored.  both are found in a single scan of each list of candidate
+    references
+    '''
+    # best (ref index, intron ratio, coverage ratio) among all references
+    # and among references that are not 'test' transcripts
+    best = [None, None]
     if len(shared_intron_refs) > 0:
         # find reference transcript with best intron overlap
         # and break ties using total coverage overlap
-        best_ref_t, ann_intron_ratio, ann_cov_ratio = \
-            find_best_intron_overlap(nodes, introns, 
-                                     shared_intron_refs,                                         
-                                     ignore_test)
-        if best_ref_t is not None:    
-            # determine whether this is a 'test' transcript
-            is_test = bool(int(best_ref_t.attrs[GTFAttr.TEST]))
-            return CInfo(category=Category.SAME_STRAND ,
-                         ref=best_ref_t,
-                         ann_cov_ratio=ann_cov_ratio,
-                         ann_intron_ratio=ann_intron_ratio,
-                         is_test=is_test)                
-            
-    if len(same_strand_refs) > 0:
+        results = find_best_intron_overlap(locus_index, t_index,
+                                           shared_intron_refs)
+        best = [(r if r[0] is not None else None) for r in results]
+    if (best[1] is None) and (len(same_strand_refs) > 0):
         # find the reference transcript with the best overlap
-        best_ref_t, ann_cov_ratio = \
-            find_best_coverage_overlap(nodes, 
-                                       same_strand_refs, 
-                                       ignore_test)
-        if best_ref_t is not None:
-            # determine whether this is a 'test' transcript
-            is_test = bool(int(best_ref_t.attrs[GTFAttr.TEST]))
-            return CInfo(category=Category.SAME_STRAND,
-                         ref=best_ref_t,
-                         ann_cov_ratio=ann_cov_ratio,
-                         ann_intron_ratio=0.0,
-                         is_test=is_test)                
-
+        results = find_best_coverage_overlap(locus_index, t_index,
+                                             same_strand_refs)
+        for i, (ref_index, ann_cov_ratio) in enumerate(results):
+            if (best[i] is None) and (ref_index is not None):
+                best[i] = (ref_index, 0.0, ann_cov_ratio)
+    if best[0] is not None:
+        ref_index, ann_intron_ratio, ann_cov_ratio = best[0]
+        # determine whether this is a 'test' transcript
+        is_test = bool(locus_index.test_flags[ref_index])
+        if is_test and (best[1] is None):
+            category = categorize_nonref_transcript(t, introns, 
+                                                    opp_strand_refs,
+                                                    intron_tree)
+        else:
+            category = Category.SAME_STRAND
+        return CInfo(category=category,
+                     ref=locus_index.transcripts[ref_index],
+                     ann_cov_ratio=ann_cov_ratio,
+                     ann_intron_ratio=ann_intron_ratio,
+                     is_test=is_test)
     # not a reference transcript
     best_ref_t = None
-    is_test = False
     ann_cov_ratio = 0.0
     if len(opp_strand_refs) > 0:
-        # transcript has coverage overlapping on the opposite strand
-        # compared to reference transcripts
-        category = Category.OPP_STRAND
         # find the reference transcript with the best overlap
-        best_ref_t, ann_cov_ratio = \
-            find_best_coverage_overlap(nodes, 
-                                       opp_strand_refs, 
-                                       ignore_test=False)
-    else:
-        # transcript has no coverage overlapping a reference transcript
-        # so it must be either intronic, interleaving, or intergenic
-        # search for introns overlapping transcript
-        found_hit = False
-        categories = set()
-        for hit in intron_tree.find(t.start, t.end):
-            if ((t.strand == hit.strand) and 
-                ((hit.start,hit.end) in introns)):
-                continue
-            found_hit = True
-            # check if there is an intron that encompasses the 
-            # entire transcript
-            if (hit.start < t.start) and (hit.end > t.end):
-                if t.strand == NO_STRAND:
-                    categories.add(Category.INTRONIC_AMBIGUOUS)
-                    # no need to check other introns for unstranded 
-                    break
-                elif hit.strand == t.strand:
-                    categories.add(Category.INTRONIC_SAME_STRAND)
-                else:
-                    categories.add(Category.INTRONIC_OPP_STRAND)
-        if not found_hit:
-            # no overlap with introns
-            category = Category.INTERGENIC
-        elif len(categories) == 1:
-            category = categories.pop()
-        elif len(categories) > 1:
-            # overlaps introns on both strand
-            category = Category.INTRONIC_AMBIGUOUS
-        else:
-            # a single intron does not encompass the transcript
-            category = Category.INTERLEAVING
+        results = find_best_coverage_overlap(locus_index, t_index, 
+                                             opp_strand_refs)
+        ref_index, ann_cov_ratio = results[0]
+        if ref_index is not None:
+            best_ref_t = locus_index.transcripts[ref_index]
+    category = categorize_nonref_transcript(t, introns, opp_strand_refs, 
+                                            intron_tree)
     return CInfo(category=category,
                  ref=best_ref_t,
                  ann_cov_ratio=ann_cov_ratio,
                  ann_intron_ratio=0.0,
-                 is_test=is_test)
-
-def compute_recurrence_and_score(nodes, node_data):
-    # gather recurrence and scores across each node
-    total_length = 0.0
-    total_score = 0.0
-    total_recur = 0.0
-    total_pctrank = 0.0
-    for n in nodes:
-        nd = node_data[n]
-        length = float(n[1] - n[0])
-        total_score += nd['score'] * length
-        total_pctrank += nd['pct'] * length
-        total_recur += len(nd['ids']) * length       
-        total_length += length
-    # calculate statistics
-    mean_score = total_score / total_length
-    mean_pctrank = total_pctrank / total_length
-    mean_recur = total_recur / total_length
-    return mean_score, mean_pctrank, mean_recur
+                 is_test=False)
+
+def compute_recurrence_and_score(transcripts, gtf_sample_attr):
+    '''
+    returns lists of the mean score, percent rank and recurrence (number
+    of distinct samples) over the nodes of each transcript weighted by
+    node length.  nodes are numbered using the exon boundaries of all the
+    transcripts and the (node, transcript) and (node, sample) incidence 
+    is kept in flat arrays so that the statistics of all transcripts are 
+    computed at once.  sums are accumulated with bincount in the same 
+    order as the equivalent loops over nodes
+    '''
+    boundaries = np.array(find_exon_boundaries(transcripts), dtype=np.int64)
+    node_lengths = np.diff(boundaries).astype(float)
+    num_nodes = len(node_lengths)
+    # gather exons of all transcripts
+    sample_codes = {}
+    t_samples = []
+    t_scores = []
+    t_pctranks = []
+    exon_owners = []
+    exon_starts = []
+    exon_ends = []
+    for i,t in enumerate(transcripts):
+        sample_id = t.attrs[gtf_sample_attr]
+        t_samples.append(sample_codes.setdefault(sample_id, len(sample_codes)))
+        t_scores.append(float(t.attrs[GTFAttr.SCORE]))
+        t_pctranks.append(float(t.attrs[GTFAttr.PCTRANK]))
+        for e in t.exons:
+            exon_owners.append(i)
+            exon_starts.append(e.start)
+            exon_ends.append(e.end)
+    # split exons into nodes in the order of the transcript exons
+    first = np.searchsorted(boundaries, exon_starts)
+    counts = np.searchsorted(boundaries, exon_ends) - first
+    ends = np.cumsum(counts)
+    nodes = np.arange(ends[-1] if len(ends) > 0 else 0)
+    nodes += np.repeat(first - (ends - counts), counts)
+    owners = np.repeat(np.array(exon_owners, dtype=np.int64), counts)
+    # node scores and recurrence
+    node_scores = np.bincount(nodes, 
+                              weights=np.array(t_scores)[owners],
+                              minlength=num_nodes)
+    node_pctranks = np.bincount(nodes, 
+                                weights=np.array(t_pctranks)[owners],
+                                minlength=num_nodes)
+    num_samples = max(1, len(sample_codes))
+    node_samples = np.unique(nodes * num_samples + 
+                             np.array(t_samples, dtype=np.int64)[owners])
+    node_recur = np.bincount(node_samples // num_samples, 
+                             minlength=num_nodes)
+    # length weighted mean over the nodes of each transcript
+    lengths = node_lengths[nodes]
+    num_transcripts = len(transcripts)
+    total_length = np.bincount(owners, weights=lengths, 
+                               minlength=num_transcripts)
+    mean_scores = np.bincount(owners, weights=node_scores[nodes] * lengths,
+                              minlength=num_transcripts) / total_length
+    mean_pctranks = np.bincount(owners, 
+                                weights=node_pctranks[nodes] * lengths,
+                                minlength=num_transcripts) / total_length
+    mean_recurs = np.bincount(owners, weights=node_recur[nodes] * lengths,
+                              minlength=num_transcripts) / total_length
+    return mean_scores.tolist(), mean_pctranks.tolist(), mean_recurs.tolist()
 
 def resolve_strand(nodes, node_score_dict, ref_node_dict):
     # find strand with highest score
@@ -238,6 +461,8 @@ def annotate_locus(transcripts,
     all_introns = set()
     # find the intron domains of the transcripts
     boundaries = find_exon_boundaries(transcripts)
+    # number the nodes and introns of the transcripts
+    locus_index = LocusIndex(transcripts, boundaries)
     # add transcript to intron and graph data structures
     inp_transcripts = []
     for t in transcripts:
@@ -250,7 +475,7 @@ def annotate_locus(transcripts,
                 ref_node_dict[n][t.strand].append(t)
             # add to introns
             for start,end in t.iterintrons():
-                ref_intron_dict[(t.strand, start, end)].append(t)
+                ref_intron_dict[(t.strand, start, end)].append(locus_index.index(t))
                 all_introns.add((t.strand,start,end))
         else:
             if t.strand != NO_STRAND:
@@ -269,12 +494,13 @@ def annotate_locus(transcripts,
     # categorize transcripts
     strand_transcript_lists = [[], [], []]
     for t in inp_transcripts:
-        # get transcript nodes and introns
-        nodes = list(split_exons(t, boundaries))
+        # get transcript introns
+        t_index = locus_index.index(t)
         introns = set(t.iterintrons())
         # try to resolve strand
         strand = t.strand
         if strand == NO_STRAND:
+            nodes = split_exons(t, boundaries)
             strand = resolve_strand(nodes, node_score_dict, ref_node_dict)
         # define opposite strand
         if strand == NO_STRAND:
@@ -282,47 +508,23 @@ def annotate_locus(transcripts,
         else:
             opp_strand = (strand + 1) % 2
         # get all reference transcripts that share introns
-        intron_ref_dict = {}
+        intron_ref_inds = []
         for start,end in introns:
             if (strand, start, end) in ref_intron_dict:
-                refs = ref_intron_dict[(strand, start, end)]
-                intron_ref_dict.update((ref.attrs[GTFAttr.TRANSCRIPT_ID],ref) 
-                                       for ref in refs)
-        intron_refs = []
-        for ref in intron_ref_dict.itervalues():
-            intron_refs.append((ref,list(split_exons(ref, boundaries))))
+                intron_ref_inds.extend(ref_intron_dict[(strand, start, end)])
+        intron_refs = order_refs_by_id(locus_index, intron_ref_inds)
         # get all reference transcripts that share coverage
-        same_strand_ref_dict = {}
-        opp_strand_ref_dict = {}
-        for n in nodes:
-            if n in ref_node_dict:
-                strand_refs = ref_node_dict[n]
-                same_strand_ref_dict.update((ref.attrs[GTFAttr.TRANSCRIPT_ID],ref) 
-                                            for ref in strand_refs[strand])
-                opp_strand_ref_dict.update((ref.attrs[GTFAttr.TRANSCRIPT_ID],ref) 
-                                           for ref in strand_refs[opp_strand])
-        same_strand_refs = []
-        for ref in same_strand_ref_dict.itervalues():
-            same_strand_refs.append((ref,list(split_exons(ref, boundaries))))
-        opp_strand_refs = []
-        for ref in opp_strand_ref_dict.itervalues():            
-            opp_strand_refs.append((ref,list(split_exons(ref, boundaries))))
+        same_strand_refs = order_refs_by_id(locus_index, 
+            locus_index.find_overlapping_refs(t_index, strand))
+        opp_strand_refs = order_refs_by_id(locus_index, 
+            locus_index.find_overlapping_refs(t_index, opp_strand))
         # categorize
-        cinf = categorize_transcript(t, nodes, introns, 
+        cinf = categorize_transcript(t, t_index, introns, 
+                                     locus_index,
                                      intron_refs,
                                      same_strand_refs,
                                      opp_strand_refs,
-                                     intron_tree,
-                                     ignore_test=False)
-        if cinf.is_test:
-            # recategorize test transcripts
-            cinf2 = categorize_transcript(t, nodes, introns, 
-                                          intron_refs,
-                                          same_strand_refs,
-                                          opp_strand_refs,
-                                          intron_tree,
-                                          ignore_test=True)
-            cinf = cinf._replace(category=cinf2.category)
+                                     intron_tree)
         # add annotation attributes
         best_ref_id = (cinf.ref.attrs[GTFAttr.TRANSCRIPT_ID] 
                        if cinf.ref is not None else 'na')
@@ -341,87 +543,230 @@ def annotate_locus(transcripts,
     del inp_transcripts
     # annotate score and recurrence for transcripts
     for strand_transcripts in strand_transcript_lists:
-        # find the intron domains of the transcripts
-        boundaries = find_exon_boundaries(strand_transcripts)
-        # gather node score/recurrence data
-        new_data_func = lambda: {'ids': set(), 
-                                 'score': 0.0, 
-                                 'pct': 0.0}
-        node_data = collections.defaultdict(new_data_func)
-        for t in strand_transcripts:
-            sample_id = t.attrs[gtf_sample_attr]
-            score = float(t.attrs[GTFAttr.SCORE])
-            pctrank = float(t.attrs[GTFAttr.PCTRANK])
-            # split exons that cross boundaries and to get the
-            # nodes in the transcript path
-            for n in split_exons(t, boundaries):
-                nd = node_data[n]
-                nd['ids'].add(sample_id)
-                nd['score'] += score
-                nd['pct'] += pctrank
+        if len(strand_transcripts) == 0:
+            continue
         # calculate recurrence and score statistics
-        for t in strand_transcripts:
-            nodes = list(split_exons(t, boundaries))
-            mean_score, mean_pctrank, mean_recur = \
-                compute_recurrence_and_score(nodes, node_data)
-            t.attrs[GTFAttr.MEAN_SCORE] = mean_score
-            t.attrs[GTFAttr.MEAN_PCTRANK] = mean_pctrank
-            t.attrs[GTFAttr.MEAN_RECURRENCE] = mean_recur
-
-def annotate_gtf_worker(input_queue, gtf_file, gtf_sample_attr): 
-    fileh = open(gtf_file, 'w')
-    while True:
-        lines = input_queue.get()
-        if len(lines) == 0:
-            break             
+        mean_scores, mean_pctranks, mean_recurs = \
+            compute_recurrence_and_score(strand_transcripts, gtf_sample_attr)
+        for i,t in enumerate(strand_transcripts):
+            t.attrs[GTFAttr.MEAN_SCORE] = mean_scores[i]
+            t.attrs[GTFAttr.MEAN_PCTRANK] = mean_pctranks[i]
+            t.attrs[GTFAttr.MEAN_RECURRENCE] = mean_recurs[i]
+
+class AnnotateWorker(WorkerHandler):
+    def __init__(self, gtf_file, gtf_sample_attr, restarted=False):
+        self.gtf_sample_attr = gtf_sample_attr
+        journal_file = gtf_file + JOURNAL_SUFFIX
+        if restarted:
+            # discard partial output of the locus that was running when
+            # the previous worker process died
+            recover_journal(journal_file, [gtf_file])
+            mode = 'a'
+        else:
+            mode = 'w'
+        self.fileh = open(gtf_file, mode)
+        self.journal = LocusJournal(journal_file, [self.fileh], mode)
+
+    def process(self, locus_num, lines, attempt):
         transcripts = transcripts_from_gtf_lines(lines)
-        annotate_locus(transcripts, gtf_sample_attr) 
+        annotate_locus(transcripts, self.gtf_sample_attr) 
         for t in transcripts:
             for f in t.to_gtf_features():
-                print >>fileh, str(f)
-        input_queue.task_done()
-        # explicitly delete large objects
-        del lines
-        del transcripts
+                print >>self.fileh, str(f)
+        self.journal.commit(locus_num)
+
+    def rollback(self):
+        self.journal.rollback()
+
+    def close(self):
+        self.journal.close()
+        self.fileh.close()
+
+def get_split_file(prefix, k):
+    if k == REF_SPLIT_KEY:
+        return prefix + REF_SPLIT_SUFFIX
+    return os.path.join(prefix, "%s.gtf" % (k))
+
+class SplitAnnotateWorker(WorkerHandler):
+    '''
+    writes the annotated transcripts of each library to a separate file
+    and reference transcripts to their own file.  the lines of each 
+    locus are written in sorted order so that every file is sorted when
+    loci are processed in order.  category statistics of each library
+    are written to a file when the worker finishes
+    '''
+    def __init__(self, prefix, gtf_sample_attr, maxfiles, restarted=False):
+        self.prefix = prefix
+        self.gtf_sample_attr = gtf_sample_attr
+        self.stats_dict = {}
+        keyfunc = lambda k: get_split_file(prefix, k)
+        journal_file = prefix + JOURNAL_SUFFIX
+        if restarted:
+            # discard partial output of the locus that was running when
+            # the previous worker process died and recount statistics
+            # from the output that was kept
+            committed = recover_split_journal(journal_file, keyfunc)
+            for k in committed:
+                if k == REF_SPLIT_KEY:
+                    continue
+                for line in open(keyfunc(k)):
+                    if line.split('\t', 3)[2] == 'transcript':
+                        f = GTFFeature.from_string(line)
+                        self._add_stats(k, f.attrs)
+        else:
+            committed = None
+            if not os.path.exists(prefix):
+                os.makedirs(prefix)
+        self.splitter = JournaledFileSplitter(journal_file, keyfunc, 
+                                              committed, maxfiles)
+
+    def _add_stats(self, library_id, attrs):
+        statsobj = self.stats_dict.get(library_id)
+        if statsobj is None:
+            statsobj = CategoryStats()
+            statsobj.library_id = library_id
+            self.stats_dict[library_id] = statsobj
+        statsobj.add_transcript(attrs)
+
+    def process(self, locus_num, lines, attempt):
+        transcripts = transcripts_from_gtf_lines(lines)
+        annotate_locus(transcripts, self.gtf_sample_attr) 
+        split_lines = collections.defaultdict(list)
+        library_transcripts = []
+        for t in transcripts:
+            if bool(int(t.attrs[GTFAttr.REF])):
+                k = REF_SPLIT_KEY
+            else:
+                k = t.attrs[GTFAttr.LIBRARY_ID]
+                library_transcripts.append((k, t))
+            split_lines[k].extend('%s\n' % str(f) 
+                                  for f in t.to_gtf_features())
+        for k, klines in split_lines.iteritems():
+            klines.sort(key=gtf_sort_key)
+            self.splitter.writelines(k, klines)
+        self.splitter.commit(locus_num)
+        for k, t in library_transcripts:
+            self._add_stats(k, t.attrs)
+
+    def rollback(self):
+        self.splitter.rollback()
+
+    def close(self):
+        self.splitter.close()
+        CategoryStats.to_file(self.prefix + STATS_SPLIT_SUFFIX,
+                              self.stats_dict.itervalues())
+
+def merge_split_files(filenames, output_file, presorted, tmp_dir):
+    if not presorted:
+        merge_sort_gtf_files(filenames, output_file, tmp_dir=tmp_dir)
+    elif len(filenames) == 1:
+        shutil.move(filenames[0], output_file)
+    else:
+        merge_sorted_gtf_files(filenames, output_file)
+
+def annotate_gtf_split_parallel(input_gtf_file,
+                                split_dir,
+                                ref_gtf_file,
+                                category_stats_file,
+                                gtf_sample_attr,
+                                num_processors,
+                                tmp_dir,
+                                quarantine_gtf_file,
+                                quarantine_index_file):
+    '''
+    annotates transcripts and writes them directly to one sorted GTF 
+    file per library in 'split_dir' along with the reference GTF file
+    and library category statistics
+    '''
+    prefixes = [os.path.join(tmp_dir, "annotate_worker%03d" % (i))
+                for i in xrange(num_processors)]
+    maxfiles = MAX_OPEN_FILE_DESCRIPTORS // num_processors
+    def handler_factory(worker_id, restarted):
+        return SplitAnnotateWorker(prefixes[worker_id], gtf_sample_attr,
+                                   maxfiles, restarted)
+    quarantine = LocusQuarantine(quarantine_gtf_file, quarantine_index_file)
+    pool = SupervisedPool(num_processors, handler_factory, 
+                          quarantine_func=quarantine)
+    pool.run(enumerate(parse_loci(open(input_gtf_file))))
+    if len(quarantine.loci) > 0:
+        logging.warning("%d loci could not be annotated and were written "
+                        "to %s" % (len(quarantine.loci), quarantine_gtf_file))
+    # combine library statistics of workers
+    stats_dict = {}
+    library_files = collections.defaultdict(list)
+    for prefix in prefixes:
+        for statsobj in CategoryStats.from_file(prefix + STATS_SPLIT_SUFFIX):
+            library_id = statsobj.library_id
+            library_files[library_id].append(get_split_file(prefix, library_id))
+            if library_id not in stats_dict:
+                stats_dict[library_id] = statsobj
+                continue
+            totalobj = stats_dict[library_id]
+            for k in xrange(Category.NUM_CATEGORIES):
+                totalobj.counts[k] += statsobj.counts[k]
+                totalobj.signal[k] += statsobj.signal[k]
+    library_ids = sorted(stats_dict)
+    # retried loci are appended out of order so worker files must be 
+    # sorted instead of merged
+    presorted = (pool.num_failures == 0)
+    logging.debug("Merging worker GTF files of %d libraries" % 
+                  (len(library_ids)))
+    for library_id in library_ids:
+        merge_split_files(library_files[library_id], 
+                          os.path.join(split_dir, "%s.gtf" % (library_id)),
+                          presorted, tmp_dir)
+    # reference transcripts are written in the same format as
+    # split_gtf_file in classify_transcripts
+    ref_files = [get_split_file(prefix, REF_SPLIT_KEY) for prefix in prefixes]
+    ref_files = [f for f in ref_files if os.path.exists(f)]
+    tmp_ref_file = os.path.join(tmp_dir, "annotate_ref.gtf")
+    merge_split_files(ref_files, tmp_ref_file, presorted, tmp_dir)
+    fileh = open(ref_gtf_file, 'w')
+    for line in open(tmp_ref_file):
+        print >>fileh, str(GTFFeature.from_string(line))
     fileh.close()
-    input_queue.task_done()
+    os.remove(tmp_ref_file)
+    CategoryStats.to_file(category_stats_file, 
+                          [stats_dict[k] for k in library_ids])
+    # remove worker files
+    for prefix in prefixes:
+        for suffix in (REF_SPLIT_SUFFIX, STATS_SPLIT_SUFFIX, JOURNAL_SUFFIX):
+            if os.path.exists(prefix + suffix):
+                os.remove(prefix + suffix)
+        if os.path.exists(prefix):
+            shutil.rmtree(prefix)
 
 def annotate_gtf_parallel(input_gtf_file,
                           output_gtf_file, 
                           gtf_sample_attr, 
                           num_processors, 
-                          tmp_dir):
-    # create queue
-    input_queue = JoinableQueue(maxsize=num_processors*3)
-    # start worker processes
-    procs = []
+                          tmp_dir,
+                          quarantine_gtf_file,
+                          quarantine_index_file):
     worker_gtf_files = []
     for i in xrange(num_processors):
         worker_gtf_file = os.path.join(tmp_dir, "annotate_worker%03d.gtf" % (i))
         worker_gtf_files.append(worker_gtf_file)
-        args = (input_queue, worker_gtf_file, gtf_sample_attr)
-        p = Process(target=annotate_gtf_worker, args=args)
-        p.daemon = True
-        p.start()
-        procs.append(p)
-    for lines in parse_loci(open(input_gtf_file)):
-        input_queue.put(lines)
-    # stop workers
-    for p in procs:
-        input_queue.put([])
-    # close queue
-    input_queue.join()
-    input_queue.close()
-    # join worker processes
-    for p in procs:
-        p.join()
+    def handler_factory(worker_id, restarted):
+        return AnnotateWorker(worker_gtf_files[worker_id], gtf_sample_attr,
+                              restarted)
+    # loci that fail twice are written to a side file instead of the
+    # annotated output
+    quarantine = LocusQuarantine(quarantine_gtf_file, quarantine_index_file)
+    pool = SupervisedPool(num_processors, handler_factory, 
+                          quarantine_func=quarantine)
+    pool.run(enumerate(parse_loci(open(input_gtf_file))))
+    if len(quarantine.loci) > 0:
+        logging.warning("%d loci could not be annotated and were written "
+                        "to %s" % (len(quarantine.loci), quarantine_gtf_file))
     # merge/sort worker gtf files
     logging.debug("Merging %d worker GTF file(s)" % (num_processors))
     merge_sort_gtf_files(worker_gtf_files, output_gtf_file, tmp_dir=tmp_dir)
     # remove worker gtf files
     for filename in worker_gtf_files:
-        if os.path.exists(filename):
-            os.remove(filename)
+        for f in (filename, filename + JOURNAL_SUFFIX):
+            if os.path.exists(f):
+                os.remove(f)
 
 def main():
     # parse command line
@@ -436,6 +781,13 @@ def main():
                         help="GTF attribute field used to distinguish "
                         "independent samples in order to compute "
                         "recurrence [default=%(default)s]")
+    parser.add_argument("--split-libraries", dest="split_libraries",
+                        action="store_true", default=False,
+                        help="Write annotated transcripts directly to "
+                        "one file per library along with the reference "
+                        "GTF file and category statistics used by "
+                        "classify_transcripts instead of writing a "
+                        "single annotated GTF file")
     parser.add_argument("run_dir")
     args = parser.parse_args()
     # set logging level
@@ -455,17 +807,39 @@ def main():
     logging.info("Parameters:")
     logging.info("num processors:       %d" % (args.num_processors))
     logging.info("gtf sample attribute: %s" % (args.gtf_sample_attr))
+    logging.info("split libraries:      %s" % (args.split_libraries))
     logging.info("run directory:        %s" % (args.run_dir))
     logging.info("----------------------------------")   
     # setup results
     results = config.AssemblylineResults(args.run_dir)
     # function to gather transcript attributes
+    if args.split_libraries:
+        # classify_transcripts only splits the annotated GTF file when
+        # it exists
+        if os.path.exists(results.annotated_transcripts_gtf_file):
+            os.remove(results.annotated_transcripts_gtf_file)
+        if not os.path.exists(results.classify_dir):
+            os.makedirs(results.classify_dir)
+        logging.info("Annotating and splitting GTF file by library")
+        annotate_gtf_split_parallel(results.transcripts_gtf_file,
+                                    results.classify_dir,
+                                    results.ref_gtf_file,
+                                    results.category_stats_file,
+                                    args.gtf_sample_attr,
+                                    num_processors,
+                                    results.tmp_dir,
+                                    results.annotate_quarantine_gtf_file,
+                                    results.annotate_quarantine_index_file)
+        logging.info("Done")
+        return 0
     logging.info("Annotating GTF file")
     annotate_gtf_parallel(results.transcripts_gtf_file,
                           results.annotated_transcripts_gtf_file,
                           args.gtf_sample_attr,
                           num_processors,
-                          results.tmp_dir)
+                          results.tmp_dir,
+                          results.annotate_quarantine_gtf_file,
+                          results.annotate_quarantine_index_file)
     logging.info("Done")
     return 0
 
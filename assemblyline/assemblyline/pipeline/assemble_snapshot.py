@@ -0,0 +1,220 @@
+'''
+Created on Oct 20, 2013
+
+@author: mkiyer
+
+AssemblyLine: transcriptome meta-assembly from RNA-Seq
+
+Copyright (C) 2012-2013 Matthew Iyer
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Runs k-mer graph construction and path finding on the transcript graphs
+saved by 'assemble_transcripts --snapshot'.  Parsing, filtering, strand
+resolution, trimming, and collapsing are not repeated.
+'''
+import os
+import sys
+import logging
+import argparse
+import shutil
+
+import assemblyline
+from assemblyline.lib.supervisor import SupervisedPool
+from assemblyline.lib.assemble.snapshot import read_snapshot_index, \
+    read_snapshot_entry, INDEX_SUFFIX
+from assemblyline.pipeline.assemble_transcripts import RunConfig, \
+    AssemblyWorker, LockValue, assemble_graphs, write_locus_results, \
+    get_initial_ids, merge_param_outputs, add_sweep_options, \
+    parse_sweep_options, add_isoform_mode_option
+
+class SnapshotAssemblyWorker(AssemblyWorker):
+    def __init__(self, snapshot_file, *args, **kwargs):
+        AssemblyWorker.__init__(self, *args, **kwargs)
+        self.snapshot_fileh = open(snapshot_file, 'rb')
+
+    def assemble(self, locus_num, entry, config, outputs):
+        transcript_graphs = read_snapshot_entry(self.snapshot_fileh, entry)
+        logging.debug("[LOCUS] %s:%d-%d %d graphs" %
+                      (entry.chrom, entry.start, entry.end,
+                       len(transcript_graphs)))
+        locus_id_str = "L%d" % (self.locus_id_value_obj.next())
+        results = assemble_graphs(entry.chrom, transcript_graphs,
+                                  [output.config for output in outputs])
+        write_locus_results(entry.chrom, locus_id_str, outputs, results)
+
+    def close(self):
+        AssemblyWorker.close(self)
+        self.snapshot_fileh.close()
+
+def parse_args(config):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        dest="verbose", default=config.verbose)
+    parser.add_argument("-p", type=int, dest="num_processors",
+                        default=config.num_processors,
+                        help="Number of processes to run in parallel "
+                        "[default=%(default)s]")
+    grp = parser.add_argument_group("Assembly options")
+    grp.add_argument("--kmax", dest="kmax",
+                     type=int, default=config.kmax, metavar="k",
+                     help="Set maximum complexity of transcript "
+                     "overlap graph [default=%(default)s]")
+    grp.add_argument("--ksensitivity", dest="ksensitivity",
+                     type=float, default=config.ksensitivity,
+                     metavar="X",
+                     help="Optimize complexity of transcript graph "
+                     "construction under the constraint that no more "
+                     "than X fraction of total coverage is retained "
+                     "[default=%(default)s]")
+    grp.add_argument("--fraction-major-isoform",
+                     dest="fraction_major_isoform", type=float,
+                     default=config.fraction_major_isoform,
+                     metavar="FRAC",
+                     help="Report transcript isoforms with expression "
+                     "fraction >=FRAC (0.0-1.0) relative to the major "
+                     "isoform [default=%(default)s]")
+    grp.add_argument("--max-paths", dest="max_paths", type=int,
+                     default=config.max_paths, metavar="N",
+                     help="Maximum path finding iterations to perform "
+                     "for each gene [default=%(default)s]")
+    add_isoform_mode_option(grp, config.isoform_mode)
+    add_sweep_options(parser)
+    grp = parser.add_argument_group("Output options")
+    grp.add_argument("-o", "--output-dir", dest="output_dir",
+                     default="assembly_snapshot",
+                     help="directory where output files will be stored "
+                     "(created if it does not exist) "
+                     "[default=%(default)s]")
+    grp.add_argument("--bed", action="store_true", dest="create_bed",
+                     default=config.create_bed,
+                     help="Produce BED output file "
+                     "[default=%(default)s]")
+    parser.add_argument("snapshot_file")
+    args = parser.parse_args()
+    # constrain parameters
+    if not os.path.exists(args.snapshot_file + INDEX_SUFFIX):
+        parser.error("Snapshot index %s not found" %
+                     (args.snapshot_file + INDEX_SUFFIX))
+    if (args.ksensitivity < 0) or (args.ksensitivity > 1):
+        parser.error("ksensitivity out of range (0.0-1.0)")
+    if (args.ksensitivity < 1e-8) and (args.kmax == 0):
+        parser.error("when ksensitivity set to zero please specify 'kmax' >= 1")
+    if (args.kmax < 0):
+        parser.error("kmax must be >= 0")
+    if (args.fraction_major_isoform < 0) or (args.fraction_major_isoform > 1):
+        parser.error("fraction_major_isoform out of range (0.0-1.0)")
+    if (args.max_paths < 1):
+        parser.error("max_paths <= 0")
+    sweep_values = parse_sweep_options(parser, args)
+    # update config attributes
+    config.verbose = args.verbose
+    config.num_processors = max(1, args.num_processors)
+    config.kmax = args.kmax
+    config.ksensitivity = args.ksensitivity
+    config.fraction_major_isoform = args.fraction_major_isoform
+    config.max_paths = args.max_paths
+    config.isoform_mode = args.isoform_mode
+    config.sweep_kmax = sweep_values['sweep_kmax']
+    config.sweep_fraction_major_isoform = sweep_values['sweep_fraction_major_isoform']
+    config.sweep_max_paths = sweep_values['sweep_max_paths']
+    config.output_dir = os.path.abspath(args.output_dir)
+    config.create_gtf = True
+    config.create_bed = args.create_bed
+    config.create_bedgraph = False
+    config.create_bigwig = False
+    config.create_bigbed = False
+    config.create_snapshot = False
+    return os.path.abspath(args.snapshot_file)
+
+def run_snapshot(snapshot_file, config):
+    """
+    assembles the transcript graphs in a snapshot file in parallel and
+    merges output from child processes
+    """
+    # create temp directory
+    tmp_dir = os.path.join(config.output_dir, "tmp")
+    if not os.path.exists(tmp_dir):
+        logging.debug("Creating tmp directory '%s'" % (tmp_dir))
+        os.makedirs(tmp_dir)
+    params, entries = read_snapshot_index(snapshot_file + INDEX_SUFFIX)
+    logging.info("Snapshot contains %d loci built with:" % (len(entries)))
+    for k,v in params:
+        logging.info("%s: %s" % (k,v))
+    # shared memory values
+    param_configs = config.get_param_configs()
+    next_ids = get_initial_ids(config)
+    locus_id_value_obj = LockValue(next_ids[0])
+    param_id_value_objs = []
+    for i in xrange(len(param_configs)):
+        param_id_value_objs.append(tuple(LockValue(x) for x in
+                                         next_ids[1+3*i:4+3*i]))
+    worker_prefixes = [os.path.join(tmp_dir, "worker%03d" % (i))
+                       for i in xrange(config.num_processors)]
+    def handler_factory(worker_id, restarted):
+        return SnapshotAssemblyWorker(snapshot_file,
+                                      worker_prefixes[worker_id], config,
+                                      locus_id_value_obj,
+                                      param_id_value_objs,
+                                      restarted)
+    pool = SupervisedPool(config.num_processors, handler_factory)
+    pool.run((entry.locus_num, entry) for entry in entries)
+    if len(pool.quarantined) > 0:
+        logging.warning("%d loci could not be assembled: %s" %
+                        (len(pool.quarantined),
+                         ','.join(map(str, sorted(pool.quarantined)))))
+    # merge gtf and bed files for each set of parameters
+    merge_param_outputs(worker_prefixes, tmp_dir, config)
+    # cleanup
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    logging.info("Done")
+    return 0
+
+def main():
+    # create default run configuration
+    config = RunConfig()
+    # parse command line
+    snapshot_file = parse_args(config)
+    # setup logging
+    if config.verbose:
+        level = logging.DEBUG
+    else:
+        level = logging.INFO
+    logging.basicConfig(level=level,
+                        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    logging.info("AssemblyLine version %s" % (assemblyline.__version__))
+    logging.info("----------------------------------")
+    logging.info("snapshot file:           %s" % (snapshot_file))
+    logging.info("kmax:                    %d" % (config.kmax))
+    logging.info("ksensitivity:            %f" % (config.ksensitivity))
+    logging.info("fraction major isoform:  %f" % (config.fraction_major_isoform))
+    logging.info("max paths:               %d" % (config.max_paths))
+    logging.info("isoform mode:            %s" % (config.isoform_mode))
+    if config.is_sweep():
+        logging.info("sweep kmax:              %s" % str(config.sweep_kmax))
+        logging.info("sweep frac major isoform:%s" % str(config.sweep_fraction_major_isoform))
+        logging.info("sweep max paths:         %s" % str(config.sweep_max_paths))
+    logging.info("output directory:        %s" % (config.output_dir))
+    logging.info("num_processors:          %d" % (config.num_processors))
+    logging.info("----------------------------------")
+    # create output directory
+    if not os.path.exists(config.output_dir):
+        logging.debug("Creating output directory '%s'" % (config.output_dir))
+        os.makedirs(config.output_dir)
+    # start algorithm
+    return run_snapshot(snapshot_file, config)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -27,20 +27,38 @@ import argparse
 import collections
 import subprocess
 import shutil
-from multiprocessing import Process, JoinableQueue, Value, Lock
+import glob
+import copy
+import cStringIO
+from multiprocessing import Value, Lock
 
 import assemblyline
 from assemblyline.lib.bx.cluster import ClusterTree
 from assemblyline.lib.base import float_check_nan, GTFAttr
 from assemblyline.lib.gtf import GTFFeature
-from assemblyline.lib.gtf import parse_loci, merge_sort_gtf_files
-from assemblyline.lib.transcript import transcripts_from_gtf_lines, \
-    strand_int_to_str, NEG_STRAND
+from assemblyline.lib.gtf import parse_loci, parse_stranded_loci, \
+    merge_sort_gtf_files
+from assemblyline.lib.bedgraph import merge_bedgraph_files, \
+    merge_bedgraph_records
+from assemblyline.lib.bbi import read_chrom_sizes, write_bigwig, \
+    write_bigbed
+from assemblyline.lib.journal import LocusJournal, JOURNAL_SUFFIX, \
+    recover_journal
+from assemblyline.lib.supervisor import SupervisedPool, WorkerHandler, \
+    LocusQuarantine
+from assemblyline.lib.transcript import strand_int_to_str, NEG_STRAND
+from assemblyline.lib.locus_codec import pack_locus, unpack_locus, \
+    unpack_locus_lines
 
 from assemblyline.lib.assemble.base import NODE_SCORE
 from assemblyline.lib.assemble.filter import filter_transcripts
 from assemblyline.lib.assemble.transcript_graph import create_transcript_graphs
-from assemblyline.lib.assemble.assembler import assemble_transcript_graph
+from assemblyline.lib.assemble.assembler import get_kmer_range, \
+    build_kmer_graph, find_transcript_paths, ISOFORM_MODES
+from assemblyline.lib.assemble.snapshot import SnapshotWriter, \
+    merge_snapshots, SNAPSHOT_FILE, INDEX_SUFFIX as SNAPSHOT_INDEX_SUFFIX
+from assemblyline.lib.assemble.cache import LocusCache, locus_cache_key, \
+    pack_path_info_list, unpack_path_info_list
 
 class LockValue(object):
     def __init__(self, initval=0):
@@ -51,10 +69,87 @@ class LockValue(object):
             cur_val = self.val.value
             self.val.value += 1
             return cur_val
+    @property
+    def value(self):
+        with self.lock:
+            return self.val.value
 
 SCORING_MODES = ("unweighted", "gtf_attr")
 STRAND_NAMES = ('pos', 'neg', 'none')
 STRAND_COLORS = ('255,0,0', '0,0,255', '0,0,0')
+CHECKPOINT_FILE = "checkpoint.txt"
+QUARANTINE_GTF_FILE = "assembly.quarantine.gtf"
+QUARANTINE_INDEX_FILE = "assembly.quarantine.txt"
+SWEEP_INDEX_FILE = "sweep.txt"
+SNAPSHOT_SUFFIX = ".snapshot"
+# settings used when retrying a locus that failed
+DEGRADED_KMAX = 2
+DEGRADED_MAX_PATHS = 100
+
+def add_isoform_mode_option(grp, default):
+    grp.add_argument("--isoform-mode", dest="isoform_mode", 
+                     choices=ISOFORM_MODES, default=default,
+                     help="Method used to enumerate isoforms. 'greedy' "
+                     "repeatedly finds and subtracts the highest scoring "
+                     "path. 'flow' decomposes edge flows estimated from "
+                     "node scores and needs at most one pass per graph "
+                     "edge [default=%(default)s]")
+
+def add_sweep_options(parser):
+    grp = parser.add_argument_group("Parameter sweep options",
+                                    "Build the transcript graphs of "
+                                    "each locus once and assemble "
+                                    "them using every combination of "
+                                    "the listed values. Output for "
+                                    "each combination is written to "
+                                    "a subdirectory of the output "
+                                    "directory")
+    grp.add_argument("--sweep-kmax", dest="sweep_kmax", 
+                     default=None, metavar="k1,k2,...",
+                     help="Comma-separated list of '--kmax' values")
+    grp.add_argument("--sweep-fraction-major-isoform", 
+                     dest="sweep_fraction_major_isoform", 
+                     default=None, metavar="FRAC1,FRAC2,...",
+                     help="Comma-separated list of "
+                     "'--fraction-major-isoform' values")
+    grp.add_argument("--sweep-max-paths", dest="sweep_max_paths", 
+                     default=None, metavar="N1,N2,...",
+                     help="Comma-separated list of '--max-paths' "
+                     "values")
+
+def parse_sweep_options(parser, args):
+    """
+    returns dictionary with the list of values given for each sweep
+    option (or None if the option was not used)
+    """
+    sweep_values = {}
+    for attr, parse_func in (('sweep_kmax', int),
+                             ('sweep_fraction_major_isoform', float),
+                             ('sweep_max_paths', int)):
+        value = getattr(args, attr)
+        if value is None:
+            sweep_values[attr] = None
+            continue
+        try:
+            values = [parse_func(x) for x in value.split(',') if x]
+        except ValueError:
+            parser.error("invalid value list for %s" % (attr))
+        if len(values) == 0:
+            parser.error("no values specified for %s" % (attr))
+        sweep_values[attr] = values
+    if sweep_values['sweep_kmax'] is not None:
+        if any(x < 0 for x in sweep_values['sweep_kmax']):
+            parser.error("kmax must be >= 0")
+        if (args.ksensitivity < 1e-8) and (0 in sweep_values['sweep_kmax']):
+            parser.error("when ksensitivity set to zero please specify 'kmax' >= 1")
+    if sweep_values['sweep_fraction_major_isoform'] is not None:
+        if any((x < 0) or (x > 1) for x in 
+               sweep_values['sweep_fraction_major_isoform']):
+            parser.error("fraction_major_isoform out of range (0.0-1.0)")
+    if sweep_values['sweep_max_paths'] is not None:
+        if any(x < 1 for x in sweep_values['sweep_max_paths']):
+            parser.error("max_paths <= 0")
+    return sweep_values
 
 class RunConfig(object):
     def __init__(self):
@@ -68,14 +163,25 @@ class RunConfig(object):
         self.trim_utr_fraction = 0.1
         self.trim_intron_fraction = 0.25
         self.guided = False
+        self.stranded_loci = False
         self.kmax = 0
         self.ksensitivity = 0.90
         self.fraction_major_isoform = 0.01
         self.max_paths = 1000
+        self.isoform_mode = "greedy"
         self.output_dir = "assembly"
         self.create_gtf = True
         self.create_bed = False
         self.create_bedgraph = False
+        self.create_bigwig = False
+        self.create_bigbed = False
+        self.chrom_sizes_file = None
+        self.create_snapshot = False
+        self.resume = False
+        self.cache_dir = None
+        self.sweep_kmax = None
+        self.sweep_fraction_major_isoform = None
+        self.sweep_max_paths = None
     
     def parse_args(self):
         parser = argparse.ArgumentParser()
@@ -85,6 +191,17 @@ class RunConfig(object):
                             default=self.num_processors,
                             help="Number of processes to run in parallel "
                             "[default=%(default)s]")
+        parser.add_argument("--resume", dest="resume", action="store_true",
+                            default=self.resume,
+                            help="Resume an interrupted run using the "
+                            "completed loci recorded in the output "
+                            "directory (default: not set)")
+        parser.add_argument("--cache-dir", dest="cache_dir",
+                            default=self.cache_dir, metavar="DIR",
+                            help="Store the assembly of each locus in "
+                            "directory DIR and reuse stored results for "
+                            "loci with identical transcripts and "
+                            "parameters (default: not set)")
         parser.add_argument("--scoring-mode", dest="scoring_mode", 
                             choices=SCORING_MODES,
                             default=self.scoring_mode, metavar="MODE",
@@ -122,6 +239,13 @@ class RunConfig(object):
                             help="Trim intronic coverage when less than or "
                             "equal to FRAC fraction of the downstream exon "
                             "[default=%(default)s]")
+        parser.add_argument("--stranded-loci", dest="stranded_loci",
+                            action="store_true", 
+                            default=self.stranded_loci,
+                            help="Assemble overlapping transcripts on "
+                            "opposite strands as separate loci. Unstranded "
+                            "transcripts join the stranded locus with the "
+                            "greatest exonic overlap (default: not set)")
         grp = parser.add_argument_group("Assembly options")
         grp.add_argument("--guided", dest="guided", action="store_true",
                          default=self.guided,
@@ -153,6 +277,8 @@ class RunConfig(object):
                          default=self.max_paths, metavar="N",
                          help="Maximum path finding iterations to perform "
                          "for each gene [default=%(default)s]")
+        add_isoform_mode_option(grp, self.isoform_mode)
+        add_sweep_options(parser)
         grp = parser.add_argument_group("Output options")
         grp.add_argument("-o", "--output-dir", dest="output_dir", 
                          default=self.output_dir,
@@ -172,6 +298,28 @@ class RunConfig(object):
                          default=self.create_bedgraph,
                          help="Produce bedgraph output files "
                          "[default=%(default)s]")
+        grp.add_argument("--bigwig", action="store_true", 
+                         dest="create_bigwig", 
+                         default=self.create_bigwig,
+                         help="Produce bigWig coverage files (requires "
+                         "--chrom-sizes) [default=%(default)s]")
+        grp.add_argument("--bigbed", action="store_true", 
+                         dest="create_bigbed", 
+                         default=self.create_bigbed,
+                         help="Produce bigBed file from BED output "
+                         "(requires --chrom-sizes) [default=%(default)s]")
+        grp.add_argument("--chrom-sizes", dest="chrom_sizes_file",
+                         default=self.chrom_sizes_file, metavar="FILE",
+                         help="Tab-delimited file of chromosome names "
+                         "and sizes used to create bigWig and bigBed "
+                         "files")
+        grp.add_argument("--snapshot", action="store_true", 
+                         dest="create_snapshot", 
+                         default=self.create_snapshot,
+                         help="Save the transcript graphs of each locus "
+                         "to file '%s' so that assembly can be re-run "
+                         "with the 'assemble_snapshot' program "
+                         "[default=%%(default)s]" % (SNAPSHOT_FILE))
         parser.add_argument("gtf_input_file")
         # parse command line
         args = parser.parse_args()
@@ -194,6 +342,14 @@ class RunConfig(object):
             parser.error("fraction_major_isoform out of range (0.0-1.0)")
         if (args.max_paths < 1):
             parser.error("max_paths <= 0")
+        if args.create_bigwig or args.create_bigbed:
+            if args.chrom_sizes_file is None:
+                parser.error("--chrom-sizes required for bigWig and "
+                             "bigBed output")
+            if not os.path.exists(args.chrom_sizes_file):
+                parser.error("chrom sizes file %s not found" % 
+                             (args.chrom_sizes_file))
+        sweep_values = parse_sweep_options(parser, args)
         # update config attributes
         self.verbose = args.verbose
         self.num_processors = args.num_processors
@@ -205,14 +361,29 @@ class RunConfig(object):
         self.trim_utr_fraction = args.trim_utr_fraction
         self.trim_intron_fraction = args.trim_intron_fraction
         self.guided = args.guided
+        self.stranded_loci = args.stranded_loci
         self.kmax = args.kmax
         self.ksensitivity = args.ksensitivity
         self.fraction_major_isoform = args.fraction_major_isoform
         self.max_paths = args.max_paths
+        self.isoform_mode = args.isoform_mode
         self.output_dir = args.output_dir
         self.create_gtf = args.create_gtf
         self.create_bed = args.create_bed
         self.create_bedgraph = args.create_bedgraph
+        self.create_bigwig = args.create_bigwig
+        # bigBed file is created from the BED output
+        self.create_bigbed = args.create_bigbed
+        self.create_bed = args.create_bed or args.create_bigbed
+        if args.chrom_sizes_file is not None:
+            self.chrom_sizes_file = os.path.abspath(args.chrom_sizes_file)
+        self.create_snapshot = args.create_snapshot
+        self.resume = args.resume
+        if args.cache_dir is not None:
+            self.cache_dir = os.path.abspath(args.cache_dir)
+        self.sweep_kmax = sweep_values['sweep_kmax']
+        self.sweep_fraction_major_isoform = sweep_values['sweep_fraction_major_isoform']
+        self.sweep_max_paths = sweep_values['sweep_max_paths']
     
     def log(self, logging_func=logging.info):
         logging.info("AssemblyLine version %s" % (assemblyline.__version__))
@@ -225,18 +396,107 @@ class RunConfig(object):
         logging.info("trim utr fraction:       %f" % (self.trim_utr_fraction))
         logging.info("trim intron fraction:    %f" % (self.trim_intron_fraction))
         logging.info("guided:                  %s" % (self.guided))
+        logging.info("stranded loci:           %s" % (self.stranded_loci))
         logging.info("kmax:                    %d" % (self.kmax))
         logging.info("ksensitivity:            %f" % (self.ksensitivity))
         logging.info("fraction major isoform:  %f" % (self.fraction_major_isoform))
         logging.info("max paths:               %d" % (self.max_paths))
+        logging.info("isoform mode:            %s" % (self.isoform_mode))
         logging.info("output directory:        %s" % (self.output_dir))
         logging.info("bed:                     %s" % str(self.create_bed))
         logging.info("bedgraph                 %s" % str(self.create_bedgraph))
+        logging.info("bigwig:                  %s" % str(self.create_bigwig))
+        logging.info("bigbed:                  %s" % str(self.create_bigbed))
+        if self.chrom_sizes_file is not None:
+            logging.info("chrom sizes:             %s" % (self.chrom_sizes_file))
         logging.info("gtf:                     %s" % str(self.create_gtf))
+        logging.info("snapshot:                %s" % str(self.create_snapshot))
         logging.info("verbose:                 %s" % str(self.verbose))
         logging.info("num_processors:          %d" % (self.num_processors))        
+        logging.info("resume:                  %s" % str(self.resume))
+        logging.info("cache directory:         %s" % str(self.cache_dir))
+        if self.is_sweep():
+            logging.info("sweep kmax:              %s" % str(self.sweep_kmax))
+            logging.info("sweep frac major isoform:%s" % str(self.sweep_fraction_major_isoform))
+            logging.info("sweep max paths:         %s" % str(self.sweep_max_paths))
         logging.info("----------------------------------")
 
+    def checkpoint_fields(self):
+        '''
+        settings that must be unchanged in order to resume a run
+        '''
+        input_file = os.path.abspath(self.gtf_input_file)
+        fields = [('gtf_input_file', input_file),
+                  ('gtf_input_size', os.path.getsize(input_file)),
+                  ('gtf_input_mtime', int(os.path.getmtime(input_file)))]
+        for attr in ('scoring_mode', 'gtf_score_attr',
+                     'min_transcript_length', 'min_trim_length',
+                     'trim_utr_fraction', 'trim_intron_fraction',
+                     'guided', 'stranded_loci', 'kmax', 'ksensitivity',
+                     'fraction_major_isoform', 'max_paths',
+                     'isoform_mode', 'create_gtf', 'create_bed', 'create_bedgraph',
+                     'create_bigwig', 'create_bigbed', 'chrom_sizes_file',
+                     'create_snapshot', 'sweep_kmax', 'sweep_fraction_major_isoform',
+                     'sweep_max_paths'):
+            fields.append((attr, getattr(self, attr)))
+        return [(k, str(v)) for k,v in fields]
+
+    def snapshot_fields(self):
+        '''
+        settings used to build the transcript graphs saved in a snapshot
+        '''
+        fields = [('gtf_input_file', os.path.abspath(self.gtf_input_file))]
+        fields.extend((attr, str(getattr(self, attr))) for attr in 
+                      ('scoring_mode', 'gtf_score_attr',
+                       'min_transcript_length', 'min_trim_length',
+                       'trim_utr_fraction', 'trim_intron_fraction', 
+                       'guided', 'stranded_loci'))
+        return fields
+
+    def create_coverage(self):
+        '''
+        workers write coverage of each locus when bedgraph or bigwig 
+        output is requested
+        '''
+        return self.create_bedgraph or self.create_bigwig
+
+    def locus_attr_names(self):
+        '''
+        transcript attributes used by the workers.  other attributes are
+        dropped when loci are encoded for the workers
+        '''
+        attr_names = [GTFAttr.TRANSCRIPT_ID, GTFAttr.REF]
+        if self.scoring_mode == "gtf_attr":
+            attr_names.append(self.gtf_score_attr)
+        return attr_names
+
+    def is_sweep(self):
+        return ((self.sweep_kmax is not None) or 
+                (self.sweep_fraction_major_isoform is not None) or
+                (self.sweep_max_paths is not None))
+
+    def get_param_configs(self):
+        '''
+        returns list of (name, config) tuples with a copy of this config
+        for each combination of the parameter sweep values.  name is
+        used to label the output of the combination.  when parameters
+        are not being swept the list contains (None, self) only
+        '''
+        if not self.is_sweep():
+            return [(None, self)]
+        param_configs = []
+        for kmax in (self.sweep_kmax or [self.kmax]):
+            for frac in (self.sweep_fraction_major_isoform or 
+                         [self.fraction_major_isoform]):
+                for max_paths in (self.sweep_max_paths or [self.max_paths]):
+                    c = copy.copy(self)
+                    c.kmax = kmax
+                    c.fraction_major_isoform = frac
+                    c.max_paths = max_paths
+                    name = 'k%d_f%s_p%d' % (kmax, repr(frac), max_paths)
+                    param_configs.append((name, c))
+        return param_configs
+
 def get_gtf_features(chrom, strand, exons, locus_id, gene_id, tss_id, 
                      transcript_id, score, frac):
     tx_start = exons[0].start
@@ -343,17 +603,9 @@ def annotate_gene_and_tss_ids(path_info_list, strand,
         for i in indexes:
             path_info_list[i].gene_id = gene_id
 
-def assemble_gene(locus_chrom, locus_id_str, 
-                  gene_id_value_obj, tss_id_value_obj, t_id_value_obj,
-                  G, strand, partial_paths, 
-                  config, gtf_fileh, bed_fileh):
-    # run assembly algorithm
-    path_info_list = assemble_transcript_graph(G, strand, partial_paths,
-                                               config.kmax,
-                                               config.ksensitivity,
-                                               config.fraction_major_isoform,
-                                               config.max_paths)
-    logging.debug("\tAssembled %d transcript(s)" % (len(path_info_list)))
+def write_gene(locus_chrom, locus_id_str, 
+               gene_id_value_obj, tss_id_value_obj, t_id_value_obj,
+               strand, path_info_list, config, gtf_fileh, bed_fileh):
     # determine gene ids and tss ids
     annotate_gene_and_tss_ids(path_info_list, strand,
                               gene_id_value_obj,
@@ -392,15 +644,111 @@ def assemble_gene(locus_chrom, locus_id_str,
                                    int(round(1000.0*frac)), p.path)
                 print >>bed_fileh, '\t'.join(fields)    
 
+class AssemblyOutput(object):
+    """
+    output files and id counters for one set of assembly parameters
+    """
+    def __init__(self, config, gene_id_value_obj, tss_id_value_obj, 
+                 t_id_value_obj, gtf_fileh=None, bed_fileh=None):
+        self.config = config
+        self.gene_id_value_obj = gene_id_value_obj
+        self.tss_id_value_obj = tss_id_value_obj
+        self.t_id_value_obj = t_id_value_obj
+        self.gtf_fileh = gtf_fileh
+        self.bed_fileh = bed_fileh
+
+def assemble_locus_graphs(locus_chrom, transcripts, config, 
+                          param_configs=None, graph_callback=None):
+    """
+    builds and assembles the transcript graphs of a locus.  graphs are 
+    built once using the settings in 'config' and then assembled using
+    the kmax, fraction major isoform, and max paths settings of each
+    config in 'param_configs' (defaults to 'config' alone).  k-mer 
+    graphs are shared between parameter sets with the same range of k.
+    'graph_callback' is called with the list of transcript graphs 
+    before they are assembled.
+
+    returns a tuple (bedgraph_data, results) where bedgraph_data is a 
+    list containing the bedgraph text for each strand and results 
+    contains a list of (strand, path_info_list) tuples for each config
+    in 'param_configs'
+    """
+    if param_configs is None:
+        param_configs = [config]
+    bedgraph_bufs = [cStringIO.StringIO() for strand in xrange(0,3)]
+    # build transcript graphs
+    transcript_graphs = \
+        create_transcript_graphs(locus_chrom, transcripts, 
+                                 min_trim_length=config.min_trim_length, 
+                                 trim_utr_fraction=config.trim_utr_fraction,
+                                 trim_intron_fraction=config.trim_intron_fraction,
+                                 create_bedgraph=config.create_coverage(),
+                                 bedgraph_filehs=bedgraph_bufs)
+    if graph_callback is not None:
+        graph_callback(transcript_graphs)
+    results = assemble_graphs(locus_chrom, transcript_graphs, param_configs)
+    bedgraph_data = [buf.getvalue() for buf in bedgraph_bufs]
+    return bedgraph_data, results
+
+def assemble_graphs(locus_chrom, transcript_graphs, param_configs):
+    """
+    runs k-mer graph construction and path finding on a list of
+    TranscriptGraph objects for each config in 'param_configs'
+
+    returns a list with (strand, path_info_list) tuples for each config
+    """
+    results = [[] for c in param_configs]
+    for tg in transcript_graphs:
+        logging.debug("Subgraph %s(%s) %d nodes %d paths" %
+                       (locus_chrom, strand_int_to_str(tg.strand), 
+                        len(tg.Gsub), len(tg.partial_paths)))
+        partial_paths = tg.partial_paths
+        kmer_graphs = {}
+        for i,c in enumerate(param_configs):
+            # build k-mer graph or reuse one built for other parameters
+            krange = get_kmer_range(partial_paths, c.kmax, c.ksensitivity)
+            if krange not in kmer_graphs:
+                kmin, kmax = krange
+                kmer_graphs[krange] = build_kmer_graph(tg.Gsub, 
+                                                       partial_paths,
+                                                       kmin, kmax, 
+                                                       c.ksensitivity)
+            K, k = kmer_graphs[krange]
+            # run path finding algorithm
+            path_info_list = find_transcript_paths(tg.Gsub, K, tg.strand,
+                                                   c.fraction_major_isoform,
+                                                   c.max_paths,
+                                                   c.isoform_mode)
+            logging.debug("\tAssembled %d transcript(s) with k=%d" % 
+                          (len(path_info_list), k))
+            results[i].append((tg.strand, path_info_list))
+        del kmer_graphs
+    return results
+
+def write_locus_results(locus_chrom, locus_id_str, outputs, results):
+    for output, param_results in zip(outputs, results):
+        for strand, path_info_list in param_results:
+            write_gene(locus_chrom, locus_id_str, 
+                       output.gene_id_value_obj,
+                       output.tss_id_value_obj,
+                       output.t_id_value_obj,
+                       strand, path_info_list,
+                       output.config,
+                       output.gtf_fileh,
+                       output.bed_fileh)
+
 def assemble_locus(transcripts,
                    locus_id_value_obj,
-                   gene_id_value_obj,
-                   tss_id_value_obj,
-                   t_id_value_obj,
                    config,
-                   gtf_fileh,
-                   bed_fileh,
-                   bedgraph_filehs):
+                   outputs,
+                   bedgraph_filehs,
+                   cache=None,
+                   graph_callback=None):
+    """
+    assembles a locus and writes the results to each AssemblyOutput in
+    'outputs'.  cached results are not used when 'graph_callback' is
+    set because the callback needs the transcript graphs
+    """
     # gather properties of locus
     locus_chrom = transcripts[0].chrom
     locus_start = transcripts[0].start
@@ -414,58 +762,154 @@ def assemble_locus(transcripts,
     transcripts = filter_transcripts(transcripts, 
                                      config.min_transcript_length,
                                      config.guided)
-    # build transcript graphs
-    transcript_graphs = \
-        create_transcript_graphs(locus_chrom, transcripts, 
-                                 min_trim_length=config.min_trim_length, 
-                                 trim_utr_fraction=config.trim_utr_fraction,
-                                 trim_intron_fraction=config.trim_intron_fraction,
-                                 create_bedgraph=config.create_bedgraph,
-                                 bedgraph_filehs=bedgraph_filehs)    
-    for tg in transcript_graphs:
-        logging.debug("Subgraph %s:%d-%d(%s) %d nodes %d paths" %
-                       (locus_chrom, locus_start, locus_end,
-                        strand_int_to_str(tg.strand), len(tg.Gsub),
-                        len(tg.partial_paths)))
-        # assemble subgraph
-        assemble_gene(locus_chrom, locus_id_str, 
-                      gene_id_value_obj,
-                      tss_id_value_obj,
-                      t_id_value_obj,
-                      tg.Gsub, tg.strand, tg.partial_paths, 
-                      config,
-                      gtf_fileh,
-                      bed_fileh)
-
-def assembly_worker(input_queue, 
-                    locus_id_value_obj,
-                    gene_id_value_obj,
-                    tss_id_value_obj,
-                    t_id_value_obj,
-                    worker_prefix,
-                    config):
-    # setup output files
-    gtf_fileh = None
-    bed_fileh = None
-    bedgraph_filehs = [None, None, None]
-    if config.create_gtf:
-        gtf_fileh = open(worker_prefix + ".gtf", "w")
-    if config.create_bed:
-        bed_fileh = open(worker_prefix + ".bed", "w")
-    if config.create_bedgraph:
+    param_configs = [output.config for output in outputs]
+    # lookup locus in cache or assemble locus
+    cached = None
+    if cache is not None:
+        keys = [locus_cache_key(transcripts, c) for c in param_configs]
+    if (cache is not None) and (graph_callback is None):
+        cached = [cache.get(key) for key in keys]
+        if any(x is None for x in cached):
+            cached = None
+    if cached is not None:
+        results = []
+        for bedgraph_data, packed_results in cached:
+            results.append([(strand, unpack_path_info_list(packed))
+                            for strand, packed in packed_results])
+    else:
+        bedgraph_data, results = \
+            assemble_locus_graphs(locus_chrom, transcripts, config,
+                                  param_configs, graph_callback)
+        if cache is not None:
+            for key, param_results in zip(keys, results):
+                packed_results = [(strand, pack_path_info_list(path_info_list))
+                                  for strand, path_info_list in param_results]
+                cache.put(key, (bedgraph_data, packed_results))
+    # write output
+    if config.create_coverage():
+        for strand, data in enumerate(bedgraph_data):
+            bedgraph_filehs[strand].write(data)
+    write_locus_results(locus_chrom, locus_id_str, outputs, results)
+
+def get_param_prefix(prefix, name):
+    if name is None:
+        return prefix
+    return '%s.%s' % (prefix, name)
+
+def get_worker_files(worker_prefix, config):
+    """
+    returns list of output files written by a worker in the order
+    that their offsets are recorded in the worker journal
+    """
+    filenames = []
+    for name, param_config in config.get_param_configs():
+        param_prefix = get_param_prefix(worker_prefix, name)
+        if config.create_gtf:
+            filenames.append(param_prefix + ".gtf")
+        if config.create_bed:
+            filenames.append(param_prefix + ".bed")
+    if config.create_coverage():
         for strand in xrange(0,3):
-            filename = '%s_%s.bedgraph' % (worker_prefix, 
-                                           STRAND_NAMES[strand])
-            fileh = open(filename, 'w')
-            bedgraph_filehs[strand] = fileh
-    # process input
-    while True:
-        lines = input_queue.get()
-        if len(lines) == 0:
-            break
-        transcripts = transcripts_from_gtf_lines(lines)
+            filenames.append('%s_%s.bedgraph' % (worker_prefix, 
+                                                 STRAND_NAMES[strand]))
+    if config.create_snapshot:
+        filenames.append(worker_prefix + SNAPSHOT_SUFFIX)
+        filenames.append(worker_prefix + SNAPSHOT_SUFFIX + SNAPSHOT_INDEX_SUFFIX)
+    return filenames
+
+def get_degraded_config(config):
+    """
+    returns copy of config with settings that reduce the time and memory
+    needed to assemble a locus, used when retrying a failed locus
+    """
+    degraded_config = copy.copy(config)
+    degraded_config.kmax = min(config.kmax, DEGRADED_KMAX) or DEGRADED_KMAX
+    degraded_config.ksensitivity = 0.0
+    degraded_config.max_paths = min(config.max_paths, DEGRADED_MAX_PATHS)
+    return degraded_config
+
+class AssemblyWorker(WorkerHandler):
+    def __init__(self, worker_prefix, config,
+                 locus_id_value_obj,
+                 param_id_value_objs,
+                 restarted=False):
+        """
+        param_id_value_objs: list of (gene, tss, transcript) id counters 
+        for each set of parameters returned by config.get_param_configs()
+        """
+        self.config = config
+        self.degraded_config = get_degraded_config(config)
+        self.locus_id_value_obj = locus_id_value_obj
+        journal_file = worker_prefix + JOURNAL_SUFFIX
+        if restarted:
+            # discard partial output of the locus that was running when
+            # the previous worker process died
+            recover_journal(journal_file, 
+                            get_worker_files(worker_prefix, config))
+        # when resuming, output files have already been truncated to the 
+        # last completed locus and new output is appended
+        mode = "a" if (config.resume or restarted) else "w"
+        # setup output files in the same order as get_worker_files()
+        self.filehs = []
+        self.outputs = []
+        self.degraded_outputs = []
+        for (name, param_config), id_value_objs in \
+            zip(config.get_param_configs(), param_id_value_objs):
+            param_prefix = get_param_prefix(worker_prefix, name)
+            gtf_fileh = None
+            bed_fileh = None
+            if config.create_gtf:
+                gtf_fileh = open(param_prefix + ".gtf", mode)
+                self.filehs.append(gtf_fileh)
+            if config.create_bed:
+                bed_fileh = open(param_prefix + ".bed", mode)
+                self.filehs.append(bed_fileh)
+            self.outputs.append(AssemblyOutput(param_config, 
+                                               *id_value_objs,
+                                               gtf_fileh=gtf_fileh,
+                                               bed_fileh=bed_fileh))
+            self.degraded_outputs.append(
+                AssemblyOutput(get_degraded_config(param_config),
+                               *id_value_objs,
+                               gtf_fileh=gtf_fileh,
+                               bed_fileh=bed_fileh))
+        self.bedgraph_filehs = [None, None, None]
+        if config.create_coverage():
+            for strand in xrange(0,3):
+                filename = '%s_%s.bedgraph' % (worker_prefix, 
+                                               STRAND_NAMES[strand])
+                self.bedgraph_filehs[strand] = open(filename, mode)
+                self.filehs.append(self.bedgraph_filehs[strand])
+        self.snapshot = None
+        if config.create_snapshot:
+            self.snapshot = SnapshotWriter(worker_prefix + SNAPSHOT_SUFFIX, 
+                                           mode)
+            self.filehs.extend(self.snapshot.filehs())
+        self.id_value_objs = [locus_id_value_obj]
+        for id_value_objs in param_id_value_objs:
+            self.id_value_objs.extend(id_value_objs)
+        self.journal = LocusJournal(journal_file, self.filehs, mode)
+        self.cache = None
+        if config.cache_dir is not None:
+            self.cache = LocusCache(config.cache_dir)
+
+    def process(self, locus_num, payload, attempt):
+        if attempt > 0:
+            logging.warning("Retrying locus %d with degraded settings" % 
+                            (locus_num))
+            config = self.degraded_config
+            outputs = self.degraded_outputs
+        else:
+            config = self.config
+            outputs = self.outputs
+        self.assemble(locus_num, payload, config, outputs)
+        # record completed locus
+        self.journal.commit(locus_num, [x.value for x in self.id_value_objs])
+
+    def assemble(self, locus_num, payload, config, outputs):
+        transcripts = unpack_locus(payload)
         # conserve memory
-        del lines
+        del payload
         # assign scores to each transcript
         for t in transcripts:
             if config.scoring_mode == "unweighted":
@@ -473,82 +917,43 @@ def assembly_worker(input_queue,
             elif config.scoring_mode == "gtf_attr":
                 score = t.attrs.get(config.gtf_score_attr, '0')
                 t.score = float_check_nan(score)
+        # save transcript graphs
+        graph_callback = None
+        if self.snapshot is not None:
+            locus_chrom = transcripts[0].chrom
+            graph_callback = lambda transcript_graphs: \
+                self.snapshot.write(locus_num, locus_chrom, transcript_graphs)
         # assemble
         assemble_locus(transcripts,
-                       locus_id_value_obj,
-                       gene_id_value_obj,
-                       tss_id_value_obj,
-                       t_id_value_obj,                       
+                       self.locus_id_value_obj,
                        config,
-                       gtf_fileh,
-                       bed_fileh,
-                       bedgraph_filehs)
-        input_queue.task_done()
-    # cleanup output files
-    if config.create_bed:
-        bed_fileh.close()
-    if config.create_gtf:
-        gtf_fileh.close()
-    if config.create_bedgraph:
-        for fileh in bedgraph_filehs:
+                       outputs,
+                       self.bedgraph_filehs,
+                       self.cache,
+                       graph_callback)
+
+    def rollback(self):
+        self.journal.rollback()
+
+    def close(self):
+        if self.cache is not None:
+            logging.debug("Locus cache hits=%d misses=%d" % 
+                          (self.cache.hits, self.cache.misses))
+        self.journal.close()
+        for fileh in self.filehs:
             fileh.close()
-    input_queue.task_done()
 
-def run_parallel(config):
+def merge_worker_output(worker_prefixes, output_dir, tmp_dir, config):
     """
-    runs assembly in parallel and merges output from child processes 
-
-    config: RunConfig object
+    merges the gtf and bed files written by the workers for one set of
+    parameters
     """
-    # create temp directory
-    tmp_dir = os.path.join(config.output_dir, "tmp")
-    if not os.path.exists(tmp_dir):
-        logging.debug("Creating tmp directory '%s'" % (tmp_dir))
-        os.makedirs(tmp_dir)
-    # create queue
-    input_queue = JoinableQueue(maxsize=config.num_processors*3)
-    # shared memory values
-    locus_id_value_obj = LockValue(1)
-    gene_id_value_obj = LockValue(1)
-    tss_id_value_obj = LockValue(1)
-    t_id_value_obj = LockValue(1)
-    # start worker processes
-    procs = []
-    worker_prefixes = []
-    for i in xrange(config.num_processors):
-        worker_prefix = os.path.join(tmp_dir, "worker%03d" % (i))
-        worker_prefixes.append(worker_prefix)
-        args = (input_queue, 
-                locus_id_value_obj,
-                gene_id_value_obj,
-                tss_id_value_obj,
-                t_id_value_obj,
-                worker_prefix,
-                config)
-        p = Process(target=assembly_worker, args=args)
-        p.daemon = True
-        p.start()
-        procs.append(p)
-    # parse gtf file                
-    for lines in parse_loci(open(config.gtf_input_file)):
-        input_queue.put(lines)
-        # conserve memory
-        del lines
-    # stop workers
-    for p in procs:
-        input_queue.put([])
-    # close queue
-    input_queue.join()
-    input_queue.close()
-    # join worker processes
-    for p in procs:
-        p.join()
     # merge gtf files
     if config.create_gtf:
         logging.info("Merging %d worker GTF files" % 
-                     (config.num_processors))
+                     (len(worker_prefixes)))
         worker_gtf_files = [prefix + ".gtf" for prefix in worker_prefixes]
-        output_gtf_file = os.path.join(config.output_dir, "assembly.gtf")
+        output_gtf_file = os.path.join(output_dir, "assembly.gtf")
         merge_sort_gtf_files(worker_gtf_files, output_gtf_file, 
                              tmp_dir=tmp_dir)
         # remove worker gtf files
@@ -558,51 +963,254 @@ def run_parallel(config):
     # merge bed files
     if config.create_bed:
         logging.info("Merging %d worker BED files" % 
-                     (config.num_processors))
+                     (len(worker_prefixes)))
         worker_bed_files = [p + ".bed" for p in worker_prefixes]
-        output_bed_file = os.path.join(config.output_dir, "assembly.bed")
+        output_bed_file = os.path.join(output_dir, "assembly.bed")
         merge_sort_files(worker_bed_files, output_bed_file, 
                          sort_func=sort_bed, 
                          tmp_dir=tmp_dir)
         # write bed file track description line
-        track_name = os.path.basename(config.output_dir)
+        track_name = os.path.basename(output_dir)
         track_line = ' '.join(['track name="%s"' % (track_name),
                                'description="%s"' % (track_name),
                                'visibility=pack',
                                'useScore=1'])
-        track_file = os.path.join(config.output_dir, 
+        track_file = os.path.join(output_dir, 
                                   "assembly.bed.ucsc_track")
         fileh = open(track_file, "w")
         print >>fileh, track_line
         fileh.close()
+        # convert to bigbed
+        if config.create_bigbed:
+            logging.info("Writing bigBed file")
+            write_bigbed(output_bed_file, 
+                         read_chrom_sizes(config.chrom_sizes_file),
+                         os.path.join(output_dir, "assembly.bb"))
+
+def merge_param_outputs(worker_prefixes, tmp_dir, config):
+    """
+    merges the gtf and bed files written by the workers for each set of
+    parameters.  in sweep mode the output of each set of parameters is
+    written to a separate subdirectory
+    """
+    param_configs = config.get_param_configs()
+    for name, param_config in param_configs:
+        if name is None:
+            param_output_dir = config.output_dir
+        else:
+            param_output_dir = os.path.join(config.output_dir, name)
+            if not os.path.exists(param_output_dir):
+                os.makedirs(param_output_dir)
+            logging.info("Merging output for parameters %s" % (name))
+        param_prefixes = [get_param_prefix(p, name) for p in worker_prefixes]
+        merge_worker_output(param_prefixes, param_output_dir, tmp_dir, 
+                            config)
+    if config.is_sweep():
+        write_sweep_index(os.path.join(config.output_dir, SWEEP_INDEX_FILE),
+                          param_configs)
+
+def write_sweep_index(filename, param_configs):
+    fileh = open(filename, "w")
+    print >>fileh, '\t'.join(['name', 'kmax', 'fraction_major_isoform', 
+                              'max_paths'])
+    for name, c in param_configs:
+        print >>fileh, '\t'.join(map(str, [name, c.kmax, 
+                                           c.fraction_major_isoform, 
+                                           c.max_paths]))
+    fileh.close()
+
+def write_checkpoint_file(filename, config):
+    fileh = open(filename, "w")
+    for k,v in config.checkpoint_fields():
+        print >>fileh, '%s\t%s' % (k,v)
+    fileh.close()
+
+def check_checkpoint_file(filename, config):
+    if not os.path.exists(filename):
+        logging.error("Cannot resume: checkpoint file '%s' not found" % 
+                      (filename))
+        return False
+    saved_fields = {}
+    for line in open(filename):
+        k,v = line.rstrip('\n').split('\t', 1)
+        saved_fields[k] = v
+    valid = True
+    for k,v in config.checkpoint_fields():
+        if saved_fields.get(k) != v:
+            logging.error("Cannot resume: setting '%s' changed from '%s' "
+                          "to '%s'" % (k, saved_fields.get(k), v))
+            valid = False
+    return valid
+
+def get_initial_ids(config):
+    '''
+    returns list with the first value of each id counter.  the locus id
+    is followed by the gene, tss, and transcript ids of each parameter
+    set (the same order used by the worker journals)
+    '''
+    return [1] * (1 + 3 * len(config.get_param_configs()))
+
+def recover_workers(tmp_dir, config):
+    """
+    restores worker output files from an interrupted run to the last 
+    completed locus recorded in each worker journal
+
+    returns (worker_prefixes, completed_loci, next_ids) tuple
+    """
+    worker_prefixes = []
+    completed_loci = set()
+    next_ids = get_initial_ids(config)
+    pattern = os.path.join(tmp_dir, "worker*" + JOURNAL_SUFFIX)
+    for journal_file in sorted(glob.glob(pattern)):
+        worker_prefix = journal_file[:-len(JOURNAL_SUFFIX)]
+        worker_files = get_worker_files(worker_prefix, config)
+        entries = recover_journal(journal_file, worker_files)
+        for entry in entries:
+            completed_loci.add(entry.locus_num)
+            next_ids = [max(a,b) for a,b in zip(next_ids, entry.ids)]
+        worker_prefixes.append(worker_prefix)
+    return worker_prefixes, completed_loci, next_ids
+
+def run_parallel(config):
+    """
+    runs assembly in parallel and merges output from child processes 
+
+    config: RunConfig object
+    """
+    # create temp directory
+    tmp_dir = os.path.join(config.output_dir, "tmp")
+    if not os.path.exists(tmp_dir):
+        logging.debug("Creating tmp directory '%s'" % (tmp_dir))
+        os.makedirs(tmp_dir)
+    checkpoint_file = os.path.join(tmp_dir, CHECKPOINT_FILE)
+    if config.resume:
+        # restore worker output from previous run
+        if not check_checkpoint_file(checkpoint_file, config):
+            return 1
+        old_worker_prefixes, completed_loci, next_ids = \
+            recover_workers(tmp_dir, config)
+        logging.info("Resuming run with %d loci completed" % 
+                     (len(completed_loci)))
+    else:
+        # remove journals left behind by previous runs
+        for filename in glob.glob(os.path.join(tmp_dir, "worker*" + 
+                                               JOURNAL_SUFFIX)):
+            os.remove(filename)
+        write_checkpoint_file(checkpoint_file, config)
+        old_worker_prefixes = []
+        completed_loci = set()
+        next_ids = get_initial_ids(config)
+    # loci that failed in a previous run are not retried
+    quarantine = LocusQuarantine(
+        os.path.join(config.output_dir, QUARANTINE_GTF_FILE),
+        os.path.join(config.output_dir, QUARANTINE_INDEX_FILE),
+        config.resume)
+    skip_loci = completed_loci.union(quarantine.loci)
+    # shared memory values
+    param_configs = config.get_param_configs()
+    locus_id_value_obj = LockValue(next_ids[0])
+    param_id_value_objs = []
+    for i in xrange(len(param_configs)):
+        param_id_value_objs.append(tuple(LockValue(x) for x in 
+                                         next_ids[1+3*i:4+3*i]))
+    # setup worker output
+    worker_prefixes = []
+    for i in xrange(config.num_processors):
+        worker_prefix = os.path.join(tmp_dir, "worker%03d" % (i))
+        worker_prefixes.append(worker_prefix)
+        if config.resume and (worker_prefix not in old_worker_prefixes):
+            # create empty output for workers added since last run
+            for filename in get_worker_files(worker_prefix, config):
+                open(filename, "w").close()
+    def handler_factory(worker_id, restarted):
+        return AssemblyWorker(worker_prefixes[worker_id], config,
+                              locus_id_value_obj,
+                              param_id_value_objs,
+                              restarted)
+    # output from workers of a previous run that are not restarted
+    # (when fewer processors are used) must also be merged
+    worker_prefixes.extend(x for x in old_worker_prefixes
+                           if x not in worker_prefixes)
+    # parse gtf file and run workers
+    if config.stranded_loci:
+        parse_func = parse_stranded_loci
+    else:
+        parse_func = parse_loci
+    # loci are sent to workers in binary form
+    attr_names = config.locus_attr_names()
+    def locus_iter():
+        for locus_num, lines in enumerate(parse_func(open(config.gtf_input_file))):
+            if locus_num in skip_loci:
+                continue
+            yield locus_num, pack_locus(lines, attr_names)
+    def quarantine_func(locus_num, payload, reason):
+        quarantine(locus_num, unpack_locus_lines(payload), reason)
+    pool = SupervisedPool(config.num_processors, handler_factory, 
+                          quarantine_func=quarantine_func)
+    pool.run(locus_iter())
+    if len(quarantine.loci) > 0:
+        logging.warning("%d loci could not be assembled and were written "
+                        "to %s" % (len(quarantine.loci), quarantine.gtf_file))
+    # merge gtf and bed files for each set of parameters
+    merge_param_outputs(worker_prefixes, tmp_dir, config)
+    # merge transcript graph snapshots
+    if config.create_snapshot:
+        logging.info("Merging %d worker snapshot files" % 
+                     (len(worker_prefixes)))
+        snapshot_files = [p + SNAPSHOT_SUFFIX for p in worker_prefixes]
+        merge_snapshots(snapshot_files, 
+                        os.path.join(config.output_dir, SNAPSHOT_FILE),
+                        config.snapshot_fields())
     # merge bedgraph files
-    if config.create_bedgraph:
+    if config.create_coverage():
         logging.info("Merging %d worker bedGraph files" % 
-                     (config.num_processors))
+                     (len(worker_prefixes)))
+        if config.create_bigwig:
+            chrom_sizes = read_chrom_sizes(config.chrom_sizes_file)
+        # worker files are merged without sorting only when each worker
+        # received its loci in order.  loci on opposite strands overlap
+        # so the coverage of consecutive stranded loci is not ordered, 
+        # retried loci are written after later loci, and resumed runs
+        # append the remaining loci after loci that already finished
+        presorted = not (config.stranded_loci or config.resume or
+                         (pool.num_failures > 0) or 
+                         (pool.num_restarts > 0))
         for strand in xrange(0,3):
             strand_name = STRAND_NAMES[strand]
             bgfiles = ['%s_%s.bedgraph' % (p, strand_name)
                        for p in worker_prefixes]
-            output_file = os.path.join(config.output_dir, 
-                                       "assembly_%s.bedgraph" % strand_name)
-            merge_sort_files(bgfiles, output_file, 
-                             sort_func=sort_bed, 
-                             tmp_dir=tmp_dir)
+            if not presorted:
+                for filename in bgfiles:
+                    sort_bed(filename, filename + ".sorted", tmp_dir)
+                    shutil.move(filename + ".sorted", filename)
             track_name = '%s_%s' % (os.path.basename(config.output_dir), 
                                     strand_name)
-            track_line = ' '.join(['track type=bedGraph',
-                                   'name="%s"' % (track_name),
-                                   'description="%s"' % (track_name),
-                                   'visibility=full',
-                                   'color=%s' % (STRAND_COLORS[strand]),
-                                   'autoScale=on',
-                                   'alwaysZero=on',
-                                   'maxHeightPixels=64:64:11'])
-            track_file = os.path.join(config.output_dir, 
-                                      "assembly_%s.bedgraph.ucsc_track" % strand_name)
-            fileh = open(track_file, "w")
-            print >>fileh, track_line
-            fileh.close()
+            track_options = ['name="%s"' % (track_name),
+                             'description="%s"' % (track_name),
+                             'visibility=full',
+                             'color=%s' % (STRAND_COLORS[strand]),
+                             'autoScale=on',
+                             'alwaysZero=on',
+                             'maxHeightPixels=64:64:11']
+            output_files = []
+            if config.create_bedgraph:
+                output_file = os.path.join(config.output_dir, 
+                                           "assembly_%s.bedgraph" % strand_name)
+                merge_bedgraph_files(bgfiles, output_file)
+                output_files.append((output_file, 'bedGraph'))
+            if config.create_bigwig:
+                # worker files are merged directly into the bigwig file
+                output_file = os.path.join(config.output_dir, 
+                                           "assembly_%s.bw" % strand_name)
+                write_bigwig(lambda: merge_bedgraph_records(bgfiles),
+                             chrom_sizes, output_file)
+                output_files.append((output_file, 'bigWig'))
+            for output_file, track_type in output_files:
+                track_line = ' '.join(['track type=%s' % (track_type)] + 
+                                      track_options)
+                fileh = open(output_file + ".ucsc_track", "w")
+                print >>fileh, track_line
+                fileh.close()
     # cleanup
     if os.path.exists(tmp_dir):
         shutil.rmtree(tmp_dir)
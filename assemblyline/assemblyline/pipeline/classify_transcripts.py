@@ -23,57 +23,28 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import logging
 import argparse
 import os
-import subprocess
 import sys
 import multiprocessing
 import collections
+import itertools
+import traceback
+
+import numpy as np
 
 import assemblyline
 import assemblyline.lib.config as config
-from assemblyline.lib.transcript import parse_gtf
-from assemblyline.lib.base import CategoryStats, Category, \
-    GTFAttr, check_executable, BufferedFileSplitter
+from assemblyline.lib.base import CategoryStats, GTFAttr, \
+    FileSplitter
 from assemblyline.lib.gtf import GTFFeature, merge_sort_gtf_files
+from assemblyline.lib.classify import LibraryFeatures, PooledModel, \
+    classify_features, decide, r_str, sample_features, train_pooled_model
 
-# R script to call for classifying transcripts
-_module_dir = assemblyline.__path__[0]
-CLASSIFY_R_SCRIPT = os.path.join(_module_dir, "lib", "classify_transcripts.R")
-DInfo = collections.namedtuple('DecisionInfo', ['pred', 'log10lr', 'is_test'])
-
-
-def get_classify_header_fields():
-    header = ["chrom", "start", "library_id", "t_id", "category", 
-              "test", "ann_ref_id", "ann_cov_ratio", "ann_intron_ratio", 
-              "mean_recurrence", "score", "pctrank", "length", "num_exons"]
-    return header
-
-def get_classify_fields(t):
-    # setup list of annotation fields
-    fields = [t.chrom,
-              t.start,
-              t.attrs[GTFAttr.LIBRARY_ID],
-              t.attrs[GTFAttr.TRANSCRIPT_ID],
-              t.attrs[GTFAttr.CATEGORY],
-              t.attrs[GTFAttr.TEST],
-              t.attrs[GTFAttr.ANN_REF_ID],
-              t.attrs[GTFAttr.ANN_COV_RATIO],
-              t.attrs[GTFAttr.ANN_INTRON_RATIO],
-              t.attrs[GTFAttr.MEAN_RECURRENCE],
-              t.attrs[GTFAttr.SCORE],
-              t.attrs[GTFAttr.PCTRANK],
-              t.length,
-              len(t.exons)]
-    return fields
+# densities of the pooled classifier
+POOLED_MODEL_FILE = "pooled_model.npz"
+# maximum number of transcripts of each class sampled from a library
+# to train the pooled classifier
+POOLED_MAX_SAMPLES = 20000
 
-def write_transcript_table(gtf_file, table_file):
-    fileh = open(table_file, 'w')
-    print >>fileh, '\t'.join(get_classify_header_fields())
-    for transcripts in parse_gtf(open(gtf_file)):
-        for t in transcripts:
-            fields = get_classify_fields(t)
-            print >>fileh, '\t'.join(map(str, fields))
-    fileh.close()
-    
 def read_classify_info(filename):
     field_dict = {}
     for line in open(filename):
@@ -81,111 +52,129 @@ def read_classify_info(filename):
         field_dict[fields[0]] = fields[1:]
     return field_dict
 
-def read_classify_decisions(filename):
-    fileh = open(filename)
-    header_fields = fileh.next().strip().split('\t')
-    t_id_ind = header_fields.index('t_id')
-    category_ind = header_fields.index('category')
-    test_ind = header_fields.index('test')
-    num_exons_ind = header_fields.index('num_exons')
-    log10lr_intronic_ind = header_fields.index('log10lr.intronic')
-    log10lr_intergenic_ind = header_fields.index('log10lr.intergenic')
-    #intronic_pred_ind = header_fields.index("pred.train.intronic")
-    intergenic_pred_ind = header_fields.index("pred.train.intergenic")
-    decision_dict = {}
-    for line in fileh:
-        fields = line.strip().split('\t')
-        t_id = fields[t_id_ind]
-        category = int(fields[category_ind])
-        is_test = bool(int(fields[test_ind]))
-        multi_exon = int(fields[num_exons_ind]) > 1        
-        if is_test or category == Category.SAME_STRAND:
-            intronic_log10lr = fields[log10lr_intronic_ind]
-            intergenic_log10lr = fields[log10lr_intergenic_ind]
-            if intronic_log10lr == "NA" and intergenic_log10lr == "NA":
-                log10lr = "NA"
-            elif intronic_log10lr != "NA" and intergenic_log10lr != "NA":
-                log10lr = str(max(intronic_log10lr, intergenic_log10lr))
-            elif intergenic_log10lr != "NA":
-                log10lr = intergenic_log10lr
-            else:
-                log10lr = intronic_log10lr
-            pred = True
-        elif category in Category.INTRONIC_LIKE:
-            if multi_exon:
-                pred = True
-            else:
-                # For now do not allow single exon intronic same-stranded 
-                # transcripts
-                pred = False
-                #pred = fields[intronic_pred_ind] == "TRUE"
-            log10lr = fields[log10lr_intronic_ind]
-        elif category in Category.INTERGENIC_LIKE:
-            pred = multi_exon
-            if multi_exon:
-                pred = True
-            else:
-                pred = fields[intergenic_pred_ind] == "TRUE"
-            log10lr = fields[log10lr_intergenic_ind]
-        decision_dict[t_id] = DInfo(pred=pred,
-                                    log10lr=log10lr,
-                                    is_test=is_test)
-    fileh.close()
-    return decision_dict 
+def sample_library_transcripts(args):
+    library_id, output_dir, max_samples, seed = args
+    input_gtf_file = os.path.join(output_dir, library_id + ".gtf")
+    try:
+        features = LibraryFeatures.from_gtf(input_gtf_file)
+        random_state = np.random.RandomState(seed)
+        samples = sample_features(features, max_samples, random_state)
+    except Exception:
+        logging.error("[FAILED]   library_id='%s'\n%s" % 
+                      (library_id, traceback.format_exc()))
+        return 1, library_id, None, None
+    lims = None
+    if len(features) > 0:
+        x = features.mean_recurrence
+        y = features.pctrank
+        lims = (x.min(), x.max(), y.min(), y.max())
+    return 0, library_id, samples, lims
+
+def train_pooled_classifier(results, num_processors, max_samples):
+    # read library category statistics
+    stats_list = list(CategoryStats.from_file(results.category_stats_file))
+    # sample transcripts from each library
+    tasks = []
+    for i, statsobj in enumerate(stats_list):
+        tasks.append((statsobj.library_id, results.classify_dir, 
+                      max_samples, i))
+    # samples are collected in library order so that the model does not
+    # depend on the order in which libraries finish
+    pool = multiprocessing.Pool(processes=num_processors)
+    result_iter = pool.imap(sample_library_transcripts, tasks)
+    errors = False
+    samples_list = []
+    lims = None
+    for retcode, library_id, samples, library_lims in result_iter:
+        if retcode != 0:
+            errors = True
+            continue
+        samples_list.append(samples)
+        if library_lims is None:
+            continue
+        if lims is None:
+            lims = library_lims
+        else:
+            lims = (min(lims[0], library_lims[0]), 
+                    max(lims[1], library_lims[1]),
+                    min(lims[2], library_lims[2]), 
+                    max(lims[3], library_lims[3]))
+    pool.close()
+    pool.join()
+    if errors:
+        logging.error("Errors occurred while sampling transcripts")
+        return 1
+    if lims is None:
+        logging.error("No transcripts found to train classifier")
+        return 1
+    # estimate densities
+    logging.info("Training pooled classifier on %d libraries" % 
+                 (len(samples_list)))
+    model = train_pooled_model(samples_list, lims)
+    for name in ("intronic", "intergenic"):
+        if model.has_class(name):
+            logging.debug("Pooled %s cutoff: %f" % 
+                          (name, model.cutoffs[name]))
+        else:
+            logging.warning("Not enough transcripts for pooled %s "
+                            "classification" % (name))
+    model.to_file(os.path.join(results.classify_dir, POOLED_MODEL_FILE))
+    return 0
 
 def classify_library_transcripts(args):
-    library_id, output_dir = args
+    library_id, output_dir, model_file = args
     prefix = os.path.join(output_dir, library_id)
     # input files
     input_gtf_file = prefix + ".gtf"
-    logfile = prefix + ".log"
-    tablefile = prefix + '.inp.txt'
     # output files
     #info_file = prefix + ".info.txt"
-    output_res_file = prefix + ".out.txt"
     expr_gtf_file = prefix + ".expr.gtf"
     bkgd_gtf_file = prefix + ".bkgd.gtf"
-    # write table of observations
     logging.debug("[STARTED]  library_id='%s'" % (library_id))
-    write_transcript_table(input_gtf_file, tablefile)
-    # run R script to do classification
-    logfh = open(logfile, "w")
-    retcode = subprocess.call(["Rscript", "--vanilla",
-                               CLASSIFY_R_SCRIPT, 
-                               prefix], 
-                              stdout=logfh, stderr=logfh)
-    logfh.close()
-    if retcode != 0:
-        logging.error("[FAILED]   library_id='%s'" % (library_id))
-        return retcode, library_id
+    # read transcript features and do classification
+    try:
+        features = LibraryFeatures.from_gtf(input_gtf_file)
+        model = None
+        if model_file is not None:
+            model = PooledModel.from_file(model_file)
+        results = classify_features(features, prefix, model=model)
+    except Exception:
+        logging.error("[FAILED]   library_id='%s'\n%s" % 
+                      (library_id, traceback.format_exc()))
+        return 1, library_id
+    retcode = 0
     # get library stats
     #info_field_dict = read_classify_info(info_file)
     #has_tests = int(info_field_dict["tests"][0]) > 0
     # get transcript predictions
-    decision_dict = read_classify_decisions(output_res_file)
+    pred, log10lr = decide(features, results)
+    log10lr_attrs = [' %s "%s";' % (GTFAttr.LOG10LR, 
+                                    "NA" if np.isnan(x) else r_str(x, 15))
+                     for x in log10lr]
     # partition input into expressed vs background
     expr_fileh = open(expr_gtf_file, 'w')
     bkgd_fileh = open(bkgd_gtf_file, 'w')
     output_file_handles = [bkgd_fileh, expr_fileh]
-    for feature in GTFFeature.parse(open(input_gtf_file)):
-        t_id = feature.attrs[GTFAttr.TRANSCRIPT_ID]
-        dinf = decision_dict[t_id]
-        feature.attrs[GTFAttr.LOG10LR] = dinf.log10lr
-        fileh = output_file_handles[int(dinf.pred)]
-        print >>fileh, str(feature)
+    filehs = [output_file_handles[int(x)] for x in pred]
+    for row, line in itertools.izip(features.line_rows, 
+                                    open(input_gtf_file)):
+        filehs[row].write(line.rstrip('\n') + log10lr_attrs[row] + '\n')
     for fileh in output_file_handles:
         fileh.close()
     logging.debug("[FINISHED] library_id='%s'" % (library_id))
     return retcode, library_id
 
-def classify_transcripts(results, num_processors):
+def classify_transcripts(results, num_processors, pooled=False):
     # read library category statistics
     stats_list = list(CategoryStats.from_file(results.category_stats_file))
+    model_file = None
+    if pooled:
+        model_file = os.path.join(results.classify_dir, POOLED_MODEL_FILE)
     # get tasks
     tasks = []
     for statsobj in stats_list:
         library_id = statsobj.library_id
-        tasks.append((library_id, results.classify_dir))
+        tasks.append((library_id, results.classify_dir, model_file))
     # use multiprocessing to parallelize
     pool = multiprocessing.Pool(processes=num_processors)
     result_iter = pool.imap_unordered(classify_library_transcripts, tasks)
@@ -265,7 +254,7 @@ def split_gtf_file(gtf_file, split_dir, ref_gtf_file, category_stats_file,
                    bufsize=(1 << 30)):
     # split input gtf by library and mark test ids
     keyfunc = lambda myid: os.path.join(split_dir, "%s.gtf" % (myid))
-    bufobj = BufferedFileSplitter(keyfunc, bufsize)
+    bufobj = FileSplitter(keyfunc, bufsize, threaded=True)
     ref_fileh = open(ref_gtf_file, 'w')
     stats_dict = collections.defaultdict(lambda: CategoryStats())
     logging.info("Splitting transcripts by library")
@@ -278,30 +267,21 @@ def split_gtf_file(gtf_file, split_dir, ref_gtf_file, category_stats_file,
         library_id = f.attrs[GTFAttr.LIBRARY_ID]
         # keep statistics
         if f.feature_type == 'transcript':
-            is_test = bool(int(f.attrs[GTFAttr.TEST]))
-            if is_test:
-                category = Category.SAME_STRAND
-            else:
-                category = int(f.attrs[GTFAttr.CATEGORY])
-            score = float(f.attrs[GTFAttr.SCORE])         
             statsobj = stats_dict[library_id]
             statsobj.library_id = library_id
-            statsobj.counts[category] += 1
-            statsobj.signal[category] += score
+            statsobj.add_transcript(f.attrs)
         # write features from each library to separate files
         bufobj.write(library_id, line)
     # close open file handles
     ref_fileh.close()
     bufobj.close()
-    logging.debug("Buffer flushes: %d" % (bufobj.flushes))
-    # write library category statistics
+    logging.debug("Buffer flushes: %d file opens: %d" % 
+                  (bufobj.flushes, bufobj.opens))
+    # write library category statistics (sorted by library id like 
+    # annotate_transcripts --split-libraries)
     logging.info("Writing category statistics")
-    fh = open(category_stats_file, "w")
-    print >>fh, '\t'.join(CategoryStats.header_fields())
-    for statsobj in stats_dict.itervalues():
-        fields = statsobj.to_fields()
-        print >>fh, '\t'.join(map(str, fields))
-    fh.close()
+    CategoryStats.to_file(category_stats_file, 
+                          (stats_dict[k] for k in sorted(stats_dict)))
 
 def main():
     multiprocessing.freeze_support()
@@ -314,16 +294,21 @@ def main():
                         help="Size of buffer when splitting GTF file")
     parser.add_argument("-p", "--num-processors", type=int, 
                         dest="num_processors", default=1)
+    parser.add_argument("--pooled", action="store_true", default=False,
+                        help="Estimate densities once from transcripts "
+                        "sampled from all libraries and score each "
+                        "library with them instead of training a "
+                        "classifier per library")
+    parser.add_argument("--pooled-samples", type=int, 
+                        dest="pooled_samples", default=POOLED_MAX_SAMPLES,
+                        help="Maximum number of transcripts of each class "
+                        "sampled from each library to train the pooled "
+                        "classifier [default=%(default)s]")
     parser.add_argument("run_dir")
     args = parser.parse_args()
     # check command line parameters
     if not os.path.exists(args.run_dir):
         parser.error("Run directory %s not found" % (args.run_dir))
-    # check command line parameters
-    if not os.path.exists(CLASSIFY_R_SCRIPT):
-        parser.error("Classification R script not found")
-    if not check_executable("Rscript"):
-        parser.error("Rscript binary not found")        
     num_processors = max(1, args.num_processors)
     # set logging level
     if args.verbose:
@@ -339,20 +324,39 @@ def main():
     logging.info("run directory:    %s" % (args.run_dir))
     logging.info("num processors:   %d" % (args.num_processors))
     logging.info("buffer size:      %d" % (args.bufsize))
+    logging.info("pooled:           %s" % (args.pooled))
+    if args.pooled:
+        logging.info("pooled samples:   %d" % (args.pooled_samples))
     logging.info("verbose logging:  %s" % (args.verbose))
     logging.info("----------------------------------")   
     # setup results
     results = config.AssemblylineResults(args.run_dir)
     if not os.path.exists(results.classify_dir):
         os.makedirs(results.classify_dir)
-    # split gtf file
-    split_gtf_file(results.annotated_transcripts_gtf_file, 
-                   results.classify_dir,
-                   results.ref_gtf_file,
-                   results.category_stats_file,
-                   args.bufsize)
+    # split gtf file unless annotate_transcripts already wrote one 
+    # file per library
+    if os.path.exists(results.annotated_transcripts_gtf_file):
+        split_gtf_file(results.annotated_transcripts_gtf_file, 
+                       results.classify_dir,
+                       results.ref_gtf_file,
+                       results.category_stats_file,
+                       args.bufsize)
+    elif os.path.exists(results.category_stats_file):
+        logging.info("Using library GTF files written by "
+                     "annotate_transcripts")
+    else:
+        logging.error("Annotated GTF file %s not found" % 
+                      (results.annotated_transcripts_gtf_file))
+        return 1
+    # train pooled classifier
+    if args.pooled:
+        retcode = train_pooled_classifier(results, num_processors, 
+                                          args.pooled_samples)
+        if retcode != 0:
+            logging.error("ERROR")
+            return retcode
     # run classification
-    retcode = classify_transcripts(results, num_processors)
+    retcode = classify_transcripts(results, num_processors, args.pooled)
     if retcode != 0:
         logging.error("ERROR")
         return retcode
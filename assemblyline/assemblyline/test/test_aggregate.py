@@ -0,0 +1,210 @@
+'''
+Created on Oct 30, 2013
+
+@author: mkiyer
+'''
+import unittest
+import os
+import sys
+import random
+import tempfile
+import shutil
+import StringIO
+
+import assemblyline.lib.config as config
+from assemblyline.lib.base import Library
+from assemblyline.pipeline.aggregate_transcripts import read_gtf_file, \
+    filter_transcripts, stream_filter_library, aggregate_library, \
+    get_library_files, sort_gtf_file, main
+
+def make_library_lines(num_transcripts, seed):
+    '''
+    exons of random transcripts with short transcripts and short first
+    and last exons, grouped by transcript
+    '''
+    rng = random.Random(seed)
+    transcripts = []
+    for i in xrange(num_transcripts):
+        strand = rng.choice('+-')
+        start = rng.randint(0, 10000)
+        exons = []
+        for j in xrange(rng.randint(1, 4)):
+            length = rng.choice((5, 10, 100, 200, 400))
+            exons.append((start, start + length))
+            start += length + rng.randint(50, 500)
+        attrs = ('gene_id "G%d"; transcript_id "T%d"; FPKM "%s";' %
+                 (i // 2, i, rng.choice(('0.5', '1.0', '2.5', '10'))))
+        lines = ['\t'.join(['chr1', 'Cufflinks', 'exon', str(s + 1),
+                            str(e), '1000', strand, '.', attrs])
+                 for s,e in exons]
+        transcripts.append(lines)
+    return transcripts
+
+def write_lines(filename, lines):
+    fileh = open(filename, 'w')
+    for line in lines:
+        print >>fileh, line
+    fileh.close()
+
+def make_library(gtf_file):
+    library = Library()
+    library.library_id = 'L1'
+    library.sample_id = 'S1'
+    library.gtf_file = gtf_file
+    return library
+
+def filter_in_memory(library):
+    filehs = [StringIO.StringIO() for i in xrange(3)]
+    t_dict = read_gtf_file(library, 'FPKM')
+    filter_transcripts(library.library_id, t_dict, filehs[0], filehs[1],
+                       filehs[2], 250)
+    return [fileh.getvalue() for fileh in filehs]
+
+class TestAggregate(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_stream_filter(self):
+        # output is identical to reading the library into memory
+        transcripts = make_library_lines(200, 1)
+        gtf_file = os.path.join(self.tmp_dir, 'lib.gtf')
+        write_lines(gtf_file, [line for lines in transcripts
+                               for line in lines])
+        library = make_library(gtf_file)
+        expected = filter_in_memory(library)
+        filehs = [StringIO.StringIO() for i in xrange(3)]
+        num_transcripts = stream_filter_library(library, 'FPKM', 250,
+                                                filehs[0], filehs[1],
+                                                filehs[2])
+        self.assertEqual(num_transcripts, 200)
+        self.assertEqual([fileh.getvalue() for fileh in filehs], expected)
+        # some transcripts pass and some are dropped
+        self.assertTrue(len(expected[1]) > 0)
+        self.assertTrue(len(expected[0]) > 0)
+        # empty library
+        write_lines(gtf_file, [])
+        self.assertEqual(stream_filter_library(library, 'FPKM', 250,
+                                               filehs[0], filehs[1],
+                                               filehs[2]), 0)
+
+    def test_noncontiguous_fallback(self):
+        # exons of transcripts that are not contiguous are detected by the
+        # streaming filter and the library is read into memory
+        transcripts = make_library_lines(50, 2)
+        moved = [tlines for tlines in transcripts if len(tlines) > 1][0]
+        moved_line = moved.pop()
+        lines = [line for tlines in transcripts for line in tlines]
+        lines.append(moved_line)
+        gtf_file = os.path.join(self.tmp_dir, 'lib.gtf')
+        write_lines(gtf_file, lines)
+        library = make_library(gtf_file)
+        filehs = [StringIO.StringIO() for i in xrange(3)]
+        self.assertEqual(stream_filter_library(library, 'FPKM', 250,
+                                               filehs[0], filehs[1],
+                                               filehs[2]), -1)
+        self.assertEqual([fileh.getvalue() for fileh in filehs],
+                         ['', '', ''])
+        expected = filter_in_memory(library)
+        # aggregate_library falls back to the in memory filter
+        prefix = os.path.join(self.tmp_dir, 'L1')
+        aggregate_library((library, 'FPKM', 250, prefix))
+        gtf_file, dropped_gtf_file, stats_file = get_library_files(prefix)
+        expected_gtf_file = os.path.join(self.tmp_dir, 'expected.gtf')
+        unsorted_gtf_file = expected_gtf_file + '.unsorted'
+        open(unsorted_gtf_file, 'w').write(expected[0])
+        sort_gtf_file(unsorted_gtf_file, expected_gtf_file, self.tmp_dir)
+        self.assertEqual(open(gtf_file).read(),
+                         open(expected_gtf_file).read())
+        self.assertEqual(open(dropped_gtf_file).read(), expected[1])
+        self.assertEqual(open(stats_file).read(), expected[2])
+
+
+class TestIncremental(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.output_dir = os.path.join(self.tmp_dir, 'out')
+        self.results = config.AssemblylineResults(self.output_dir)
+        ref_lines = ['\t'.join(['chr1', 'ref', 'exon', '101', '600', '0', 
+                                '+', '.', 'gene_id "R1"; transcript_id "R1";'])]
+        self.ref_gtf_file = os.path.join(self.tmp_dir, 'ref.gtf')
+        write_lines(self.ref_gtf_file, ref_lines)
+        self.test_file = os.path.join(self.tmp_dir, 'tests.txt')
+        write_lines(self.test_file, ['R1'])
+        library_lines = ['library_id\tsample_id\tgtf_file']
+        for i in xrange(3):
+            gtf_file = os.path.join(self.tmp_dir, 'lib%d.gtf' % (i))
+            write_lines(gtf_file, [line for lines in 
+                                   make_library_lines(20, i) 
+                                   for line in lines])
+            library_lines.append('lib%d\tsample%d\t%s' % (i, i, gtf_file))
+        self.library_table_file = os.path.join(self.tmp_dir, 'libraries.txt')
+        write_lines(self.library_table_file, library_lines)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def run_aggregate(self):
+        argv = sys.argv
+        sys.argv = ['aggregate_transcripts', '--incremental', 
+                    '--tests', self.test_file, '-o', self.output_dir, 
+                    self.ref_gtf_file, self.library_table_file]
+        try:
+            self.assertEqual(main(), 0)
+        finally:
+            sys.argv = argv
+        return open(self.results.transcripts_gtf_file).read()
+
+    def mark_library_files(self):
+        # library output files are given an old modification time so
+        # that files written again are detected
+        for library_id in ('L1', 'L2', 'L3'):
+            prefix = os.path.join(self.results.aggregate_dir, library_id)
+            for filename in get_library_files(prefix):
+                os.utime(filename, (0, 0))
+
+    def processed_libraries(self):
+        library_ids = []
+        for library_id in ('L1', 'L2', 'L3'):
+            prefix = os.path.join(self.results.aggregate_dir, library_id)
+            gtf_file = get_library_files(prefix)[0]
+            if os.path.getmtime(gtf_file) != 0:
+                library_ids.append(library_id)
+        return library_ids
+
+    def test_incremental(self):
+        output = self.run_aggregate()
+        self.assertEqual(self.processed_libraries(), ['L1', 'L2', 'L3'])
+        # unchanged libraries are not processed again
+        self.mark_library_files()
+        self.assertEqual(self.run_aggregate(), output)
+        self.assertEqual(self.processed_libraries(), [])
+        # a changed library is processed again
+        fileh = open(os.path.join(self.tmp_dir, 'lib1.gtf'), 'a')
+        for line in make_library_lines(5, 10)[0]:
+            print >>fileh, line.replace('"T0"', '"X0"')
+        fileh.close()
+        self.mark_library_files()
+        new_output = self.run_aggregate()
+        self.assertNotEqual(new_output, output)
+        self.assertEqual(self.processed_libraries(), ['L2'])
+        # a corrupt manifest processes all libraries again
+        manifest_lines = open(self.results.aggregate_manifest_file).readlines()
+        write_lines(self.results.aggregate_manifest_file, 
+                    [line.rstrip('\n')[:20] for line in manifest_lines])
+        self.mark_library_files()
+        self.assertEqual(self.run_aggregate(), new_output)
+        self.assertEqual(self.processed_libraries(), ['L1', 'L2', 'L3'])
+        # as does a missing manifest
+        os.remove(self.results.aggregate_manifest_file)
+        self.mark_library_files()
+        self.assertEqual(self.run_aggregate(), new_output)
+        self.assertEqual(self.processed_libraries(), ['L1', 'L2', 'L3'])
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -4,14 +4,215 @@ Created on Feb 12, 2013
 @author: mkiyer
 '''
 import unittest
+import collections
+import numpy as np
 
 # project imports
-from assemblyline.pipeline.annotate_transcripts import annotate_locus
-from assemblyline.lib.base import GTFAttr
+from assemblyline.pipeline.annotate_transcripts import annotate_locus, \
+    resolve_strand, LocusIndex, order_refs_by_id, \
+    compute_recurrence_and_score
+from assemblyline.lib.base import Category, GTFAttr
+from assemblyline.lib.transcript import Transcript, Exon, POS_STRAND, \
+    NEG_STRAND, NO_STRAND
+from assemblyline.lib.bx.intersection import Interval, IntervalTree
+from assemblyline.lib.assemble.transcript_graph import \
+    find_exon_boundaries, split_exons
 
 # local imports
 from test_base import read_first_locus
 
+def make_transcript(t_id, strand, exons, ref=False, test=False, 
+                    sample_id="S1", score=1.0, pctrank=0.5):
+    t = Transcript()
+    t.chrom = "chr1"
+    t.strand = strand
+    t.exons = [Exon(start, end) for start,end in exons]
+    t.start = t.exons[0].start
+    t.end = t.exons[-1].end
+    t.attrs = {GTFAttr.TRANSCRIPT_ID: t_id,
+               GTFAttr.REF: '1' if ref else '0',
+               GTFAttr.TEST: '1' if test else '0',
+               GTFAttr.SCORE: str(score),
+               GTFAttr.PCTRANK: str(pctrank),
+               "sample_id": sample_id}
+    return t
+
+def random_locus(rng, num_transcripts):
+    transcripts = []
+    for i in xrange(num_transcripts):
+        is_ref = rng.rand() < 0.4
+        strand = rng.randint(0, 2) if is_ref else rng.randint(0, 3)
+        num_exons = rng.randint(1, 5)
+        coords = np.sort(rng.choice(np.arange(0, 400, 10), 2 * num_exons,
+                                    replace=False)).tolist()
+        exons = zip(coords[0::2], coords[1::2])
+        transcripts.append(make_transcript("T%d" % (i), strand, exons,
+                                           ref=is_ref, 
+                                           test=is_ref and (rng.rand() < 0.3),
+                                           sample_id="S%d" % rng.randint(3),
+                                           score=rng.randint(1, 10)))
+    return transcripts
+
+def nested_coverage_overlap(nodes1, nodes2):
+    a = set(nodes1)
+    b = set(nodes2)
+    shared_length = sum((n[1] - n[0]) for n in a.intersection(b))
+    total_length = sum((n[1] - n[0]) for n in a.union(b))
+    return shared_length, total_length
+
+def nested_best_coverage_overlap(nodes, reftuples, ignore_test):
+    best_ref_t = None
+    best_ratio = 0.0
+    for ref_t, ref_nodes in reftuples:
+        if ignore_test and bool(int(ref_t.attrs[GTFAttr.TEST])):
+            continue
+        shared_cov, union_cov = nested_coverage_overlap(nodes, ref_nodes)
+        ratio = float(shared_cov) / union_cov
+        if ratio > best_ratio:
+            best_ref_t = ref_t
+            best_ratio = ratio
+    return best_ref_t, best_ratio
+
+def nested_best_intron_overlap(nodes, introns, reftuples, ignore_test):
+    best_ref_t = None
+    best_intron_ratio = 0.0
+    best_cov_ratio = 0.0
+    for ref_t, ref_nodes in reftuples:
+        if ignore_test and bool(int(ref_t.attrs[GTFAttr.TEST])):
+            continue
+        ref_introns = set(ref_t.iterintrons())
+        intron_ratio = (float(len(introns.intersection(ref_introns))) / 
+                        len(introns.union(ref_introns)))
+        shared_cov, total_cov = nested_coverage_overlap(nodes, ref_nodes)
+        cov_ratio = float(shared_cov) / total_cov
+        if ((intron_ratio > best_intron_ratio) or
+            ((intron_ratio == best_intron_ratio) and 
+             (cov_ratio > best_cov_ratio))):
+            best_ref_t = ref_t
+            best_intron_ratio = intron_ratio
+            best_cov_ratio = cov_ratio
+    return best_ref_t, best_intron_ratio, best_cov_ratio
+
+def nested_categorize(t, nodes, introns, intron_refs, same_strand_refs,
+                      opp_strand_refs, intron_tree, ignore_test):
+    if len(intron_refs) > 0:
+        ref_t, intron_ratio, cov_ratio = \
+            nested_best_intron_overlap(nodes, introns, intron_refs, 
+                                       ignore_test)
+        if ref_t is not None:
+            return (Category.SAME_STRAND, ref_t, intron_ratio, cov_ratio,
+                    bool(int(ref_t.attrs[GTFAttr.TEST])))
+    if len(same_strand_refs) > 0:
+        ref_t, cov_ratio = nested_best_coverage_overlap(nodes, 
+                                                        same_strand_refs,
+                                                        ignore_test)
+        if ref_t is not None:
+            return (Category.SAME_STRAND, ref_t, 0.0, cov_ratio,
+                    bool(int(ref_t.attrs[GTFAttr.TEST])))
+    ref_t = None
+    cov_ratio = 0.0
+    if len(opp_strand_refs) > 0:
+        category = Category.OPP_STRAND
+        ref_t, cov_ratio = nested_best_coverage_overlap(nodes, 
+                                                        opp_strand_refs,
+                                                        False)
+        return (category, ref_t, 0.0, cov_ratio, False)
+    found_hit = False
+    categories = set()
+    for hit in intron_tree.find(t.start, t.end):
+        if (t.strand == hit.strand) and ((hit.start,hit.end) in introns):
+            continue
+        found_hit = True
+        if (hit.start < t.start) and (hit.end > t.end):
+            if t.strand == NO_STRAND:
+                categories.add(Category.INTRONIC_AMBIGUOUS)
+                break
+            elif hit.strand == t.strand:
+                categories.add(Category.INTRONIC_SAME_STRAND)
+            else:
+                categories.add(Category.INTRONIC_OPP_STRAND)
+    if not found_hit:
+        category = Category.INTERGENIC
+    elif len(categories) == 1:
+        category = categories.pop()
+    elif len(categories) > 1:
+        category = Category.INTRONIC_AMBIGUOUS
+    else:
+        category = Category.INTERLEAVING
+    return (category, ref_t, 0.0, cov_ratio, False)
+
+def nested_annotate_locus(transcripts):
+    '''
+    categories of the nonreference transcripts of a locus found by 
+    comparing each transcript with each candidate reference (the 
+    implementation before LocusIndex).  returns dictionary mapping 
+    transcript id to (category, reference id, intron ratio, coverage 
+    ratio, is test) tuples
+    '''
+    ref_intron_dict = collections.defaultdict(lambda: [])
+    ref_node_dict = collections.defaultdict(lambda: ([],[]))
+    node_score_dict = collections.defaultdict(lambda: [0.0, 0.0])
+    all_introns = set()
+    boundaries = find_exon_boundaries(transcripts)
+    inp_transcripts = []
+    for t in transcripts:
+        if bool(int(t.attrs[GTFAttr.REF])):
+            for n in split_exons(t, boundaries):
+                ref_node_dict[n][t.strand].append(t)
+            for start,end in t.iterintrons():
+                ref_intron_dict[(t.strand, start, end)].append(t)
+                all_introns.add((t.strand,start,end))
+        else:
+            if t.strand != NO_STRAND:
+                score = float(t.attrs[GTFAttr.SCORE])
+                for n in split_exons(t, boundaries):
+                    node_score_dict[n][t.strand] += score
+            inp_transcripts.append(t)
+            for start,end in t.iterintrons():
+                all_introns.add((t.strand,start,end))
+    intron_tree = IntervalTree()
+    for strand,start,end in all_introns:
+        intron_tree.insert_interval(Interval(start,end,strand=strand))
+    results = {}
+    for t in inp_transcripts:
+        nodes = list(split_exons(t, boundaries))
+        introns = set(t.iterintrons())
+        strand = t.strand
+        if strand == NO_STRAND:
+            strand = resolve_strand(nodes, node_score_dict, ref_node_dict)
+        opp_strand = NO_STRAND if strand == NO_STRAND else (strand + 1) % 2
+        intron_ref_dict = {}
+        for start,end in introns:
+            if (strand, start, end) in ref_intron_dict:
+                intron_ref_dict.update((ref.attrs[GTFAttr.TRANSCRIPT_ID],ref) 
+                                       for ref in ref_intron_dict[(strand, start, end)])
+        same_strand_ref_dict = {}
+        opp_strand_ref_dict = {}
+        for n in nodes:
+            if n in ref_node_dict:
+                strand_refs = ref_node_dict[n]
+                same_strand_ref_dict.update((ref.attrs[GTFAttr.TRANSCRIPT_ID],ref) 
+                                            for ref in strand_refs[strand])
+                opp_strand_ref_dict.update((ref.attrs[GTFAttr.TRANSCRIPT_ID],ref) 
+                                           for ref in strand_refs[opp_strand])
+        reftuples = [[(ref, list(split_exons(ref, boundaries))) 
+                      for ref in d.itervalues()]
+                     for d in (intron_ref_dict, same_strand_ref_dict, 
+                               opp_strand_ref_dict)]
+        cinf = nested_categorize(t, nodes, introns, reftuples[0], 
+                                 reftuples[1], reftuples[2], intron_tree, 
+                                 False)
+        if cinf[4]:
+            cinf2 = nested_categorize(t, nodes, introns, reftuples[0], 
+                                      reftuples[1], reftuples[2], 
+                                      intron_tree, True)
+            cinf = (cinf2[0],) + cinf[1:]
+        ref_id = (cinf[1].attrs[GTFAttr.TRANSCRIPT_ID] 
+                  if cinf[1] is not None else 'na')
+        results[t.attrs[GTFAttr.TRANSCRIPT_ID]] = \
+            (cinf[0], ref_id, cinf[2], cinf[3], cinf[4])
+    return results
+
 class TestAnnotate(unittest.TestCase):
 
     def test_categories(self):
@@ -120,6 +321,143 @@ class TestAnnotate(unittest.TestCase):
         self.assertTrue(t.attrs[GTFAttr.TEST] == "1")
 
 
+    def test_locus_index(self):
+        # overlaps and candidate references found with the arrays of 
+        # LocusIndex match those of sets of nodes and introns
+        rng = np.random.RandomState(11)
+        for k in xrange(50):
+            transcripts = random_locus(rng, 12)
+            boundaries = find_exon_boundaries(transcripts)
+            locus_index = LocusIndex(transcripts, boundaries)
+            nodes = [list(split_exons(t, boundaries)) for t in transcripts]
+            inds = np.arange(len(transcripts))
+            for i,t in enumerate(transcripts):
+                self.assertEqual(locus_index.index(t), i)
+                shared, total = locus_index.coverage_overlap(i, inds)
+                introns = set(t.iterintrons())
+                shared_introns, total_introns = \
+                    locus_index.intron_overlap(i, inds)
+                for j,t2 in enumerate(transcripts):
+                    self.assertEqual((shared[j], total[j]), 
+                                     nested_coverage_overlap(nodes[i], 
+                                                             nodes[j]))
+                    introns2 = set(t2.iterintrons())
+                    self.assertEqual(shared_introns[j], 
+                                     len(introns & introns2))
+                    self.assertEqual(total_introns[j], 
+                                     len(introns | introns2))
+                for strand in xrange(3):
+                    ref_dict = {}
+                    for n in nodes[i]:
+                        ref_dict.update((t2.attrs[GTFAttr.TRANSCRIPT_ID], j)
+                                        for j,t2 in enumerate(transcripts)
+                                        if (t2.attrs[GTFAttr.REF] == '1') and
+                                        (t2.strand == strand) and 
+                                        (n in nodes[j]))
+                    refs = locus_index.find_overlapping_refs(i, strand)
+                    self.assertEqual(sorted(refs), sorted(ref_dict.values()))
+                    self.assertEqual(order_refs_by_id(locus_index, refs),
+                                     ref_dict.values())
+
+    def test_nested_loop_equivalence(self):
+        # categories, references and ratios match the nested loop 
+        # comparison of each transcript with each candidate reference
+        rng = np.random.RandomState(7)
+        for k in xrange(300):
+            transcripts = random_locus(rng, rng.randint(1, 16))
+            expected = nested_annotate_locus(transcripts)
+            annotate_locus(transcripts, gtf_sample_attr="sample_id")
+            for t in transcripts:
+                t_id = t.attrs[GTFAttr.TRANSCRIPT_ID]
+                if t_id not in expected:
+                    continue
+                self.assertEqual((t.attrs[GTFAttr.CATEGORY],
+                                  t.attrs[GTFAttr.ANN_REF_ID],
+                                  t.attrs[GTFAttr.ANN_INTRON_RATIO],
+                                  t.attrs[GTFAttr.ANN_COV_RATIO],
+                                  t.attrs[GTFAttr.TEST] == '1'), 
+                                 expected[t_id])
+
+    def test_categorize_transcript(self):
+        # category, reference and ratios of each kind of transcript as
+        # found by the nested loop implementation
+        transcripts = [
+            make_transcript('R1', POS_STRAND, [(100,200), (300,400), (500,600)],
+                            ref=True),
+            make_transcript('R2', NEG_STRAND, [(700,800)], ref=True),
+            make_transcript('R3', POS_STRAND, [(1100,1200)], ref=True, 
+                            test=True),
+            make_transcript('A', POS_STRAND, [(100,200), (300,400)]),
+            make_transcript('B', POS_STRAND, [(720,780)]),
+            make_transcript('C', POS_STRAND, [(220,280)]),
+            make_transcript('D', NEG_STRAND, [(420,480)]),
+            make_transcript('E', POS_STRAND, [(900,1000)]),
+            make_transcript('F', NO_STRAND, [(310,390)]),
+            make_transcript('G', NO_STRAND, [(410,490)]),
+            make_transcript('H', POS_STRAND, [(1120,1180)])]
+        expected = {
+            # same strand with shared introns
+            'A': (Category.SAME_STRAND, 'R1', 0.5, 200.0/300, '0'),
+            # opposite strand
+            'B': (Category.OPP_STRAND, 'R2', 0.0, 0.6, '0'),
+            # intronic same and opposite strand
+            'C': (Category.INTRONIC_SAME_STRAND, 'na', 0.0, 0.0, '0'),
+            'D': (Category.INTRONIC_OPP_STRAND, 'na', 0.0, 0.0, '0'),
+            # intergenic
+            'E': (Category.INTERGENIC, 'na', 0.0, 0.0, '0'),
+            # unstranded transcript resolved to the strand of 'A'
+            'F': (Category.SAME_STRAND, 'R1', 0.0, 80.0/300, '0'),
+            # unstranded transcript within an intron
+            'G': (Category.INTRONIC_AMBIGUOUS, 'na', 0.0, 0.0, '0'),
+            # overlaps only a test reference so it is categorized as if 
+            # the reference were absent
+            'H': (Category.INTERGENIC, 'R3', 0.0, 0.6, '1')}
+        self.assertEqual(nested_annotate_locus(transcripts),
+                         dict((k, v[:4] + (v[4] == '1',)) 
+                              for k,v in expected.iteritems()))
+        annotate_locus(transcripts, gtf_sample_attr="sample_id")
+        for t in transcripts:
+            t_id = t.attrs[GTFAttr.TRANSCRIPT_ID]
+            if t_id not in expected:
+                continue
+            category, ref_id, intron_ratio, cov_ratio, is_test = \
+                expected[t_id]
+            self.assertEqual(t.attrs[GTFAttr.CATEGORY], category)
+            self.assertEqual(t.attrs[GTFAttr.ANN_REF_ID], ref_id)
+            self.assertAlmostEqual(t.attrs[GTFAttr.ANN_INTRON_RATIO], 
+                                   intron_ratio)
+            self.assertAlmostEqual(t.attrs[GTFAttr.ANN_COV_RATIO], cov_ratio)
+            self.assertEqual(t.attrs[GTFAttr.TEST], is_test)
+
+    def test_recurrence_and_score(self):
+        # nodes are [0,50) [50,100) [100,120) [120,150) and [300,400).
+        # sample 'S3' shares no nodes with the other samples
+        transcripts = [
+            make_transcript('T1', POS_STRAND, [(0,100)], sample_id='S1', 
+                            score=2.0, pctrank=0.2),
+            make_transcript('T2', POS_STRAND, [(50,150)], sample_id='S1', 
+                            score=4.0, pctrank=0.4),
+            make_transcript('T3', POS_STRAND, [(50,100), (120,150)], 
+                            sample_id='S2', score=6.0, pctrank=0.6),
+            make_transcript('T4', POS_STRAND, [(300,400)], sample_id='S3',
+                            score=8.0, pctrank=0.8)]
+        mean_scores, mean_pctranks, mean_recurs = \
+            compute_recurrence_and_score(transcripts, "sample_id")
+        expected_scores = [7.0, 9.8, 11.25, 8.0]
+        expected_pctranks = [0.7, 0.98, 1.125, 0.8]
+        expected_recurs = [1.5, 1.8, 2.0, 1.0]
+        for i in xrange(len(transcripts)):
+            self.assertAlmostEqual(mean_scores[i], expected_scores[i], 12)
+            self.assertAlmostEqual(mean_pctranks[i], expected_pctranks[i], 12)
+            self.assertAlmostEqual(mean_recurs[i], expected_recurs[i], 12)
+        self.assertEqual(mean_recurs[3], 1.0)
+        # annotate_locus stores the statistics of each transcript
+        annotate_locus(transcripts, gtf_sample_attr="sample_id")
+        self.assertEqual([t.attrs[GTFAttr.MEAN_RECURRENCE] 
+                          for t in transcripts], mean_recurs)
+        self.assertEqual([t.attrs[GTFAttr.MEAN_SCORE] 
+                          for t in transcripts], mean_scores)
+
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testName']
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,110 @@
+'''
+Created on Oct 22, 2013
+
+@author: mkiyer
+'''
+import unittest
+import os
+import shutil
+import tempfile
+import random
+
+from assemblyline.lib.bbi import write_bigwig, write_bigbed, BBIFile, \
+    BIGWIG_MAGIC, BIGBED_MAGIC
+
+def make_bedgraph(chrom_sizes, seed=1):
+    rng = random.Random(seed)
+    records = []
+    for chrom in sorted(chrom_sizes):
+        pos = rng.randint(0, 20)
+        while True:
+            start = pos + rng.randint(0, 30)
+            end = start + rng.randint(1, 40)
+            if end > chrom_sizes[chrom]:
+                break
+            records.append((chrom, start, end, float(rng.randint(1, 50)) / 4))
+            pos = end
+    return records
+
+class TestBBI(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.chrom_sizes = {'chr1': 20000, 'chr10': 5000, 'chr2': 9000,
+                            'chrX': 100}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_bigwig(self):
+        records = make_bedgraph(self.chrom_sizes)
+        filename = os.path.join(self.tmp_dir, 'test.bw')
+        # small blocks and nodes to create multi-level index trees
+        write_bigwig(lambda: iter(records), self.chrom_sizes, filename,
+                     items_per_slot=4, block_size=3)
+        bbi = BBIFile(filename)
+        self.assertEqual(bbi.magic, BIGWIG_MAGIC)
+        self.assertEqual(bbi.chrom_sizes, self.chrom_sizes)
+        for chrom, start, end in [('chr1', 0, 20000), ('chr2', 1000, 1500),
+                                  ('chr10', 4990, 5000), ('chrX', 0, 100)]:
+            expected = [(r[1], r[2], r[3]) for r in records
+                        if r[0] == chrom and r[1] < end and r[2] > start]
+            self.assertEqual(bbi.fetch(chrom, start, end), expected)
+        # total summary and zoom levels
+        valid_count = sum(r[2] - r[1] for r in records)
+        total = sum((r[2] - r[1]) * r[3] for r in records)
+        self.assertEqual(bbi.summary[0], valid_count)
+        self.assertAlmostEqual(bbi.summary[3], total)
+        self.assertTrue(len(bbi.zoom_levels) > 0)
+        for level in xrange(len(bbi.zoom_levels)):
+            zoom_total = 0.0
+            zoom_count = 0
+            for chrom in self.chrom_sizes:
+                zrecs = bbi.fetch_zoom(level, chrom, 0, self.chrom_sizes[chrom])
+                zoom_total += zrecs['sum_data'].sum()
+                zoom_count += zrecs['valid_count'].sum()
+            self.assertEqual(zoom_count, valid_count)
+            self.assertAlmostEqual(zoom_total / total, 1.0, places=5)
+        bbi.close()
+
+    def test_empty(self):
+        filename = os.path.join(self.tmp_dir, 'test.bw')
+        write_bigwig(lambda: iter([]), self.chrom_sizes, filename)
+        bbi = BBIFile(filename)
+        self.assertEqual(bbi.chrom_sizes, {})
+        self.assertEqual(bbi.fetch('chr1', 0, 100), [])
+        bbi.close()
+
+    def test_unsorted(self):
+        records = [('chr2', 0, 10, 1.0), ('chr1', 0, 10, 1.0)]
+        filename = os.path.join(self.tmp_dir, 'test.bw')
+        self.assertRaises(ValueError, write_bigwig, lambda: iter(records),
+                          self.chrom_sizes, filename)
+
+    def test_bigbed(self):
+        bed_file = os.path.join(self.tmp_dir, 'test.bed')
+        lines = []
+        for chrom, start, end, value in make_bedgraph(self.chrom_sizes, 2):
+            # overlapping features
+            end = min(end + 25, self.chrom_sizes[chrom])
+            lines.append('\t'.join(map(str, [chrom, start, end, 'G%d' % start,
+                                             int(value), '+'])))
+        open(bed_file, 'w').write('\n'.join(lines) + '\n')
+        filename = os.path.join(self.tmp_dir, 'test.bb')
+        write_bigbed(bed_file, self.chrom_sizes, filename,
+                     items_per_slot=5, block_size=4)
+        bbi = BBIFile(filename)
+        self.assertEqual(bbi.magic, BIGBED_MAGIC)
+        self.assertEqual(bbi.field_count, 6)
+        for chrom in self.chrom_sizes:
+            expected = [(int(f[1]), int(f[2]), '\t'.join(f[3:]))
+                        for f in (line.split('\t') for line in lines)
+                        if f[0] == chrom and int(f[2]) > 100 and
+                        int(f[1]) < 3000]
+            self.assertEqual(bbi.fetch(chrom, 100, 3000), expected)
+        bbi.close()
+
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -0,0 +1,54 @@
+'''
+Created on Oct 22, 2013
+
+@author: mkiyer
+'''
+import unittest
+import os
+import shutil
+import tempfile
+
+from assemblyline.lib.bedgraph import coverage_runs, get_bedgraph_lines, \
+    merge_bedgraph_files
+
+class TestBedGraph(unittest.TestCase):
+
+    def test_coverage_runs(self):
+        # overlapping intervals, adjacent equal values, and a gap
+        starts = [10, 20, 25, 30, 50]
+        ends = [20, 30, 28, 40, 60]
+        values = [1.0, 1.0, 2.0, 3.0, 1.5]
+        run_starts, run_ends, run_values = coverage_runs(starts, ends, values)
+        self.assertEqual(list(run_starts), [10, 25, 28, 30, 50])
+        self.assertEqual(list(run_ends), [25, 28, 30, 40, 60])
+        self.assertEqual(list(run_values), [1.0, 3.0, 1.0, 3.0, 1.5])
+        # empty input
+        self.assertEqual(list(get_bedgraph_lines('chr1', [], [], [])), [])
+        lines = list(get_bedgraph_lines('chr1', [5], [8], [0.25]))
+        self.assertEqual(lines, ['chr1\t5\t8\t0.25'])
+
+    def test_merge(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            data = [['chr1\t5\t8\t1.0\n', 'chr1\t100\t110\t2.0\n',
+                     'chr2\t0\t10\t1.0\n'],
+                    ['chr1\t20\t30\t1.0\n', 'chr10\t5\t10\t4.0\n'],
+                    []]
+            filenames = []
+            for i,lines in enumerate(data):
+                filename = os.path.join(tmp_dir, 'w%d.bedgraph' % i)
+                open(filename, 'w').writelines(lines)
+                filenames.append(filename)
+            output_file = os.path.join(tmp_dir, 'merged.bedgraph')
+            merge_bedgraph_files(filenames, output_file)
+            self.assertEqual(open(output_file).readlines(),
+                             ['chr1\t5\t8\t1.0\n', 'chr1\t20\t30\t1.0\n',
+                              'chr1\t100\t110\t2.0\n', 'chr10\t5\t10\t4.0\n',
+                              'chr2\t0\t10\t1.0\n'])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
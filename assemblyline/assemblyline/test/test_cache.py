@@ -0,0 +1,60 @@
+'''
+Created on Oct 19, 2013
+
+@author: mkiyer
+'''
+import unittest
+import shutil
+import tempfile
+
+# project imports
+from assemblyline.pipeline.assemble_transcripts import RunConfig
+from assemblyline.lib.assemble.base import PathInfo
+from assemblyline.lib.transcript import Exon
+from assemblyline.lib.assemble.cache import LocusCache, locus_cache_key, \
+    pack_path_info_list, unpack_path_info_list
+
+# local imports
+from test_base import read_first_locus
+
+class TestLocusCache(unittest.TestCase):
+
+    def test_cache_key(self):
+        config = RunConfig()
+        transcripts = read_first_locus("annotate_category1.gtf")
+        key = locus_cache_key(transcripts, config)
+        # key does not depend on transcript order or ids
+        transcripts.reverse()
+        for i,t in enumerate(transcripts):
+            t.attrs['transcript_id'] = 'X%d' % i
+        self.assertEqual(key, locus_cache_key(transcripts, config))
+        # key depends on scores and assembly parameters
+        config.max_paths += 1
+        self.assertNotEqual(key, locus_cache_key(transcripts, config))
+        config.max_paths -= 1
+        transcripts[0].score += 1.0
+        self.assertNotEqual(key, locus_cache_key(transcripts, config))
+
+    def test_get_put(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            cache = LocusCache(cache_dir)
+            key = 'ab' * 20
+            self.assertTrue(cache.get(key) is None)
+            paths = [PathInfo(10.5, [Exon(0, 100), Exon(200, 300)])]
+            cache.put(key, (['', 'chr1\t0\t1\t1.0\n', ''],
+                            [(0, pack_path_info_list(paths))]))
+            bedgraph_data, results = LocusCache(cache_dir).get(key)
+            self.assertEqual(bedgraph_data[1], 'chr1\t0\t1\t1.0\n')
+            strand, packed = results[0]
+            p = unpack_path_info_list(packed)[0]
+            self.assertEqual(p.score, 10.5)
+            self.assertEqual(p.path, [Exon(0, 100), Exon(200, 300)])
+            self.assertEqual(cache.misses, 1)
+        finally:
+            shutil.rmtree(cache_dir)
+
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
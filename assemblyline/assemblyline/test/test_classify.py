@@ -0,0 +1,312 @@
+'''
+Created on Nov 4, 2013
+
+@author: mkiyer
+'''
+import unittest
+import os
+import math
+import tempfile
+import shutil
+import numpy as np
+
+from assemblyline.lib.stats import bandwidth_nrd, kde2d, kde2d_binned, \
+    interp_surface
+from assemblyline.lib.classify import performance_table, \
+    performance_at_cutoff, classify_kde2d, r_str, LibraryFeatures, decide, \
+    sample_features, train_pooled_model, score_and_write_results, \
+    PooledModel, BACKGROUND_CLASS, EXPRESSED_CLASS, \
+    classify_and_write_results
+import assemblyline.lib.classify as classify
+
+ATTRS = 'transcript_id "%s"; cat "%d"; tst "%d"; score "%s"; avgrecur "1.5"; pct "50.0";'
+LINES = ['chr1\tal\ttranscript\t1\t500\t1000\t+\t.\t' + ATTRS % ('T1', 0, 0, '2.0'),
+         'chr1\tal\texon\t1\t100\t1000\t+\t.\ttranscript_id "T1";',
+         'chr1\tal\texon\t401\t500\t1000\t+\t.\ttranscript_id "T1";',
+         'chr1\tal\ttranscript\t601\t700\t1000\t+\t.\t' + ATTRS % ('T2', 2, 0, '1.0'),
+         'chr1\tal\texon\t601\t700\t1000\t+\t.\ttranscript_id "T2";',
+         'chr1\tal\ttranscript\t801\t900\t1000\t-\t.\t' + ATTRS % ('T3', 6, 1, '3.0'),
+         'chr1\tal\texon\t801\t900\t1000\t-\t.\ttranscript_id "T3";',
+         'chr1\tal\ttranscript\t951\t990\t1000\t-\t.\t' + ATTRS % ('T4', 6, 0, '1.0'),
+         'chr1\tal\texon\t951\t990\t1000\t-\t.\ttranscript_id "T4";']
+
+def r_kde2d(x, y, n, lims):
+    # direct transcription of kde2d and bandwidth.nrd in the R script
+    # formerly used to classify transcripts
+    def nrd(v):
+        v = sorted(v)
+        def quantile(p):
+            h = (len(v) - 1) * p
+            lo = int(math.floor(h))
+            return v[lo] + (h - lo) * (v[min(lo + 1, len(v) - 1)] - v[lo])
+        mean = sum(v) / len(v)
+        sd = math.sqrt(sum((a - mean)**2 for a in v) / (len(v) - 1))
+        iqr = (quantile(0.75) - quantile(0.25)) / 1.34
+        return 4 * 1.06 * min(sd, iqr) * len(v)**(-1/5.0)
+    def dnorm(a):
+        return math.exp(-0.5 * a * a) / math.sqrt(2 * math.pi)
+    gx = [lims[0] + i * (lims[1] - lims[0]) / (n - 1.0) for i in xrange(n)]
+    gy = [lims[2] + i * (lims[3] - lims[2]) / (n - 1.0) for i in xrange(n)]
+    hx = nrd(x) / 4.0
+    hy = nrd(y) / 4.0
+    z = [[sum(dnorm((gx[i] - x[k]) / hx) * dnorm((gy[j] - y[k]) / hy)
+              for k in xrange(len(x))) / (len(x) * hx * hy)
+          for j in xrange(n)] for i in xrange(n)]
+    return gx, gy, z
+
+def r_interp_surface(gx, gy, z, px, py):
+    # interp.surface with R's 1-based indices
+    def approx(g, v):
+        for i in xrange(len(g) - 1):
+            if g[i] <= v <= g[i + 1]:
+                return (i + 1) + (v - g[i]) / (g[i + 1] - g[i])
+    nx = len(gx)
+    ny = len(gy)
+    lx = approx(gx, px)
+    ly = approx(gy, py)
+    lx1 = int(math.floor(lx))
+    ly1 = int(math.floor(ly))
+    ex = lx - lx1
+    ey = ly - ly1
+    if lx1 == nx:
+        ex = 1
+        lx1 = nx - 1
+    if ly1 == ny:
+        ey = 1
+        ly1 = ny - 1
+    def zz(i, j):
+        return z[i - 1][j - 1]
+    return (zz(lx1, ly1) * (1 - ex) * (1 - ey) + 
+            zz(lx1 + 1, ly1) * ex * (1 - ey) +
+            zz(lx1, ly1 + 1) * (1 - ex) * ey + 
+            zz(lx1 + 1, ly1 + 1) * ex * ey)
+
+def r_classify(x, y, cl, clweights, n):
+    # classify.kde2d followed by the choice of the cutoff with the best
+    # balanced accuracy (ROCR cutoffs are Inf and the distinct 
+    # predictions in decreasing order; the first maximum wins)
+    lims = (min(x), max(x), min(y), max(y))
+    z = []
+    for c in (1, 2):
+        xc = [a for a, k in zip(x, cl) if k == c]
+        yc = [b for b, k in zip(y, cl) if k == c]
+        gx, gy, d = r_kde2d(xc, yc, n, lims)
+        z.append([r_interp_surface(gx, gy, d, a, b) for a, b in zip(x, y)])
+    lr = [math.log10((z2 * clweights[1] + 1e-10) / 
+                     (z1 * clweights[0] + 1e-10)) 
+          for z1, z2 in zip(z[0], z[1])]
+    train = [(v, k == 2) for v, k in zip(lr, cl) if k in (1, 2)]
+    npos = sum(1 for v, pos in train if pos)
+    nneg = len(train) - npos
+    best = None
+    for cutoff in [float('inf')] + sorted(set(v for v, pos in train), 
+                                          reverse=True):
+        tp = sum(1 for v, pos in train if pos and v >= cutoff)
+        tn = sum(1 for v, pos in train if (not pos) and v < cutoff)
+        balacc = (tp / float(npos) + tn / float(nneg)) / 2.0
+        if (best is None) or (balacc > best[0]):
+            best = (balacc, cutoff)
+    cutoff = best[1]
+    return lr, cutoff, [v > cutoff for v in lr]
+
+class TestClassify(unittest.TestCase):
+
+    def test_bandwidth(self):
+        x = np.array([1.0, 2.0, 3.0, 4.0, 10.0])
+        # iqr/1.34 is smaller than the standard deviation
+        h = 4 * 1.06 * (2.0 / 1.34) * 5**(-0.2)
+        self.assertAlmostEqual(bandwidth_nrd(x), h)
+
+    def test_kde2d(self):
+        rng = np.random.RandomState(0)
+        x = rng.normal(size=200)
+        y = rng.normal(size=200)
+        gx, gy, z = kde2d(x, y, n=60, lims=(-6, 6, -6, 6))
+        self.assertEqual(z.shape, (60, 60))
+        # density integrates to one
+        area = (gx[1] - gx[0]) * (gy[1] - gy[0])
+        self.assertAlmostEqual(z.sum() * area, 1.0, places=3)
+        # interpolation is exact at grid points and on planes
+        self.assertTrue(np.allclose(interp_surface(gx, gy, z, gx[[0, 5, 59]],
+                                                   gy[[3, 59, 0]]),
+                                    z[[0, 5, 59], [3, 59, 0]]))
+        plane = 2 * gx[:, np.newaxis] + 3 * gy[np.newaxis, :]
+        px = rng.uniform(-6, 6, size=20)
+        py = rng.uniform(-6, 6, size=20)
+        self.assertTrue(np.allclose(interp_surface(gx, gy, plane, px, py),
+                                    2 * px + 3 * py))
+        self.assertRaises(ValueError, kde2d, x, np.zeros(200))
+
+    def test_kde2d_binned(self):
+        rng = np.random.RandomState(2)
+        x = np.concatenate((rng.exponential(2, 5000), 
+                            rng.normal(5, 1, 5000)))
+        y = np.concatenate((rng.uniform(0, 100, 5000), 
+                            rng.normal(50, 10, 5000)))
+        # grid covering the data and grid that excludes some of it
+        for lims in (None, (0.0, 5.0, 20.0, 60.0)):
+            gx, gy, z = kde2d(x, y, n=50, lims=lims)
+            bx, by, zb = kde2d_binned(x, y, n=50, lims=lims)
+            self.assertTrue(np.array_equal(gx, bx))
+            self.assertTrue(np.array_equal(gy, by))
+            self.assertTrue(np.abs(z - zb).max() < 1e-3 * z.max())
+        # heavy-tailed data has bandwidths that are small compared to the
+        # range of the data (binned on a finer grid or computed exactly)
+        for x in (rng.lognormal(0, 0.8, 20000), rng.lognormal(0, 1.5, 20000),
+                  rng.pareto(1.0, 20000), 
+                  np.concatenate((rng.normal(1, 0.01, 19980), 
+                                  rng.uniform(50, 1000, 20)))):
+            y = rng.standard_t(2, 20000)
+            z = kde2d(x, y, n=50)[2]
+            zb = kde2d_binned(x, y, n=50)[2]
+            self.assertTrue(np.abs(z - zb).max() < 1e-3 * z.max())
+
+    def test_performance(self):
+        pred = np.array([0.9, 0.8, 0.8, 0.3, 0.1])
+        labels = np.array([True, True, False, False, True])
+        cutoffs, sens, spec, balacc, auc = performance_table(pred, labels)
+        self.assertEqual(list(cutoffs), [np.inf, 0.9, 0.8, 0.3, 0.1])
+        self.assertTrue(np.allclose(sens, [0, 1/3.0, 2/3.0, 2/3.0, 1]))
+        self.assertTrue(np.allclose(spec, [1, 1, 0.5, 0, 0]))
+        self.assertAlmostEqual(auc, 0.5 * (1/3.0 + 2/3.0) * 0.5 + 
+                               0.5 * 2/3.0 + 0.0)
+        self.assertEqual(performance_at_cutoff(0.8, pred, labels)[:4],
+                         [2, 1, 1, 1])
+        self.assertRaises(ValueError, performance_table, pred, 
+                          np.ones(5, dtype=np.bool))
+
+    def test_classify(self):
+        rng = np.random.RandomState(1)
+        x = np.concatenate((rng.normal(0, 1, 300), rng.normal(3, 1, 300)))
+        y = np.concatenate((rng.normal(0, 1, 300), rng.normal(3, 1, 300)))
+        cl = np.array([1] * 300 + [2] * 300)
+        log10lr = classify_kde2d(x, y, cl, (1, 1))
+        self.assertTrue(np.median(log10lr[cl == 2]) > 0)
+        self.assertTrue(np.median(log10lr[cl == 1]) < 0)
+        self.assertEqual(map(r_str, [None, True, np.inf, 0.25, 'x']),
+                         ['NA', 'TRUE', 'Inf', '0.25', 'x'])
+
+    def test_r_reference(self):
+        # decisions and likelihood ratios match the formulas of the R
+        # script (rounding differences only)
+        rng = np.random.RandomState(4)
+        x = np.concatenate((rng.lognormal(0, 0.5, 60), 
+                            rng.lognormal(1, 0.5, 80), 
+                            rng.lognormal(0.5, 0.5, 10)))
+        y = np.concatenate((rng.uniform(0, 60, 60), 
+                            rng.uniform(30, 100, 80),
+                            rng.uniform(0, 100, 10)))
+        cl = np.array([1] * 60 + [2] * 80 + [0] * 10)
+        tmp_dir = tempfile.mkdtemp()
+        lr, pred = classify_and_write_results(x, y, cl, (1, 2.5), 
+                                              os.path.join(tmp_dir, "c"),
+                                              n=15)
+        shutil.rmtree(tmp_dir)
+        rlr, rcutoff, rpred = r_classify(list(x), list(y), list(cl), 
+                                         (1, 2.5), 15)
+        self.assertTrue(np.allclose(lr, rlr, rtol=1e-10, atol=1e-12))
+        self.assertEqual(list(pred), rpred)
+        # binned densities change log10 likelihood ratios by less than
+        # 5e-2 (see module docstring)
+        x = np.concatenate((rng.lognormal(1, 0.4, 3000), 
+                            rng.lognormal(0, 0.4, 3000)))
+        y = np.concatenate((rng.normal(60, 20, 3000), 
+                            rng.uniform(0, 80, 3000)))
+        cl = np.array([2] * 3000 + [1] * 3000)
+        exact = classify_kde2d(x, y, cl, (1, 1))
+        min_obs = classify.BINNED_KDE_MIN_OBS
+        classify.BINNED_KDE_MIN_OBS = 0
+        try:
+            binned = classify_kde2d(x, y, cl, (1, 1))
+        finally:
+            classify.BINNED_KDE_MIN_OBS = min_obs
+        self.assertTrue(0 < np.abs(exact - binned).max() < 5e-2)
+
+    def test_features(self):
+        tmp_dir = tempfile.mkdtemp()
+        gtf_file = os.path.join(tmp_dir, 'lib.gtf')
+        fileh = open(gtf_file, 'w')
+        for line in LINES:
+            print >>fileh, line
+        fileh.close()
+        f = LibraryFeatures.from_gtf(gtf_file)
+        shutil.rmtree(tmp_dir)
+        self.assertEqual(f.t_ids, ['T1', 'T2', 'T3', 'T4'])
+        self.assertEqual(list(f.line_rows), [0, 0, 0, 1, 1, 2, 2, 3, 3])
+        self.assertEqual(list(f.num_exons), [2, 1, 1, 1])
+        self.assertEqual(list(f.category), [0, 2, 6, 6])
+        self.assertEqual(list(f.is_test), [False, False, True, False])
+        self.assertEqual(list(f.score), [2.0, 1.0, 3.0, 1.0])
+        nan = np.nan
+        results = [(np.array([-3.0, 1.0, nan, nan]), 
+                    np.array([False, True, False, False])),
+                   (np.array([-1.5, nan, 2.0, 0.5]),
+                    np.array([False, False, True, True]))]
+        pred, log10lr = decide(f, results)
+        # single exon intronic transcripts are background and known
+        # transcripts receive the larger likelihood ratio
+        self.assertEqual(list(pred), [True, False, True, True])
+        self.assertEqual(list(log10lr), [-1.5, 1.0, 2.0, 0.5])
+
+    def test_pooled(self):
+        rng = np.random.RandomState(3)
+        samples_list = []
+        for i in xrange(3):
+            f = LibraryFeatures()
+            f.category = np.array([0] * 200 + [2] * 100 + [6] * 100)
+            f.is_test = np.zeros(400, dtype=np.bool)
+            f.is_test[:10] = True
+            f.mean_recurrence = np.concatenate((rng.normal(3, 1, 200),
+                                                rng.normal(0, 1, 200)))
+            f.pctrank = np.concatenate((rng.normal(3, 1, 200),
+                                        rng.normal(0, 1, 200)))
+            samples = sample_features(f, 150, rng)
+            self.assertEqual(len(samples["expressed"][0]), 150)
+            self.assertEqual(len(samples["intronic"][0]), 100)
+            samples_list.append(samples)
+        model = train_pooled_model(samples_list, (-5.0, 8.0, -5.0, 8.0), 
+                                   kde2d_n=40)
+        self.assertTrue(model.has_class("intronic"))
+        self.assertTrue(model.has_class("intergenic"))
+        x = np.array([0.5, 2.5])
+        lr = model.log10lr("intronic", x, x, (1, 1))
+        self.assertTrue(lr[0] < model.cutoffs["intronic"] < lr[1])
+        # models are saved and loaded
+        tmp_dir = tempfile.mkdtemp()
+        model_file = os.path.join(tmp_dir, "model.npz")
+        model.to_file(model_file)
+        m = PooledModel.from_file(model_file)
+        self.assertTrue(np.array_equal(m.densities["intergenic"], 
+                                       model.densities["intergenic"]))
+        self.assertEqual(m.cutoffs, model.cutoffs)
+        # libraries without enough observations use the pooled cutoff
+        # offset by their prior weight
+        cl = np.array([BACKGROUND_CLASS, EXPRESSED_CLASS])
+        prefix = os.path.join(tmp_dir, "lib")
+        lr10, pred = score_and_write_results(m, "intronic", x, x, cl, 
+                                             (1, 10.0), prefix)
+        self.assertTrue(np.allclose(lr10, lr + 1.0))
+        self.assertEqual(list(pred), [False, True])
+        self.assertTrue(os.path.exists(prefix + ".perf.txt"))
+        shutil.rmtree(tmp_dir)
+
+    def test_pooled_zero_variance(self):
+        # classes without spread have no density bandwidth and are left
+        # out of the model like classes with too few observations
+        rng = np.random.RandomState(5)
+        samples = {"expressed": (rng.normal(3, 1, 200), 
+                                 rng.normal(3, 1, 200)),
+                   "intronic": (np.ones(200), rng.normal(0, 1, 200)),
+                   "intergenic": (rng.normal(0, 1, 200), 
+                                  rng.normal(0, 1, 200))}
+        model = train_pooled_model([samples], (-5.0, 8.0, -5.0, 8.0), 
+                                   kde2d_n=40)
+        self.assertFalse(model.has_class("intronic"))
+        self.assertTrue(model.has_class("intergenic"))
+        self.assertTrue("intergenic" in model.cutoffs)
+        self.assertFalse("intronic" in model.cutoffs)
+
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
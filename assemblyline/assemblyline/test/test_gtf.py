@@ -0,0 +1,128 @@
+'''
+Created on Oct 22, 2013
+
+@author: mkiyer
+'''
+import unittest
+import os
+import random
+import tempfile
+import shutil
+
+from assemblyline.lib.gtf import parse_loci, split_stranded_loci, \
+    sort_gtf, gtf_sort_key, merge_sorted_gtf_files, GTFError
+
+def make_transcript(t_id, strand, exons):
+    attrs = 'gene_id "%s"; transcript_id "%s";' % (t_id, t_id)
+    lines = ['\t'.join(['chr1', 'test', 'transcript', str(exons[0][0]+1),
+                        str(exons[-1][1]), '1000', strand, '.', attrs])]
+    for start, end in exons:
+        lines.append('\t'.join(['chr1', 'test', 'exon', str(start+1),
+                                str(end), '1000', strand, '.', attrs]))
+    return lines
+
+def sort_lines(lines):
+    return sorted(lines, key=lambda x: (int(x.split('\t')[3]),
+                                        x.split('\t')[2] != 'transcript'))
+
+def get_ids(locus):
+    return sorted(set(line.split('transcript_id "')[1].split('"')[0]
+                      for line in locus))
+
+class TestStrandedLoci(unittest.TestCase):
+
+    def test_split(self):
+        lines = []
+        lines.extend(make_transcript('P1', '+', [(100, 200), (500, 600)]))
+        lines.extend(make_transcript('P2', '+', [(150, 300), (500, 700)]))
+        lines.extend(make_transcript('M1', '-', [(550, 650), (900, 1000)]))
+        # unstranded transcript with best overlap to minus strand
+        lines.extend(make_transcript('U1', '.', [(880, 990)]))
+        # unstranded transcript overlapping both strands equally
+        lines.extend(make_transcript('U2', '.', [(600, 640)]))
+        # unstranded transcript within an intron
+        lines.extend(make_transcript('U3', '.', [(350, 400)]))
+        lines = sort_lines(lines)
+        loci = list(parse_loci(iter(lines)))
+        self.assertEqual(len(loci), 1)
+        # U2 forces the strands to be merged
+        loci = split_stranded_loci(loci[0])
+        self.assertEqual([get_ids(x) for x in loci],
+                         [['M1', 'P1', 'P2', 'U1', 'U2'], ['U3']])
+        lines = [x for x in lines if 'U2' not in x]
+        loci = split_stranded_loci(lines)
+        self.assertEqual([get_ids(x) for x in loci],
+                         [['P1', 'P2'], ['U3'], ['M1', 'U1']])
+        # lines keep their original order
+        for locus in loci:
+            self.assertEqual(locus, [x for x in lines if x in locus])
+        self.assertEqual(sum(len(x) for x in loci), len(lines))
+
+    def test_sort_key(self):
+        # sorting lines in python matches sort_gtf
+        rng = random.Random(3)
+        lines = []
+        for i in xrange(300):
+            t_id = 'T%d' % rng.randint(0, 20)
+            chrom = rng.choice(['chr1', 'chr10', 'chr2', 'chrX'])
+            start = rng.randint(0, 50)
+            exons = [(start, start + rng.randint(1, 10))]
+            for line in make_transcript(t_id, rng.choice('+-.'), exons):
+                lines.append(line.replace('chr1', chrom, 1))
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            input_file = os.path.join(tmp_dir, 'in.gtf')
+            sorted_file = os.path.join(tmp_dir, 'sorted.gtf')
+            fileh = open(input_file, 'w')
+            for line in lines:
+                print >>fileh, line
+            fileh.close()
+            sort_gtf(input_file, sorted_file)
+            expected = open(sorted_file).read().splitlines()
+            self.assertEqual(sorted(lines, key=gtf_sort_key), expected)
+            # merge sorted halves
+            filenames = []
+            for i,part in enumerate((lines[::2], lines[1::2])):
+                filename = os.path.join(tmp_dir, 'part%d.gtf' % i)
+                fileh = open(filename, 'w')
+                for line in sorted(part, key=gtf_sort_key):
+                    print >>fileh, line
+                fileh.close()
+                filenames.append(filename)
+            merged_file = os.path.join(tmp_dir, 'merged.gtf')
+            merge_sorted_gtf_files(filenames, merged_file)
+            self.assertEqual(open(merged_file).read().splitlines(), 
+                             expected)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_merge_unsorted(self):
+        # a file with chromosomes in the order of a locale other than C
+        # ('chrm' before 'chrUn') is not merged
+        lines = []
+        for chrom in ('chrm', 'chrUn'):
+            for line in make_transcript('T1', '+', [(10, 20)]):
+                lines.append(line.replace('chr1', chrom, 1))
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            filenames = []
+            for i,part in enumerate((lines, sorted(lines, key=gtf_sort_key))):
+                filename = os.path.join(tmp_dir, 'part%d.gtf' % i)
+                fileh = open(filename, 'w')
+                for line in part:
+                    print >>fileh, line
+                fileh.close()
+                filenames.append(filename)
+            merged_file = os.path.join(tmp_dir, 'merged.gtf')
+            self.assertRaises(GTFError, merge_sorted_gtf_files, filenames,
+                              merged_file)
+            merge_sorted_gtf_files(filenames[1:], merged_file)
+            self.assertEqual(open(merged_file).read().splitlines(),
+                             sorted(lines, key=gtf_sort_key))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -0,0 +1,64 @@
+'''
+Created on Oct 23, 2013
+
+@author: mkiyer
+'''
+import unittest
+import random
+import tempfile
+import shutil
+
+from assemblyline.lib.intervalindex import IntervalIndex
+
+def find_brute(intervals, chrom, start, end):
+    return sorted(v for c,s,e,v in intervals
+                  if c == chrom and e > start and s < end)
+
+class TestIntervalIndex(unittest.TestCase):
+
+    def make_intervals(self, n=500):
+        rng = random.Random(13)
+        intervals = []
+        for i in xrange(n):
+            chrom = rng.choice(('chr1', 'chr2', 'chrX'))
+            start = rng.randint(0, 10000)
+            end = start + rng.randint(1, 800)
+            intervals.append((chrom, start, end, i))
+        return intervals
+
+    def test_find(self):
+        intervals = self.make_intervals()
+        index = IntervalIndex.from_intervals(intervals)
+        self.assertEqual(len(index), len(intervals))
+        rng = random.Random(7)
+        for i in xrange(500):
+            chrom = rng.choice(('chr1', 'chr2', 'chrX'))
+            start = rng.randint(0, 11000)
+            end = start + rng.randint(1, 300)
+            self.assertEqual(sorted(index.find_values(chrom, start, end)),
+                             find_brute(intervals, chrom, start, end))
+        # unknown chromosome and boundaries (half-open intervals)
+        self.assertEqual(len(index.find('chrY', 0, 100000)), 0)
+        index = IntervalIndex.from_intervals([('chr1', 10, 20, 0)])
+        self.assertEqual(list(index.find_values('chr1', 20, 30)), [])
+        self.assertEqual(list(index.find_values('chr1', 0, 10)), [])
+        self.assertEqual(list(index.find_values('chr1', 19, 20)), [0])
+
+    def test_save_load(self):
+        intervals = self.make_intervals()
+        index = IntervalIndex.from_intervals(intervals)
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            index.save(tmp_dir)
+            loaded = IntervalIndex.load(tmp_dir, mmap=True)
+            self.assertEqual(loaded.chroms, index.chroms)
+            self.assertEqual(list(loaded.find_values('chr2', 1000, 5000)),
+                             list(index.find_values('chr2', 1000, 5000)))
+            del loaded
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -0,0 +1,98 @@
+'''
+Created on Oct 18, 2013
+
+@author: mkiyer
+'''
+import unittest
+import os
+import shutil
+import tempfile
+
+# project imports
+from assemblyline.lib.journal import LocusJournal, JournalEntry, \
+    read_journal, recover_journal
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.filenames = [os.path.join(self.tmp_dir, 'out%d.txt' % i)
+                          for i in xrange(2)]
+        self.journal_file = os.path.join(self.tmp_dir, 'out.journal')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_loci(self):
+        filehs = [open(f, 'w') for f in self.filenames]
+        journal = LocusJournal(self.journal_file, filehs)
+        filehs[0].write('a0\n')
+        filehs[1].write('b0\n')
+        journal.commit(0, (5, 7))
+        # partial output of a failed locus is rolled back
+        filehs[0].write('partial\n')
+        journal.rollback()
+        filehs[1].write('b1\n')
+        journal.commit(2, (6, 7))
+        # output of a locus that was never committed
+        filehs[0].write('a3\n')
+        journal.close()
+        for fileh in filehs:
+            fileh.close()
+
+    def test_commit_and_rollback(self):
+        self.write_loci()
+        self.assertEqual(read_journal(self.journal_file),
+                         [JournalEntry(0, (5, 7), (3, 3)),
+                          JournalEntry(2, (6, 7), (3, 6))])
+        self.assertEqual(open(self.filenames[0]).read(), 'a0\na3\n')
+        self.assertEqual(open(self.filenames[1]).read(), 'b0\nb1\n')
+        # missing journal has no entries
+        self.assertEqual(read_journal(self.journal_file + '.x'), [])
+
+    def test_incomplete_entry(self):
+        self.write_loci()
+        # process was killed while writing an entry
+        fileh = open(self.journal_file, 'a')
+        fileh.write('3\t8,7\t9')
+        fileh.close()
+        self.assertEqual([e.locus_num for e in
+                          read_journal(self.journal_file)], [0, 2])
+
+    def test_recover(self):
+        self.write_loci()
+        entries = recover_journal(self.journal_file, self.filenames)
+        self.assertEqual([e.locus_num for e in entries], [0, 2])
+        # uncommitted output is removed
+        self.assertEqual(open(self.filenames[0]).read(), 'a0\n')
+        self.assertEqual(open(self.filenames[1]).read(), 'b0\nb1\n')
+        # entries that refer to output lost before reaching disk are
+        # discarded
+        fileh = open(self.filenames[1], 'a')
+        fileh.truncate(4)
+        fileh.close()
+        entries = recover_journal(self.journal_file, self.filenames)
+        self.assertEqual([e.locus_num for e in entries], [0])
+        self.assertEqual(read_journal(self.journal_file), entries)
+        self.assertEqual(open(self.filenames[1]).read(), 'b0\n')
+        # restarted worker appends to the recovered files
+        filehs = [open(f, 'a') for f in self.filenames]
+        journal = LocusJournal(self.journal_file, filehs, 'a')
+        filehs[0].write('a4\n')
+        journal.commit(4)
+        journal.close()
+        for fileh in filehs:
+            fileh.close()
+        self.assertEqual([e.offsets for e in read_journal(self.journal_file)],
+                         [(3, 3), (6, 3)])
+        # without a journal all output is discarded
+        os.remove(self.journal_file)
+        self.assertEqual(recover_journal(self.journal_file,
+                                         self.filenames), [])
+        self.assertEqual([os.path.getsize(f) for f in self.filenames],
+                         [0, 0])
+
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -0,0 +1,54 @@
+'''
+Created on Oct 24, 2013
+
+@author: mkiyer
+'''
+import unittest
+
+from assemblyline.lib.transcript import transcripts_from_gtf_lines
+from assemblyline.lib.locus_codec import pack_locus, unpack_locus, \
+    unpack_locus_lines
+
+LINES = ['chr1\tlib\ttranscript\t101\t500\t1000\t+\t.\tgene_id "G1"; transcript_id "T1"; ref "1"; pct "5.5";',
+         'chr1\tlib\texon\t301\t500\t1000\t+\t.\tgene_id "G1"; transcript_id "T1"; ref "1"; pct "5.5";',
+         'chr1\tlib\texon\t101\t200\t1000\t+\t.\tgene_id "G1"; transcript_id "T1"; ref "1"; pct "5.5";',
+         'chr1\tlib\ttranscript\t151\t450\t1000\t.\t.\tgene_id "G2"; transcript_id "T2";',
+         'chr1\tlib\texon\t151\t450\t1000\t.\t.\tgene_id "G2"; transcript_id "T2";']
+
+def transcript_tuples(transcripts, attr_names):
+    return [(t.chrom, t.start, t.end, t.strand,
+             [(e.start, e.end) for e in t.exons],
+             dict((k,v) for k,v in t.attrs.iteritems() if k in attr_names))
+            for t in transcripts]
+
+class TestLocusCodec(unittest.TestCase):
+
+    def test_roundtrip(self):
+        attr_names = ['transcript_id', 'ref', 'pct']
+        payload = pack_locus(LINES, attr_names)
+        self.assertTrue(isinstance(payload, str))
+        expected = transcript_tuples(transcripts_from_gtf_lines(LINES),
+                                     attr_names)
+        transcripts = unpack_locus(payload)
+        self.assertEqual(transcript_tuples(transcripts, attr_names),
+                         expected)
+        # attributes that were not requested are dropped
+        self.assertFalse('gene_id' in transcripts[0].attrs)
+        self.assertFalse('ref' in transcripts[1].attrs)
+        # gtf lines of an encoded locus
+        lines = unpack_locus_lines(payload)
+        self.assertEqual(transcript_tuples(transcripts_from_gtf_lines(lines),
+                                           attr_names), expected)
+
+    def test_malformed(self):
+        # exon before transcript record is sent as text so the worker
+        # raises the error
+        lines = [LINES[1], LINES[0]]
+        payload = pack_locus(lines, ['transcript_id'])
+        self.assertEqual(payload, lines)
+        self.assertRaises(Exception, unpack_locus, payload)
+
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
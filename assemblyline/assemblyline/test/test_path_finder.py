@@ -0,0 +1,65 @@
+'''
+Created on Oct 21, 2013
+
+@author: mkiyer
+'''
+import unittest
+import networkx as nx
+
+from assemblyline.lib.assemble.base import NODE_SCORE
+from assemblyline.lib.assemble.path_finder import find_suboptimal_paths, \
+    find_flow_paths
+
+def make_graph(node_scores, edges):
+    G = nx.DiGraph()
+    for n,score in node_scores.iteritems():
+        G.add_node(n, attr_dict={NODE_SCORE: score})
+    G.add_edges_from(edges)
+    return G
+
+class TestPathFinder(unittest.TestCase):
+
+    def test_flow_paths(self):
+        G = make_graph({'S': 3.0, 'A': 3.0, 'B': 2.0, 'C': 1.0, 'T': 3.0},
+                       [('S','A'), ('A','B'), ('A','C'), ('B','T'),
+                        ('C','T')])
+        greedy = find_suboptimal_paths(G, 'S', 'T', 0.0, 1000)
+        flow = find_flow_paths(G, 'S', 'T', 0.0, 1000)
+        self.assertEqual([p for p,s in flow], [p for p,s in greedy])
+        self.assertEqual([p for p,s in flow], [('S','A','B','T'),
+                                               ('S','A','C','T')])
+        self.assertAlmostEqual(flow[0][1], 2.0)
+        self.assertAlmostEqual(flow[1][1], 1.0)
+        # graph node scores are not modified
+        self.assertEqual(G.node['B'][NODE_SCORE], 2.0)
+        # paths below fraction of major path and beyond max paths
+        self.assertEqual(len(find_flow_paths(G, 'S', 'T', 0.6, 1000)), 1)
+        self.assertEqual(len(find_flow_paths(G, 'S', 'T', 0.0, 1)), 1)
+
+    def test_flow_paths_unique(self):
+        # a path is never reported twice and the number of paths is
+        # bounded by the number of edges
+        G = make_graph({'S': 10.0, 'A': 6.0, 'B': 9.0, 'C': 4.0, 'T': 10.0},
+                       [('S','A'), ('S','B'), ('A','B'), ('A','C'),
+                        ('B','C'), ('B','T'), ('C','T')])
+        flow = find_flow_paths(G, 'S', 'T', 0.0, 1000)
+        paths = [p for p,s in flow]
+        self.assertEqual(len(paths), len(set(paths)))
+        self.assertTrue(len(paths) <= G.number_of_edges())
+        scores = [s for p,s in flow]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+    def test_flow_paths_no_flow(self):
+        # when no edge has flow the best greedy path is returned
+        G = make_graph({'S': 0.0, 'A': 0.0, 'B': 0.0, 'T': 0.0},
+                       [('S','A'), ('S','B'), ('A','T'), ('B','T')])
+        greedy = find_suboptimal_paths(G, 'S', 'T', 0.0, 1000)
+        flow = find_flow_paths(G, 'S', 'T', 0.0, 1000)
+        self.assertEqual(len(flow), 1)
+        self.assertEqual(flow, greedy[:1])
+        self.assertEqual(G.node['A'][NODE_SCORE], 0.0)
+
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -0,0 +1,114 @@
+'''
+Created on Oct 28, 2013
+
+@author: mkiyer
+'''
+import unittest
+import os
+import tempfile
+import shutil
+import StringIO
+
+from assemblyline.lib.gtf import GTFFeature
+from assemblyline.lib.transcript import POS_STRAND, NEG_STRAND
+from assemblyline.lib.refbundle import build_reference_bundle, \
+    ReferenceBundle, is_reference_bundle
+from assemblyline.pipeline.aggregate_transcripts import \
+    add_reference_gtf_file, add_reference_bundle
+
+LINES = ['chr1\tref\texon\t301\t400\t0\t+\t.\tgene_id "G1"; transcript_id "T1"; ref "1";',
+         'chr1\tref\texon\t101\t200\t0\t+\t.\tgene_id "G1"; transcript_id "T1"; ref "1";',
+         'chr1\tref\texon\t101\t200\t0\t+\t.\tgene_id "G1"; transcript_id "T2";',
+         'chr1\tref\texon\t301\t450\t0\t+\t.\tgene_id "G1"; transcript_id "T2";',
+         'chr1\tref\texon\t401\t500\t0\t-\t.\tgene_id "G2"; transcript_id "T3";',
+         'chr1\tref\texon\t601\t700\t0\t-\t.\tgene_id "G3"; transcript_id "T4";',
+         'chr2\tref\ttranscript\t51\t90\t0\t+\t.\tgene_id "G4"; transcript_id "T5"; gene_name "X";',
+         'chr2\tref\texon\t51\t90\t0\t+\t.\tgene_id "G4"; transcript_id "T5";']
+
+class TestReferenceBundle(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.gtf_file = os.path.join(self.tmp_dir, 'ref.gtf')
+        fileh = open(self.gtf_file, 'w')
+        for line in LINES:
+            print >>fileh, line
+        fileh.close()
+        self.bundle_dir = os.path.join(self.tmp_dir, 'bundle')
+        build_reference_bundle(self.gtf_file, self.bundle_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_transcripts(self):
+        self.assertTrue(is_reference_bundle(self.bundle_dir))
+        self.assertFalse(is_reference_bundle(self.tmp_dir))
+        bundle = ReferenceBundle(self.bundle_dir)
+        self.assertEqual(bundle.transcript_ids, ['T1', 'T2', 'T3', 'T4', 'T5'])
+        self.assertEqual(bundle.get_exons(0), [(100, 200), (300, 400)])
+        self.assertEqual(bundle.get_chrom(4), 'chr2')
+        transcripts = list(bundle.iter_transcripts())
+        self.assertEqual(transcripts[1].exons[1].end, 450)
+        self.assertEqual(transcripts[2].strand, NEG_STRAND)
+        self.assertEqual(transcripts[4].attrs['gene_name'], 'X')
+        # tool attributes are removed and transcript records are made
+        # for transcripts without them
+        for i, exon_lines, t_line in bundle.iter_gtf_lines():
+            f = GTFFeature.from_string(t_line)
+            self.assertEqual(f.feature_type, 'transcript')
+            self.assertFalse('ref' in f.attrs)
+            self.assertEqual(len(exon_lines), len(bundle.get_exons(i)))
+
+    def test_loci(self):
+        bundle = ReferenceBundle(self.bundle_dir)
+        self.assertEqual(list(bundle.iter_loci()),
+                         [('chr1', 100, 500, 0, 3),
+                          ('chr1', 600, 700, 3, 4),
+                          ('chr2', 50, 90, 4, 5)])
+        self.assertEqual(list(bundle.locus_index.find_values('chr1', 450, 650)),
+                         [0, 1])
+
+    def test_exons_introns(self):
+        bundle = ReferenceBundle(self.bundle_dir)
+        self.assertEqual(list(bundle.find_exon_transcripts('chr1', 420, 430)),
+                         [1, 2])
+        self.assertEqual(list(bundle.find_exon_transcripts('chr1', 420, 430,
+                                                           NEG_STRAND)), [2])
+        self.assertTrue(bundle.has_intron('chr1', 200, 300, POS_STRAND))
+        self.assertFalse(bundle.has_intron('chr1', 200, 300, NEG_STRAND))
+        self.assertFalse(bundle.has_intron('chr1', 200, 350, POS_STRAND))
+        self.assertFalse(bundle.has_intron('chrX', 200, 300, POS_STRAND))
+        pattern = [(150, 200), (300, 420)]
+        self.assertEqual(list(bundle.find_splice_pattern('chr1', POS_STRAND,
+                                                         pattern)), [0, 1])
+        self.assertEqual(len(bundle.find_splice_pattern('chr1', NEG_STRAND,
+                                                        pattern)), 0)
+        self.assertEqual(len(bundle.find_splice_pattern('chr2', POS_STRAND,
+                                                        [(50, 90)])), 0)
+
+    def test_check_source(self):
+        self.assertEqual(ReferenceBundle(self.bundle_dir).check_source(), [])
+        fileh = open(self.gtf_file, 'a')
+        print >>fileh, LINES[0]
+        fileh.close()
+        os.utime(self.gtf_file, (0, 0))
+        self.assertEqual(len(ReferenceBundle(self.bundle_dir).check_source()), 2)
+        os.remove(self.gtf_file)
+        self.assertEqual(len(ReferenceBundle(self.bundle_dir).check_source()), 1)
+
+    def test_aggregate_reference(self):
+        def parse(fileh):
+            fileh.seek(0)
+            return sorted((f.seqid, f.feature_type, f.start, f.end, f.strand,
+                           sorted(f.attrs.items()))
+                          for f in GTFFeature.parse(fileh))
+        gtf_fileh = StringIO.StringIO()
+        add_reference_gtf_file(self.gtf_file, set(['G1']), 0.0, gtf_fileh)
+        bundle_fileh = StringIO.StringIO()
+        add_reference_bundle(self.bundle_dir, set(['G1']), 0.0, bundle_fileh)
+        self.assertEqual(parse(gtf_fileh), parse(bundle_fileh))
+
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
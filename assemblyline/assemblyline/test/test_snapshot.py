@@ -0,0 +1,64 @@
+'''
+Created on Oct 20, 2013
+
+@author: mkiyer
+'''
+import unittest
+import os
+import shutil
+import tempfile
+
+# project imports
+from assemblyline.lib.assemble.transcript_graph import create_transcript_graphs
+from assemblyline.lib.assemble.assembler import assemble_transcript_graph
+from assemblyline.lib.assemble.snapshot import SnapshotWriter, \
+    merge_snapshots, read_snapshot_index, read_snapshot_entry
+
+# local imports
+from test_base import read_first_locus
+
+def assemble(transcript_graphs):
+    results = []
+    for tg in transcript_graphs:
+        path_info_list = assemble_transcript_graph(tg.Gsub, tg.strand,
+                                                   tg.partial_paths,
+                                                   0, 0.9, 0.01, 1000)
+        results.append([(p.score, [(e.start, e.end) for e in p.path])
+                        for p in path_info_list])
+    return results
+
+class TestSnapshot(unittest.TestCase):
+
+    def test_roundtrip(self):
+        transcripts = read_first_locus("assemble1.gtf")
+        chrom = transcripts[0].chrom
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            # write two loci from separate 'workers' and merge
+            filenames = [os.path.join(tmp_dir, 'w%d.snapshot' % i)
+                         for i in xrange(2)]
+            for locus_num, filename in zip((5, 2), filenames):
+                writer = SnapshotWriter(filename)
+                writer.write(locus_num, chrom,
+                             create_transcript_graphs(chrom, transcripts))
+                writer.close()
+            output_file = os.path.join(tmp_dir, 'graphs.snapshot')
+            merge_snapshots(filenames, output_file, [('guided', 'False')])
+            params, entries = read_snapshot_index(output_file + '.idx')
+            self.assertEqual(params, [('guided', 'False')])
+            self.assertEqual([e.locus_num for e in entries], [2, 5])
+            # assembly of restored graphs matches the original graphs
+            expected = assemble(create_transcript_graphs(chrom, transcripts))
+            fileh = open(output_file, 'rb')
+            for entry in entries:
+                transcript_graphs = read_snapshot_entry(fileh, entry)
+                self.assertEqual(len(transcript_graphs), entry.num_graphs)
+                self.assertEqual(assemble(transcript_graphs), expected)
+            fileh.close()
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
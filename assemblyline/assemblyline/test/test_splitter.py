@@ -0,0 +1,66 @@
+'''
+Created on Nov 1, 2013
+
+@author: mkiyer
+'''
+import unittest
+import os
+import tempfile
+import shutil
+
+from assemblyline.lib.base import FileSplitter, FileHandleCache
+
+class TestFileSplitter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def check_split(self, threaded):
+        keyfunc = lambda k: os.path.join(self.tmp_dir, '%s.txt' % (k))
+        # small buffer and file cache force repeated flushes and 
+        # reopening of evicted files
+        splitter = FileSplitter(keyfunc, bufsize=50, maxfiles=2,
+                                threaded=threaded)
+        expected = {}
+        for i in xrange(200):
+            k = 'k%d' % (i % 7 if i % 3 else 0)
+            line = '%s\t%d\n' % (k, i)
+            splitter.write(k, line)
+            expected[k] = expected.get(k, '') + line
+        splitter.close()
+        self.assertTrue(splitter.flushes > 1)
+        self.assertTrue(len(splitter.cache.fileh_dict) == 0)
+        self.assertEqual(sorted(splitter.sizes), sorted(expected))
+        for k, data in expected.iteritems():
+            self.assertEqual(open(keyfunc(k)).read(), data)
+            self.assertEqual(splitter.sizes[k], len(data))
+
+    def test_split(self):
+        self.check_split(False)
+
+    def test_split_threaded(self):
+        self.check_split(True)
+
+    def test_file_handle_cache(self):
+        keyfunc = lambda k: os.path.join(self.tmp_dir, '%s.txt' % (k))
+        for k in ('a', 'b'):
+            open(keyfunc(k), 'w').write('old\n')
+        # files of append keys keep their contents
+        cache = FileHandleCache(keyfunc, maxsize=2, append_keys=['a'])
+        for k in ('a', 'b', 'c', 'a', 'b'):
+            cache.get_file_handle(k).write(k + '\n')
+            self.assertTrue(len(cache.fileh_dict) <= 2)
+        self.assertTrue(cache.get_open_file_handle('c') is None)
+        cache.close()
+        self.assertEqual(cache.opens, 5)
+        self.assertEqual(open(keyfunc('a')).read(), 'old\na\na\n')
+        self.assertEqual(open(keyfunc('b')).read(), 'b\nb\n')
+        self.assertEqual(open(keyfunc('c')).read(), 'c\n')
+
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
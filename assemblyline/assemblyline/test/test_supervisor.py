@@ -0,0 +1,202 @@
+'''
+Created on Oct 18, 2013
+
+@author: mkiyer
+'''
+import unittest
+import os
+import shutil
+import tempfile
+
+# project imports
+from assemblyline.lib.supervisor import SupervisedPool, WorkerHandler
+import assemblyline.lib.supervisor as supervisor
+from assemblyline.lib.journal import LocusJournal, read_journal, \
+    recover_journal, recover_split_journal, JournaledFileSplitter
+
+class RecordingWorker(WorkerHandler):
+    '''
+    writes one line per task.  task 'raise' fails on its first attempt,
+    task 'die' kills the worker process on every attempt
+    '''
+    def __init__(self, filename, restarted):
+        mode = 'a' if restarted else 'w'
+        if restarted:
+            recover_journal(filename + '.journal', [filename])
+        self.fileh = open(filename, mode)
+        self.journal = LocusJournal(filename + '.journal', [self.fileh], mode)
+    def process(self, task_id, payload, attempt):
+        if payload == 'raise' and attempt == 0:
+            self.fileh.write('partial\n')
+            raise ValueError(payload)
+        if payload == 'die':
+            self.fileh.write('partial\n')
+            self.fileh.flush()
+            os._exit(1)
+        self.fileh.write('%d\t%s\t%d\n' % (task_id, payload, attempt))
+        self.journal.commit(task_id)
+    def rollback(self):
+        self.journal.rollback()
+    def close(self):
+        self.journal.close()
+        self.fileh.close()
+
+class RollbackFailureWorker(RecordingWorker):
+    '''
+    cannot roll back the failure of task 'raise' so the worker exits 
+    after reporting it
+    '''
+    def rollback(self):
+        raise IOError('rollback failed')
+
+class DyingConnection(object):
+    '''
+    pipe to a worker process that is killed just before the first task
+    is sent to it, as when a worker dies between the health check of the
+    supervisor and the send
+    '''
+    def __init__(self, conn, proc):
+        self.conn = conn
+        self.proc = proc
+        self.killed = False
+    def send(self, obj):
+        if (obj is not None) and (not self.killed):
+            self.killed = True
+            self.proc.terminate()
+            self.proc.join()
+        return self.conn.send(obj)
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+class DyingSendPool(SupervisedPool):
+    def __init__(self, *args, **kwargs):
+        SupervisedPool.__init__(self, *args, **kwargs)
+        self.num_dying = 0
+    def _start_worker(self, w, restarted=False):
+        SupervisedPool._start_worker(self, w, restarted)
+        if (w.worker_id == 0) and (self.num_dying < 2):
+            self.num_dying += 1
+            w.conn = DyingConnection(w.conn, w.proc)
+
+class TestSupervisor(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_retry_and_quarantine(self):
+        payloads = ['a', 'raise', 'b', 'die', 'c', 'd']
+        filenames = [os.path.join(self.tmp_dir, 'worker%d.txt' % i)
+                     for i in xrange(2)]
+        def factory(worker_id, restarted):
+            return RecordingWorker(filenames[worker_id], restarted)
+        quarantined = []
+        def quarantine_func(task_id, payload, reason):
+            quarantined.append((task_id, payload))
+        pool = SupervisedPool(2, factory, quarantine_func)
+        num_done = pool.run(enumerate(payloads))
+        self.assertEqual(num_done, 5)
+        self.assertEqual(quarantined, [(3, 'die')])
+        results = {}
+        for filename in filenames:
+            for line in open(filename):
+                # partial output of failed tasks must be rolled back
+                self.assertNotEqual(line, 'partial\n')
+                task_id, payload, attempt = line.strip().split('\t')
+                results[int(task_id)] = (payload, int(attempt))
+            committed = [e.locus_num for e in
+                         read_journal(filename + '.journal')]
+            self.assertTrue(all(x in results for x in committed))
+        self.assertEqual(sorted(results), [0, 1, 2, 4, 5])
+        self.assertEqual(results[1], ('raise', 1))
+        self.assertEqual(results[0], ('a', 0))
+
+    def test_split_journal(self):
+        keyfunc = lambda k: os.path.join(self.tmp_dir, '%s.txt' % k)
+        journal_file = os.path.join(self.tmp_dir, 'split.journal')
+        splitter = JournaledFileSplitter(journal_file, keyfunc, maxsize=1)
+        splitter.write('a', 'a0\n')
+        splitter.write('b', 'b0\n')
+        splitter.commit(0)
+        splitter.write('a', 'a1\n')
+        splitter.rollback()
+        splitter.write('b', 'b1\n')
+        splitter.commit(1)
+        # output of a locus that was never committed
+        splitter.write('a', 'a2\n')
+        splitter.write('c', 'c2\n')
+        splitter.close()
+        committed = recover_split_journal(journal_file, keyfunc)
+        self.assertEqual(committed, {'a': 3, 'b': 6})
+        self.assertEqual(open(keyfunc('a')).read(), 'a0\n')
+        self.assertEqual(open(keyfunc('b')).read(), 'b0\nb1\n')
+        # restarted splitter appends to committed files and replaces
+        # files of new keys
+        splitter = JournaledFileSplitter(journal_file, keyfunc, committed)
+        splitter.write('a', 'a3\n')
+        splitter.write('c', 'c3\n')
+        splitter.commit(3)
+        splitter.close()
+        self.assertEqual(open(keyfunc('a')).read(), 'a0\na3\n')
+        self.assertEqual(open(keyfunc('c')).read(), 'c3\n')
+        self.assertEqual(recover_split_journal(journal_file, keyfunc),
+                         {'a': 6, 'b': 6, 'c': 3})
+
+
+    def run_payloads(self, pool_class, handler_class, payloads):
+        filenames = [os.path.join(self.tmp_dir, 'worker%d.txt' % i)
+                     for i in xrange(2)]
+        def factory(worker_id, restarted):
+            return handler_class(filenames[worker_id], restarted)
+        quarantined = []
+        def quarantine_func(task_id, payload, reason):
+            quarantined.append((task_id, payload))
+        pool = pool_class(2, factory, quarantine_func)
+        num_done = pool.run(enumerate(payloads))
+        results = {}
+        for filename in filenames:
+            for line in open(filename):
+                task_id, payload, attempt = line.strip().split('\t')
+                results[int(task_id)] = (payload, int(attempt))
+        return pool, num_done, quarantined, results
+
+    def test_send_to_dead_worker(self):
+        # a worker that dies before a task reaches it is replaced and
+        # the task is sent to another worker without counting an attempt
+        payloads = ['a', 'b', 'c', 'd', 'e']
+        pool, num_done, quarantined, results = \
+            self.run_payloads(DyingSendPool, RecordingWorker, payloads)
+        self.assertEqual(pool.num_dying, 2)
+        self.assertEqual(num_done, 5)
+        self.assertEqual(quarantined, [])
+        self.assertEqual(pool.num_failures, 0)
+        self.assertEqual(pool.num_restarts, 2)
+        self.assertEqual(sorted(results), range(5))
+        self.assertTrue(all(attempt == 0 for payload, attempt 
+                            in results.itervalues()))
+        self.assertEqual(pool.exited, [])
+
+    def test_rollback_failure(self):
+        # a worker that cannot roll back exits after reporting the 
+        # failure and is replaced without waiting for it to exit
+        payloads = ['a', 'raise', 'b', 'c']
+        poll_interval = supervisor.POLL_INTERVAL
+        supervisor.POLL_INTERVAL = 60.0
+        try:
+            pool, num_done, quarantined, results = \
+                self.run_payloads(SupervisedPool, RollbackFailureWorker,
+                                  payloads)
+        finally:
+            supervisor.POLL_INTERVAL = poll_interval
+        self.assertEqual(num_done, 4)
+        self.assertEqual(quarantined, [])
+        self.assertEqual(pool.num_failures, 1)
+        self.assertEqual(pool.num_restarts, 1)
+        self.assertEqual(results[1], ('raise', 1))
+        self.assertEqual(pool.exited, [])
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
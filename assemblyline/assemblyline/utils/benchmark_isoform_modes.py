@@ -0,0 +1,131 @@
+'''
+Created on Oct 21, 2013
+
+@author: mkiyer
+
+Compares the runtime and output of the isoform enumeration modes of the
+assembler.  The k-mer graph of each transcript graph is built once and
+path finding is timed separately for each mode.
+'''
+import sys
+import time
+import logging
+import argparse
+
+from assemblyline.lib.base import GTFAttr, float_check_nan
+from assemblyline.lib.gtf import parse_loci
+from assemblyline.lib.transcript import transcripts_from_gtf_lines
+from assemblyline.lib.assemble.filter import filter_transcripts
+from assemblyline.lib.assemble.transcript_graph import create_transcript_graphs
+from assemblyline.lib.assemble.assembler import get_kmer_range, \
+    build_kmer_graph, find_transcript_paths, ISOFORM_MODES
+
+def path_key(p):
+    return tuple((e.start, e.end) for e in p.path)
+
+def compare_results(ref_paths, test_paths):
+    '''
+    returns (num_shared, shared_score, total_score, score_diff) where
+    shared_score and total_score are sums of scores of reference paths
+    and score_diff is the sum of absolute relative score differences of
+    the shared paths
+    '''
+    test_scores = dict((path_key(p), p.score) for p in test_paths)
+    num_shared = 0
+    shared_score = 0.0
+    total_score = 0.0
+    score_diff = 0.0
+    for p in ref_paths:
+        total_score += p.score
+        k = path_key(p)
+        if k in test_scores:
+            num_shared += 1
+            shared_score += p.score
+            score_diff += abs(test_scores[k] - p.score) / max(p.score, 1e-8)
+    return num_shared, shared_score, total_score, score_diff
+
+def main():
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--gtf-score-attr", dest="gtf_score_attr",
+                        default=GTFAttr.PCTRANK, metavar="ATTR")
+    parser.add_argument("--min-transcript-length", type=int, default=250,
+                        dest="min_transcript_length")
+    parser.add_argument("--kmax", type=int, default=0)
+    parser.add_argument("--ksensitivity", type=float, default=0.90)
+    parser.add_argument("--fraction-major-isoform", type=float,
+                        default=0.01, dest="fraction_major_isoform")
+    parser.add_argument("--max-paths", type=int, default=1000,
+                        dest="max_paths")
+    parser.add_argument("-o", dest="output_file", default=None,
+                        help="write per-graph comparison to this file")
+    parser.add_argument("gtf_input_file")
+    args = parser.parse_args()
+    ref_mode = ISOFORM_MODES[0]
+    modes = list(ISOFORM_MODES)
+    outfh = None
+    if args.output_file is not None:
+        outfh = open(args.output_file, 'w')
+        header = ['chrom', 'start', 'end', 'strand', 'kmer_nodes']
+        for mode in modes:
+            header.extend(['%s_time' % mode, '%s_paths' % mode])
+        header.extend(['shared_paths', 'shared_score_frac'])
+        print >>outfh, '\t'.join(header)
+    total_times = dict((mode,0.0) for mode in modes)
+    total_paths = dict((mode,0) for mode in modes)
+    num_graphs = 0
+    totals = [0, 0.0, 0.0, 0.0]
+    for lines in parse_loci(open(args.gtf_input_file)):
+        transcripts = transcripts_from_gtf_lines(lines)
+        for t in transcripts:
+            t.score = float_check_nan(t.attrs.get(args.gtf_score_attr, '0'))
+        transcripts = filter_transcripts(transcripts,
+                                         args.min_transcript_length)
+        if len(transcripts) == 0:
+            continue
+        chrom = transcripts[0].chrom
+        for tg in create_transcript_graphs(chrom, transcripts):
+            kmin, kmax = get_kmer_range(tg.partial_paths, args.kmax,
+                                        args.ksensitivity)
+            K, k = build_kmer_graph(tg.Gsub, tg.partial_paths, kmin, kmax,
+                                    args.ksensitivity)
+            results = {}
+            times = {}
+            for mode in modes:
+                t0 = time.time()
+                results[mode] = find_transcript_paths(tg.Gsub, K, tg.strand,
+                                                      args.fraction_major_isoform,
+                                                      args.max_paths,
+                                                      mode)
+                times[mode] = time.time() - t0
+                total_times[mode] += times[mode]
+                total_paths[mode] += len(results[mode])
+            num_graphs += 1
+            for mode in modes:
+                if mode == ref_mode:
+                    continue
+                stats = compare_results(results[ref_mode], results[mode])
+                totals = [a+b for a,b in zip(totals, stats)]
+            if outfh is not None:
+                start = min(n.start for n in tg.Gsub)
+                end = max(n.end for n in tg.Gsub)
+                fields = [chrom, start, end, tg.strand, len(K)]
+                for mode in modes:
+                    fields.extend(['%.6f' % times[mode], len(results[mode])])
+                fields.extend([stats[0], '%.4f' % (stats[1] / max(stats[2], 1e-8))])
+                print >>outfh, '\t'.join(map(str, fields))
+    if outfh is not None:
+        outfh.close()
+    num_shared, shared_score, total_score, score_diff = totals
+    print 'graphs\t%d' % (num_graphs)
+    for mode in modes:
+        print '%s_time\t%.3f' % (mode, total_times[mode])
+        print '%s_paths\t%d' % (mode, total_paths[mode])
+    print 'shared_paths\t%d' % (num_shared)
+    print 'shared_score_frac\t%.4f' % (shared_score / max(total_score, 1e-8))
+    print 'mean_rel_score_diff\t%.4f' % (score_diff / max(num_shared, 1))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
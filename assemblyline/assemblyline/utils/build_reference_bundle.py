@@ -0,0 +1,43 @@
+'''
+Created on Oct 28, 2013
+
+@author: mkiyer
+'''
+import os
+import sys
+import logging
+import argparse
+
+import assemblyline
+from assemblyline.lib.refbundle import build_reference_bundle
+
+def main():
+    # setup logging
+    logging.basicConfig(level=logging.DEBUG,
+                        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    logging.info("AssemblyLine %s" % (assemblyline.__version__))
+    logging.info("----------------------------------")
+    # parse command line
+    parser = argparse.ArgumentParser(description="Compile a reference GTF "
+                                     "file into a bundle directory that is "
+                                     "accepted in place of the reference "
+                                     "GTF file by aggregate_transcripts, "
+                                     "compare_assemblies and gtf_annotate")
+    parser.add_argument("ref_gtf_file")
+    parser.add_argument("bundle_dir")
+    args = parser.parse_args()
+    # check command line
+    if not os.path.exists(args.ref_gtf_file):
+        parser.error("reference gtf file %s not found" % (args.ref_gtf_file))
+    logging.info("Parameters:")
+    logging.info("reference gtf file: %s" % (args.ref_gtf_file))
+    logging.info("bundle dir:         %s" % (args.bundle_dir))
+    logging.info("Building reference bundle")
+    num_transcripts = build_reference_bundle(args.ref_gtf_file,
+                                             args.bundle_dir)
+    logging.info("Added %d transcripts" % (num_transcripts))
+    logging.info("Done")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
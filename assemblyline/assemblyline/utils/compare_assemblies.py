@@ -37,6 +37,8 @@ from assemblyline.lib.transcript import cmp_strand, parse_gtf, \
     strand_int_to_str, NO_STRAND, POS_STRAND, NEG_STRAND
 from assemblyline.lib.assemble.transcript_graph import \
     find_exon_boundaries, split_exons
+from assemblyline.lib.refbundle import ReferenceBundle, is_reference_bundle, \
+    add_attrs_to_line
 
 # for nearest transcripts calculation
 MAX_LOCUS_DIST = 100000000
@@ -526,9 +528,24 @@ def build_locus_trees(gtf_file):
     locus_trees = collections.defaultdict(lambda: IntervalTree())
     for chrom, cluster_tree in locus_cluster_trees.iteritems():
         for locus_start, locus_end, indexes in cluster_tree.getregions():
-            for i in indexes:
-                locus_transcripts = [transcripts[i] for i in indexes]
-                locus_trees[chrom].insert_interval(Interval(locus_start, locus_end, value=locus_transcripts))
+            locus_transcripts = [transcripts[x] for x in indexes]
+            locus_trees[chrom].insert_interval(Interval(locus_start, locus_end, value=locus_transcripts))
+    return locus_trees
+
+def build_bundle_locus_trees(bundle_dir):
+    '''
+    builds the same interval trees as build_locus_trees from the loci 
+    stored in a reference bundle
+    '''
+    bundle = ReferenceBundle(bundle_dir)
+    transcripts = []
+    for t in bundle.iter_transcripts():
+        t.attrs[GTFAttr.REF] = '1'
+        transcripts.append(t)
+    locus_trees = collections.defaultdict(lambda: IntervalTree())
+    for chrom, locus_start, locus_end, first, last in bundle.iter_loci():
+        locus_transcripts = transcripts[first:last]
+        locus_trees[chrom].insert_interval(Interval(locus_start, locus_end, value=locus_transcripts))
     return locus_trees
 
 def find_nearest_transcripts(chrom, start, end, strand, locus_trees):
@@ -610,6 +627,13 @@ def add_gtf_file(gtf_file, outfh, is_ref):
             f.attrs[GTFAttr.REF] = refval
             print >>outfh, str(f)
 
+def add_bundle(bundle_dir, outfh):
+    attrs = ((GTFAttr.REF, '1'),)
+    for i, exon_lines, t_line in ReferenceBundle(bundle_dir).iter_gtf_lines():
+        for line in exon_lines:
+            print >>outfh, add_attrs_to_line(line, attrs)
+        print >>outfh, add_attrs_to_line(t_line, attrs)
+
 def compare_assemblies(ref_gtf_file, test_gtf_file, output_dir): 
     # output files
     if not os.path.exists(output_dir):
@@ -626,7 +650,10 @@ def compare_assemblies(ref_gtf_file, test_gtf_file, output_dir):
         # make temporary file to store merged ref/test gtf files
         with open(merged_gtf_file, "w") as fileh:
             logging.info("Adding reference GTF file")
-            add_gtf_file(ref_gtf_file, fileh, is_ref=True)
+            if is_reference_bundle(ref_gtf_file):
+                add_bundle(ref_gtf_file, fileh)
+            else:
+                add_gtf_file(ref_gtf_file, fileh, is_ref=True)
             logging.info("Adding test GTF file")
             add_gtf_file(test_gtf_file, fileh, is_ref=False)
         open(merge_done_file, 'w').close()
@@ -700,7 +727,10 @@ def compare_assemblies(ref_gtf_file, test_gtf_file, output_dir):
     intergenic_done_file = os.path.join(output_dir, 'intergenic.done')
     if not os.path.exists(intergenic_done_file):
         logging.info("Building interval index")
-        locus_trees = build_locus_trees(merged_sorted_gtf_file)
+        if is_reference_bundle(ref_gtf_file):
+            locus_trees = build_bundle_locus_trees(ref_gtf_file)
+        else:
+            locus_trees = build_locus_trees(merged_sorted_gtf_file)
         logging.info('Finding nearest matches to intergenic transcripts')
         gtf_fileh = open(intergenic_gtf_file, 'w')
         intergenic_fileh = open(intergenic_file, 'w')
@@ -778,7 +808,8 @@ def main():
                         dest="verbose", default=False)
     parser.add_argument("-o", "--output-dir", dest="output_dir", 
                         default="compare")
-    parser.add_argument("ref_gtf_file")
+    parser.add_argument("ref_gtf_file", help="reference GTF file or "
+                        "bundle directory built by build_reference_bundle")
     parser.add_argument("test_gtf_file")
     args = parser.parse_args()
     # set logging level
@@ -12,6 +12,8 @@ import os
 from assemblyline.lib.bx.intersection import Interval, IntervalTree
 from assemblyline.lib.bed import BEDFeature
 from assemblyline.lib.gtf import GTFFeature, parse_loci
+from assemblyline.lib.transcript import strand_str_to_int
+from assemblyline.lib.refbundle import ReferenceBundle, is_reference_bundle
 
 def build_interval_tree_from_bed(bed_file):
     trees = collections.defaultdict(lambda: IntervalTree())
@@ -21,13 +23,28 @@ def build_interval_tree_from_bed(bed_file):
             tree.insert_interval(Interval(start, end, strand=f.strand, value=f.name))
     return trees
 
+def find_bed_matches(trees, chrom, start, end, strand):
+    hits = trees[chrom].find(start, end)
+    return set(hit.value for hit in hits if hit.strand == strand)
+
+def find_bundle_matches(bundle, chrom, start, end, strand):
+    t_inds = bundle.find_exon_transcripts(chrom, start, end, 
+                                          strand_str_to_int(strand))
+    return set(bundle.transcript_ids[i] for i in t_inds)
+
 def annotate_gtf(gtf_file, bed_dbs):
     # read reference databases
     bed_trees = []
     for name,filename in bed_dbs:
-        logging.debug("Loading BED db '%s' file '%s'" % (name,filename))
-        trees = build_interval_tree_from_bed(filename)
-        bed_trees.append((name, trees))
+        if is_reference_bundle(filename):
+            logging.debug("Loading reference bundle '%s' dir '%s'" % 
+                          (name,filename))
+            bed_trees.append((name, (ReferenceBundle(filename), 
+                                     find_bundle_matches)))
+        else:
+            logging.debug("Loading BED db '%s' file '%s'" % (name,filename))
+            trees = build_interval_tree_from_bed(filename)
+            bed_trees.append((name, (trees, find_bed_matches)))
     # parse gtf file and annotate
     logging.debug("Annotating GTF")
     for lines in parse_loci(open(gtf_file)):
@@ -41,17 +58,16 @@ def annotate_gtf(gtf_file, bed_dbs):
             if f.feature_type == 'transcript':
                 transcripts.append(f)
             elif f.feature_type == 'exon':
-                for dbname,dbtrees in bed_trees:
+                for dbname,(db,find_matches) in bed_trees:
                     # intersect this exon with features
-                    hits = dbtrees[f.seqid].find(f.start, f.end)                        
-                    matches = set(hit.value for hit in hits if hit.strand == f.strand)
+                    matches = find_matches(db, f.seqid, f.start, f.end, f.strand)
                     f.attrs[dbname] = ','.join(sorted(matches))
                     # update transcript level matches
                     transcript_matches[t_id][dbname].update(matches)
         # set transcript annotations
         for f in transcripts:
             t_id = f.attrs['transcript_id']
-            for dbname,dbtrees in bed_trees:
+            for dbname,db in bed_trees:
                 matches = transcript_matches[t_id][dbname]
                 f.attrs[dbname] = ','.join(sorted(matches))
         # write features
@@ -63,7 +79,11 @@ def main():
     logging.basicConfig(level=logging.DEBUG,
                         format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
     parser = argparse.ArgumentParser()
-    parser.add_argument("--bed", dest="bed_args", action="append", default=[])
+    parser.add_argument("--bed", dest="bed_args", action="append", default=[],
+                        help="NAME,FILE where FILE is a BED file or a "
+                        "reference bundle directory built by "
+                        "build_reference_bundle (may be specified more "
+                        "than once)")
     parser.add_argument("gtf_file")
     args = parser.parse_args()
     if not os.path.exists(args.gtf_file):
@@ -22,35 +22,35 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
 import argparse
 import logging
-import os
 import sys
 
 from assemblyline.lib.gtf import GTFFeature
+from assemblyline.lib.base import FileSplitter
 
 def main():
     logging.basicConfig(level=logging.DEBUG,
                         format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
     parser = argparse.ArgumentParser()
     parser.add_argument("--gtf-split-attr", dest="gtf_split_attr", default="library_id")
+    parser.add_argument("--bufsize", dest="bufsize", type=int, 
+                        default=(1 << 28),
+                        help="Size of buffer when splitting GTF file "
+                        "[default=%(default)s]")
     parser.add_argument("gtf_file")
     args = parser.parse_args()
-    fhdict = {}
     gtf_split_attr = args.gtf_split_attr
+    keyfunc = lambda val: "%s.gtf" % (val)
+    splitter = FileSplitter(keyfunc, args.bufsize, threaded=True)
     for f in GTFFeature.parse(open(args.gtf_file)):
         if gtf_split_attr not in f.attrs:
             val = "na_missing"
         else:
             val = f.attrs[args.gtf_split_attr]
-        filename = "%s.gtf" % (val)
-        if not os.path.exists(filename):
-            fh = open(filename, "w")
-            fhdict[val] = fh
-        else:
-            fh = fhdict[val]
-        print >>fh, str(f)
-    for fh in fhdict.itervalues():
-        fh.close()
+        splitter.write(val, "%s\n" % str(f))
+    splitter.close()
+    for val, size in splitter.sizes.iteritems():
+        logging.debug("%s: %d bytes" % (keyfunc(val), size))
     return 0
 
 if __name__ == '__main__':
-    sys.exit(main())
\ No newline at end of file
+    sys.exit(main())
@@ -3,12 +3,13 @@ Created on Feb 6, 2013
 
 @author: mkiyer
 '''
-import subprocess
 import argparse
 import sys
 import os
 
-from assemblyline.lib.base import check_executable
+from assemblyline.lib.bedgraph import merge_bedgraph_records
+from assemblyline.lib.bbi import read_chrom_sizes, write_bigwig, \
+    write_bigbed
 
 def main():
     parser = argparse.ArgumentParser()
@@ -16,10 +17,6 @@ def main():
     parser.add_argument("output_dir")
     parser.add_argument("chrom_sizes_file")
     args = parser.parse_args()
-    if not check_executable("bedToBigBed"):
-        parser.error("bedToBigBed binary not found in PATH")
-    if not check_executable("bedGraphToBigWig"):
-        parser.error("'bedGraphToBigWig' executable not found in PATH")
     if not os.path.exists(args.chrom_sizes_file):
         parser.error("chrom sizes file %s not found" % (args.chrom_sizes_file))
     if not os.path.exists(args.output_dir):
@@ -42,11 +39,13 @@ def main():
             parser.error("Bedgraph file %s not found" % (bedgraph_files[i]))
         if not os.path.exists(bedgraph_track_files[i]):
             parser.error("Bedgraph track file %s not found" % (bedgraph_track_files[i]))
+    chrom_sizes = read_chrom_sizes(args.chrom_sizes_file)
     # convert to bigbed
     bigbed_file = os.path.join(output_dir, "assembly.bb")
-    retcode = subprocess.call(["bedToBigBed", bed_file, args.chrom_sizes_file, bigbed_file])
-    if retcode != 0:
-        print >>sys.stderr, "bedToBigBed ERROR"
+    try:
+        write_bigbed(bed_file, chrom_sizes, bigbed_file)
+    except ValueError as e:
+        print >>sys.stderr, "bigBed ERROR: %s" % (str(e))
         return 1
     # print track lines
     f = open(bed_track_file)
@@ -69,9 +68,11 @@ def main():
     # convert to bigwig
     for bedgraph_file in bedgraph_files:
         bwfile = os.path.splitext(bedgraph_file)[0] + ".bw"
-        retcode = subprocess.call(["bedGraphToBigWig", bedgraph_file, args.chrom_sizes_file, bwfile])
-        if retcode != 0:
-            print >>sys.stderr, "bedGraphToBigWig ERROR"
+        try:
+            write_bigwig(lambda: merge_bedgraph_records([bedgraph_file]),
+                         chrom_sizes, bwfile)
+        except ValueError as e:
+            print >>sys.stderr, "bigWig ERROR: %s" % (str(e))
             return 1
         track_file = bedgraph_file + ".ucsc_track"
         f = open(track_file)
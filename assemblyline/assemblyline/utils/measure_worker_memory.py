@@ -0,0 +1,152 @@
+'''
+Created on Oct 23, 2013
+
+@author: mkiyer
+
+Measures the private memory of forked worker processes that query
+reference exons loaded by the parent process.  Reference exons are held
+either in a dictionary of IntervalTree objects or in a memory mapped
+IntervalIndex.  Private memory (pages not shared with other processes)
+is read from /proc/<pid>/smaps after each worker queries every exon.
+'''
+import sys
+import os
+import logging
+import argparse
+import collections
+import tempfile
+import shutil
+from multiprocessing import Process, Queue
+import numpy as np
+
+from assemblyline.lib.bx.intersection import Interval, IntervalTree
+from assemblyline.lib.gtf import GTFFeature
+from assemblyline.lib.intervalindex import IntervalIndex
+
+MODES = ('none', 'tree', 'flat')
+
+def get_private_kb(pid='self'):
+    '''
+    returns private (unshared) memory of a process in kilobytes
+    '''
+    total = 0
+    for filename in ('/proc/%s/smaps_rollup' % pid, '/proc/%s/smaps' % pid):
+        if not os.path.exists(filename):
+            continue
+        for line in open(filename):
+            if line.startswith('Private_Clean:') or line.startswith('Private_Dirty:'):
+                total += int(line.split()[1])
+        return total
+    return total
+
+def read_exons(gtf_file):
+    exons = []
+    transcript_ids = {}
+    for f in GTFFeature.parse(open(gtf_file)):
+        if f.feature_type != 'exon':
+            continue
+        t_id = f.attrs['transcript_id']
+        t_index = transcript_ids.setdefault(t_id, len(transcript_ids))
+        exons.append((f.seqid, f.start, f.end, t_id, t_index))
+    return exons
+
+def build_trees(exons):
+    trees = collections.defaultdict(lambda: IntervalTree())
+    for chrom, start, end, t_id, t_index in exons:
+        trees[chrom].insert_interval(Interval(start, end, value=t_id))
+    return dict(trees)
+
+def query_tree(data, chrom, start, end):
+    if chrom not in data:
+        return 0
+    return len(data[chrom].find(start, end))
+
+def query_flat(data, chrom, start, end):
+    return len(data.find(chrom, start, end))
+
+def worker(data, query_func, queries, result_queue):
+    before = get_private_kb()
+    chroms, chrom_inds, starts, ends = queries
+    hits = 0
+    for i in xrange(len(starts)):
+        hits += query_func(data, chroms[chrom_inds[i]], int(starts[i]), 
+                           int(ends[i]))
+    after = get_private_kb()
+    result_queue.put((os.getpid(), before, after, hits))
+
+def get_queries(exons):
+    '''
+    queries are stored in arrays so that reading them does not add to
+    the private memory of the workers
+    '''
+    chroms = sorted(set(x[0] for x in exons))
+    chrom_ids = dict((c,i) for i,c in enumerate(chroms))
+    return (chroms, 
+            np.array([chrom_ids[x[0]] for x in exons], dtype=np.int32),
+            np.array([x[1] for x in exons], dtype=np.int64),
+            np.array([x[2] for x in exons], dtype=np.int64))
+
+def measure(mode, exons, queries, num_processes, tmp_dir):
+    data = None
+    query_func = lambda data, chrom, start, end: 0
+    if mode == 'tree':
+        data = build_trees(exons)
+        query_func = query_tree
+    elif mode == 'flat':
+        index_dir = os.path.join(tmp_dir, 'index')
+        IntervalIndex.from_intervals((x[0], x[1], x[2], x[4])
+                                     for x in exons).save(index_dir)
+        data = IntervalIndex.load(index_dir, mmap=True)
+        query_func = query_flat
+    result_queue = Queue()
+    procs = [Process(target=worker, args=(data, query_func, queries,
+                                          result_queue))
+             for i in xrange(num_processes)]
+    for p in procs:
+        p.start()
+    results = [result_queue.get() for p in procs]
+    for p in procs:
+        p.join()
+    return results
+
+def main():
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-p", dest="num_processes", default="1,2,4",
+                        help="comma separated list of worker counts "
+                        "[default=%(default)s]")
+    parser.add_argument("--mode", dest="modes", action="append",
+                        choices=MODES, default=None,
+                        help="reference data structure to measure "
+                        "(may be specified more than once) "
+                        "[default=all]")
+    parser.add_argument("ref_gtf_file")
+    args = parser.parse_args()
+    modes = args.modes if args.modes is not None else list(MODES)
+    num_processes_list = [int(x) for x in args.num_processes.split(',')]
+    logging.info("Reading exons")
+    exons = read_exons(args.ref_gtf_file)
+    logging.info("Read %d exons" % (len(exons)))
+    queries = get_queries(exons)
+    print '\t'.join(['mode', 'workers', 'mean_private_kb',
+                     'max_private_kb', 'mean_query_private_kb'])
+    for mode in modes:
+        for num_processes in num_processes_list:
+            tmp_dir = tempfile.mkdtemp()
+            try:
+                results = measure(mode, exons, queries, num_processes, 
+                                  tmp_dir)
+            finally:
+                shutil.rmtree(tmp_dir)
+            private_kb = [after for pid, before, after, hits in results]
+            query_kb = [after - before for pid, before, after, hits in results]
+            fields = [mode, num_processes,
+                      '%.0f' % (float(sum(private_kb)) / len(private_kb)),
+                      max(private_kb),
+                      '%.0f' % (float(sum(query_kb)) / len(query_kb))]
+            print '\t'.join(map(str, fields))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())